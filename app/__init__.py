@@ -1,11 +1,13 @@
 # Load environment variables FIRST, before any other imports
+import multiprocessing
 import os
 from dotenv import load_dotenv
 
 env_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env')
 loaded = load_dotenv(env_path, override=True)
 
-if loaded and os.path.exists(env_path):
+# Processos filhos (pool de derivados) herdam o ambiente: não repetem o log.
+if loaded and os.path.exists(env_path) and multiprocessing.parent_process() is None:
     print("=" * 80)
     print(f"✅ ENVIRONMENT VARIABLES LOADED FROM: {env_path}")
     print("=" * 80)
@@ -28,6 +30,15 @@ if loaded and os.path.exists(env_path):
 
     print("=" * 80)
 
-from app.agent import root_agent
+
+def __getattr__(name):
+    # O agente é importado sob demanda (ADK lê ``app.root_agent``), para que
+    # processos que só usam utilitários de ``app`` não carreguem os agentes.
+    if name == "root_agent":
+        from app.agent import root_agent
+
+        return root_agent
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 __all__ = ["root_agent"]
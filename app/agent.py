@@ -41,6 +41,7 @@ from .utils.json_tools import try_parse_json_string
 
 
 logger = logging.getLogger(__name__)
+from .agents.budget import BudgetLoopGuard, SkipIfBudgetLow
 from .agents.gating import RunIfPassed, ResetDeterministicValidationState
 from .agents.storybrand_fallback import fallback_storybrand_pipeline
 from .agents.storybrand_gate import StoryBrandQualityGate
@@ -52,6 +53,14 @@ from .callbacks.persist_outputs import (
 from .schemas.storybrand import StoryBrandAnalysis
 from .validators.final_delivery_validator import FinalDeliveryValidatorAgent
 from .utils.logging_helpers import log_struct_event
+from .utils.scheduled_gemini import register_scheduled_gemini
+from .utils.session_budget import (
+    budget_level,
+    record_degradation,
+    record_llm_calls,
+    start_session_budget,
+)
+from .utils.vertex_retry import PRIORITY_BACKGROUND, set_vertex_call_context
 
 
 # ────────────────────────────────────────────────────────────────────────────────
@@ -580,6 +589,25 @@ class ImageAssetsAgent(BaseAgent):
             return
 
         total_variations = len(variations)
+        # Orçamento da sessão baixo: gera só as primeiras variações; esgotado: nenhuma.
+        variation_limit = total_variations
+        level = budget_level(state)
+        if level != "ok":
+            variation_limit = (
+                0 if level == "exhausted" else max(0, config.session_budget_low_image_variations)
+            )
+        if variation_limit < total_variations:
+            record_degradation(
+                state,
+                stage=self.name,
+                action="limit_image_variations",
+                detail=(
+                    f"Orçamento da sessão {level}: imagens geradas para "
+                    f"{variation_limit}/{total_variations} variações."
+                ),
+                budget_level=level,
+                variation_limit=variation_limit,
+            )
         user_id = str(state.get("user_id") or "anonymous")
         session_identifier = str(
             getattr(ctx.session, "id", "")
@@ -604,8 +632,10 @@ class ImageAssetsAgent(BaseAgent):
             },
         )
 
-        summary: list[Dict[str, Any]] = []
+        summary_by_index: dict[int, dict[str, Any]] = {}
         critical_errors: list[str] = []
+        # Dica de nova tentativa (ex.: circuito do modelo de imagem aberto) por variação.
+        retry_after_by_index: dict[int, float] = {}
         generated_any = False
         character_reference_used_overall = False
         product_reference_used_overall = False
@@ -615,11 +645,78 @@ class ImageAssetsAgent(BaseAgent):
             "prompt_estado_intermediario",
             "prompt_estado_aspiracional",
         ]
+        stage_labels = {
+            1: "estado atual",
+            2: "estado intermediário",
+            3: "estado aspiracional",
+        }
+
+        # Todas as variações compartilham uma única fila de progresso; o
+        # semáforo limita quantas chamadas ao modelo rodam ao mesmo tempo.
+        max_concurrency = max(1, int(getattr(config, "image_generation_max_concurrency", 1) or 1))
+        semaphore = asyncio.Semaphore(max_concurrency)
+        progress_queue: asyncio.Queue[tuple[str, int, Any]] = asyncio.Queue()
+        visuals: dict[int, dict[str, Any]] = {}
+        tasks: list[asyncio.Task[None]] = []
+
+        # Checkpoints por etapa (gcs_uri + hash do prompt): uma nova execução
+        # retoma apenas as etapas ausentes ou que falharam. Cada checkpoint sai
+        # num evento com state_delta para que sessões persistentes o gravem.
+        checkpoints = state.get("image_generation_checkpoints")
+        if not isinstance(checkpoints, dict):
+            checkpoints = {}
+        checkpoints = {key: dict(value) for key, value in checkpoints.items() if isinstance(value, dict)}
+
+        async def run_variation(idx: int, visual: dict[str, Any], metadata: dict[str, Any]) -> None:
+            async def progress_callback(stage_idx: int, stage_label: str) -> None:
+                await progress_queue.put(("progress", idx, (stage_idx, stage_label)))
+
+            def checkpoint_callback(stage_label: str, record: dict[str, str]) -> None:
+                checkpoints.setdefault(str(idx), {})[stage_label] = record
+                progress_queue.put_nowait(("checkpoint", idx, None))
+
+            async with semaphore:
+                await progress_queue.put(("start", idx, None))
+                try:
+                    assets = await generate_transformation_images(
+                        prompt_atual=visual["prompt_estado_atual"],
+                        prompt_intermediario=visual["prompt_estado_intermediario"],
+                        prompt_aspiracional=visual["prompt_estado_aspiracional"],
+                        variation_idx=idx,
+                        metadata=metadata,
+                        progress_callback=progress_callback,
+                        reference_character=character_metadata,
+                        reference_product=product_metadata,
+                        checkpoints=checkpoints.get(str(idx)),
+                        checkpoint_callback=checkpoint_callback,
+                    )
+                except Exception as exc:  # pragma: no cover - depende de runtime externo
+                    retry_after = getattr(exc, "retry_after", None)
+                    if retry_after is not None:
+                        retry_after_by_index[idx] = float(retry_after)
+                    await progress_queue.put(("done", idx, (None, str(exc))))
+                    return
+                await progress_queue.put(("done", idx, (assets, None)))
 
         for idx, variation in enumerate(variations):
             variation_number = idx + 1
             visual = variation.setdefault("visual", {}) or {}
 
+            if idx >= variation_limit:
+                visual["image_generation_skipped"] = "session_budget"
+                summary_by_index[idx] = {
+                    "variation_index": idx,
+                    "status": "skipped",
+                    "reason": "session_budget",
+                    "character_reference_used": False,
+                    "product_reference_used": False,
+                    "safe_search_notes": safe_search_notes,
+                }
+                review["issues"].append(
+                    f"Variation {variation_number} skipped: session budget {level}"
+                )
+                continue
+
             required_fields = [
                 "prompt_estado_atual",
                 "prompt_estado_intermediario",
@@ -632,32 +729,20 @@ class ImageAssetsAgent(BaseAgent):
                     + ", ".join(missing_fields)
                 )
                 visual["image_generation_error"] = message
-                summary.append({
+                summary_by_index[idx] = {
                     "variation_index": idx,
                     "status": "skipped",
                     "missing_fields": missing_fields,
                     "character_reference_used": False,
                     "product_reference_used": False,
                     "safe_search_notes": safe_search_notes,
-                })
+                }
                 review["issues"].append(
                     f"Variation {variation_number} skipped due to missing fields: {', '.join(missing_fields)}"
                 )
                 yield Event(author=self.name, content=Content(parts=[Part(text=message)]))
                 continue
 
-            yield Event(
-                author=self.name,
-                content=Content(parts=[Part(
-                    text=f"🎨 Iniciando geração de imagens para variação {variation_number}/{total_variations}."
-                )]),
-            )
-
-            progress_queue: asyncio.Queue[tuple[int, str]] = asyncio.Queue()
-
-            async def progress_callback(stage_idx: int, stage_label: str) -> None:
-                await progress_queue.put((stage_idx, stage_label))
-
             if character_metadata or product_metadata:
                 reference_assets: Dict[str, Any] = {}
                 if character_metadata:
@@ -690,78 +775,37 @@ class ImageAssetsAgent(BaseAgent):
                 "product_summary": state.get("reference_image_product_summary"),
             }
 
-            # Extract reference images from state (if present)
-            reference_images = state.get("reference_images", {})
-            reference_character = reference_images.get("character")
-            reference_product = reference_images.get("product")
-
-            task = asyncio.create_task(
-                generate_transformation_images(
-                    prompt_atual=visual["prompt_estado_atual"],
-                    prompt_intermediario=visual["prompt_estado_intermediario"],
-                    prompt_aspiracional=visual["prompt_estado_aspiracional"],
-                    variation_idx=idx,
-                    metadata=metadata,
-                    progress_callback=progress_callback,
-                    reference_character=character_metadata,
-                    reference_product=product_metadata,
-                )
-            )
+            visuals[idx] = visual
+            tasks.append(asyncio.create_task(run_variation(idx, visual, metadata)))
 
-            progress_task = asyncio.create_task(progress_queue.get())
-            stage_labels = {
-                1: "estado atual",
-                2: "estado intermediário",
-                3: "estado aspiracional",
-            }
+        pending = len(tasks)
+        try:
+            while pending:
+                kind, idx, payload = await progress_queue.get()
+                variation_number = idx + 1
 
-            assets: Dict[str, Any] | None = None
-            error: str | None = None
+                if kind == "start":
+                    yield Event(
+                        author=self.name,
+                        content=Content(parts=[Part(
+                            text=f"🎨 Iniciando geração de imagens para variação {variation_number}/{total_variations}."
+                        )]),
+                    )
+                    continue
 
-            try:
-                while True:
-                    done, _ = await asyncio.wait(
-                        {task, progress_task},
-                        return_when=asyncio.FIRST_COMPLETED,
+                if kind == "checkpoint":
+                    snapshot = {key: dict(value) for key, value in checkpoints.items()}
+                    state["image_generation_checkpoints"] = snapshot
+                    yield Event(
+                        author=self.name,
+                        actions=EventActions(
+                            state_delta={"image_generation_checkpoints": snapshot}
+                        ),
                     )
+                    continue
 
-                    if progress_task in done:
-                        stage_idx, stage_label = progress_task.result()
-                        pretty = stage_labels.get(stage_idx, stage_label)
-                        yield Event(
-                            author=self.name,
-                            content=Content(parts=[Part(
-                                text=f"✅ Variação {variation_number}: etapa {stage_idx}/3 ({pretty}) concluída."
-                            )]),
-                        )
-                        progress_queue.task_done()
-                        if task.done():
-                            try:
-                                assets = task.result()
-                            except Exception as exc:  # pragma: no cover - depende de runtime externo
-                                error = str(exc)
-                            if progress_queue.empty():
-                                break
-                        else:
-                            progress_task = asyncio.create_task(progress_queue.get())
-
-                    if task in done:
-                        try:
-                            assets = task.result()
-                        except Exception as exc:  # pragma: no cover - depende de runtime externo
-                            error = str(exc)
-                        break
-            finally:
-                if not task.done():
-                    task.cancel()
-                    with contextlib.suppress(asyncio.CancelledError):
-                        await task
-                if progress_task and not progress_task.done():
-                    progress_task.cancel()
-                    with contextlib.suppress(asyncio.CancelledError):
-                        await progress_task
-                while not progress_queue.empty():
-                    stage_idx, stage_label = await progress_queue.get()
+                if kind == "progress":
+                    stage_idx, stage_label = payload
                     pretty = stage_labels.get(stage_idx, stage_label)
                     yield Event(
                         author=self.name,
@@ -769,91 +813,114 @@ class ImageAssetsAgent(BaseAgent):
                             text=f"✅ Variação {variation_number}: etapa {stage_idx}/3 ({pretty}) concluída."
                         )]),
                     )
-                    progress_queue.task_done()
+                    continue
+
+                pending -= 1
+                assets, error = payload
+                visual = visuals[idx]
+
+                if error or not assets:
+                    error_message = error or "Falha desconhecida na geração de imagens."
+                    visual["image_generation_error"] = error_message
+                    summary_by_index[idx] = {
+                        "variation_index": idx,
+                        "status": "error",
+                        "error": error_message,
+                        "character_reference_used": False,
+                        "product_reference_used": False,
+                        "safe_search_notes": safe_search_notes,
+                    }
+                    if idx in retry_after_by_index:
+                        summary_by_index[idx]["retry_after"] = retry_after_by_index[idx]
+                    critical_errors.append(error_message)
+                    review["issues"].append(
+                        f"Erro ao gerar imagens da variação {variation_number}: {error_message}"
+                    )
+                    yield Event(
+                        author=self.name,
+                        content=Content(parts=[Part(
+                            text=f"❌ Falha na geração de imagens da variação {variation_number}: {error_message}"
+                        )]),
+                    )
+                    continue
+
+                visual.pop("image_generation_error", None)
+                visual.pop("image_generation_skipped", None)
+                visual["image_estado_atual_gcs"] = assets["estado_atual"]["gcs_uri"]
+                visual["image_estado_atual_url"] = assets["estado_atual"].get("signed_url", "")
+                visual["image_estado_intermediario_gcs"] = assets["estado_intermediario"]["gcs_uri"]
+                visual["image_estado_intermediario_url"] = assets["estado_intermediario"].get("signed_url", "")
+                visual["image_estado_aspiracional_gcs"] = assets["estado_aspiracional"]["gcs_uri"]
+                visual["image_estado_aspiracional_url"] = assets["estado_aspiracional"].get("signed_url", "")
+                # Derivados leves (preview/thumb) ficam ao lado dos campos originais.
+                for stage_key in ("estado_atual", "estado_intermediario", "estado_aspiracional"):
+                    for name, derivative in (assets[stage_key].get("derivatives") or {}).items():
+                        visual[f"image_{stage_key}_{name}_gcs"] = derivative.get("gcs_uri", "")
+                        visual[f"image_{stage_key}_{name}_url"] = derivative.get("signed_url", "")
+                assets_meta = assets.get("meta", {}) or {}
+                if assets_meta:
+                    visual["image_generation_meta"] = assets_meta
+
+                character_used = bool(assets_meta.get("reference_character_used"))
+                product_used = bool(assets_meta.get("reference_product_used"))
+                character_reference_used_overall = (
+                    character_reference_used_overall or character_used
+                )
+                product_reference_used_overall = (
+                    product_reference_used_overall or product_used
+                )
+
+                reference_errors: dict[str, Any] = {}
+                character_error = assets_meta.get("reference_character_error")
+                product_error = assets_meta.get("reference_product_error")
+                if character_error:
+                    reference_errors["character"] = character_error
+                    review["issues"].append(
+                        f"Falha ao carregar referência de personagem: {character_error}"
+                    )
+                if product_error:
+                    reference_errors["product"] = product_error
+                    review["issues"].append(
+                        f"Falha ao carregar referência de produto: {product_error}"
+                    )
+
+                emotions: dict[str, str] = {}
+                for field in emotion_fields:
+                    value = visual.get(field)
+                    if isinstance(value, str):
+                        match = emotion_pattern.search(value)
+                        if match:
+                            emotions[field] = match.group(1).strip()
 
-            if error or not assets:
-                error_message = error or "Falha desconhecida na geração de imagens."
-                visual["image_generation_error"] = error_message
-                summary.append({
+                summary_by_index[idx] = {
                     "variation_index": idx,
-                    "status": "error",
-                    "error": error_message,
-                    "character_reference_used": False,
-                    "product_reference_used": False,
+                    "status": "ok",
+                    "assets": assets,
+                    "character_reference_used": character_used,
+                    "product_reference_used": product_used,
+                    "emotions": emotions,
                     "safe_search_notes": safe_search_notes,
-                })
-                critical_errors.append(error_message)
-                review["issues"].append(
-                    f"Erro ao gerar imagens da variação {variation_number}: {error_message}"
-                )
+                    "reference_errors": reference_errors or None,
+                }
+                generated_any = True
+
                 yield Event(
                     author=self.name,
                     content=Content(parts=[Part(
-                        text=f"❌ Falha na geração de imagens da variação {variation_number}: {error_message}"
+                        text=f"🎉 Variação {variation_number}: imagens geradas e anexadas ao JSON."
                     )]),
                 )
-                continue
-
-            visual.pop("image_generation_error", None)
-            visual["image_estado_atual_gcs"] = assets["estado_atual"]["gcs_uri"]
-            visual["image_estado_atual_url"] = assets["estado_atual"].get("signed_url", "")
-            visual["image_estado_intermediario_gcs"] = assets["estado_intermediario"]["gcs_uri"]
-            visual["image_estado_intermediario_url"] = assets["estado_intermediario"].get("signed_url", "")
-            visual["image_estado_aspiracional_gcs"] = assets["estado_aspiracional"]["gcs_uri"]
-            visual["image_estado_aspiracional_url"] = assets["estado_aspiracional"].get("signed_url", "")
-            assets_meta = assets.get("meta", {}) or {}
-            if assets_meta:
-                visual["image_generation_meta"] = assets_meta
-
-            character_used = bool(assets_meta.get("reference_character_used"))
-            product_used = bool(assets_meta.get("reference_product_used"))
-            character_reference_used_overall = (
-                character_reference_used_overall or character_used
-            )
-            product_reference_used_overall = (
-                product_reference_used_overall or product_used
-            )
-
-            reference_errors: Dict[str, Any] = {}
-            character_error = assets_meta.get("reference_character_error")
-            product_error = assets_meta.get("reference_product_error")
-            if character_error:
-                reference_errors["character"] = character_error
-                review["issues"].append(
-                    f"Falha ao carregar referência de personagem: {character_error}"
-                )
-            if product_error:
-                reference_errors["product"] = product_error
-                review["issues"].append(
-                    f"Falha ao carregar referência de produto: {product_error}"
-                )
-
-            emotions: Dict[str, str] = {}
-            for field in emotion_fields:
-                value = visual.get(field)
-                if isinstance(value, str):
-                    match = emotion_pattern.search(value)
-                    if match:
-                        emotions[field] = match.group(1).strip()
-
-            summary.append({
-                "variation_index": idx,
-                "status": "ok",
-                "assets": assets,
-                "character_reference_used": character_used,
-                "product_reference_used": product_used,
-                "emotions": emotions,
-                "safe_search_notes": safe_search_notes,
-                "reference_errors": reference_errors or None,
-            })
-            generated_any = True
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            for task in tasks:
+                with contextlib.suppress(asyncio.CancelledError):
+                    await task
 
-            yield Event(
-                author=self.name,
-                content=Content(parts=[Part(
-                    text=f"🎉 Variação {variation_number}: imagens geradas e anexadas ao JSON."
-                )]),
-            )
+        summary: list[dict[str, Any]] = [
+            summary_by_index[idx] for idx in sorted(summary_by_index)
+        ]
 
         try:
             state["final_code_delivery"] = json.dumps(variations, ensure_ascii=False)
@@ -899,6 +966,8 @@ class ImageAssetsAgent(BaseAgent):
             review["grade"] = "fail"
             state["image_assets_review_failed"] = True
             state["image_assets_review_failure_reason"] = "; ".join(review["issues"]) or "Falha na geração de imagens."
+            if retry_after_by_index:
+                review["retry_after"] = max(retry_after_by_index.values())
         elif generated_any:
             review["grade"] = "pass"
             state.pop("image_assets_review_failed", None)
@@ -1920,6 +1989,9 @@ plan_review_loop = LoopAgent(
         feature_planner,
         plan_reviewer,
         EscalationChecker(name="plan_escalation_checker", review_key="plan_review_result"),
+        BudgetLoopGuard(
+            name="plan_budget_guard", review_key="plan_review_result", loop_name="plan_review_loop"
+        ),
     ],
     after_agent_callback=make_failure_handler(
         "plan_review_result",
@@ -1958,6 +2030,9 @@ code_review_loop = LoopAgent(
         code_reviewer,
         EscalationChecker(name="code_escalation_checker", review_key="code_review_result"),
         RunIfFailed(name="refine_if_failed", review_key="code_review_result", agent=code_refiner),
+        BudgetLoopGuard(
+            name="code_budget_guard", review_key="code_review_result", loop_name="code_review_loop"
+        ),
     ],
     after_agent_callback=make_failure_handler(
         "code_review_result",
@@ -1997,6 +2072,11 @@ semantic_validation_loop = LoopAgent(
             review_key="semantic_visual_review",
             agent=semantic_fix_agent,
         ),
+        BudgetLoopGuard(
+            name="semantic_budget_guard",
+            review_key="semantic_visual_review",
+            loop_name="semantic_validation_loop",
+        ),
     ],
     after_agent_callback=make_failure_handler(
         "semantic_visual_review",
@@ -2004,8 +2084,11 @@ semantic_validation_loop = LoopAgent(
     ),
 )
 
-semantic_validation_stage = EscalationBarrier(
-    name="semantic_validation_stage", agent=semantic_validation_loop
+# Com o orçamento da sessão baixo, o loop semântico é pulado (grade "skipped").
+semantic_validation_stage = SkipIfBudgetLow(
+    name="semantic_validation_budget_gate",
+    review_key="semantic_visual_review",
+    agent=EscalationBarrier(name="semantic_validation_stage", agent=semantic_validation_loop),
 )
 
 deterministic_validation_stage = SequentialAgent(
@@ -2039,6 +2122,7 @@ def build_execution_pipeline(flag_enabled: bool) -> SequentialAgent:
                 name="image_assets_if_passed",
                 review_key="semantic_visual_review",
                 agent=image_assets_agent,
+                expected_grade=("pass", "skipped"),
             ),
             RunIfPassed(
                 name="persist_final_delivery_if_passed",
@@ -2103,9 +2187,15 @@ class FeatureOrchestrator(BaseAgent):
             return
 
         ctx.session.state["orchestrator_has_run"] = True
+        # O pipeline longo cede a vez ao preflight interativo; filas justas por usuário.
+        set_vertex_call_context(PRIORITY_BACKGROUND, ctx.session.user_id)
+        start_session_budget(ctx.session.state)
         yield Event(author=self.name, content=Content(parts=[Part(text="Iniciando processamento...")]))
 
         async for event in self._complete_pipeline.run_async(ctx):
+            # Cada resposta final de modelo consome uma chamada do orçamento da sessão.
+            if event.usage_metadata is not None and not event.partial:
+                record_llm_calls(ctx.session.state)
             yield event
 
         if ctx.session.state.get("plan_review_result_failed"):
@@ -2142,4 +2232,7 @@ class FeatureOrchestrator(BaseAgent):
         ctx.session.state["orchestrator_has_run"] = False
 
 
+if config.enable_llm_scheduler:
+    register_scheduled_gemini()
+
 root_agent = FeatureOrchestrator(complete_pipeline=complete_pipeline)
@@ -0,0 +1,90 @@
+"""Agents that degrade the pipeline when the session budget runs low."""
+
+from __future__ import annotations
+
+import logging
+from collections.abc import AsyncGenerator
+
+from google.adk.agents import BaseAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event, EventActions
+from google.genai.types import Content, Part
+
+from app.utils.session_budget import budget_level, record_degradation
+
+logger = logging.getLogger(__name__)
+
+
+class BudgetLoopGuard(BaseAgent):
+    """Last step of a review ``LoopAgent``: ends the loop early when the budget is low.
+
+    The current draft is kept as is. The review keeps its grade, so a failing
+    review still trips the loop's failure handler; ``budget_cut`` only marks
+    that no further iteration was attempted.
+    """
+
+    def __init__(self, *, name: str, review_key: str, loop_name: str) -> None:
+        super().__init__(name=name)
+        self._review_key = review_key
+        self._loop_name = loop_name
+
+    async def _run_async_impl(
+        self, ctx: InvocationContext
+    ) -> AsyncGenerator[Event, None]:
+        state = ctx.session.state
+        level = budget_level(state)
+        if level == "ok":
+            yield Event(author=self.name)
+            return
+
+        result = state.get(self._review_key)
+        if isinstance(result, dict):
+            state[self._review_key] = {**result, "budget_cut": True}
+        record_degradation(
+            state,
+            stage=self._loop_name,
+            action="cut_review_iterations",
+            detail=f"Orçamento da sessão {level}: revisão encerrada sem nova iteração.",
+            review_key=self._review_key,
+            budget_level=level,
+        )
+        yield Event(author=self.name, actions=EventActions(escalate=True))
+
+
+class SkipIfBudgetLow(BaseAgent):
+    """Skip the wrapped stage when the budget is low, grading ``review_key`` as ``skipped``."""
+
+    def __init__(self, *, name: str, review_key: str, agent: BaseAgent) -> None:
+        super().__init__(name=name)
+        self._review_key = review_key
+        self._agent = agent
+
+    async def _run_async_impl(
+        self, ctx: InvocationContext
+    ) -> AsyncGenerator[Event, None]:
+        state = ctx.session.state
+        level = budget_level(state)
+        if level == "ok":
+            async for event in self._agent.run_async(ctx):
+                yield event
+            return
+
+        message = f"Orçamento da sessão {level}: {self._agent.name} não executado."
+        state[self._review_key] = {
+            "grade": "skipped",
+            "comment": message,
+            "source": self.name,
+        }
+        record_degradation(
+            state,
+            stage=self._agent.name,
+            action="skip_stage",
+            detail=message,
+            review_key=self._review_key,
+            budget_level=level,
+        )
+        logger.info("SkipIfBudgetLow: %s", message)
+        yield Event(author=self.name, content=Content(parts=[Part(text=message)]))
+
+
+__all__ = ["BudgetLoopGuard", "SkipIfBudgetLow"]
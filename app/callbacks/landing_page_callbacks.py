@@ -6,14 +6,19 @@ Integrates StoryBrand analysis after web fetching.
 import logging
 import json
 from typing import Any, Dict
-import os
 import time
-from app.tools.langextract_sb7 import StoryBrandExtractor
+from app.tools.langextract_sb7 import get_storybrand_extractor
 from app.schemas.storybrand import StoryBrandAnalysis
 from app.utils.delivery_status import write_failure_meta
 from app.utils.metrics import record_delivery_failure
 from app.utils.session_state import resolve_state, safe_session_id, safe_user_id
-from app.utils.vertex_retry import VertexRetryExceededError
+from app.utils.storybrand_planner import plan_outcome
+from app.utils.vertex_retry import (
+    PRIORITY_NORMAL,
+    VertexCircuitOpenError,
+    VertexRetryExceededError,
+    vertex_call_context,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -63,7 +68,7 @@ def _mark_storybrand_failure(
     record_delivery_failure(reason)
 
 
-def process_and_extract_sb7(
+async def process_and_extract_sb7(
     *,
     tool: Any,
     args: Dict[str, Any] | None = None,
@@ -106,8 +111,8 @@ def process_and_extract_sb7(
     try:
         logger.info("Iniciando análise StoryBrand do conteúdo HTML")
 
-        # Criar extrator e processar
-        extractor = StoryBrandExtractor()
+        # Extrator compartilhado (prompt e few-shots já montados)
+        extractor = get_storybrand_extractor()
         # Usar texto limpo extraído pela Trafilatura
         input_text = text_content
         # Logar tamanho do input
@@ -119,19 +124,17 @@ def process_and_extract_sb7(
         except Exception:
             pass
 
-        # Truncar para reduzir latência (mantendo contexto suficiente) – controlável por env
-        truncate_limit = int(os.getenv("STORYBRAND_TRUNCATE_LIMIT_CHARS", "12000"))
-        truncated = False
-        if (
-            truncate_limit > 0
-            and isinstance(input_text, str)
-            and len(input_text) > truncate_limit
-        ):
-            input_text = input_text[:truncate_limit]
-            truncated = True
+        # Um único plano decide orçamento de tokens, chunks, workers e passes
+        plan = extractor.plan_input(input_text)
+        # Reduzido uma única vez aqui; o extrator recebe texto e truncation_info prontos.
+        input_text, truncation_info = extractor.prepare_input(input_text, plan)
+        truncated = bool(truncation_info.get("truncated"))
+        if truncated:
             logger.info(
-                "Conteúdo truncado para %sk chars para análise StoryBrand (melhor latência)",
-                int(truncate_limit / 1000),
+                "Conteúdo reduzido para %s chars (~%s tokens) para análise StoryBrand (%s)",
+                len(input_text),
+                plan.budget_tokens,
+                truncation_info.get("strategy"),
             )
 
         t0 = time.time()
@@ -140,10 +143,14 @@ def process_and_extract_sb7(
         if state:
             landing_page_url = state.get("landing_page_url", "")
 
-        storybrand_data = extractor.extract(
-            input_text,
-            landing_page_url=landing_page_url or None,
-        )
+        # A extração StoryBrand bloqueia o restante do pipeline: fura a fila de background.
+        with vertex_call_context(priority=PRIORITY_NORMAL):
+            storybrand_data = await extractor.aextract(
+                input_text,
+                landing_page_url=landing_page_url or None,
+                plan=plan,
+                truncation_info=truncation_info,
+            )
         t1 = time.time()
         duration = round(t1 - t0, 2)
         # Logar métrica de latência
@@ -151,7 +158,13 @@ def process_and_extract_sb7(
             params = {
                 "duration_s": duration,
                 "truncated": truncated,
-                "truncate_limit": truncate_limit,
+                "plan": plan.as_dict(),
+                **plan_outcome(plan, t1 - t0),
+                "truncation_info": {
+                    key: value
+                    for key, value in truncation_info.items()
+                    if key != "selected_segments"
+                },
             }
             # Persistir no estado para debug rápido
             if hasattr(tool_context, 'state'):
@@ -208,6 +221,16 @@ def process_and_extract_sb7(
             if hasattr(tool_context, 'state'):
                 tool_context.state['storybrand_raw'] = storybrand_data
 
+    except VertexCircuitOpenError as e:
+        message = "Vertex AI indisponível (circuito aberto) ao extrair StoryBrand"
+        logger.error("%s: %s", message, e)
+        _mark_storybrand_failure(
+            tool_context,
+            reason="vertex_circuit_open",
+            message=message,
+            retry_after=e.retry_after,
+            attempts=e.attempts,
+        )
     except VertexRetryExceededError as e:
         message = "Vertex AI saturado ao extrair StoryBrand"
         logger.error("%s: %s", message, e)
@@ -81,12 +81,55 @@ class DevelopmentConfiguration:
     web_fetch_timeout: int = 30
     cache_landing_pages: bool = True
     min_storybrand_completeness: float = 0.6
+    # LlmAgents do ADK passam pela fila de prioridade do Vertex. Desligado por padrão:
+    # os agentes passariam a dividir as permissões de VERTEX_CONCURRENCY_LIMIT
+    enable_llm_scheduler: bool = False
+
+    # Orçamento por sessão (tempo de parede + respostas de modelo); abaixo da fração
+    # "low" as revisões são encurtadas, o loop semântico é pulado e menos imagens são geradas.
+    # Desligado por padrão: variações sem imagens e revisões encurtadas mudam a entrega
+    session_budget_enabled: bool = False
+    session_budget_seconds: float = 900.0
+    session_budget_llm_calls: int = 150
+    session_budget_low_fraction: float = 0.2
+    session_budget_low_image_variations: int = 1
+
+    # Admissão de execuções (/run, /run_sse): ativas + fila FIFO; excedente recebe 429.
+    # Limites por processo worker, não globais
+    run_admission_enabled: bool = True
+    run_max_active: int = 8
+    run_max_queued: int = 16
+    run_queue_timeout: float = 30.0  # segundos na fila antes do 429
+
+    # Cotas por user_id (token bucket: taxa por hora + rajada); desligado por padrão
+    user_quota_enabled: bool = False
+    user_quota_llm_calls_per_hour: float = 600.0
+    user_quota_llm_calls_burst: int = 120
+    user_quota_images_per_hour: float = 90.0
+    user_quota_images_burst: int = 30
+    user_quota_gcs_mb_per_hour: float = 512.0
+    user_quota_gcs_mb_burst: int = 256
+    # Reservado antes de cada chamada de imagem e acertado com o tamanho real no upload
+    user_quota_gcs_image_estimate_mb: float = 2.0
 
     # Image generation (Gemini Image Preview)
     image_generation_timeout: int = 60
     image_generation_max_retries: int = 3
     image_transformation_steps: int = 3
+    image_generation_max_concurrency: int = 3  # variações geradas em paralelo (1 = sequencial)
     image_signed_url_ttl: int = 60 * 60 * 24  # 24h
+    image_defer_signed_urls: bool = True  # guarda só o gs:// e assina sob demanda na entrega
+    image_raw_passthrough: bool = True  # mantém os bytes do modelo sem decodificar/recodificar
+    image_cache_enabled: bool = True  # reaproveita imagens idênticas já salvas no GCS
+    image_cache_index_path: str = "artifacts/image_cache/index.jsonl"
+    image_derivatives_enabled: bool = True  # previews WebP/JPEG e miniaturas junto do PNG original
+    image_derivative_workers: int = 2  # processos para codificar derivados (0 = thread)
+    image_backend: str = "vertex"  # "vertex" (Gemini + GCS) ou "local" (PNGs sintéticos em disco)
+    image_local_backend_dir: str = "artifacts/local_image_backend"
+    image_local_latency_seconds: float = 0.0
+    image_local_error_rate: float = 0.0  # fração de chamadas ao modelo que falham (injeção de erro)
+    image_local_seed: int = 0
+    image_local_throttled_regions: str = ""  # regiões (vírgula) em que o backend local responde 429
     image_current_prompt_template: str = (
         "Use the approved character reference to anchor identity (summary: {character_summary};"
         " labels: {character_labels}). {prompt_atual}"
@@ -104,6 +147,7 @@ class DevelopmentConfiguration:
         "{prompt_aspiracional}"
     )
     reference_cache_ttl_seconds: int = 60 * 60  # 1 hour
+    reference_image_cache_max_bytes: int = 64 * 1024 * 1024  # 64 MiB
     enable_reference_images: bool = False
     reference_images_bucket: str | None = None
 
@@ -169,6 +213,64 @@ if os.getenv("STORYBRAND_MIN_COMPLETENESS"):
     except ValueError:
         pass
 
+if os.getenv("ENABLE_LLM_SCHEDULER"):
+    config.enable_llm_scheduler = os.getenv("ENABLE_LLM_SCHEDULER").lower() == "true"
+
+if os.getenv("SESSION_BUDGET_ENABLED"):
+    config.session_budget_enabled = os.getenv("SESSION_BUDGET_ENABLED").lower() == "true"
+
+if os.getenv("SESSION_BUDGET_SECONDS"):
+    config.session_budget_seconds = float(os.getenv("SESSION_BUDGET_SECONDS"))
+
+if os.getenv("SESSION_BUDGET_LLM_CALLS"):
+    config.session_budget_llm_calls = int(os.getenv("SESSION_BUDGET_LLM_CALLS"))
+
+if os.getenv("SESSION_BUDGET_LOW_FRACTION"):
+    config.session_budget_low_fraction = float(os.getenv("SESSION_BUDGET_LOW_FRACTION"))
+
+if os.getenv("SESSION_BUDGET_LOW_IMAGE_VARIATIONS"):
+    config.session_budget_low_image_variations = int(
+        os.getenv("SESSION_BUDGET_LOW_IMAGE_VARIATIONS")
+    )
+
+if os.getenv("RUN_ADMISSION_ENABLED"):
+    config.run_admission_enabled = os.getenv("RUN_ADMISSION_ENABLED").lower() == "true"
+
+if os.getenv("RUN_MAX_ACTIVE"):
+    config.run_max_active = int(os.getenv("RUN_MAX_ACTIVE"))
+
+if os.getenv("RUN_MAX_QUEUED"):
+    config.run_max_queued = int(os.getenv("RUN_MAX_QUEUED"))
+
+if os.getenv("RUN_QUEUE_TIMEOUT"):
+    config.run_queue_timeout = float(os.getenv("RUN_QUEUE_TIMEOUT"))
+
+if os.getenv("USER_QUOTA_ENABLED"):
+    config.user_quota_enabled = os.getenv("USER_QUOTA_ENABLED").lower() == "true"
+
+if os.getenv("USER_QUOTA_LLM_CALLS_PER_HOUR"):
+    config.user_quota_llm_calls_per_hour = float(os.getenv("USER_QUOTA_LLM_CALLS_PER_HOUR"))
+
+if os.getenv("USER_QUOTA_LLM_CALLS_BURST"):
+    config.user_quota_llm_calls_burst = int(os.getenv("USER_QUOTA_LLM_CALLS_BURST"))
+
+if os.getenv("USER_QUOTA_IMAGES_PER_HOUR"):
+    config.user_quota_images_per_hour = float(os.getenv("USER_QUOTA_IMAGES_PER_HOUR"))
+
+if os.getenv("USER_QUOTA_IMAGES_BURST"):
+    config.user_quota_images_burst = int(os.getenv("USER_QUOTA_IMAGES_BURST"))
+
+if os.getenv("USER_QUOTA_GCS_MB_PER_HOUR"):
+    config.user_quota_gcs_mb_per_hour = float(os.getenv("USER_QUOTA_GCS_MB_PER_HOUR"))
+
+if os.getenv("USER_QUOTA_GCS_MB_BURST"):
+    config.user_quota_gcs_mb_burst = int(os.getenv("USER_QUOTA_GCS_MB_BURST"))
+
+if os.getenv("USER_QUOTA_GCS_IMAGE_ESTIMATE_MB"):
+    config.user_quota_gcs_image_estimate_mb = float(
+        os.getenv("USER_QUOTA_GCS_IMAGE_ESTIMATE_MB")
+    )
+
 if os.getenv("PREFLIGHT_SHADOW_MODE"):
     config.preflight_shadow_mode = (
         os.getenv("PREFLIGHT_SHADOW_MODE").lower() == "true"
@@ -180,12 +282,53 @@ if os.getenv("IMAGE_GENERATION_TIMEOUT"):
 if os.getenv("IMAGE_GENERATION_MAX_RETRIES"):
     config.image_generation_max_retries = int(os.getenv("IMAGE_GENERATION_MAX_RETRIES"))
 
+if os.getenv("IMAGE_GENERATION_MAX_CONCURRENCY"):
+    config.image_generation_max_concurrency = max(
+        1, int(os.getenv("IMAGE_GENERATION_MAX_CONCURRENCY"))
+    )
+
 if os.getenv("IMAGE_TRANSFORMATION_STEPS"):
     config.image_transformation_steps = int(os.getenv("IMAGE_TRANSFORMATION_STEPS"))
 
 if os.getenv("IMAGE_SIGNED_URL_TTL"):
     config.image_signed_url_ttl = int(os.getenv("IMAGE_SIGNED_URL_TTL"))
 
+if os.getenv("IMAGE_DEFER_SIGNED_URLS"):
+    config.image_defer_signed_urls = os.getenv("IMAGE_DEFER_SIGNED_URLS").lower() == "true"
+
+if os.getenv("IMAGE_RAW_PASSTHROUGH"):
+    config.image_raw_passthrough = os.getenv("IMAGE_RAW_PASSTHROUGH").lower() == "true"
+
+if os.getenv("IMAGE_CACHE_ENABLED"):
+    config.image_cache_enabled = os.getenv("IMAGE_CACHE_ENABLED").lower() == "true"
+
+if os.getenv("IMAGE_CACHE_INDEX_PATH"):
+    config.image_cache_index_path = os.getenv("IMAGE_CACHE_INDEX_PATH")
+
+if os.getenv("IMAGE_DERIVATIVES_ENABLED"):
+    config.image_derivatives_enabled = os.getenv("IMAGE_DERIVATIVES_ENABLED").lower() == "true"
+
+if os.getenv("IMAGE_DERIVATIVE_WORKERS"):
+    config.image_derivative_workers = max(0, int(os.getenv("IMAGE_DERIVATIVE_WORKERS")))
+
+if os.getenv("IMAGE_BACKEND"):
+    config.image_backend = os.getenv("IMAGE_BACKEND").strip().lower()
+
+if os.getenv("IMAGE_LOCAL_BACKEND_DIR"):
+    config.image_local_backend_dir = os.getenv("IMAGE_LOCAL_BACKEND_DIR")
+
+if os.getenv("IMAGE_LOCAL_LATENCY_SECONDS"):
+    config.image_local_latency_seconds = float(os.getenv("IMAGE_LOCAL_LATENCY_SECONDS"))
+
+if os.getenv("IMAGE_LOCAL_ERROR_RATE"):
+    config.image_local_error_rate = float(os.getenv("IMAGE_LOCAL_ERROR_RATE"))
+
+if os.getenv("IMAGE_LOCAL_SEED"):
+    config.image_local_seed = int(os.getenv("IMAGE_LOCAL_SEED"))
+
+if os.getenv("IMAGE_LOCAL_THROTTLED_REGIONS"):
+    config.image_local_throttled_regions = os.getenv("IMAGE_LOCAL_THROTTLED_REGIONS")
+
 if os.getenv("IMAGE_CURRENT_PROMPT_TEMPLATE"):
     config.image_current_prompt_template = os.getenv("IMAGE_CURRENT_PROMPT_TEMPLATE")
 
@@ -206,6 +349,14 @@ if os.getenv("REFERENCE_CACHE_TTL_SECONDS"):
     except ValueError:
         pass
 
+if os.getenv("REFERENCE_IMAGE_CACHE_MAX_BYTES"):
+    try:
+        config.reference_image_cache_max_bytes = int(
+            os.getenv("REFERENCE_IMAGE_CACHE_MAX_BYTES")
+        )
+    except ValueError:
+        pass
+
 if os.getenv("ENABLE_REFERENCE_IMAGES"):
     config.enable_reference_images = os.getenv("ENABLE_REFERENCE_IMAGES").lower() == "true"
 
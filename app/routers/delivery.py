@@ -1,16 +1,18 @@
 import os
 import json
+import math
 import logging
-from pathlib import Path
 from datetime import timedelta
+from pathlib import Path
 from typing import Optional
 
 from fastapi import APIRouter, HTTPException, Query
-from fastapi.responses import FileResponse, Response
+from fastapi.responses import Response
 from google.cloud import storage
 from typing import Any
 
 from app.utils.delivery_status import load_failure_meta
+from app.utils.signed_urls import hydrate_image_urls
 
 
 logger = logging.getLogger(__name__)
@@ -37,12 +39,19 @@ def _parse_gcs_uri(uri: str) -> tuple[str, str]:
     return bucket, blob
 
 
+def _hydrate_payload(payload: bytes) -> tuple[Any, bytes]:
+    """Sign image URLs stored only as gs:// URIs, in batch, before serving inline."""
+    data = hydrate_image_urls(json.loads(payload))
+    return data, json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+
 def _has_all_image_urls(data: Any) -> bool:
     """Validate that ALL variations have complete image URLs (strict).
 
     - Exige exatamente 3 variações
     - Cada variação deve conter as três URLs: atual, intermediário e aspiracional
     - Qualquer presença de `image_generation_error` invalida a entrega
+    - Variações com `image_generation_skipped` (orçamento da sessão) não exigem URLs
     """
     if not isinstance(data, list) or len(data) != 3:
         return False
@@ -60,6 +69,8 @@ def _has_all_image_urls(data: Any) -> bool:
         # Rejeita variações com erro de geração
         if visual.get("image_generation_error"):
             return False
+        if visual.get("image_generation_skipped"):
+            continue
         if not all(visual.get(k) for k in required_fields):
             return False
 
@@ -84,6 +95,10 @@ def _report_missing(data: Any) -> list[dict[str, Any]]:
             out.append({"variation": idx, "status": "generation_error", "error": visual["image_generation_error"]})
             continue
 
+        if visual.get("image_generation_skipped"):
+            out.append({"variation": idx, "status": "skipped", "reason": visual["image_generation_skipped"]})
+            continue
+
         missing = [k for k in [
             "image_estado_atual_url",
             "image_estado_intermediario_url",
@@ -106,7 +121,13 @@ def get_final_meta(user_id: str = Query(...), session_id: str = Query(...)):
     if not meta:
         failure_meta = load_failure_meta(session_id)
         if failure_meta and str(failure_meta.get("user_id", "")) == str(user_id):
-            raise HTTPException(status_code=503, detail=failure_meta)
+            retry_after = failure_meta.get("retry_after")
+            headers = (
+                {"Retry-After": str(max(1, math.ceil(float(retry_after))))}
+                if isinstance(retry_after, (int, float))
+                else None
+            )
+            raise HTTPException(status_code=503, detail=failure_meta, headers=headers)
         raise HTTPException(status_code=404, detail="Final delivery not available yet")
 
     # Optional sanity check: if user_id mismatches, still return 404
@@ -116,16 +137,52 @@ def get_final_meta(user_id: str = Query(...), session_id: str = Query(...)):
     return {"ok": True, **meta}
 
 
+def _read_final_payload(meta: dict, session_id: str) -> bytes | None:
+    """Read the stored delivery JSON from GCS, falling back to the local copy."""
+    gcs_uri = (meta.get("final_delivery_gcs_uri") or "").strip()
+    if gcs_uri.startswith("gs://"):
+        try:
+            bucket_name, blob_name = _parse_gcs_uri(gcs_uri)
+            client = storage.Client(project=os.getenv("GOOGLE_CLOUD_PROJECT"))
+            return client.bucket(bucket_name).blob(blob_name).download_as_bytes()
+        except Exception as e:
+            logger.warning(
+                "Failed to download final delivery %s: %s. Trying local fallback.",
+                gcs_uri,
+                e,
+            )
+
+    local_path = meta.get("final_delivery_local_path")
+    if local_path and Path(local_path).exists():
+        try:
+            return Path(local_path).read_bytes()
+        except Exception:
+            logger.exception(
+                "Failed to read local final delivery for session %s from %s.",
+                session_id,
+                local_path,
+            )
+    return None
+
+
 @router.get("/final/download")
 def download_final(
     user_id: str = Query(...),
     session_id: str = Query(...),
     inline: bool = Query(False),
 ):
-    """Provide access to the final delivery via Signed URL (GCS) or local stream.
+    """Provide the final delivery with image URLs signed.
 
-    - If meta includes a GCS URI, generate a short-lived v4 Signed URL and return it.
-    - Otherwise, stream the local file (dev fallback).
+    Images are stored with ``gs://`` URIs only, so the payload (from GCS or the
+    local dev copy) is hydrated before it leaves the server:
+
+    - ``inline``: the hydrated JSON, validated for complete image assets.
+    - Otherwise, with GCS: a signed copy is written next to the stored object and
+      ``{"ok": true, "signed_url": ..., "expires_in": 600}`` points at it.
+    - Otherwise (local dev): the hydrated JSON as a file attachment.
+
+    If the image URLs cannot be signed the request fails with 502 instead of
+    serving an unsigned payload.
     """
     meta = _load_local_meta(session_id)
     if not meta:
@@ -134,122 +191,68 @@ def download_final(
     if str(meta.get("user_id", "")) != str(user_id):
         raise HTTPException(status_code=404, detail="Final delivery not found for this user/session")
 
-    gcs_uri = (meta.get("final_delivery_gcs_uri") or "").strip()
-    filename = meta.get("filename") or f"{session_id}.json"
+    payload = _read_final_payload(meta, session_id)
+    if payload is None:
+        raise HTTPException(status_code=404, detail="No artifact available for download")
 
-    if gcs_uri.startswith("gs://"):
-        # Generate Signed URL
-        try:
-            bucket_name, blob_name = _parse_gcs_uri(gcs_uri)
-            client = storage.Client(project=os.getenv("GOOGLE_CLOUD_PROJECT"))
-            bucket = client.bucket(bucket_name)
-            blob = bucket.blob(blob_name)
-            if inline:
-                try:
-                    payload = blob.download_as_bytes()
-
-                    # Validate the payload has all required image URLs (optional validation)
-                    data = json.loads(payload)
-                    if not _has_all_image_urls(data):
-                        logger.warning(
-                            "Some image assets missing for session %s. Details: %s",
-                            session_id,
-                            _report_missing(data)
-                        )
-                        # Enforce strict validation
-                        raise HTTPException(
-                            status_code=424,
-                            detail={
-                                "message": "Image assets incomplete. Please reprocess the session.",
-                                "missing": _report_missing(data)
-                            }
-                        )
-
-                    return Response(content=payload, media_type="application/json")
-                except Exception as e:
-                    logger.warning(
-                        "Failed to download inline payload for %s: %s. Trying local fallback.",
-                        gcs_uri,
-                        e,
-                    )
-                    # Try local fallback before returning signed_url
-                    local_path = meta.get("final_delivery_local_path")
-                    if local_path and Path(local_path).exists():
-                        try:
-                            payload = Path(local_path).read_bytes()
-
-                            # Validate the local payload (optional validation)
-                            data = json.loads(payload)
-                            if not _has_all_image_urls(data):
-                                logger.warning(
-                                    "Some image assets missing in local file for session %s. Details: %s",
-                                    session_id,
-                                    _report_missing(data)
-                                )
-                                # Enforce strict validation
-                                raise HTTPException(
-                                    status_code=424,
-                                    detail={
-                                        "message": "Image assets incomplete. Please reprocess the session.",
-                                        "missing": _report_missing(data)
-                                    }
-                                )
-
-                            logger.info(
-                                "Successfully served inline content from local fallback for session %s",
-                                session_id
-                            )
-                            return Response(content=payload, media_type="application/json")
-                        except HTTPException:
-                            raise
-                        except Exception as local_err:
-                            logger.error(
-                                "Failed to read local fallback for session %s: %s",
-                                session_id,
-                                local_err
-                            )
-                    # If we reach here, neither GCS nor local worked for inline
-                    logger.error(
-                        "Unable to serve inline content for session %s - no fallback available",
-                        session_id
-                    )
-
-            # For non-inline requests, return signed URL as before
-            if not inline:
-                url = blob.generate_signed_url(
-                    version="v4",
-                    expiration=timedelta(seconds=600),
-                    method="GET",
-                    response_disposition=f'attachment; filename="{filename}"',
-                    response_type="application/json",
-                )
-                return {"ok": True, "signed_url": url, "expires_in": 600}
-        except HTTPException:
-            raise
-        except Exception as e:
-            logger.error(
-                "Failed to generate Signed URL for %s: %s. Falling back to local download if available.",
-                gcs_uri,
-                e,
-                exc_info=True,
-            )
-            # Fall through to local fallback below
+    try:
+        data, payload = _hydrate_payload(payload)
+    except Exception:
+        logger.error("Failed to sign image URLs for session %s.", session_id, exc_info=True)
+        raise HTTPException(
+            status_code=502,
+            detail="Could not sign image URLs for the final delivery. Please retry.",
+        )
 
-    # Fallback to local stream
-    local_path = meta.get("final_delivery_local_path")
-    if local_path and Path(local_path).exists():
-        if inline:
+    filename = meta.get("filename") or f"{session_id}.json"
+    if not inline:
+        gcs_uri = (meta.get("final_delivery_gcs_uri") or "").strip()
+        if gcs_uri.startswith("gs://"):
             try:
-                payload = Path(local_path).read_bytes()
-            except Exception:
-                logger.exception(
-                    "Failed to read local inline payload for session %s from %s.",
-                    session_id,
-                    local_path,
+                return _signed_copy_response(gcs_uri, payload, filename)
+            except Exception as e:
+                logger.error(
+                    "Failed to generate Signed URL for %s: %s. Falling back to direct download.",
+                    gcs_uri,
+                    e,
+                    exc_info=True,
                 )
-            else:
-                return Response(content=payload, media_type="application/json")
-
-        return FileResponse(path=local_path, media_type="application/json", filename=filename)
-
-    raise HTTPException(status_code=404, detail="No artifact available for download")
+        return Response(
+            content=payload,
+            media_type="application/json",
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        )
+
+    if not _has_all_image_urls(data):
+        logger.warning(
+            "Some image assets missing for session %s. Details: %s",
+            session_id,
+            _report_missing(data),
+        )
+        # Enforce strict validation
+        raise HTTPException(
+            status_code=424,
+            detail={
+                "message": "Image assets incomplete. Please reprocess the session.",
+                "missing": _report_missing(data),
+            },
+        )
+
+    return Response(content=payload, media_type="application/json")
+
+
+def _signed_copy_response(gcs_uri: str, payload: bytes, filename: str) -> dict[str, Any]:
+    """Upload the hydrated payload beside the stored one and sign a URL to it."""
+    bucket_name, blob_name = _parse_gcs_uri(gcs_uri)
+    client = storage.Client(project=os.getenv("GOOGLE_CLOUD_PROJECT"))
+    # O objeto original guarda só gs://; a cópia assinada é regravada a cada download.
+    blob = client.bucket(bucket_name).blob(f"{blob_name.removesuffix('.json')}.signed.json")
+    blob.upload_from_string(payload, content_type="application/json")
+    url = blob.generate_signed_url(
+        version="v4",
+        expiration=timedelta(seconds=600),
+        method="GET",
+        response_disposition=f'attachment; filename="{filename}"',
+        response_type="application/json",
+    )
+    return {"ok": True, "signed_url": url, "expires_in": 600}
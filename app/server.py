@@ -13,6 +13,7 @@
 # limitations under the License.
 
 import logging
+import math
 import os
 from typing import Any, Literal, Mapping, Optional
 
@@ -20,7 +21,8 @@ from typing import Any, Literal, Mapping, Optional
 # This ensures .env is loaded before any imports happen
 
 import google.auth
-from fastapi import Body, FastAPI, File, Form, HTTPException, UploadFile, status
+from fastapi import Body, FastAPI, File, Form, HTTPException, Query, Request, UploadFile, status
+from fastapi.responses import JSONResponse
 from google.adk.cli.fast_api import get_fast_api_app
 from google.cloud import logging as google_cloud_logging
 from opentelemetry import trace
@@ -30,7 +32,9 @@ from app.schemas.run_preflight import RunPreflightRequest
 from app.plan_models.fixed_plans import get_plan_by_format
 from app.format_specifications import get_specs_by_format, get_specs_json_by_format
 from app.config import config, CTA_INSTAGRAM_CHOICES, CTA_BY_OBJECTIVE
+from app.utils.admission import get_admission_controller, install_admission_middleware
 from app.utils.gcs import upload_reference_image as upload_reference_image_to_gcs
+from app.utils.quotas import QuotaExceededError, get_user_quotas
 from app.utils.reference_cache import (
     build_reference_summary,
     cache_reference_metadata,
@@ -39,6 +43,7 @@ from app.utils.reference_cache import (
 )
 from app.utils.tracing import CloudTraceLoggingSpanExporter
 from app.utils.typing import Feedback
+from app.utils.vertex_retry import PRIORITY_INTERACTIVE, vertex_call_context
 from app.utils.vision import (
     ReferenceImageAnalysisError,
     ReferenceImageUnsafeError,
@@ -107,6 +112,9 @@ app: FastAPI = get_fast_api_app(
 )
 app.title = "facilitador"
 app.description = "API for interacting with the Agent facilitador"
+# Limita pipelines simultâneos em /run e /run_sse (fila FIFO + 429 com Retry-After).
+# Fica dentro do CORS para que o navegador consiga ler o 429; limites valem por worker.
+install_admission_middleware(app)
 
 # Include custom delivery router (final JSON download)
 try:
@@ -139,12 +147,29 @@ async def log_feature_flags():
             "enable_image_generation": config.enable_image_generation,
             "preflight_shadow_mode": config.preflight_shadow_mode,
             "vertex_concurrency_limit": os.getenv("VERTEX_CONCURRENCY_LIMIT"),
-            "storybrand_soft_char_limit": os.getenv("STORYBRAND_SOFT_CHAR_LIMIT"),
+            "storybrand_max_input_tokens": os.getenv("STORYBRAND_MAX_INPUT_TOKENS"),
+            "storybrand_target_seconds": os.getenv("STORYBRAND_TARGET_SECONDS"),
             "storybrand_hard_char_limit": os.getenv("STORYBRAND_HARD_CHAR_LIMIT"),
         }
     )
 
 
+@app.on_event("startup")
+async def warm_image_derivative_pool():
+    """Spawn the derivative encoder processes before the first image is generated."""
+    from app.utils.image_derivatives import warm_derivative_executor
+
+    if config.enable_image_generation and config.image_derivatives_enabled:
+        warm_derivative_executor()
+
+
+@app.on_event("shutdown")
+async def stop_image_derivative_pool():
+    from app.utils.image_derivatives import shutdown_derivative_executor
+
+    shutdown_derivative_executor()
+
+
 @app.post("/feedback")
 def collect_feedback(feedback: Feedback) -> dict[str, str]:
     """Collect and log feedback.
@@ -159,6 +184,40 @@ def collect_feedback(feedback: Feedback) -> dict[str, str]:
     return {"status": "success"}
 
 
+@app.exception_handler(QuotaExceededError)
+async def quota_exceeded_handler(_request: Request, exc: QuotaExceededError) -> JSONResponse:
+    retry_after = max(1, math.ceil(exc.retry_after))
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={
+            "detail": "Cota do usuário esgotada; tente novamente mais tarde.",
+            "resource": exc.resource,
+            "retry_after": retry_after,
+        },
+        headers={"Retry-After": str(retry_after)},
+    )
+
+
+@app.get("/quota/{user_id}")
+def user_quota_status(user_id: str, session_id: str = Query(...)) -> dict[str, Any]:
+    """Remaining per-user budget for model calls, image generations and GCS bytes.
+
+    Only answered for a session this user started (same check as the delivery routes).
+    """
+    if get_admission_controller().owner(session_id) != user_id:
+        raise HTTPException(status_code=404, detail="Quota not found for this user/session")
+    return get_user_quotas().report(user_id)
+
+
+@app.get("/run_admission/{session_id}")
+def run_admission_status(session_id: str, user_id: str = Query(...)) -> dict[str, Any]:
+    """Queue position of a pipeline run (0 = running) and overall admission load."""
+    controller = get_admission_controller()
+    if controller.owner(session_id) != user_id:
+        raise HTTPException(status_code=404, detail="Run not found for this user/session")
+    return controller.status(session_id)
+
+
 def _coerce_bool(value: Any) -> Optional[bool]:
     if isinstance(value, bool):
         return value
@@ -276,6 +335,8 @@ async def upload_reference_image_endpoint(
             status_code=status.HTTP_502_BAD_GATEWAY,
             detail="Vision analysis failed for the uploaded image.",
         ) from exc
+    except QuotaExceededError:
+        raise  # 429 via quota_exceeded_handler
     except Exception as exc:  # pragma: no cover - defensive
         try:
             logger.log_struct(
@@ -367,7 +428,9 @@ def run_preflight(request: RunPreflightRequest = Body(...)) -> dict:
     except Exception:
         pass
 
-    result = extract_user_input(text)
+    preflight_user_id = raw_payload.get("user_id") or raw_payload.get("userId")
+    with vertex_call_context(priority=PRIORITY_INTERACTIVE, user_id=preflight_user_id):
+        result = extract_user_input(text)
     try:
         logger.log_struct({
             "event": "preflight_result",
@@ -3,37 +3,88 @@
 from __future__ import annotations
 
 import asyncio
+import contextlib
 import inspect
 import json
 import logging
 import os
 import time
-from dataclasses import dataclass
+from collections.abc import Awaitable, Callable, Mapping
+from dataclasses import dataclass, field
 from datetime import timedelta
 from io import BytesIO
-from typing import Any, Awaitable, Callable, Dict, Optional
+from typing import Any, Dict, Optional
 
 import requests
 
-from google import genai
 from google.genai import types
-from google.cloud import storage
 from PIL import Image
 
 from app.config import config
 from app.schemas.reference_assets import ReferenceImageMetadata
+from app.utils.image_backends import (
+    create_blob_store,
+    create_image_model_client,
+    default_location,
+)
+from app.utils.image_cache import (
+    GeneratedImageIndex,
+    get_generated_image_index,
+    image_content_hash,
+    make_image_cache_key,
+)
+from app.utils.image_derivatives import build_derivatives
+from app.utils.reference_cache import (
+    get_reference_image_cache,
+    reference_image_cache_key,
+)
+from app.utils.quotas import (
+    GCS_BYTES,
+    IMAGE_GENERATIONS,
+    charge_user_quota,
+    settle_user_quota,
+)
+from app.utils.single_flight import get_single_flight
+from app.utils.vertex_retry import (
+    alimit_vertex_concurrency,
+    charge_vertex_call_quota,
+    check_vertex_circuit,
+    get_region_pool,
+    get_vertex_limiter,
+    raise_if_vertex_circuit_open,
+    record_region_failure,
+    record_vertex_outcome,
+)
 
 logger = logging.getLogger(__name__)
 
 _MODEL_NAME = "gemini-2.5-flash-image"
-_PROJECT_ID = os.getenv("GOOGLE_CLOUD_PROJECT")
-_LOCATION = os.getenv("GOOGLE_CLOUD_LOCATION", "us-central1")
-_client = genai.Client(
-    vertexai=True,
-    project=_PROJECT_ID,
-    location=_LOCATION,
-)
-_storage_client = storage.Client()
+
+_image_stage_flight = get_single_flight("image_stage")
+
+# Clientes criados sob demanda conforme ``config.image_backend`` (vertex/local).
+_client: Any = None
+_regional_clients: dict[str, Any] = {}
+_storage_client: Any = None
+
+
+def _get_client(region: str | None = None) -> Any:
+    global _client
+    if region is None or region == default_location():
+        if _client is None:
+            _client = create_image_model_client()
+        return _client
+    client = _regional_clients.get(region)
+    if client is None:
+        client = _regional_clients[region] = create_image_model_client(location=region)
+    return client
+
+
+def _get_storage_client() -> Any:
+    global _storage_client
+    if _storage_client is None:
+        _storage_client = create_blob_store()
+    return _storage_client
 
 SYSTEM_INSTRUCTIONS = (
     "Você gera imagens que contam uma transformação em três etapas.\n"
@@ -58,16 +109,57 @@ def _get_generation_config() -> types.GenerateContentConfig:
     )
 
 ProgressCallback = Callable[[int, str], Awaitable[None] | None]
+CheckpointCallback = Callable[[str, dict[str, Any]], Awaitable[None] | None]
 
 
 @dataclass
 class _UploadResult:
     gcs_uri: str
     signed_url: str
+    # nome do derivado (preview, preview_jpeg, thumb) -> gcs_uri/mime_type/signed_url
+    derivatives: dict[str, dict[str, str]] = field(default_factory=dict)
+
+
+def _stored_derivatives(upload: Any) -> dict[str, dict[str, str]]:
+    """Derivative URIs as persisted in checkpoints and the image index (no URLs)."""
+
+    return {
+        name: {"gcs_uri": item["gcs_uri"], "mime_type": item["mime_type"]}
+        for name, item in (getattr(upload, "derivatives", None) or {}).items()
+    }
+
+
+@dataclass(frozen=True)
+class GeneratedImage:
+    """Encoded image bytes sent to/returned by the model without re-encoding.
+
+    Used for model outputs and for reference uploads in a supported format.
+    """
 
+    data: bytes
+    mime_type: str = "image/png"
 
-def _load_reference_image(metadata: ReferenceImageMetadata) -> Image.Image:
-    """Load a reference image either from a signed URL or directly from GCS."""
+    @property
+    def extension(self) -> str:
+        return _MIME_EXTENSIONS.get(self.mime_type, "png")
+
+
+_MIME_EXTENSIONS = {
+    "image/png": "png",
+    "image/jpeg": "jpg",
+    "image/webp": "webp",
+}
+
+
+def _blob_for_uri(gcs_uri: str) -> Any:
+    bucket_name, _, blob_name = gcs_uri.removeprefix("gs://").partition("/")
+    if not gcs_uri.startswith("gs://") or not bucket_name or not blob_name:
+        raise ValueError(f"Invalid GCS URI: {gcs_uri}")
+    return _get_storage_client().bucket(bucket_name).blob(blob_name)
+
+
+def _download_reference_bytes(metadata: ReferenceImageMetadata) -> bytes:
+    """Fetch the encoded reference image either from a signed URL or directly from GCS."""
 
     if not metadata.gcs_uri:
         raise ValueError("Reference metadata must include a GCS URI")
@@ -81,9 +173,7 @@ def _load_reference_image(metadata: ReferenceImageMetadata) -> Image.Image:
             raise RuntimeError(
                 f"Failed to download reference image {metadata.id} via signed URL"
             ) from exc
-        with BytesIO(response.content) as buffer:
-            image = Image.open(buffer)
-            return image.convert("RGB")
+        return response.content
 
     # Fallback to direct GCS access.
     if not metadata.gcs_uri.startswith("gs://"):
@@ -91,18 +181,55 @@ def _load_reference_image(metadata: ReferenceImageMetadata) -> Image.Image:
             f"Unsupported GCS URI for reference image {metadata.id}: {metadata.gcs_uri}"
         )
 
-    bucket_path = metadata.gcs_uri[5:]
-    bucket_name, _, blob_name = bucket_path.partition("/")
-    if not bucket_name or not blob_name:
+    try:
+        blob = _blob_for_uri(metadata.gcs_uri)
+    except ValueError as exc:
         raise RuntimeError(
             f"Invalid GCS URI for reference image {metadata.id}: {metadata.gcs_uri}"
-        )
+        ) from exc
+    return blob.download_as_bytes()  # pragma: no cover - depends on GCS
+
+
+def _sniff_mime_type(data: bytes) -> str | None:
+    """MIME type of ``data`` if it is a format the image model accepts as is."""
 
-    blob = _storage_client.bucket(bucket_name).blob(blob_name)
-    data = blob.download_as_bytes()  # pragma: no cover - depends on GCS
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def _reference_part(data: bytes) -> GeneratedImage:
+    """Encoded reference bytes for the model; only other formats are decoded and converted."""
+
+    mime_type = _sniff_mime_type(data)
+    if mime_type is not None:
+        return GeneratedImage(data=data, mime_type=mime_type)
     with BytesIO(data) as buffer:
         image = Image.open(buffer)
-        return image.convert("RGB")
+        converted = image.convert("RGB")
+    return GeneratedImage(data=_encode_png(converted), mime_type="image/png")
+
+
+def _load_reference_image(metadata: ReferenceImageMetadata) -> GeneratedImage:
+    """Load a reference image as encoded bytes, reusing the process-wide cache.
+
+    PNG/JPEG/WebP uploads are sent exactly as stored; the PIL decode only runs
+    for formats that need conversion, once per cached reference.
+    """
+
+    def load() -> tuple[bytes, GeneratedImage]:
+        data = _download_reference_bytes(metadata)
+        return data, _reference_part(data)
+
+    entry = get_reference_image_cache().get_or_load(
+        reference_image_cache_key(metadata),
+        load,
+    )
+    return entry.image
 
 
 def _sanitize_segment(value: str, fallback: str) -> str:
@@ -126,7 +253,7 @@ def _resolve_bucket() -> tuple[str, str]:
     return bucket_name, bucket_uri
 
 
-def _extract_image(response: Any) -> Image.Image:
+def _extract_image_bytes(response: Any) -> GeneratedImage:
     candidates = getattr(response, "candidates", []) or []
     for candidate in candidates:
         content = getattr(candidate, "content", None)
@@ -135,27 +262,38 @@ def _extract_image(response: Any) -> Image.Image:
         for part in getattr(content, "parts", []) or []:
             inline_data = getattr(part, "inline_data", None)
             if inline_data and getattr(inline_data, "data", None):
-                with BytesIO(inline_data.data) as handle:
-                    image = Image.open(handle)
-                    return image.convert("RGB")
+                return GeneratedImage(
+                    data=bytes(inline_data.data),
+                    mime_type=getattr(inline_data, "mime_type", None) or "image/png",
+                )
     raise RuntimeError("Resposta do modelo não contém dados de imagem.")
 
 
-async def _call_model(contents: list[Any]) -> Image.Image:
+def _decode_image(generated: GeneratedImage) -> Image.Image:
+    with BytesIO(generated.data) as handle:
+        image = Image.open(handle)
+        return image.convert("RGB")
+
+
+def _encode_png(image: Image.Image) -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    data = buffer.getvalue()
+    buffer.close()
+    return data
+
+
+async def _call_model(contents: list[Any]) -> GeneratedImage | Image.Image:
     parts: list[types.Part] = []
     for item in contents:
         if isinstance(item, str):
             parts.append(types.Part.from_text(text=item))
+        elif isinstance(item, GeneratedImage):
+            # Reaproveita os bytes originais do modelo, sem recodificar.
+            parts.append(types.Part.from_bytes(data=item.data, mime_type=item.mime_type))
         elif isinstance(item, Image.Image):
-            buffer = BytesIO()
-            item.save(buffer, format="PNG")
-            parts.append(
-                types.Part.from_bytes(
-                    data=buffer.getvalue(),
-                    mime_type="image/png",
-                )
-            )
-            buffer.close()
+            data = await asyncio.to_thread(_encode_png, item)
+            parts.append(types.Part.from_bytes(data=data, mime_type="image/png"))
         else:
             parts.append(item)
 
@@ -167,21 +305,43 @@ async def _call_model(contents: list[Any]) -> Image.Image:
     ]
 
     generation_config = _get_generation_config()
+    # Semeia o limitador AIMD do modelo de imagem com a concorrência configurada.
+    get_vertex_limiter(_MODEL_NAME, initial=config.image_generation_max_concurrency)
+    regions = get_region_pool(_MODEL_NAME)
+    tried: set[str] = set()
+    # Uma geração lógica consome a cota uma vez, por mais tentativas que leve.
+    charge_vertex_call_quota(IMAGE_GENERATIONS)
 
     delay_seconds = 1.5
     last_exc: Optional[Exception] = None
-    for attempt in range(1, config.image_generation_max_retries + 1):
+    attempt = 0
+    failovers = 0  # trocas imediatas de região não consomem tentativas
+    while attempt - failovers < config.image_generation_max_retries:
+        attempt += 1
+        check_vertex_circuit(_MODEL_NAME, attempts=attempt - 1, last_exception=last_exc)
+        region = regions.choose(exclude=tried)
+        tried.add(region)
+        started = time.monotonic()
         try:
-            response = await asyncio.wait_for(
-                asyncio.to_thread(
-                    _client.models.generate_content,
-                    model=_MODEL_NAME,
-                    contents=formatted_contents,
-                    config=generation_config,
-                ),
-                timeout=config.image_generation_timeout,
-            )
-            return _extract_image(response)
+            async with alimit_vertex_concurrency(_MODEL_NAME, quota=None):
+                try:
+                    response = await asyncio.wait_for(
+                        _get_client(region).aio.models.generate_content(
+                            model=_MODEL_NAME,
+                            contents=formatted_contents,
+                            config=generation_config,
+                        ),
+                        timeout=config.image_generation_timeout,
+                    )
+                except Exception as call_exc:
+                    record_vertex_outcome(_MODEL_NAME, call_exc, region=region)
+                    raise
+            record_vertex_outcome(_MODEL_NAME)
+            regions.record_success(region, time.monotonic() - started)
+            generated = _extract_image_bytes(response)
+            if config.image_raw_passthrough:
+                return generated
+            return await asyncio.to_thread(_decode_image, generated)
         except Exception as exc:  # pragma: no cover - network.errors
             last_exc = exc
             logger.warning(
@@ -190,7 +350,14 @@ async def _call_model(contents: list[Any]) -> Image.Image:
                 config.image_generation_max_retries,
                 exc,
             )
-            if attempt < config.image_generation_max_retries:
+            raise_if_vertex_circuit_open(_MODEL_NAME, attempts=attempt, last_exception=exc)
+            # 429/503 com outra região disponível: tenta lá já, sem reiniciar o backoff.
+            if record_region_failure(
+                regions, region, exc, tried, attempts=attempt, logger_obj=logger
+            ):
+                failovers += 1
+                continue
+            if attempt - failovers < config.image_generation_max_retries:
                 await asyncio.sleep(min(delay_seconds, 10))
                 delay_seconds *= 1.5
     raise RuntimeError(
@@ -211,6 +378,15 @@ def _summarize_stage_inputs(parts: list[Any]) -> list[dict[str, Any]]:
                 }
             )
             continue
+        if isinstance(item, GeneratedImage):
+            summary.append(
+                {
+                    "type": "image",
+                    "mime_type": item.mime_type,
+                    "bytes": len(item.data),
+                }
+            )
+            continue
         if isinstance(item, Image.Image):
             summary.append(
                 {
@@ -232,49 +408,253 @@ async def _notify(callback: Optional[ProgressCallback], stage_idx: int, stage_la
         await result
 
 
+async def _checkpoint(
+    callback: CheckpointCallback | None, stage_label: str, record: dict[str, str]
+) -> None:
+    if not callback:
+        return
+    result = callback(stage_label, record)
+    if inspect.isawaitable(result):
+        await result
+
+
+async def _gather_or_cancel(*aws: Awaitable[Any]) -> list[Any]:
+    """Run ``aws`` concurrently; on the first failure cancel the remaining ones."""
+
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return list(await asyncio.gather(*tasks))
+    except BaseException:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+async def _gather_settled(*aws: Awaitable[Any]) -> list[Any]:
+    """Run ``aws`` to completion, then re-raise the first failure, if any.
+
+    Used when stages are checkpointed: a failing branch should not discard a
+    sibling stage that is about to upload, since a re-run resumes from it.
+    """
+
+    results = await asyncio.gather(*aws, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return list(results)
+
+
 async def _upload_image(
-    image: Image.Image,
+    image: GeneratedImage | Image.Image,
     *,
     user_id: str,
     session_id: str,
     variation_idx: int,
     stage_label: str,
-    prefix_override: Optional[str] = None,
+    prefix_override: str | None = None,
+    content_hash: str | None = None,
+    reserved_bytes: int = 0,
 ) -> _UploadResult:
+    """Upload a stage image (and its derivatives) and return its URIs.
+
+    With ``content_hash`` the object is written once per user under
+    ``images/by-hash/<hash>`` instead of the session path, so index entries
+    never point at an object a later run overwrites. ``reserved_bytes`` already
+    charged to the user's ``gcs_bytes`` quota are settled with the real size.
+    """
+
     bucket_name, bucket_uri = _resolve_bucket()
-    bucket = _storage_client.bucket(bucket_name)
+    bucket = _get_storage_client().bucket(bucket_name)
 
     safe_user = _sanitize_segment(user_id, "anonymous")
     safe_session = _sanitize_segment(session_id, "nosession")
-    base_prefix = prefix_override or f"deliveries/{safe_user}/{safe_session}/images"
-    filename = f"{stage_label}_{variation_idx}.png"
-    blob_path = f"{base_prefix}/{filename}"
+    if content_hash:
+        base_prefix = f"{prefix_override or f'deliveries/{safe_user}/images'}/by-hash"
+        stem = content_hash
+    else:
+        base_prefix = prefix_override or f"deliveries/{safe_user}/{safe_session}/images"
+        stem = f"{stage_label}_{variation_idx}"
+    if isinstance(image, GeneratedImage):
+        data = image.data
+        content_type = image.mime_type
+        extension = image.extension
+    else:
+        data = await asyncio.to_thread(_encode_png, image)
+        content_type = "image/png"
+        extension = "png"
 
-    buffer = BytesIO()
-    image.save(buffer, format="PNG")
-    data = buffer.getvalue()
-    buffer.close()
+    blob_path = f"{base_prefix}/{stem}.{extension}"
+    if not reserved_bytes:
+        charge_user_quota(user_id, GCS_BYTES, len(data))
 
     blob = bucket.blob(blob_path)
-    await asyncio.to_thread(blob.upload_from_string, data, content_type="image/png")
+    upload_original = asyncio.to_thread(blob.upload_from_string, data, content_type=content_type)
+    try:
+        if config.image_derivatives_enabled:
+            # Os derivados são codificados enquanto o original sobe.
+            _, derivatives = await _gather_or_cancel(
+                upload_original,
+                _upload_derivatives(
+                    bucket,
+                    bucket_name,
+                    data,
+                    prefix=f"{base_prefix}/derivatives",
+                    stem=stem,
+                ),
+            )
+        else:
+            await upload_original
+            derivatives = {}
+    except BaseException:
+        # Nada foi gravado: devolve a reserva.
+        settle_user_quota(user_id, GCS_BYTES, reserved=reserved_bytes, actual=0)
+        raise
+    settle_user_quota(user_id, GCS_BYTES, reserved=reserved_bytes, actual=len(data))
+
+    return _UploadResult(
+        gcs_uri=f"gs://{bucket_name}/{blob_path}",
+        signed_url=_sign_blob(blob, content_type),
+        derivatives=derivatives,
+    )
+
+
+async def _upload_derivatives(
+    bucket: Any, bucket_name: str, data: bytes, *, prefix: str, stem: str
+) -> dict[str, dict[str, str]]:
+    """Encode previews/thumbnails and upload them concurrently (best effort)."""
 
-    signed_url = ""
     try:
-        signed_url = blob.generate_signed_url(
+        encoded = await build_derivatives(data)
+    except Exception as exc:
+        logger.warning("Falha ao gerar derivados de %s: %s", stem, exc, exc_info=True)
+        return {}
+
+    async def upload(item: Any) -> tuple[str, dict[str, str]]:
+        blob_path = f"{prefix}/{stem}_{item.name}.{item.extension}"
+        blob = bucket.blob(blob_path)
+        await asyncio.to_thread(blob.upload_from_string, item.data, content_type=item.mime_type)
+        return item.name, {
+            "gcs_uri": f"gs://{bucket_name}/{blob_path}",
+            "mime_type": item.mime_type,
+            "signed_url": _sign_blob(blob, item.mime_type),
+        }
+
+    try:
+        uploaded = await _gather_or_cancel(*(upload(item) for item in encoded))
+    except Exception as exc:  # pragma: no cover - depends on GCS
+        logger.warning("Falha ao enviar derivados de %s: %s", stem, exc, exc_info=True)
+        return {}
+    return dict(uploaded)
+
+
+def _sign_blob(blob: Any, content_type: str) -> str:
+    # Com assinatura adiada guardamos só o gs://; os endpoints de entrega assinam
+    # em lote via app.utils.signed_urls.
+    if config.image_defer_signed_urls:
+        return ""
+    try:
+        return blob.generate_signed_url(
             version="v4",
             expiration=timedelta(seconds=config.image_signed_url_ttl),
             method="GET",
-            response_type="image/png",
+            response_type=content_type,
         )
     except Exception as exc:  # pragma: no cover - depends on GCP setup
-        logger.warning("Falha ao gerar Signed URL para %s: %s", blob_path, exc, exc_info=True)
+        logger.warning("Falha ao gerar Signed URL para %s: %s", blob.name, exc, exc_info=True)
+        return ""
 
-    return _UploadResult(
-        gcs_uri=f"gs://{bucket_name}/{blob_path}",
-        signed_url=signed_url,
+
+@dataclass
+class _CachedStage:
+    upload: _UploadResult
+    mime_type: str
+    content_hash: str | None = None
+
+
+async def _resolve_stored_stage(record: dict[str, Any]) -> _CachedStage | None:
+    """Return the stored stage if its GCS object still exists."""
+
+    gcs_uri = record.get("gcs_uri") or ""
+    mime_type = record.get("mime_type") or "image/png"
+    try:
+        blob = _blob_for_uri(gcs_uri)
+        exists = await asyncio.to_thread(blob.exists)
+    except Exception as exc:  # pragma: no cover - depends on GCS
+        logger.warning("Falha ao validar imagem em cache %s: %s", gcs_uri, exc)
+        return None
+    if not exists:
+        return None
+    derivatives: dict[str, dict[str, str]] = {}
+    for name, item in (record.get("derivatives") or {}).items():
+        try:
+            derivative_blob = _blob_for_uri(item["gcs_uri"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        derivatives[name] = {
+            "gcs_uri": item["gcs_uri"],
+            "mime_type": item.get("mime_type") or "",
+            "signed_url": _sign_blob(derivative_blob, item.get("mime_type") or ""),
+        }
+    return _CachedStage(
+        upload=_UploadResult(
+            gcs_uri=gcs_uri,
+            signed_url=_sign_blob(blob, mime_type),
+            derivatives=derivatives,
+        ),
+        mime_type=mime_type,
+        content_hash=record.get("content_hash") or None,
     )
 
 
+async def _lookup_cached_stage(
+    index: GeneratedImageIndex | None, key: str
+) -> _CachedStage | None:
+    """Resolve a content-addressed stage to its existing GCS object, if still present."""
+
+    if index is None:
+        return None
+    record = index.get(key)
+    if not record:
+        return None
+    cached = await _resolve_stored_stage(record)
+    if cached is None:
+        index.discard(key)
+    return cached
+
+
+async def _lookup_checkpoint(
+    checkpoints: Mapping[str, Mapping[str, Any]] | None, stage_label: str, key: str
+) -> _CachedStage | None:
+    """Resume a stage checkpointed by a previous run of the same variation."""
+
+    record = (checkpoints or {}).get(stage_label)
+    if not isinstance(record, Mapping) or record.get("prompt_hash") != key:
+        return None
+    return await _resolve_stored_stage(dict(record))
+
+
+async def _download_generated_image(cached: _CachedStage) -> GeneratedImage:
+    blob = _blob_for_uri(cached.upload.gcs_uri)
+    data = await asyncio.to_thread(blob.download_as_bytes)
+    return GeneratedImage(data=data, mime_type=cached.mime_type)
+
+
+async def _as_generated_image(image: Any) -> Any:
+    """Encode a PIL result once so it can be hashed, uploaded and reused as is."""
+
+    if isinstance(image, Image.Image):
+        return GeneratedImage(data=await asyncio.to_thread(_encode_png, image))
+    return image
+
+
+def _content_hash(image: Any) -> str | None:
+    if isinstance(image, GeneratedImage):
+        return image_content_hash(image.data)
+    return None
+
+
 async def generate_transformation_images(
     *,
     prompt_atual: str,
@@ -285,8 +665,14 @@ async def generate_transformation_images(
     progress_callback: Optional[ProgressCallback] = None,
     reference_character: Optional[ReferenceImageMetadata] = None,
     reference_product: Optional[ReferenceImageMetadata] = None,
+    checkpoints: Mapping[str, Mapping[str, Any]] | None = None,
+    checkpoint_callback: CheckpointCallback | None = None,
 ) -> Dict[str, Dict[str, str]]:
-    """Generate and upload the three transformation images for a single variation."""
+    """Generate and upload the three transformation images for a single variation.
+
+    ``checkpoints`` maps stage labels to records saved by ``checkpoint_callback`` in a
+    previous run; stages whose ``prompt_hash`` still matches are resumed from GCS.
+    """
 
     if not prompt_atual:
         raise ValueError("prompt_atual não pode ser vazio.")
@@ -301,8 +687,8 @@ async def generate_transformation_images(
 
     started_at = time.perf_counter()
 
-    character_image: Image.Image | None = None
-    product_image: Image.Image | None = None
+    character_image: GeneratedImage | None = None
+    product_image: GeneratedImage | None = None
     character_load_error: str | None = None
     product_load_error: str | None = None
 
@@ -378,35 +764,15 @@ async def generate_transformation_images(
         stage_one_inputs.append(product_image)
     stage_one_inputs.append(prompt_estado_atual)
 
-    if logger.isEnabledFor(logging.DEBUG):
-        logger.debug(
-            "generate_content inputs for variation %s - estado_atual: %s",
-            variation_idx,
-            json.dumps(_summarize_stage_inputs(stage_one_inputs)),
-        )
-
-    image_atual = await _call_model(stage_one_inputs)
-    upload_atual = await _upload_image(
-        image_atual,
-        user_id=user_id,
-        session_id=session_id,
-        variation_idx=variation_idx,
-        stage_label="estado_atual",
-        prefix_override=prefix,
-    )
-    await _notify(progress_callback, 1, "estado_atual")
-
     # Etapa 2 – intermediário (usa imagem base)
     transform_prompt_inter_parts: list[str] = [
         "Gerar a IMAGEM DO ESTADO INTERMEDIÁRIO: o personagem está buscando soluções na internet sobre o produto/serviço do anunciante.",
         "Enquadramento over-the-shoulder (por trás e levemente de lado), câmera atrás e lateral do personagem.",
         "A TELA do dispositivo deve estar de frente para a câmera e ser o foco principal, mostrando Instagram, site ou resultados de busca do anunciante.",
-        "Iluminação realista, foco na tela e sem reflexos que impeçam a leitura."
+        "Iluminação realista, foco na tela e sem reflexos que impeçam a leitura.",
+        # A etapa 2 sempre recebe a imagem gerada na etapa 1.
+        "Use como referência a IMAGEM COMPARTILHADA do estado atual para manter o mesmo personagem, características físicas e expressões.",
     ]
-    if image_atual is not None:
-        transform_prompt_inter_parts.append(
-            "Use como referência a IMAGEM COMPARTILHADA do estado atual para manter o mesmo personagem, características físicas e expressões."
-        )
     if character_image is not None:
         transform_prompt_inter_parts.append(
             "Considere também a imagem compartilhada do personagem para reforçar consistência de rosto e proporções."
@@ -420,30 +786,6 @@ async def generate_transformation_images(
     )
     transform_prompt_inter_parts.append(prompt_intermediario)
     transform_prompt_inter = " ".join(transform_prompt_inter_parts)
-    stage_two_inputs: list[Any] = [image_atual]
-    if character_image is not None:
-        stage_two_inputs.append(character_image)
-    if product_image is not None:
-        stage_two_inputs.append(product_image)
-    stage_two_inputs.append(transform_prompt_inter)
-
-    if logger.isEnabledFor(logging.DEBUG):
-        logger.debug(
-            "generate_content inputs for variation %s - estado_intermediario: %s",
-            variation_idx,
-            json.dumps(_summarize_stage_inputs(stage_two_inputs)),
-        )
-
-    image_intermediario = await _call_model(stage_two_inputs)
-    upload_intermediario = await _upload_image(
-        image_intermediario,
-        user_id=user_id,
-        session_id=session_id,
-        variation_idx=variation_idx,
-        stage_label="estado_intermediario",
-        prefix_override=prefix,
-    )
-    await _notify(progress_callback, 2, "estado_intermediario")
 
     # Etapa 3 – aspiracional (usa apenas uploads aprovados)
     transform_prompt_asp_parts: list[str] = [
@@ -471,23 +813,216 @@ async def generate_transformation_images(
         stage_three_inputs.append(character_image)
     stage_three_inputs.append(transform_prompt_asp)
 
-    if logger.isEnabledFor(logging.DEBUG):
-        logger.debug(
-            "generate_content inputs for variation %s - estado_aspiracional: %s",
-            variation_idx,
-            json.dumps(_summarize_stage_inputs(stage_three_inputs)),
+    # Cache endereçado por conteúdo: etapas idênticas (mesmo usuário, modelo,
+    # config, prompt e referências) reaproveitam o objeto já salvo no GCS.
+    image_index = get_generated_image_index()
+    track_stages = image_index is not None or bool(checkpoints) or checkpoint_callback is not None
+    generation_fingerprint = (
+        _get_generation_config().model_dump(mode="json", exclude_none=True)
+        if track_stages
+        else None
+    )
+    reference_keys = [
+        reference_image_cache_key(reference)
+        for reference, image in (
+            (reference_character, character_image),
+            (reference_product, product_image),
         )
+        if reference is not None and image is not None
+    ]
 
-    image_aspiracional = await _call_model(stage_three_inputs)
-    upload_aspiracional = await _upload_image(
-        image_aspiracional,
-        user_id=user_id,
-        session_id=session_id,
-        variation_idx=variation_idx,
-        stage_label="estado_aspiracional",
-        prefix_override=prefix,
-    )
-    await _notify(progress_callback, 3, "estado_aspiracional")
+    def stage_key(prompt: str, parent_key: str | None = None) -> str:
+        return make_image_cache_key(
+            model=_MODEL_NAME,
+            generation_config=generation_fingerprint,
+            prompt=prompt,
+            reference_keys=reference_keys,
+            parent_key=parent_key,
+            owner=user_id,
+        )
+
+    def intermediate_key(image_atual: Any, content_hash: str | None) -> str:
+        # A etapa 2 é endereçada pelos bytes exatos da etapa 1 que recebe.
+        return stage_key(
+            transform_prompt_inter,
+            parent_key=content_hash or _content_hash(image_atual) or key_atual,
+        )
+
+    key_atual = stage_key(prompt_estado_atual)
+    key_aspiracional = stage_key(transform_prompt_asp)
+    cache_hits: list[str] = []
+    resumed_stages: list[str] = []
+
+    async def save_checkpoint(
+        stage_label: str,
+        cache_key: str,
+        upload: _UploadResult,
+        mime_type: str,
+        content_hash: str | None,
+    ) -> None:
+        record: dict[str, Any] = {
+            "gcs_uri": upload.gcs_uri,
+            "mime_type": mime_type,
+            "prompt_hash": cache_key,
+        }
+        if content_hash:
+            record["content_hash"] = content_hash
+        derivatives = _stored_derivatives(upload)
+        if derivatives:
+            record["derivatives"] = derivatives
+        await _checkpoint(checkpoint_callback, stage_label, record)
+
+    async def lookup_stage(stage_label: str, cache_key: str) -> _CachedStage | None:
+        cached = await _lookup_checkpoint(checkpoints, stage_label, cache_key)
+        if cached is not None:
+            resumed_stages.append(stage_label)
+            return cached
+        cached = await _lookup_cached_stage(image_index, cache_key)
+        if cached is not None:
+            cache_hits.append(stage_label)
+            await save_checkpoint(
+                stage_label, cache_key, cached.upload, cached.mime_type, cached.content_hash
+            )
+        return cached
+
+    async def upload_stage(image: Any, stage_label: str, cache_key: str) -> _UploadResult:
+        content_hash = _content_hash(image) if track_stages else None
+        uploaded = await _upload_image(
+            image,
+            user_id=user_id,
+            session_id=session_id,
+            variation_idx=variation_idx,
+            stage_label=stage_label,
+            prefix_override=prefix,
+            # Só o que entra no índice precisa de um caminho imutável.
+            content_hash=content_hash if image_index is not None else None,
+            reserved_bytes=gcs_reservations.pop(cache_key, 0),
+        )
+        mime_type = image.mime_type if isinstance(image, GeneratedImage) else "image/png"
+        if image_index is not None:
+            image_index.put(
+                cache_key,
+                gcs_uri=uploaded.gcs_uri,
+                mime_type=mime_type,
+                content_hash=content_hash,
+                derivatives=_stored_derivatives(uploaded) or None,
+            )
+        await save_checkpoint(stage_label, cache_key, uploaded, mime_type, content_hash)
+        return uploaded
+
+    gcs_reservations: dict[str, int] = {}
+    gcs_estimate = int(config.user_quota_gcs_image_estimate_mb * 1024 * 1024)
+
+    async def generate_stage(cache_key: str, inputs: list[Any]) -> Any:
+        # Reserva os bytes do upload antes da chamada: cota de GCS esgotada não
+        # gasta uma geração de imagem. O upload acerta a diferença.
+        charge_user_quota(user_id, GCS_BYTES, gcs_estimate)
+        try:
+            # Etapas idênticas em voo (outra sessão do mesmo usuário, reenvio)
+            # compartilham a chamada ao modelo.
+            image = await _image_stage_flight.ado(cache_key, lambda: _call_model(inputs))
+            image = await _as_generated_image(image) if track_stages else image
+        except BaseException:
+            settle_user_quota(user_id, GCS_BYTES, reserved=gcs_estimate, actual=0)
+            raise
+        gcs_reservations[cache_key] = gcs_estimate
+        return image
+
+    async def upload_current(image: Any) -> _UploadResult:
+        uploaded = await upload_stage(image, "estado_atual", key_atual)
+        await _notify(progress_callback, 1, "estado_atual")
+        return uploaded
+
+    async def reuse_current(cached: _CachedStage) -> _UploadResult:
+        await _notify(progress_callback, 1, "estado_atual")
+        return cached.upload
+
+    # Grafo de dependências: 1 → 2 em sequência (a etapa 2 usa a imagem da 1),
+    # enquanto a etapa 3 depende só das referências e roda em paralelo.
+    # O upload de cada etapa corre junto com a próxima chamada ao modelo.
+    async def run_current_to_intermediate() -> tuple[_UploadResult, _UploadResult]:
+        cached_atual = await lookup_stage("estado_atual", key_atual)
+        if cached_atual is not None:
+            image_atual: Any = None
+            if cached_atual.content_hash is None:
+                # Registro antigo sem hash: baixa a etapa 1 para endereçar a etapa 2.
+                image_atual = await _download_generated_image(cached_atual)
+            key_intermediario = intermediate_key(image_atual, cached_atual.content_hash)
+            cached_intermediario = await lookup_stage("estado_intermediario", key_intermediario)
+            if cached_intermediario is not None:
+                await _notify(progress_callback, 1, "estado_atual")
+                await _notify(progress_callback, 2, "estado_intermediario")
+                return cached_atual.upload, cached_intermediario.upload
+            if image_atual is None:
+                image_atual = await _download_generated_image(cached_atual)
+            upload_atual_task = asyncio.create_task(reuse_current(cached_atual))
+        else:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "generate_content inputs for variation %s - estado_atual: %s",
+                    variation_idx,
+                    json.dumps(_summarize_stage_inputs(stage_one_inputs)),
+                )
+            image_atual = await generate_stage(key_atual, stage_one_inputs)
+            key_intermediario = intermediate_key(image_atual, None)
+            upload_atual_task = asyncio.create_task(upload_current(image_atual))
+        try:
+            stage_two_inputs: list[Any] = [image_atual]
+            if character_image is not None:
+                stage_two_inputs.append(character_image)
+            if product_image is not None:
+                stage_two_inputs.append(product_image)
+            stage_two_inputs.append(transform_prompt_inter)
+
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "generate_content inputs for variation %s - estado_intermediario: %s",
+                    variation_idx,
+                    json.dumps(_summarize_stage_inputs(stage_two_inputs)),
+                )
+
+            image_intermediario = await generate_stage(key_intermediario, stage_two_inputs)
+            upload_intermediario = await upload_stage(
+                image_intermediario, "estado_intermediario", key_intermediario
+            )
+            # Mantém a ordem 1 → 2 das notificações mesmo se o upload 2 terminar antes.
+            upload_atual = await upload_atual_task
+            await _notify(progress_callback, 2, "estado_intermediario")
+            return upload_atual, upload_intermediario
+        finally:
+            if not upload_atual_task.done():
+                upload_atual_task.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await upload_atual_task
+
+    async def run_aspirational() -> _UploadResult:
+        cached = await lookup_stage("estado_aspiracional", key_aspiracional)
+        if cached is not None:
+            await _notify(progress_callback, 3, "estado_aspiracional")
+            return cached.upload
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "generate_content inputs for variation %s - estado_aspiracional: %s",
+                variation_idx,
+                json.dumps(_summarize_stage_inputs(stage_three_inputs)),
+            )
+        image_aspiracional = await generate_stage(key_aspiracional, stage_three_inputs)
+        upload_aspiracional = await upload_stage(
+            image_aspiracional, "estado_aspiracional", key_aspiracional
+        )
+        await _notify(progress_callback, 3, "estado_aspiracional")
+        return upload_aspiracional
+
+    gather = _gather_settled if checkpoint_callback else _gather_or_cancel
+    try:
+        (upload_atual, upload_intermediario), upload_aspiracional = await gather(
+            run_current_to_intermediate(),
+            run_aspirational(),
+        )
+    finally:
+        # Imagens geradas que não chegaram ao upload (falha/cancelamento) devolvem a reserva.
+        for reserved in gcs_reservations.values():
+            settle_user_quota(user_id, GCS_BYTES, reserved=reserved, actual=0)
 
     elapsed = time.perf_counter() - started_at
     logger.info(
@@ -500,6 +1035,10 @@ async def generate_transformation_images(
         "variation_idx": variation_idx,
         "duration_seconds": elapsed,
     }
+    if cache_hits:
+        meta["image_cache_hits"] = sorted(cache_hits)
+    if resumed_stages:
+        meta["resumed_stages"] = sorted(resumed_stages)
 
     if reference_character is not None:
         meta.update(
@@ -529,4 +1068,4 @@ async def generate_transformation_images(
     }
 
 
-__all__ = ["generate_transformation_images", "_load_reference_image"]
+__all__ = ["GeneratedImage", "generate_transformation_images", "_load_reference_image"]
@@ -3,10 +3,13 @@ StoryBrand Framework Extractor using LangExtract
 Uses Google's LangExtract library with LLMs to extract the 7 StoryBrand elements.
 """
 
+import asyncio
 import hashlib
 import logging
 import os
 import textwrap
+import threading
+import time
 from typing import Any, Dict, List, Optional
 
 try:
@@ -19,7 +22,20 @@ except ImportError:
 logger = logging.getLogger(__name__)
 
 from app.utils.cache import get_storybrand_cache, make_storybrand_cache_key
-from app.utils.vertex_retry import VertexRetryExceededError, call_with_vertex_retry
+from app.utils.single_flight import get_single_flight
+from app.utils.storybrand_planner import (
+    StoryBrandPlan,
+    apply_plan,
+    estimate_tokens,
+    get_latency_model,
+    plan_storybrand_extraction,
+)
+from app.utils.vertex_retry import (
+    VertexRetryExceededError,
+    acall_with_vertex_retry,
+    call_with_vertex_retry,
+    vertex_region,
+)
 
 
 class StoryBrandExtractor:
@@ -47,6 +63,7 @@ class StoryBrandExtractor:
         self.model_id = model_id
         self.cache_enabled = os.getenv("STORYBRAND_CACHE_ENABLED", "true").lower() != "false"
         self._cache = get_storybrand_cache()
+        self._flight = get_single_flight("storybrand")
 
         # Forçar uso de Vertex AI (sem API key)
         self.project = os.getenv("GOOGLE_CLOUD_PROJECT")
@@ -81,6 +98,10 @@ class StoryBrandExtractor:
 
         # Criar exemplos para few-shot learning
         self.examples = self._create_storybrand_examples()
+        # Prompt + few-shots vão em toda chamada do LangExtract (um por chunk).
+        self.prompt_tokens = estimate_tokens(self.prompt) + sum(
+            2 * estimate_tokens(example.text) for example in self.examples
+        )
 
     def _create_storybrand_examples(self) -> List[lx.data.ExampleData]:
         """Cria exemplos de alta qualidade para treinar o modelo."""
@@ -443,63 +464,152 @@ class StoryBrandExtractor:
 
         return examples
 
-    def _prepare_input(self, content: str) -> tuple[str, bool, dict[str, Any]]:
-        """Normalize and adaptively truncate the HTML/text payload for Vertex AI."""
+    def plan_input(self, content: str) -> StoryBrandPlan:
+        """Token budget, chunk size, workers and passes for ``content``."""
+
+        return plan_storybrand_extraction(content, prompt_tokens=self.prompt_tokens)
+
+    def prepare_input(
+        self, content: str, plan: StoryBrandPlan
+    ) -> tuple[str, dict[str, Any]]:
+        """Reduce the payload to the plan's budget; returns ``(text, truncation_info)``.
+
+        Pass both to :meth:`aextract`/:meth:`extract` so the page is reduced only once.
+        """
 
         if not isinstance(content, str):
-            return "", False, {"input_length": 0, "strategy": "empty"}
-
-        hard_limit = max(0, int(os.getenv("STORYBRAND_HARD_CHAR_LIMIT", "20000")))
-        soft_limit = max(1000, int(os.getenv("STORYBRAND_SOFT_CHAR_LIMIT", "12000")))
-        tail_ratio = float(os.getenv("STORYBRAND_TAIL_RATIO", "0.2"))
-        tail_ratio = min(max(tail_ratio, 0.05), 0.4)
-
-        length = len(content)
-        overflow = max(0, length - soft_limit)
-        adaptive_bonus = min(soft_limit, int(overflow * 0.3))
-        allowed = soft_limit + adaptive_bonus
-        if hard_limit:
-            allowed = min(allowed, hard_limit)
-
-        metadata: dict[str, Any] = {
-            "input_length": length,
-            "soft_limit": soft_limit,
-            "hard_limit": hard_limit,
-            "allowed_chars": allowed,
-            "tail_ratio": tail_ratio,
+            return "", {"input_length": 0, "strategy": "empty", "truncated": False}
+
+        prepared, metadata = apply_plan(content, plan)
+        metadata["input_hash"] = hashlib.sha256(prepared.encode("utf-8")).hexdigest()
+        return prepared, metadata
+
+    def _prepare_request(
+        self,
+        page_content: str,
+        landing_page_url: str | None,
+        plan: StoryBrandPlan,
+        truncation_info: dict[str, Any] | None = None,
+    ) -> tuple[dict[str, Any], str | None]:
+        """Monta os parâmetros do LangExtract e a chave de cache/single-flight.
+
+        Returns:
+            (extract_kwargs, cache_key)
+        """
+
+        # Parâmetros de performance decididos pelo planner (env vars são tetos)
+        passes = plan.passes
+        max_workers = plan.max_workers
+        max_char_buffer = plan.max_char_buffer
+
+        if truncation_info is None:
+            prepared_input, truncation_info = self.prepare_input(page_content, plan)
+            if truncation_info.get("truncated"):
+                logger.info("StoryBrand input truncated", extra=truncation_info)
+            else:
+                logger.debug("StoryBrand input passthrough", extra=truncation_info)
+        else:
+            # Já reduzido pelo chamador (prepare_input): segue como está.
+            prepared_input = page_content
+
+        # Configurar parâmetros baseado no modo (Vertex AI ou Gemini API)
+        extract_kwargs = {
+            "text_or_documents": prepared_input,
+            "prompt_description": self.prompt,
+            "examples": self.examples,
+            "model_id": self.model_id,  # String com nome do modelo
+            "extraction_passes": passes,
+            "max_workers": max_workers,
+            "max_char_buffer": max_char_buffer,
+            "use_schema_constraints": True,  # Forçar estrutura
+            "fence_output": False
         }
 
-        if length <= allowed or allowed <= 0:
-            metadata.update({"strategy": "passthrough", "truncated": False})
-            digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
-            metadata["input_hash"] = digest
-            return content, False, metadata
-
-        head_chars = max(soft_limit, int(allowed * (1 - tail_ratio)))
-        head_chars = min(head_chars, allowed)
-        tail_chars = max(0, allowed - head_chars)
-        truncated_content = content[:head_chars]
-        if tail_chars:
-            truncated_content += "\n<!-- storybrand:tail -->\n" + content[-tail_chars:]
-
-        digest = hashlib.sha256(truncated_content.encode("utf-8")).hexdigest()
-        metadata.update(
-            {
-                "strategy": "head_tail",
-                "truncated": True,
-                "head_chars": head_chars,
-                "tail_chars": tail_chars,
-                "input_hash": digest,
-            }
+        # Sempre usar Vertex AI via ADC (sem API key)
+        logger.info(f"Usando Vertex AI - Projeto: {self.project}, Região: {self.location}")
+        logger.info(
+            "LangExtract params: passes=%s, max_workers=%s, max_char_buffer=%s "
+            "(plan: %s, predicted %.1fs)",
+            passes,
+            max_workers,
+            max_char_buffer,
+            plan.reason,
+            plan.predicted_seconds,
         )
-        return truncated_content, True, metadata
+        extract_kwargs["language_model_params"] = {
+            "vertexai": True,
+            "project": self.project,
+            "location": self.location,
+        }
+
+        # A chave também identifica extrações idênticas em voo (single-flight),
+        # mesmo com o cache desligado. Só entra o que muda o resultado: max_workers
+        # afeta apenas a latência; passes e max_char_buffer andam em degraus no planner.
+        cache_key = None
+        if truncation_info.get("input_hash"):
+            cache_key = make_storybrand_cache_key(
+                truncation_info["input_hash"],
+                self.model_id,
+                passes,
+                max_char_buffer,
+                os.getenv("GOOGLE_CLOUD_PROJECT"),
+                landing_page_url or "",
+            )
+
+        return extract_kwargs, cache_key
 
-    def extract(self, page_content: str, *, landing_page_url: Optional[str] = None) -> Dict[str, Any]:
+    def _cached(
+        self, cache_key: str | None, landing_page_url: str | None
+    ) -> dict[str, Any] | None:
+        # Pode tocar o SQLite (busy timeout, BEGIN IMMEDIATE): no caminho assíncrono roda em thread.
+        if not cache_key or not self.cache_enabled:
+            return None
+        cached = self._cache.get(cache_key)
+        if cached is not None:
+            logger.info(
+                "Retornando StoryBrand do cache local", extra={"landing_page_url": landing_page_url}
+            )
+        return cached
+
+    def _timed_extract(self, extract_kwargs: dict[str, Any], plan: StoryBrandPlan) -> Any:
+        # Só chamadas concluídas calibram o modelo de latência (sem fila nem backoff).
+        started = time.perf_counter()
+        result = lx.extract(**self._regional(extract_kwargs))
+        get_latency_model().observe(plan, time.perf_counter() - started)
+        return result
+
+    def _regional(self, extract_kwargs: dict[str, Any]) -> dict[str, Any]:
+        # A camada de retry escolhe a região a cada tentativa (failover 429/503).
+        params = {**extract_kwargs["language_model_params"], "location": vertex_region(self.location)}
+        return {**extract_kwargs, "language_model_params": params}
+
+    def _finalize(self, result: Any, cache_key: str | None) -> dict[str, Any]:
+        # Converter resultado para formato StoryBrand
+        converted = self._convert_to_storybrand_format(result)
+
+        if cache_key and self.cache_enabled:
+            self._cache.set(cache_key, converted)
+
+        return converted
+
+    def extract(
+        self,
+        page_content: str,
+        *,
+        landing_page_url: str | None = None,
+        plan: StoryBrandPlan | None = None,
+        truncation_info: dict[str, Any] | None = None,
+    ) -> dict[str, Any]:
         """
         Extrai os elementos StoryBrand do conteúdo HTML usando LangExtract.
 
+        Bloqueia a thread atual; em código assíncrono use :meth:`aextract`.
+
         Args:
             page_content: Conteúdo da página (HTML bruto ou texto processado via Trafilatura)
+            plan: Plano de orçamento já calculado (default: :meth:`plan_input`)
+            truncation_info: Resultado de :meth:`prepare_input`; quando informado,
+                ``page_content`` já foi reduzido e não passa de novo pelo plano
 
         Returns:
             Dict com os 7 elementos StoryBrand extraídos
@@ -510,76 +620,71 @@ class StoryBrandExtractor:
 
         try:
             logger.info("Iniciando extração StoryBrand com LangExtract (Vertex AI)")
+            plan = plan or self.plan_input(page_content)
+            extract_kwargs, cache_key = self._prepare_request(
+                page_content, landing_page_url, plan, truncation_info
+            )
+            cached = self._cached(cache_key, landing_page_url)
+            if cached is not None:
+                return cached
+
+            def run() -> dict[str, Any]:
+                # Executar extração com LangExtract usando retry/backoff
+                result = call_with_vertex_retry(
+                    lambda: self._timed_extract(extract_kwargs, plan),
+                    model=self.model_id,
+                    logger_obj=logger,
+                )
+                return self._finalize(result, cache_key)
 
-            # Parâmetros de performance via env vars (com defaults seguros)
-            passes = int(os.getenv("STORYBRAND_EXTRACTION_PASSES", "1"))
-            max_workers = int(os.getenv("STORYBRAND_MAX_WORKERS", "4"))
-            max_char_buffer = int(os.getenv("STORYBRAND_MAX_CHAR_BUFFER", "1500"))
+            # Requisições idênticas simultâneas compartilham uma única chamada ao Vertex.
+            return self._flight.do(cache_key, run)
 
-            prepared_input, truncated, truncation_info = self._prepare_input(page_content)
-            if truncated:
-                logger.info("StoryBrand input truncated", extra=truncation_info)
-            else:
-                logger.debug("StoryBrand input passthrough", extra=truncation_info)
+        except VertexRetryExceededError as e:
+            logger.error("Vertex AI saturado após múltiplas tentativas: %s", e)
+            raise
+        except Exception as e:
+            logger.error(f"Erro ao extrair StoryBrand com LangExtract: {str(e)}")
+            return self._empty_result()
 
-            # Configurar parâmetros baseado no modo (Vertex AI ou Gemini API)
-            extract_kwargs = {
-                "text_or_documents": prepared_input,
-                "prompt_description": self.prompt,
-                "examples": self.examples,
-                "model_id": self.model_id,  # String com nome do modelo
-                "extraction_passes": passes,
-                "max_workers": max_workers,
-                "max_char_buffer": max_char_buffer,
-                "use_schema_constraints": True,  # Forçar estrutura
-                "fence_output": False
-            }
-
-            # Sempre usar Vertex AI via ADC (sem API key)
-            logger.info(f"Usando Vertex AI - Projeto: {self.project}, Região: {self.location}")
-            logger.info(
-                "LangExtract params: passes=%s, max_workers=%s, max_char_buffer=%s",
-                passes,
-                max_workers,
-                max_char_buffer,
-            )
-            extract_kwargs["language_model_params"] = {
-                "vertexai": True,
-                "project": self.project,
-                "location": self.location,
-            }
-
-            cache_key = None
-            if self.cache_enabled and truncation_info.get("input_hash"):
-                cache_key = make_storybrand_cache_key(
-                    truncation_info["input_hash"],
-                    self.model_id,
-                    passes,
-                    max_workers,
-                    max_char_buffer,
-                    os.getenv("GOOGLE_CLOUD_PROJECT"),
-                    landing_page_url or "",
-                )
-                cached = self._cache.get(cache_key) if cache_key else None
-                if cached is not None:
-                    logger.info(
-                        "Retornando StoryBrand do cache local", extra={"landing_page_url": landing_page_url}
-                    )
-                    return cached
-
-            # Executar extração com LangExtract usando retry/backoff
-            result = call_with_vertex_retry(
-                lambda: lx.extract(**extract_kwargs),
-                logger_obj=logger,
-            )
+    async def aextract(
+        self,
+        page_content: str,
+        *,
+        landing_page_url: str | None = None,
+        plan: StoryBrandPlan | None = None,
+        truncation_info: dict[str, Any] | None = None,
+    ) -> dict[str, Any]:
+        """Versão assíncrona de :meth:`extract`.
+
+        A chamada ao LangExtract e o acesso ao cache rodam em threads; a espera por
+        permissões e o backoff usam o event loop, sem bloquear outras sessões.
+        """
 
-            # Converter resultado para formato StoryBrand
-            converted = self._convert_to_storybrand_format(result)
+        if not page_content:
+            return self._empty_result()
 
-            if cache_key:
-                self._cache.set(cache_key, converted)
+        try:
+            logger.info("Iniciando extração StoryBrand com LangExtract (Vertex AI)")
+            plan = plan or self.plan_input(page_content)
+            extract_kwargs, cache_key = self._prepare_request(
+                page_content, landing_page_url, plan, truncation_info
+            )
+            # Leitura e escrita do cache fora do event loop: um writer disputado no
+            # SQLite não pode travar as demais sessões do worker.
+            cached = await asyncio.to_thread(self._cached, cache_key, landing_page_url)
+            if cached is not None:
+                return cached
+
+            async def run() -> dict[str, Any]:
+                result = await acall_with_vertex_retry(
+                    lambda: asyncio.to_thread(self._timed_extract, extract_kwargs, plan),
+                    model=self.model_id,
+                    logger_obj=logger,
+                )
+                return await asyncio.to_thread(self._finalize, result, cache_key)
 
-            return converted
+            return await self._flight.ado(cache_key, run)
 
         except VertexRetryExceededError as e:
             logger.error("Vertex AI saturado após múltiplas tentativas: %s", e)
@@ -836,3 +941,28 @@ class StoryBrandExtractor:
         except Exception as e:
             logger.error(f"Erro ao salvar visualização: {str(e)}")
             return ""
+
+
+_extractors: dict[tuple, StoryBrandExtractor] = {}
+_extractors_lock = threading.Lock()
+
+
+def get_storybrand_extractor(model_id: str = "gemini-2.5-flash") -> StoryBrandExtractor:
+    """
+    Extrator compartilhado pelo processo (prompt e few-shots montados uma única vez).
+
+    A instância não muda após a construção e pode ser usada por várias threads; uma
+    nova é criada se o projeto/região ou o cache configurados mudarem.
+    """
+    key = (
+        model_id,
+        os.getenv("STORYBRAND_CACHE_ENABLED", "true").lower() != "false",
+        os.getenv("GOOGLE_CLOUD_PROJECT"),
+        os.getenv("GOOGLE_CLOUD_LOCATION", "us-central1"),
+    )
+    with _extractors_lock:
+        extractor = _extractors.get(key)
+        if extractor is None:
+            extractor = StoryBrandExtractor(model_id=model_id)
+            _extractors[key] = extractor
+        return extractor
@@ -0,0 +1,368 @@
+"""Admission control for the pipeline run endpoints (``/run`` and ``/run_sse``).
+
+At most ``run_max_active`` pipelines run at once; up to ``run_max_queued`` more
+wait in FIFO order for at most ``run_queue_timeout`` seconds. Anything beyond
+that gets ``429`` with ``Retry-After`` estimated from recent run durations.
+
+Runs are identified by their ``session_id`` so the frontend can poll
+``GET /run_admission/{session_id}?user_id=...`` for its queue position while the
+request is waiting; the controller remembers which ``user_id`` started each
+recent session, and the status routes only answer that user. A run whose ``user_id`` has no model-call (or, with image
+generation on, image) quota left is refused up front with the same ``429``
+shape, instead of failing mid-stream as a generic SSE error.
+
+The limits are per worker process: each uvicorn/gunicorn worker (and each
+Cloud Run instance) keeps its own active set and queue, so the service-wide
+ceiling is ``run_max_active`` times the number of workers.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import math
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, MutableMapping
+from typing import Any
+
+from app.config import config
+from app.utils.quotas import (
+    IMAGE_GENERATIONS,
+    LLM_CALLS,
+    QuotaExceededError,
+    check_user_quota,
+)
+
+try:  # pragma: no cover - optional dependency during tests
+    from app.utils.metrics import record_run_admission
+except Exception:  # pragma: no cover
+    def record_run_admission(_active: int, _queued: int, _outcome: str | None = None) -> None:
+        return
+
+logger = logging.getLogger(__name__)
+
+RUN_PATHS = frozenset({"/run", "/run_sse"})
+
+Scope = MutableMapping[str, Any]
+Message = MutableMapping[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+ASGIApp = Callable[[Scope, Receive, Send], Awaitable[None]]
+
+
+class AdmissionRejectedError(Exception):
+    """Raised when a run cannot be admitted now; carries the ``Retry-After`` hint."""
+
+    def __init__(self, reason: str, *, retry_after: float, position: int | None = None) -> None:
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+        self.position = position
+
+
+class AdmissionController:
+    """Bounded active set plus a bounded FIFO wait queue (single event loop)."""
+
+    def __init__(
+        self,
+        *,
+        max_active: int,
+        max_queued: int,
+        queue_timeout: float,
+        initial_run_seconds: float = 120.0,
+        max_owners: int = 4096,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.max_active = max(1, max_active)
+        self.max_queued = max(0, max_queued)
+        self.queue_timeout = queue_timeout
+        self._clock = clock
+        self._active: dict[str, float] = {}
+        self._waiting: OrderedDict[str, asyncio.Future[None]] = OrderedDict()
+        self._avg_run_seconds = initial_run_seconds
+        self._owners: OrderedDict[str, str] = OrderedDict()
+        self._max_owners = max(1, max_owners)
+        self.admitted = 0
+        self.rejected = 0
+
+    def _report(self, outcome: str | None = None) -> None:
+        record_run_admission(len(self._active), len(self._waiting), outcome)
+
+    def retry_after(self, position: int | None = None) -> float:
+        """Rough wait until a slot frees up for someone at ``position`` (1-based)."""
+
+        ahead = position if position is not None else len(self._waiting) + 1
+        waves = math.ceil(ahead / self.max_active)
+        return max(1.0, waves * self._avg_run_seconds)
+
+    def remember_owner(self, key: str, user_id: str) -> None:
+        """Record the user that started run ``key`` (the most recent sessions are kept)."""
+
+        self._owners[key] = user_id
+        self._owners.move_to_end(key)
+        while len(self._owners) > self._max_owners:
+            self._owners.popitem(last=False)
+
+    def owner(self, key: str) -> str | None:
+        return self._owners.get(key)
+
+    def position(self, key: str) -> int | None:
+        """1-based queue position, ``0`` while running, ``None`` if unknown."""
+
+        if key in self._active:
+            return 0
+        for index, waiting_key in enumerate(self._waiting, start=1):
+            if waiting_key == key:
+                return index
+        return None
+
+    def status(self, key: str | None = None) -> dict[str, Any]:
+        payload: dict[str, Any] = {
+            "active": len(self._active),
+            "queued": len(self._waiting),
+            "max_active": self.max_active,
+            "max_queued": self.max_queued,
+        }
+        if key is not None:
+            position = self.position(key)
+            payload["state"] = (
+                "unknown" if position is None else "running" if position == 0 else "queued"
+            )
+            payload["position"] = position
+            if position:
+                payload["retry_after"] = round(self.retry_after(position), 1)
+        return payload
+
+    async def acquire(self, key: str) -> None:
+        """Admit ``key`` now or after waiting in the queue; raises :class:`AdmissionRejectedError`."""
+
+        if key in self._active or key in self._waiting:
+            # Uma sessão executa um pipeline por vez.
+            self.rejected += 1
+            self._report("duplicate")
+            raise AdmissionRejectedError(
+                "session_busy", retry_after=self.retry_after(1), position=self.position(key)
+            )
+        if len(self._active) < self.max_active and not self._waiting:
+            self._admit(key)
+            return
+        if len(self._waiting) >= self.max_queued or self.queue_timeout <= 0:
+            self.rejected += 1
+            self._report("rejected")
+            raise AdmissionRejectedError(
+                "queue_full", retry_after=self.retry_after(len(self._waiting) + 1)
+            )
+
+        future: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self._waiting[key] = future
+        self._report()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            position = self.position(key)
+            if future.done() and not future.cancelled():
+                return  # admitido no mesmo instante do timeout
+            self._waiting.pop(key, None)
+            self.rejected += 1
+            self._report("timeout")
+            raise AdmissionRejectedError(
+                "queue_timeout", retry_after=self.retry_after(position), position=position
+            ) from None
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(key)  # já tinha vaga: devolve
+            else:
+                self._waiting.pop(key, None)
+                self._report()
+            raise
+
+    def _admit(self, key: str) -> None:
+        self._active[key] = self._clock()
+        self.admitted += 1
+        self._report("admitted")
+
+    def release(self, key: str) -> None:
+        started = self._active.pop(key, None)
+        if started is not None:
+            duration = self._clock() - started
+            self._avg_run_seconds += 0.2 * (duration - self._avg_run_seconds)
+        while self._waiting and len(self._active) < self.max_active:
+            next_key, future = self._waiting.popitem(last=False)
+            if future.done():
+                continue
+            self._admit(next_key)
+            future.set_result(None)
+        self._report()
+
+
+_controller: AdmissionController | None = None
+
+
+def get_admission_controller() -> AdmissionController:
+    global _controller
+    if _controller is None:
+        _controller = AdmissionController(
+            max_active=config.run_max_active,
+            max_queued=config.run_max_queued,
+            queue_timeout=config.run_queue_timeout,
+        )
+    return _controller
+
+
+def _run_field(body: bytes, *names: str) -> str | None:
+    try:
+        payload = json.loads(body or b"{}")
+    except ValueError:
+        return None
+    if not isinstance(payload, dict):
+        return None
+    value = next((payload[name] for name in names if payload.get(name)), None)
+    return str(value) if value else None
+
+
+def _session_key(body: bytes) -> str | None:
+    return _run_field(body, "session_id", "sessionId")
+
+
+def check_run_quota(user_id: str | None) -> None:
+    """Refuse a run up front when the user could not make even one model call."""
+
+    check_user_quota(user_id, LLM_CALLS)
+    if config.enable_image_generation:
+        check_user_quota(user_id, IMAGE_GENERATIONS)
+
+
+def install_admission_middleware(app: Any) -> None:
+    """Add :class:`AdmissionMiddleware` to a Starlette app, inside ``CORSMiddleware``.
+
+    ``add_middleware`` would make it the outermost layer, so its 429 responses
+    would skip CORS and cross-origin browsers could not read the status or
+    ``Retry-After``.
+    """
+
+    from starlette.middleware import Middleware
+    from starlette.middleware.cors import CORSMiddleware
+
+    middleware = Middleware(AdmissionMiddleware)
+    for index, existing in enumerate(app.user_middleware):
+        if existing.cls is CORSMiddleware:
+            app.user_middleware.insert(index + 1, middleware)
+            return
+    app.user_middleware.insert(0, middleware)
+
+
+class AdmissionMiddleware:
+    """ASGI middleware that holds an admission slot for the whole run (including SSE)."""
+
+    def __init__(self, app: ASGIApp, controller: AdmissionController | None = None) -> None:
+        self.app = app
+        self._controller = controller
+
+    @property
+    def controller(self) -> AdmissionController:
+        return self._controller or get_admission_controller()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            scope["type"] != "http"
+            or scope.get("method") != "POST"
+            or scope.get("path") not in RUN_PATHS
+            or not (config.run_admission_enabled or config.user_quota_enabled)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        # Lê o corpo para identificar sessão e usuário e o repassa intacto ao app.
+        messages: list[Message] = []
+        body = b""
+        while True:
+            message = await receive()
+            messages.append(message)
+            if message["type"] != "http.request":
+                break
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+
+        async def replay() -> Message:
+            if messages:
+                return messages.pop(0)
+            return await receive()
+
+        user_id = _run_field(body, "user_id", "userId")
+        session_key = _session_key(body)
+        controller = self.controller
+        if session_key and user_id:
+            # Só o dono da sessão consulta fila e cota (GET /run_admission, /quota).
+            controller.remember_owner(session_key, user_id)
+        try:
+            check_run_quota(user_id)
+        except QuotaExceededError as exc:
+            await _reject_quota(send, exc)
+            return
+        if not config.run_admission_enabled:
+            await self.app(scope, replay, send)
+            return
+
+        key = session_key or f"anonymous-{id(scope)}"
+        try:
+            await controller.acquire(key)
+        except AdmissionRejectedError as exc:
+            await _reject(send, exc)
+            return
+
+        try:
+            await self.app(scope, replay, send)
+        finally:
+            controller.release(key)
+
+
+async def _reject(send: Send, exc: AdmissionRejectedError) -> None:
+    retry_after = max(1, math.ceil(exc.retry_after))
+    payload = {
+        "detail": "Muitas execuções em andamento; tente novamente mais tarde.",
+        "reason": exc.reason,
+        "retry_after": retry_after,
+        "queue_position": exc.position,
+    }
+    logger.warning("run_admission_rejected", extra={"reason": exc.reason, "retry_after": retry_after})
+    await _send_429(send, payload, retry_after)
+
+
+async def _reject_quota(send: Send, exc: QuotaExceededError) -> None:
+    retry_after = max(1, math.ceil(min(exc.retry_after, 86400)))
+    payload = {
+        "detail": "Cota do usuário esgotada; tente novamente mais tarde.",
+        "reason": "user_quota",
+        "resource": exc.resource,
+        "retry_after": retry_after,
+    }
+    await _send_429(send, payload, retry_after)
+
+
+async def _send_429(send: Send, payload: dict[str, Any], retry_after: int) -> None:
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("ascii")),
+                (b"retry-after", str(retry_after).encode("ascii")),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+__all__ = [
+    "AdmissionController",
+    "AdmissionMiddleware",
+    "AdmissionRejectedError",
+    "check_run_quota",
+    "get_admission_controller",
+    "install_admission_middleware",
+]
@@ -1,62 +1,372 @@
 from __future__ import annotations
 
+import heapq
+import itertools
 import json
+import logging
 import os
+import sqlite3
+import sys
 import threading
 import time
+import zlib
 from collections import OrderedDict
+from collections.abc import Callable, Hashable
 from dataclasses import dataclass
-from typing import Any, Hashable
+from pathlib import Path
+from typing import Any, Protocol
+
+try:  # pragma: no cover - optional dependency during tests
+    from app.utils.metrics import record_response_cache_event
+except Exception:  # pragma: no cover
+    def record_response_cache_event(_cache: str, _event: str, _count: int = 1) -> None:
+        return
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache(Protocol):
+    """Interface shared by the response cache backends (memory, SQLite, remote)."""
+
+    def get(self, key: Hashable) -> Any | None: ...
+
+    def set(self, key: Hashable, value: Any) -> None: ...
 
 
 @dataclass
 class CacheEntry:
     value: Any
     expires_at: float | None
+    size: int = 0
+
+
+def _estimate_size(value: Any) -> int:
+    """Approximate payload size in bytes (UTF-8 JSON, as the SQLite backend stores it)."""
+
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    try:
+        return len(json.dumps(value, ensure_ascii=False, default=str).encode("utf-8"))
+    except (TypeError, ValueError):
+        return sys.getsizeof(value)
 
 
 class InMemoryResponseCache:
-    """Simple thread-safe LRU cache with optional TTL semantics."""
+    """Thread-safe LRU cache with optional TTL and byte limit.
+
+    Expiry times sit in a min-heap next to the LRU ``OrderedDict``, so purging
+    only pops entries that are actually due (amortized ``O(log n)`` per entry)
+    instead of scanning the whole store on every call. A key read after its
+    deadline is dropped on the spot; heap records left behind by overwritten or
+    deleted keys are skipped when popped and compacted once they outnumber the
+    live entries.
+    """
 
-    def __init__(self, maxsize: int = 32, ttl_seconds: int | None = 900) -> None:
+    def __init__(
+        self,
+        maxsize: int = 32,
+        ttl_seconds: int | None = 900,
+        *,
+        max_bytes: int | None = None,
+        name: str = "response",
+        sizeof: Callable[[Any], int] = _estimate_size,
+    ) -> None:
         self._store: OrderedDict[Hashable, CacheEntry] = OrderedDict()
+        self._expiry: list[tuple[float, int, Hashable]] = []
         self._maxsize = max(1, maxsize)
+        self._max_bytes = max_bytes if max_bytes and max_bytes > 0 else None
         self._ttl = ttl_seconds if ttl_seconds and ttl_seconds > 0 else None
+        self._sizeof = sizeof
+        self._bytes = 0
+        self._seq = itertools.count()
         self._lock = threading.Lock()
+        self._loading: dict[Hashable, threading.Lock] = {}
+        self.name = name
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0}
 
-    def _purge_expired(self) -> None:
-        if not self._store:
+    def _count(self, event: str, count: int = 1) -> None:
+        if count <= 0:
             return
-        if self._ttl is None:
+        self._stats[event] += count
+        record_response_cache_event(self.name, event, count)
+
+    def _remove(self, key: Hashable) -> CacheEntry | None:
+        entry = self._store.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+        return entry
+
+    def _purge_expired(self, now: float) -> None:
+        expiry = self._expiry
+        expired = 0
+        while expiry and expiry[0][0] <= now:
+            expires_at, _, key = heapq.heappop(expiry)
+            entry = self._store.get(key)
+            # Registros de chaves sobrescritas ou removidas ficam obsoletos no heap.
+            if entry is not None and entry.expires_at == expires_at:
+                self._remove(key)
+                expired += 1
+        self._count("expired", expired)
+
+    def _compact_expiry(self) -> None:
+        if len(self._expiry) <= 2 * len(self._store) + 64:
             return
-        now = time.time()
-        keys_to_delete = [
-            key for key, entry in self._store.items() if entry.expires_at and entry.expires_at <= now
+        self._expiry = [
+            record
+            for record in self._expiry
+            if (entry := self._store.get(record[2])) is not None and entry.expires_at == record[0]
         ]
-        for key in keys_to_delete:
-            self._store.pop(key, None)
+        heapq.heapify(self._expiry)
+
+    def _lookup(self, key: Hashable) -> tuple[bool, Any]:
+        now = time.time()
+        self._purge_expired(now)
+        entry = self._store.get(key)
+        if entry is None:
+            self._count("misses")
+            return False, None
+        if entry.expires_at is not None and entry.expires_at <= now:
+            self._remove(key)
+            self._count("expired")
+            self._count("misses")
+            return False, None
+        # refresh LRU order
+        self._store.move_to_end(key)
+        self._count("hits")
+        return True, entry.value
 
     def get(self, key: Hashable) -> Any | None:
         with self._lock:
-            self._purge_expired()
-            entry = self._store.get(key)
-            if entry is None:
-                return None
-            # refresh LRU order
-            self._store.move_to_end(key)
-            return entry.value
+            return self._lookup(key)[1]
 
     def set(self, key: Hashable, value: Any) -> None:
+        size = self._sizeof(value)
+        with self._lock:
+            now = time.time()
+            self._purge_expired(now)
+            self._remove(key)
+            expires_at = (now + self._ttl) if self._ttl is not None else None
+            self._store[key] = CacheEntry(value=value, expires_at=expires_at, size=size)
+            self._bytes += size
+            if expires_at is not None:
+                heapq.heappush(self._expiry, (expires_at, next(self._seq), key))
+            evicted = 0
+            while len(self._store) > self._maxsize or (
+                self._max_bytes is not None and self._bytes > self._max_bytes and len(self._store) > 1
+            ):
+                _, entry = self._store.popitem(last=False)
+                self._bytes -= entry.size
+                evicted += 1
+            self._count("evictions", evicted)
+            self._compact_expiry()
+
+    def delete(self, key: Hashable) -> bool:
+        """Drop ``key``; returns whether it was cached."""
+
         with self._lock:
-            self._purge_expired()
-            if key in self._store:
-                self._store.move_to_end(key)
-            self._store[key] = CacheEntry(
-                value=value,
-                expires_at=(time.time() + self._ttl) if self._ttl is not None else None,
+            return self._remove(key) is not None
+
+    def get_or_set(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """Return the cached value or call ``loader`` once and cache its result.
+
+        Concurrent callers for the same key wait for the first loader instead of
+        calling it again. ``None`` results are returned but not cached.
+        """
+
+        with self._lock:
+            found, value = self._lookup(key)
+            if found:
+                return value
+            key_lock = self._loading.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                entry = self._store.get(key)
+                if entry is not None and (entry.expires_at is None or entry.expires_at > time.time()):
+                    self._store.move_to_end(key)
+                    self._count("hits")
+                    return entry.value
+            try:
+                value = loader()
+                if value is not None:
+                    self.set(key, value)
+            finally:
+                with self._lock:
+                    if self._loading.get(key) is key_lock:
+                        del self._loading[key]
+        return value
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                **self._stats,
+                "entries": len(self._store),
+                "bytes": self._bytes,
+                "maxsize": self._maxsize,
+            }
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._store)
+
+
+class SqliteResponseCache:
+    """Durable cache in a SQLite file shared by every worker on the host.
+
+    Values are stored as zlib-compressed JSON. Entries expire after ``ttl_seconds``;
+    once the compressed payloads exceed ``max_bytes`` the least recently read
+    entries are evicted. WAL mode lets workers read while another one writes.
+    Hits, misses and evictions are exported as ``response_cache.events``.
+    """
+
+    # Atualiza accessed_at no máximo uma vez por janela, para não escrever a cada leitura.
+    _TOUCH_INTERVAL = 60.0
+
+    def __init__(
+        self,
+        path: str | os.PathLike[str],
+        *,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl_seconds: int | None = 7 * 24 * 3600,
+        name: str = "storybrand",
+        compress_level: int = 6,
+    ) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.name = name
+        self._max_bytes = max(1, max_bytes)
+        self._ttl = ttl_seconds if ttl_seconds and ttl_seconds > 0 else None
+        self._compress_level = compress_level
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL,"
+                " expires_at REAL, accessed_at REAL NOT NULL)"
             )
-            while len(self._store) > self._maxsize:
-                self._store.popitem(last=False)
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries(accessed_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Uma conexão por thread; o SQLite coordena os processos pelo arquivo.
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, event: str, count: int = 1) -> None:
+        if count <= 0:
+            return
+        with self._stats_lock:
+            self._stats[event] += count
+        record_response_cache_event(self.name, event, count)
+
+    @staticmethod
+    def _key(key: Hashable) -> str:
+        return key if isinstance(key, str) else json.dumps(key, sort_keys=True, default=str)
+
+    def get(self, key: Hashable) -> Any | None:
+        now = time.time()
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT value, expires_at, accessed_at FROM entries WHERE key = ?",
+                (self._key(key),),
+            ).fetchone()
+            if row is None:
+                self._count("misses")
+                return None
+            payload, expires_at, accessed_at = row
+            if expires_at is not None and expires_at <= now:
+                conn.execute("DELETE FROM entries WHERE key = ?", (self._key(key),))
+                self._count("expired")
+                self._count("misses")
+                return None
+            if now - accessed_at >= self._TOUCH_INTERVAL:
+                conn.execute(
+                    "UPDATE entries SET accessed_at = ? WHERE key = ?", (now, self._key(key))
+                )
+            value = json.loads(zlib.decompress(payload))
+        except (sqlite3.Error, zlib.error, ValueError) as exc:
+            logger.warning("response_cache_read_failed", extra={"cache": self.name, "error": str(exc)})
+            self._count("misses")
+            return None
+        self._count("hits")
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        now = time.time()
+        payload = zlib.compress(
+            json.dumps(value, ensure_ascii=False, default=str).encode("utf-8"),
+            self._compress_level,
+        )
+        if len(payload) > self._max_bytes:
+            return
+        expires_at = now + self._ttl if self._ttl is not None else None
+        try:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, size, expires_at, accessed_at)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (self._key(key), payload, len(payload), expires_at, now),
+                )
+                expired = conn.execute(
+                    "DELETE FROM entries WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,)
+                ).rowcount
+                evicted = self._evict_locked(conn)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as exc:
+            logger.warning("response_cache_write_failed", extra={"cache": self.name, "error": str(exc)})
+            return
+        self._count("expired", expired)
+        self._count("evictions", evicted)
+
+    def delete(self, key: Hashable) -> bool:
+        try:
+            deleted = self._connect().execute(
+                "DELETE FROM entries WHERE key = ?", (self._key(key),)
+            ).rowcount
+        except sqlite3.Error as exc:
+            logger.warning("response_cache_delete_failed", extra={"cache": self.name, "error": str(exc)})
+            return False
+        return deleted > 0
+
+    def _evict_locked(self, conn: sqlite3.Connection) -> int:
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        evicted = 0
+        if total <= self._max_bytes:
+            return 0
+        for key, size in conn.execute(
+            "SELECT key, size FROM entries ORDER BY accessed_at ASC"
+        ).fetchall():
+            if total <= self._max_bytes:
+                break
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        return evicted
+
+    def stats(self) -> dict[str, int]:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        try:
+            entries, total = self._connect().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+        except sqlite3.Error:
+            entries, total = 0, 0
+        stats.update(entries=entries, bytes=total)
+        return stats
 
 
 def make_storybrand_cache_key(*parts: Any) -> str:
@@ -71,11 +381,35 @@ def make_storybrand_cache_key(*parts: Any) -> str:
     return json.dumps(normalized, separators=(",", ":"))
 
 
-_storybrand_cache = InMemoryResponseCache(
-    maxsize=int(os.getenv("STORYBRAND_CACHE_MAXSIZE", "32")),
-    ttl_seconds=int(os.getenv("STORYBRAND_CACHE_TTL", "900")),
-)
+_storybrand_cache: ResponseCache | None = None
+_storybrand_cache_lock = threading.Lock()
+
+
+def _build_storybrand_cache() -> ResponseCache:
+    backend = os.getenv("STORYBRAND_CACHE_BACKEND", "memory").strip().lower()
+    max_bytes = int(float(os.getenv("STORYBRAND_CACHE_MAX_MB", "64")) * 1024 * 1024)
+    if backend == "sqlite":
+        try:
+            return SqliteResponseCache(
+                os.getenv("STORYBRAND_CACHE_PATH", "artifacts/storybrand_cache/cache.sqlite3"),
+                max_bytes=max_bytes,
+                ttl_seconds=int(os.getenv("STORYBRAND_CACHE_TTL", str(7 * 24 * 3600))),
+            )
+        except (OSError, sqlite3.Error) as exc:
+            logger.warning("StoryBrand SQLite cache unavailable, using memory: %s", exc)
+    return InMemoryResponseCache(
+        maxsize=int(os.getenv("STORYBRAND_CACHE_MAXSIZE", "32")),
+        ttl_seconds=int(os.getenv("STORYBRAND_CACHE_TTL", "900")),
+        max_bytes=max_bytes,
+        name="storybrand",
+    )
+
 
+def get_storybrand_cache() -> ResponseCache:
+    """Process-wide StoryBrand cache (``STORYBRAND_CACHE_BACKEND``: ``memory`` or ``sqlite``)."""
 
-def get_storybrand_cache() -> InMemoryResponseCache:
-    return _storybrand_cache
+    global _storybrand_cache
+    with _storybrand_cache_lock:
+        if _storybrand_cache is None:
+            _storybrand_cache = _build_storybrand_cache()
+        return _storybrand_cache
@@ -0,0 +1,99 @@
+"""Derivative encoding that runs inside the image derivative process pool.
+
+Spawned workers unpickle functions by module path, so this module only imports
+the standard library and Pillow: no ``app.config`` (which resolves Google
+credentials) and no agents.
+"""
+
+from __future__ import annotations
+
+from collections.abc import Sequence
+from dataclasses import dataclass
+from io import BytesIO
+
+from PIL import Image
+
+
+@dataclass(frozen=True)
+class DerivativeSpec:
+    name: str
+    format: str  # formato PIL ("WEBP" ou "JPEG")
+    max_side: int
+    quality: int
+
+
+@dataclass(frozen=True)
+class EncodedDerivative:
+    name: str
+    data: bytes
+    mime_type: str
+    extension: str
+    width: int
+    height: int
+
+
+DEFAULT_DERIVATIVE_SPECS: tuple[DerivativeSpec, ...] = (
+    DerivativeSpec(name="preview", format="WEBP", max_side=1024, quality=80),
+    DerivativeSpec(name="preview_jpeg", format="JPEG", max_side=1024, quality=82),
+    DerivativeSpec(name="thumb", format="WEBP", max_side=320, quality=70),
+)
+
+_FORMAT_INFO = {
+    "WEBP": ("image/webp", "webp"),
+    "JPEG": ("image/jpeg", "jpg"),
+}
+
+
+def encode_derivatives(
+    data: bytes, specs: Sequence[DerivativeSpec] = DEFAULT_DERIVATIVE_SPECS
+) -> list[EncodedDerivative]:
+    """Decode ``data`` once and encode every spec, largest first.
+
+    Module-level (picklable) so it can run inside the process pool.
+    """
+
+    with Image.open(BytesIO(data)) as source:
+        base = source.convert("RGB")
+
+    results: list[EncodedDerivative] = []
+    current = base
+    for spec in sorted(specs, key=lambda item: item.max_side, reverse=True):
+        # Reduz a partir do maior derivado já calculado: cada passo fica mais barato.
+        if max(current.size) > spec.max_side:
+            current = current.copy()
+            current.thumbnail((spec.max_side, spec.max_side), Image.Resampling.LANCZOS)
+        mime_type, extension = _FORMAT_INFO[spec.format]
+        buffer = BytesIO()
+        save_kwargs = {"quality": spec.quality}
+        if spec.format == "JPEG":
+            save_kwargs.update(optimize=True, progressive=True)
+        else:
+            save_kwargs["method"] = 4
+        current.save(buffer, format=spec.format, **save_kwargs)
+        results.append(
+            EncodedDerivative(
+                name=spec.name,
+                data=buffer.getvalue(),
+                mime_type=mime_type,
+                extension=extension,
+                width=current.size[0],
+                height=current.size[1],
+            )
+        )
+    order = {spec.name: idx for idx, spec in enumerate(specs)}
+    return sorted(results, key=lambda item: order[item.name])
+
+
+def ping() -> None:
+    """No-op task used to start the pool workers ahead of time."""
+
+    return None
+
+
+__all__ = [
+    "DEFAULT_DERIVATIVE_SPECS",
+    "DerivativeSpec",
+    "EncodedDerivative",
+    "encode_derivatives",
+    "ping",
+]
@@ -25,6 +25,7 @@ from google.api_core import exceptions
 
 from app.config import config
 from app.schemas.reference_assets import ReferenceImageMetadata
+from app.utils.quotas import GCS_BYTES, charge_user_quota
 from app.utils.vision import (
     ReferenceImageAnalysisError,
     ReferenceImageUnsafeError,
@@ -93,6 +94,8 @@ async def upload_reference_image(
     if not bucket_name:
         raise RuntimeError("REFERENCE_IMAGES_BUCKET is invalid")
 
+    charge_user_quota(user_id, GCS_BYTES, len(file_bytes))
+
     client = storage_client or storage.Client(project=os.getenv("GOOGLE_CLOUD_PROJECT"))
     bucket = client.bucket(bucket_name)
 
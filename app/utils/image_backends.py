@@ -0,0 +1,252 @@
+"""Backends for the image generation path: model client and blob store.
+
+``vertex`` binds ``genai.Client`` (Vertex AI) and ``storage.Client``. ``local``
+replaces both with in-process stand-ins that return deterministic synthetic PNGs
+(with configurable latency and error injection) and keep objects in a local
+directory, so the image pipeline can be load-tested and benchmarked offline.
+
+Both backends expose the subset of the SDK surface used by the pipeline:
+``client.aio.models.generate_content(...)`` and ``store.bucket(b).blob(name)``.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import os
+import random
+import threading
+from io import BytesIO
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any
+
+from PIL import Image
+
+from app.config import config
+
+# Pool HTTP compartilhado pelo cliente assíncrono (client.aio); cada chamada em
+# voo ocupa apenas uma conexão, e não uma thread do executor padrão.
+_HTTP_POOL_SIZE = max(1, int(os.getenv("IMAGE_HTTP_POOL_SIZE", "32")))
+
+_SYNTHETIC_SIZE = (128, 128)
+
+
+class InjectedBackendError(RuntimeError):
+    """Failure raised on purpose by the local backend (``image_local_error_rate``)."""
+
+
+class InjectedThrottleError(InjectedBackendError):
+    """429 raised by a local client whose region is in ``image_local_throttled_regions``."""
+
+    status_code = 429
+
+
+def _synthetic_png(seed: bytes) -> bytes:
+    digest = hashlib.sha256(seed).digest()
+    width, height = _SYNTHETIC_SIZE
+    image = Image.new("RGB", _SYNTHETIC_SIZE, color=tuple(digest[:3]))
+    # Faixas derivadas do hash deixam imagens distintas visualmente distinguíveis.
+    stripe_color = tuple(digest[3:6])
+    stripe = max(1, digest[6] % 16 + 4)
+    for x in range(0, width, stripe * 2):
+        image.paste(stripe_color, (x, 0, min(x + stripe, width), height))
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _contents_fingerprint(model: str, contents: Any) -> bytes:
+    digest = hashlib.sha256(model.encode("utf-8"))
+    for content in contents if isinstance(contents, list) else [contents]:
+        for part in getattr(content, "parts", None) or []:
+            text = getattr(part, "text", None)
+            if text:
+                digest.update(b"t" + text.encode("utf-8"))
+            inline = getattr(part, "inline_data", None)
+            if inline is not None and getattr(inline, "data", None):
+                digest.update(b"i" + hashlib.sha256(bytes(inline.data)).digest())
+    return digest.digest()
+
+
+class _LocalModels:
+    def __init__(
+        self, *, latency_seconds: float, error_rate: float, seed: int, throttled: bool = False
+    ) -> None:
+        self.latency_seconds = max(0.0, latency_seconds)
+        self.throttled = throttled
+        self.error_rate = min(max(error_rate, 0.0), 1.0)
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+
+    def _should_fail(self) -> bool:
+        with self._lock:
+            self.calls += 1
+            failed = self.error_rate > 0 and self._rng.random() < self.error_rate
+            if failed:
+                self.failures += 1
+            return failed
+
+    async def generate_content(self, *, model: str, contents: Any, config: Any = None) -> Any:
+        from google.genai import types
+
+        if self.latency_seconds:
+            await asyncio.sleep(self.latency_seconds)
+        if self.throttled:
+            with self._lock:
+                self.calls += 1
+                self.failures += 1
+            raise InjectedThrottleError("429 RESOURCE_EXHAUSTED (injected by local image backend)")
+        if self._should_fail():
+            raise InjectedBackendError("503 UNAVAILABLE (injected by local image backend)")
+        data = _synthetic_png(_contents_fingerprint(model, contents))
+        return types.GenerateContentResponse(
+            candidates=[
+                types.Candidate(
+                    content=types.Content(
+                        role="model",
+                        parts=[types.Part.from_bytes(data=data, mime_type="image/png")],
+                    )
+                )
+            ]
+        )
+
+
+class LocalImageClient:
+    """Stand-in for ``genai.Client`` that synthesizes deterministic PNGs.
+
+    ``throttled`` makes every call fail with a 429, standing in for a saturated
+    region when exercising multi-region failover.
+    """
+
+    def __init__(
+        self,
+        *,
+        latency_seconds: float = 0.0,
+        error_rate: float = 0.0,
+        seed: int = 0,
+        location: str = "local",
+        throttled: bool = False,
+    ) -> None:
+        self.location = location
+        self.models = _LocalModels(
+            latency_seconds=latency_seconds,
+            error_rate=error_rate,
+            seed=seed,
+            throttled=throttled,
+        )
+        self.aio = SimpleNamespace(models=self.models)
+
+
+class _LocalBlob:
+    def __init__(self, root: Path, bucket_name: str, name: str) -> None:
+        self.bucket_name = bucket_name
+        self.name = name
+        self.path = root / bucket_name / name
+
+    def upload_from_string(self, data: bytes | str, content_type: str | None = None) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        payload = data.encode("utf-8") if isinstance(data, str) else data
+        tmp_path = self.path.with_name(f".{self.path.name}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(payload)
+        tmp_path.replace(self.path)
+
+    def download_as_bytes(self) -> bytes:
+        return self.path.read_bytes()
+
+    def exists(self) -> bool:
+        return self.path.is_file()
+
+    def generate_signed_url(self, **_: Any) -> str:
+        return self.path.resolve().as_uri()
+
+
+class _LocalBucket:
+    def __init__(self, root: Path, name: str) -> None:
+        self._root = root
+        self.name = name
+
+    def blob(self, name: str) -> _LocalBlob:
+        return _LocalBlob(self._root, self.name, name)
+
+
+class LocalBlobStore:
+    """Stand-in for ``storage.Client`` that keeps objects under ``root/<bucket>/``."""
+
+    # URLs locais não precisam de credenciais de assinatura.
+    requires_signing_credentials = False
+
+    def __init__(self, root: Path | str) -> None:
+        self.root = Path(root)
+
+    def bucket(self, name: str) -> _LocalBucket:
+        return _LocalBucket(self.root, name)
+
+
+def _is_local() -> bool:
+    return (config.image_backend or "vertex").lower() == "local"
+
+
+def default_location() -> str:
+    return os.getenv("GOOGLE_CLOUD_LOCATION", "us-central1")
+
+
+def create_image_model_client(location: str | None = None) -> Any:
+    """Build the model client for the configured ``image_backend`` in ``location``."""
+
+    location = location or default_location()
+    if _is_local():
+        throttled = {
+            item.strip()
+            for item in (config.image_local_throttled_regions or "").split(",")
+            if item.strip()
+        }
+        return LocalImageClient(
+            latency_seconds=config.image_local_latency_seconds,
+            error_rate=config.image_local_error_rate,
+            seed=config.image_local_seed,
+            location=location,
+            throttled=location in throttled,
+        )
+
+    import httpx
+    from google import genai
+    from google.genai import types
+
+    return genai.Client(
+        vertexai=True,
+        project=os.getenv("GOOGLE_CLOUD_PROJECT"),
+        location=location,
+        http_options=types.HttpOptions(
+            async_client_args={
+                "limits": httpx.Limits(
+                    max_connections=_HTTP_POOL_SIZE,
+                    max_keepalive_connections=_HTTP_POOL_SIZE,
+                ),
+            },
+        ),
+    )
+
+
+def create_blob_store() -> Any:
+    """Build the blob store for the configured ``image_backend``."""
+
+    if _is_local():
+        return LocalBlobStore(config.image_local_backend_dir)
+
+    from google.cloud import storage
+
+    return storage.Client()
+
+
+__all__ = [
+    "InjectedBackendError",
+    "InjectedThrottleError",
+    "LocalBlobStore",
+    "LocalImageClient",
+    "create_blob_store",
+    "create_image_model_client",
+    "default_location",
+]
@@ -0,0 +1,222 @@
+"""Content-addressed index of generated images already stored in GCS."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections.abc import Iterable
+from pathlib import Path
+from typing import Any
+
+from app.config import config
+
+logger = logging.getLogger(__name__)
+
+
+def make_image_cache_key(
+    *,
+    model: str,
+    generation_config: Any,
+    prompt: str,
+    reference_keys: Iterable[str] = (),
+    parent_key: str | None = None,
+    owner: str | None = None,
+) -> str:
+    """Hash everything that determines a stage output.
+
+    ``parent_key`` chains stages that consume a previously generated image; pass the
+    content hash of that image so the intermediate stage is addressed by the exact
+    bytes it receives. ``owner`` scopes the key to one user, so cached objects are
+    never served across accounts.
+    """
+
+    payload = {
+        "owner": owner,
+        "model": model,
+        "config": generation_config,
+        "prompt": prompt,
+        "references": sorted(reference_keys),
+        "parent": parent_key,
+    }
+    encoded = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def image_content_hash(data: bytes) -> str:
+    """SHA-256 of encoded image bytes; names immutable ``by-hash`` objects."""
+
+    return hashlib.sha256(data).hexdigest()
+
+
+# Linhas obsoletas toleradas antes de reescrever o índice.
+_COMPACT_SLACK = 256
+
+
+class GeneratedImageIndex:
+    """Append-only JSON-lines index mapping stage hashes to GCS objects.
+
+    Entries are kept in memory and new lines are appended, so several workers
+    sharing the same volume see each other's results: a lookup miss first reads
+    whatever other processes appended since the last read. Overwrites and
+    deletions leave stale lines behind; once they outnumber the live entries the
+    file is rewritten atomically. A line appended by another worker during a
+    rewrite may be lost, which only costs a cache miss.
+    """
+
+    def __init__(self, path: Path | str, *, compact_slack: int = _COMPACT_SLACK) -> None:
+        self.path = Path(path)
+        self.compact_slack = compact_slack
+        self._entries: dict[str, dict[str, Any]] | None = None
+        self._offset = 0
+        self._inode: int | None = None
+        self._lines = 0
+        self._lock = threading.Lock()
+
+    def _apply(self, record: dict[str, Any], entries: dict[str, dict[str, Any]]) -> None:
+        key = record.get("key")
+        if not key:
+            return
+        if record.get("deleted"):
+            entries.pop(key, None)
+        else:
+            entries[key] = record
+
+    def _read_new_lines(self, entries: dict[str, dict[str, Any]]) -> None:
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return
+        if stat.st_ino != self._inode or stat.st_size < self._offset:
+            # Outro worker compactou o arquivo: relê do início.
+            entries.clear()
+            self._offset = 0
+            self._lines = 0
+            self._inode = stat.st_ino
+        if stat.st_size == self._offset:
+            return
+        with self.path.open("rb") as handle:
+            handle.seek(self._offset)
+            chunk = handle.read()
+        # Só consome linhas completas; uma escrita em andamento fica para depois.
+        complete = chunk.rfind(b"\n") + 1
+        for raw in chunk[:complete].splitlines():
+            raw = raw.strip()
+            if not raw:
+                continue
+            self._lines += 1
+            try:
+                record = json.loads(raw)
+            except json.JSONDecodeError:
+                logger.warning("Ignoring corrupt image cache line in %s", self.path)
+                continue
+            self._apply(record, entries)
+        self._offset += complete
+
+    def _load(self) -> dict[str, dict[str, Any]]:
+        if self._entries is None:
+            self._entries = {}
+            self._offset = 0
+            self._lines = 0
+            self._inode = None
+            self._read_new_lines(self._entries)
+        return self._entries
+
+    def _append(self, record: dict[str, Any]) -> None:
+        entries = self._load()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("ab") as handle:
+            handle.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+        self._apply(record, entries)
+        # Relê a cauda (a própria linha e as de outros workers) para manter o offset exato.
+        self._read_new_lines(entries)
+        if self._lines > 2 * len(entries) + self.compact_slack:
+            self._compact_locked()
+
+    def _compact_locked(self) -> None:
+        entries = self._load()
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        payload = b"".join(
+            (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+            for record in entries.values()
+        )
+        with tmp_path.open("wb") as handle:
+            handle.write(payload)
+        os.replace(tmp_path, self.path)
+        self._inode = self.path.stat().st_ino
+        self._offset = len(payload)
+        self._lines = len(entries)
+
+    def get(self, key: str) -> dict[str, Any] | None:
+        with self._lock:
+            entries = self._load()
+            record = entries.get(key)
+            if record is None:
+                self._read_new_lines(entries)
+                record = entries.get(key)
+            return dict(record) if record else None
+
+    def put(
+        self,
+        key: str,
+        *,
+        gcs_uri: str,
+        mime_type: str,
+        content_hash: str | None = None,
+        derivatives: dict[str, dict[str, str]] | None = None,
+    ) -> None:
+        record: dict[str, Any] = {
+            "key": key,
+            "gcs_uri": gcs_uri,
+            "mime_type": mime_type,
+            "created_at": time.time(),
+        }
+        if content_hash:
+            record["content_hash"] = content_hash
+        if derivatives:
+            record["derivatives"] = derivatives
+        with self._lock:
+            self._append(record)
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            if key in self._load():
+                self._append({"key": key, "deleted": True})
+
+    def compact(self) -> None:
+        """Rewrite the file with only the live entries."""
+
+        with self._lock:
+            self._read_new_lines(self._load())
+            self._compact_locked()
+
+    def reload(self) -> None:
+        with self._lock:
+            self._entries = None
+
+
+_index: GeneratedImageIndex | None = None
+_index_lock = threading.Lock()
+
+
+def get_generated_image_index() -> GeneratedImageIndex | None:
+    """Return the shared index, or ``None`` when the cache is disabled."""
+
+    global _index
+    if not config.image_cache_enabled:
+        return None
+    with _index_lock:
+        if _index is None or _index.path != Path(config.image_cache_index_path):
+            _index = GeneratedImageIndex(config.image_cache_index_path)
+        return _index
+
+
+__all__ = [
+    "GeneratedImageIndex",
+    "get_generated_image_index",
+    "image_content_hash",
+    "make_image_cache_key",
+]
@@ -0,0 +1,98 @@
+"""Compressed previews and thumbnails derived from generated images.
+
+Encoding runs in a process pool (``image_derivative_workers``) so large PNG
+decodes and WebP/JPEG encodes never hold the event loop or the GIL of the
+serving process. With ``image_derivative_workers = 0`` it falls back to a thread.
+The pool only runs functions from :mod:`app.utils.derivative_encoding`, so the
+spawned workers never import the config or the agents.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import multiprocessing
+import threading
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from app.config import config
+from app.utils.derivative_encoding import (
+    DEFAULT_DERIVATIVE_SPECS,
+    DerivativeSpec,
+    EncodedDerivative,
+    encode_derivatives,
+    ping,
+)
+
+logger = logging.getLogger(__name__)
+
+
+_executor: ProcessPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ProcessPoolExecutor | None:
+    global _executor
+    workers = int(config.image_derivative_workers or 0)
+    if workers <= 0:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            # spawn evita herdar locks de threads (gRPC, asyncio) via fork.
+            _executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _executor
+
+
+def warm_derivative_executor() -> None:
+    """Start the worker processes ahead of the first image."""
+
+    executor = _get_executor()
+    if executor is None:
+        return
+    for _ in range(int(config.image_derivative_workers)):
+        executor.submit(ping)
+
+
+def _reset_executor() -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def build_derivatives(
+    data: bytes, specs: Sequence[DerivativeSpec] = DEFAULT_DERIVATIVE_SPECS
+) -> list[EncodedDerivative]:
+    """Encode derivatives off the event loop (process pool, thread as fallback)."""
+
+    executor = _get_executor()
+    if executor is None:
+        return await asyncio.to_thread(encode_derivatives, data, tuple(specs))
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(executor, encode_derivatives, data, tuple(specs))
+    except BrokenProcessPool:
+        logger.warning("Derivative process pool broke; recreating and retrying in a thread.")
+        _reset_executor()
+        return await asyncio.to_thread(encode_derivatives, data, tuple(specs))
+
+
+def shutdown_derivative_executor() -> None:
+    _reset_executor()
+
+
+__all__ = [
+    "DEFAULT_DERIVATIVE_SPECS",
+    "DerivativeSpec",
+    "EncodedDerivative",
+    "build_derivatives",
+    "encode_derivatives",
+    "shutdown_derivative_executor",
+    "warm_derivative_executor",
+]
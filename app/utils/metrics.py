@@ -1,11 +1,88 @@
 from __future__ import annotations
 
-from typing import Mapping
+import threading
+from collections.abc import Iterable, Mapping
 
 from opentelemetry import metrics
 
 _meter = metrics.get_meter("instagram_ads.storybrand")
 
+_vertex_permits: dict[str, int] = {}
+_gauges_lock = threading.Lock()
+
+
+def _observe_vertex_permits(_options: metrics.CallbackOptions) -> Iterable[metrics.Observation]:
+    with _gauges_lock:
+        snapshot = dict(_vertex_permits)
+    return [metrics.Observation(value, {"model": model}) for model, value in snapshot.items()]
+
+
+_vertex_permits_gauge = _meter.create_observable_gauge(
+    name="vertex.concurrency.permits",
+    callbacks=[_observe_vertex_permits],
+    description="Current adaptive (AIMD) Vertex AI concurrency permits per model",
+    unit="1",
+)
+
+_llm_queue_depth: dict[tuple[str, str], int] = {}
+
+
+def _observe_llm_queue_depth(_options: metrics.CallbackOptions) -> Iterable[metrics.Observation]:
+    with _gauges_lock:
+        snapshot = dict(_llm_queue_depth)
+    return [
+        metrics.Observation(depth, {"model": model, "priority": priority})
+        for (model, priority), depth in snapshot.items()
+    ]
+
+
+_llm_queue_depth_gauge = _meter.create_observable_gauge(
+    name="llm.scheduler.queue_depth",
+    callbacks=[_observe_llm_queue_depth],
+    description="Model calls waiting for a Vertex AI permit, per model and priority class",
+    unit="1",
+)
+
+_run_admission: dict[str, int] = {}
+
+
+def _observe_run_admission(_options: metrics.CallbackOptions) -> Iterable[metrics.Observation]:
+    with _gauges_lock:
+        snapshot = dict(_run_admission)
+    return [metrics.Observation(value, {"state": state}) for state, value in snapshot.items()]
+
+
+_run_admission_gauge = _meter.create_observable_gauge(
+    name="pipeline.admission.runs",
+    callbacks=[_observe_run_admission],
+    description="Pipeline runs currently active or waiting for admission",
+    unit="1",
+)
+
+_run_admission_counter = _meter.create_counter(
+    name="pipeline.admission.decisions",
+    description="Admission decisions for pipeline runs (admitted, rejected, timeout, duplicate)",
+    unit="1",
+)
+
+_llm_queue_wait_histogram = _meter.create_histogram(
+    name="llm.scheduler.wait_time",
+    description="Time model calls spent waiting for a Vertex AI permit",
+    unit="s",
+)
+
+_vertex_hedge_counter = _meter.create_counter(
+    name="vertex.hedge.count",
+    description="Hedged Vertex AI requests issued, and how many of them won",
+    unit="1",
+)
+
+_response_cache_counter = _meter.create_counter(
+    name="response_cache.events",
+    description="Response cache hits, misses, expirations and evictions, per cache",
+    unit="1",
+)
+
 _vertex_429_counter = _meter.create_counter(
     name="storybrand.vertex429.count",
     description="Count of Vertex AI RESOURCE_EXHAUSTED errors seen during StoryBrand extraction",
@@ -35,6 +112,36 @@ def record_vertex_429(attributes: Mapping[str, str] | None = None) -> None:
     _vertex_429_counter.add(1, _normalize_attributes(attributes))
 
 
+def record_vertex_permits(model: str, permits: int) -> None:
+    with _gauges_lock:
+        _vertex_permits[model] = permits
+
+
+def record_llm_queue_depth(model: str, priority: str, depth: int) -> None:
+    with _gauges_lock:
+        _llm_queue_depth[(model, priority)] = depth
+
+
+def record_run_admission(active: int, queued: int, outcome: str | None = None) -> None:
+    with _gauges_lock:
+        _run_admission["active"] = active
+        _run_admission["queued"] = queued
+    if outcome:
+        _run_admission_counter.add(1, {"outcome": outcome})
+
+
+def record_llm_queue_wait(model: str, priority: str, seconds: float) -> None:
+    _llm_queue_wait_histogram.record(seconds, {"model": model, "priority": priority})
+
+
+def record_vertex_hedge(model: str, operation: str, outcome: str) -> None:
+    _vertex_hedge_counter.add(1, {"model": model, "operation": operation, "outcome": outcome})
+
+
+def record_response_cache_event(cache: str, event: str, count: int = 1) -> None:
+    _response_cache_counter.add(count, {"cache": cache, "event": event})
+
+
 def record_storybrand_fallback(reason: str) -> None:
     _fallback_counter.add(1, {"reason": reason})
 
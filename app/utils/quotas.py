@@ -0,0 +1,251 @@
+"""Per-user token-bucket quotas for model calls, image generations and GCS bytes.
+
+Each ``(user_id, resource)`` pair has a bucket that refills at ``rate_per_hour``
+up to ``burst``. The shared call paths charge it before doing the work: model
+permits in :mod:`app.utils.vertex_retry` (``llm_calls`` / ``image_generations``)
+and uploads (``gcs_bytes``). Image stages reserve an estimate of their upload
+before the model call and settle it with the real size afterwards. An empty bucket raises :class:`QuotaExceededError`
+with the seconds until enough tokens are back. Calls without a user tag
+(``anonymous``) are not metered.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from typing import Any
+
+from app.config import config
+
+logger = logging.getLogger(__name__)
+
+LLM_CALLS = "llm_calls"
+IMAGE_GENERATIONS = "image_generations"
+GCS_BYTES = "gcs_bytes"
+RESOURCES = (LLM_CALLS, IMAGE_GENERATIONS, GCS_BYTES)
+
+_ANONYMOUS_USERS = frozenset({"", "anonymous"})
+
+
+class QuotaExceededError(RuntimeError):
+    """A user's quota for ``resource`` is spent; ``retry_after`` seconds until it refills."""
+
+    def __init__(self, user_id: str, resource: str, *, retry_after: float) -> None:
+        super().__init__(
+            f"Quota exceeded for user {user_id!r} on {resource}; retry in {retry_after:.0f}s"
+        )
+        self.user_id = user_id
+        self.resource = resource
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Classic token bucket; ``consume`` never blocks."""
+
+    __slots__ = ("_clock", "capacity", "rate", "tokens", "updated")
+
+    def __init__(
+        self, *, rate_per_second: float, capacity: float, clock: Callable[[], float] = time.monotonic
+    ) -> None:
+        self.rate = max(0.0, rate_per_second)
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self._clock = clock
+        self.updated = clock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self, amount: float) -> float:
+        """Take ``amount`` tokens; returns 0 on success or the seconds to wait otherwise.
+
+        Requests larger than the bucket are capped at its capacity, so a single
+        large upload needs a full bucket rather than being refused forever.
+        """
+
+        wait = self.wait_for(amount)
+        if wait == 0:
+            self.tokens -= min(amount, self.capacity)
+        return wait
+
+    def wait_for(self, amount: float) -> float:
+        """Seconds until ``amount`` tokens are available (0 = now), without taking them."""
+
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        if self.rate <= 0:
+            return float("inf")
+        return (amount - self.tokens) / self.rate
+
+    def adjust(self, amount: float) -> None:
+        """Take (``amount`` > 0) or return (< 0) tokens unconditionally.
+
+        Settling a reservation may leave the bucket below zero; the debt delays
+        the next charge instead of refusing work that already happened.
+        """
+
+        self._refill()
+        amount = max(-self.capacity, min(amount, self.capacity))
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+    def remaining(self) -> float:
+        self._refill()
+        return self.tokens
+
+
+def _limits(resource: str) -> tuple[float, float]:
+    """``(rate_per_hour, burst)`` for ``resource`` from the configuration."""
+
+    if resource == LLM_CALLS:
+        return config.user_quota_llm_calls_per_hour, config.user_quota_llm_calls_burst
+    if resource == IMAGE_GENERATIONS:
+        return config.user_quota_images_per_hour, config.user_quota_images_burst
+    if resource == GCS_BYTES:
+        mb = 1024 * 1024
+        return config.user_quota_gcs_mb_per_hour * mb, config.user_quota_gcs_mb_burst * mb
+    raise ValueError(f"Unknown quota resource: {resource!r}")
+
+
+class UserQuotas:
+    """Buckets per ``(user_id, resource)``, created on first use.
+
+    A full bucket behaves exactly like a missing one, so full buckets are swept
+    out at most every ``sweep_interval`` seconds; past ``max_buckets`` the least
+    recently used ones are dropped as well.
+    """
+
+    def __init__(
+        self,
+        *,
+        clock: Callable[[], float] = time.monotonic,
+        max_buckets: int = 10_000,
+        sweep_interval: float = 60.0,
+    ) -> None:
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._buckets: OrderedDict[tuple[str, str], TokenBucket] = OrderedDict()
+        self._max_buckets = max(1, max_buckets)
+        self._sweep_interval = sweep_interval
+        self._last_sweep = clock()
+
+    def _sweep(self) -> None:
+        self._last_sweep = self._clock()
+        for key, bucket in list(self._buckets.items()):
+            if bucket.remaining() >= bucket.capacity:
+                del self._buckets[key]
+
+    def _bucket(self, user_id: str, resource: str) -> TokenBucket:
+        if self._clock() - self._last_sweep >= self._sweep_interval:
+            self._sweep()
+        key = (user_id, resource)
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            self._buckets.move_to_end(key)
+            return bucket
+        if len(self._buckets) >= self._max_buckets:
+            self._sweep()
+            while len(self._buckets) >= self._max_buckets:
+                self._buckets.popitem(last=False)  # o menos usado recentemente
+        rate_per_hour, burst = _limits(resource)
+        bucket = TokenBucket(
+            rate_per_second=rate_per_hour / 3600.0, capacity=burst, clock=self._clock
+        )
+        self._buckets[key] = bucket
+        return bucket
+
+    def charge(self, user_id: str | None, resource: str, amount: float = 1) -> None:
+        """Consume ``amount`` of ``resource`` or raise :class:`QuotaExceededError`."""
+
+        self._take(user_id, resource, amount, consume=True)
+
+    def check(self, user_id: str | None, resource: str, amount: float = 1) -> None:
+        """Raise :class:`QuotaExceededError` if ``amount`` is not available now; consumes nothing."""
+
+        self._take(user_id, resource, amount, consume=False)
+
+    def settle(
+        self, user_id: str | None, resource: str, *, reserved: float, actual: float
+    ) -> None:
+        """Replace a ``reserved`` charge by the ``actual`` amount; never raises."""
+
+        if not config.user_quota_enabled or (user_id or "") in _ANONYMOUS_USERS:
+            return
+        if actual == reserved:
+            return
+        with self._lock:
+            self._bucket(user_id, resource).adjust(actual - reserved)
+
+    def _take(self, user_id: str | None, resource: str, amount: float, *, consume: bool) -> None:
+        if not config.user_quota_enabled or (user_id or "") in _ANONYMOUS_USERS or amount <= 0:
+            return
+        with self._lock:
+            bucket = self._bucket(user_id, resource)
+            wait = bucket.consume(amount) if consume else bucket.wait_for(amount)
+        if wait > 0:
+            logger.warning(
+                "user_quota_exceeded",
+                extra={"user_id": user_id, "resource": resource, "retry_after": wait},
+            )
+            raise QuotaExceededError(user_id, resource, retry_after=wait)
+
+    def report(self, user_id: str) -> dict[str, Any]:
+        resources: dict[str, Any] = {}
+        with self._lock:
+            for resource in RESOURCES:
+                rate_per_hour, burst = _limits(resource)
+                bucket = self._buckets.get((user_id, resource))
+                remaining = bucket.remaining() if bucket is not None else float(burst)
+                resources[resource] = {
+                    "remaining": int(remaining),
+                    "capacity": int(burst),
+                    "rate_per_hour": rate_per_hour,
+                }
+        return {"user_id": user_id, "enabled": config.user_quota_enabled, "resources": resources}
+
+
+_quotas = UserQuotas()
+
+
+def get_user_quotas() -> UserQuotas:
+    return _quotas
+
+
+def charge_user_quota(user_id: str | None, resource: str, amount: float = 1) -> None:
+    """Charge the process-wide quotas (see :meth:`UserQuotas.charge`)."""
+
+    _quotas.charge(user_id, resource, amount)
+
+
+def settle_user_quota(
+    user_id: str | None, resource: str, *, reserved: float, actual: float
+) -> None:
+    """Settle a reservation on the process-wide quotas (see :meth:`UserQuotas.settle`)."""
+
+    _quotas.settle(user_id, resource, reserved=reserved, actual=actual)
+
+
+def check_user_quota(user_id: str | None, resource: str, amount: float = 1) -> None:
+    """Check the process-wide quotas without charging (see :meth:`UserQuotas.check`)."""
+
+    _quotas.check(user_id, resource, amount)
+
+
+__all__ = [
+    "GCS_BYTES",
+    "IMAGE_GENERATIONS",
+    "LLM_CALLS",
+    "QuotaExceededError",
+    "TokenBucket",
+    "UserQuotas",
+    "charge_user_quota",
+    "check_user_quota",
+    "get_user_quotas",
+    "settle_user_quota",
+]
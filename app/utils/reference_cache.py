@@ -1,11 +1,14 @@
-"""In-memory cache helpers for reference image metadata."""
+"""In-memory cache helpers for reference image metadata and image payloads."""
 
 from __future__ import annotations
 
 import logging
 import time
+from collections import OrderedDict
+from collections.abc import Callable, Mapping, MutableMapping
+from dataclasses import dataclass
 from threading import Lock
-from typing import Any, Dict, Mapping, MutableMapping, Protocol
+from typing import Any, Protocol
 
 from app.config import config
 from app.schemas.reference_assets import ReferenceImageMetadata
@@ -101,6 +104,162 @@ def resolve_reference_metadata(
     return metadata
 
 
+@dataclass
+class CachedReferenceImage:
+    """Encoded bytes and the payload prepared from them for a reference upload."""
+
+    data: bytes
+    image: Any
+    size_bytes: int
+    expires_at: float
+
+
+def _estimate_image_bytes(image: Any, data: bytes) -> int:
+    # Payload já codificado (ex.: GeneratedImage convertido): conta os próprios bytes,
+    # exceto quando reaproveita o mesmo objeto do original.
+    encoded = getattr(image, "data", None)
+    if isinstance(encoded, (bytes, bytearray)):
+        return 0 if encoded is data else len(encoded)
+    size = getattr(image, "size", None)
+    mode = getattr(image, "mode", "") or ""
+    if isinstance(size, tuple) and len(size) == 2:
+        return int(size[0]) * int(size[1]) * max(len(mode), 1)
+    return 0
+
+
+class ReferenceImageCache:
+    """Process-wide LRU cache of reference image bytes and prepared payloads.
+
+    Entries are bounded by total size (original bytes + prepared payload) and expire
+    after ``ttl_seconds``. Concurrent loads of the same key are collapsed so a
+    session generating several variations downloads each reference once.
+    """
+
+    def __init__(self, *, max_bytes: int, ttl_seconds: int) -> None:
+        self.max_bytes = max(int(max_bytes), 0)
+        self.ttl_seconds = max(int(ttl_seconds), 0)
+        self._store: OrderedDict[str, CachedReferenceImage] = OrderedDict()
+        self._total_bytes = 0
+        self._lock = Lock()
+        self._key_locks: dict[str, Lock] = {}
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def _expiry(self) -> float:
+        return time.monotonic() + self.ttl_seconds if self.ttl_seconds else float("inf")
+
+    def _pop(self, key: str) -> None:
+        entry = self._store.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= entry.size_bytes
+
+    def _lookup(self, key: str) -> CachedReferenceImage | None:
+        entry = self._store.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at < time.monotonic():
+            self._pop(key)
+            logger.debug("Reference image %s expired from cache", key)
+            return None
+        self._store.move_to_end(key)
+        return entry
+
+    def get(self, key: str) -> CachedReferenceImage | None:
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+            return entry
+
+    def set(self, key: str, data: bytes, image: Any) -> CachedReferenceImage:
+        entry = CachedReferenceImage(
+            data=data,
+            image=image,
+            size_bytes=len(data) + _estimate_image_bytes(image, data),
+            expires_at=self._expiry(),
+        )
+        with self._lock:
+            self._pop(key)
+            if entry.size_bytes > self.max_bytes:
+                logger.debug(
+                    "Reference image %s (%d bytes) exceeds cache budget; not cached",
+                    key,
+                    entry.size_bytes,
+                )
+                return entry
+            self._store[key] = entry
+            self._total_bytes += entry.size_bytes
+            while self._total_bytes > self.max_bytes and self._store:
+                evicted_key, evicted = self._store.popitem(last=False)
+                self._total_bytes -= evicted.size_bytes
+                self._evictions += 1
+                logger.debug("Evicted reference image %s from cache", evicted_key)
+        return entry
+
+    def get_or_load(
+        self,
+        key: str,
+        loader: Callable[[], tuple[bytes, Any]],
+    ) -> CachedReferenceImage:
+        """Return the cached entry for ``key`` or populate it using ``loader``."""
+
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                self._hits += 1
+                return entry
+            key_lock = self._key_locks.setdefault(key, Lock())
+
+        with key_lock:
+            # Another thread may have loaded the key while we waited.
+            with self._lock:
+                entry = self._lookup(key)
+                if entry is not None:
+                    self._hits += 1
+                    return entry
+                self._misses += 1
+            try:
+                data, image = loader()
+                return self.set(key, data, image)
+            finally:
+                with self._lock:
+                    self._key_locks.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._store.clear()
+            self._total_bytes = 0
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "entries": len(self._store),
+                "size_bytes": self._total_bytes,
+            }
+
+
+def reference_image_cache_key(metadata: ReferenceImageMetadata) -> str:
+    """Cache key for a reference upload (id plus the GCS object it points to)."""
+
+    return f"{metadata.id}|{metadata.gcs_uri}"
+
+
+_image_cache = ReferenceImageCache(
+    max_bytes=config.reference_image_cache_max_bytes,
+    ttl_seconds=config.reference_cache_ttl_seconds,
+)
+
+
+def get_reference_image_cache() -> ReferenceImageCache:
+    return _image_cache
+
+
 def merge_user_description(
     metadata: ReferenceImageMetadata | None,
     description: str | None,
@@ -126,7 +285,7 @@ def build_reference_summary(
     """Build human-readable summaries for prompts and logging."""
 
     del payload  # reserved for future use (extended metadata merges)
-    summary: Dict[str, str | None] = {
+    summary: dict[str, str | None] = {
         "character": None,
         "product": None,
         "safe_search_notes": None,
@@ -162,11 +321,15 @@ def build_reference_summary(
 
 
 __all__ = [
+    "CachedReferenceImage",
     "InMemoryReferenceMetadataCache",
+    "ReferenceImageCache",
     "ReferenceMetadataCacheBackend",
     "build_reference_summary",
     "cache_reference_metadata",
     "configure_reference_cache",
+    "get_reference_image_cache",
     "merge_user_description",
+    "reference_image_cache_key",
     "resolve_reference_metadata",
 ]
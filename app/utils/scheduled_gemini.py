@@ -0,0 +1,85 @@
+"""Gemini model for ADK agents that goes through the Vertex call scheduler.
+
+``register_scheduled_gemini()`` replaces ADK's ``Gemini`` in the LLM registry, so
+every ``LlmAgent(model="gemini-...")`` call takes a permit from the same per-model
+pool as LangExtract and image generation. Calls are tagged with the priority
+class and user from :func:`app.utils.vertex_retry.vertex_call_context`, and
+their outcomes feed the adaptive limiter and the circuit breaker. Non-streaming
+calls to hedge-enabled models are hedged under the ``adk`` latency class.
+"""
+
+from __future__ import annotations
+
+from collections.abc import AsyncGenerator
+
+from google.adk.models.google_llm import Gemini
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from google.adk.models.registry import LLMRegistry
+
+from app.utils.vertex_retry import (
+    alimit_vertex_concurrency,
+    arun_vertex_call,
+    check_vertex_circuit,
+    record_vertex_outcome,
+)
+
+
+class ScheduledGemini(Gemini):
+    """``Gemini`` whose requests wait for a scheduler permit."""
+
+    async def generate_content_async(
+        self, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        model = llm_request.model or self.model
+        check_vertex_circuit(model)
+        if not stream:
+            # O fluxo do ADK executa ferramentas entre os yields; não segura a
+            # permissão durante esse tempo (a ferramenta pode chamar o Vertex).
+            responses = await arun_vertex_call(
+                lambda: self._collect(llm_request), model=model, hedge="adk"
+            )
+            for item in responses:
+                yield item
+            return
+
+        # Streaming: a permissão só admite a chamada; é liberada no 1º chunk.
+        upstream = super().generate_content_async(llm_request, stream)
+        first: LlmResponse | None = None
+        try:
+            async with alimit_vertex_concurrency(model):
+                first = await upstream.__anext__()
+        except StopAsyncIteration:
+            pass
+        except Exception as exc:
+            record_vertex_outcome(model, exc)
+            raise
+        if first is not None:
+            yield first
+        try:
+            async for item in upstream:
+                yield item
+        except Exception as exc:
+            record_vertex_outcome(model, exc)
+            raise
+        record_vertex_outcome(model)
+
+    async def _collect(self, llm_request: LlmRequest) -> list[LlmResponse]:
+        return [item async for item in super().generate_content_async(llm_request, False)]
+
+
+_registered = False
+
+
+def register_scheduled_gemini() -> None:
+    """Route ADK's ``gemini-*`` models through :class:`ScheduledGemini` (idempotent)."""
+
+    global _registered
+    if _registered:
+        return
+    LLMRegistry.register(ScheduledGemini)
+    LLMRegistry.resolve.cache_clear()
+    _registered = True
+
+
+__all__ = ["ScheduledGemini", "register_scheduled_gemini"]
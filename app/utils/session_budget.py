@@ -0,0 +1,127 @@
+"""Per-session time and LLM-call budget kept in the agent state.
+
+``FeatureOrchestrator`` starts a budget for every run and counts model responses
+as they stream by. Review loops, the semantic validation stage and the image
+stage consult :func:`budget_level` and degrade (fewer review iterations, skipped
+semantic loop, fewer image variations) once the budget runs low. Each
+degradation is recorded once in ``session_budget["degradations"]`` and in the
+``delivery_audit_trail``.
+"""
+
+from __future__ import annotations
+
+import logging
+import time
+from typing import Any, Literal
+
+from app.config import config
+from app.utils.audit import append_delivery_audit_event
+
+logger = logging.getLogger(__name__)
+
+STATE_KEY = "session_budget"
+
+BudgetLevel = Literal["ok", "low", "exhausted"]
+
+
+def start_session_budget(
+    state: dict[str, Any],
+    *,
+    seconds: float | None = None,
+    llm_calls: int | None = None,
+    now: float | None = None,
+) -> dict[str, Any]:
+    """Reset the budget for a new pipeline run and return it."""
+
+    budget = {
+        "started_at": time.time() if now is None else now,
+        "deadline_seconds": float(config.session_budget_seconds if seconds is None else seconds),
+        "max_llm_calls": int(config.session_budget_llm_calls if llm_calls is None else llm_calls),
+        "llm_calls": 0,
+        "degradations": [],
+    }
+    state[STATE_KEY] = budget
+    return budget
+
+
+def record_llm_calls(state: dict[str, Any], count: int = 1) -> None:
+    budget = state.get(STATE_KEY)
+    if isinstance(budget, dict):
+        budget["llm_calls"] = int(budget.get("llm_calls", 0)) + count
+
+
+def budget_remaining(state: dict[str, Any], *, now: float | None = None) -> float:
+    """Smallest remaining fraction between wall time and LLM calls (1.0 without a budget)."""
+
+    budget = state.get(STATE_KEY)
+    if not config.session_budget_enabled or not isinstance(budget, dict):
+        return 1.0
+    now = time.time() if now is None else now
+    fractions = []
+    deadline = float(budget.get("deadline_seconds") or 0)
+    if deadline > 0:
+        elapsed = now - float(budget.get("started_at", now))
+        fractions.append(1.0 - elapsed / deadline)
+    max_calls = int(budget.get("max_llm_calls") or 0)
+    if max_calls > 0:
+        fractions.append(1.0 - int(budget.get("llm_calls", 0)) / max_calls)
+    if not fractions:
+        return 1.0
+    return max(0.0, min(fractions))
+
+
+def budget_level(state: dict[str, Any], *, now: float | None = None) -> BudgetLevel:
+    remaining = budget_remaining(state, now=now)
+    if remaining <= 0.0:
+        return "exhausted"
+    if remaining <= config.session_budget_low_fraction:
+        return "low"
+    return "ok"
+
+
+def record_degradation(
+    state: dict[str, Any],
+    *,
+    stage: str,
+    action: str,
+    detail: str,
+    **extras: Any,
+) -> bool:
+    """Record a degradation once per ``(stage, action)``; ``False`` if already recorded."""
+
+    budget = state.get(STATE_KEY)
+    if not isinstance(budget, dict):
+        budget = start_session_budget(state)
+    degradations = list(budget.get("degradations", []))
+    if any(item.get("stage") == stage and item.get("action") == action for item in degradations):
+        return False
+
+    remaining = round(budget_remaining(state), 3)
+    degradations.append({"stage": stage, "action": action, "remaining": remaining})
+    budget["degradations"] = degradations
+    append_delivery_audit_event(
+        state,
+        stage=stage,
+        status="degraded",
+        detail=detail,
+        action=action,
+        budget_remaining=remaining,
+        llm_calls=budget.get("llm_calls"),
+        **extras,
+    )
+    logger.warning(
+        "session_budget_degraded",
+        extra={"stage": stage, "action": action, "budget_remaining": remaining},
+    )
+    return True
+
+
+__all__ = [
+    "STATE_KEY",
+    "BudgetLevel",
+    "budget_level",
+    "budget_remaining",
+    "record_degradation",
+    "record_llm_calls",
+    "start_session_budget",
+]
@@ -0,0 +1,238 @@
+"""Lazy, cached V4 signed URLs for objects stored in GCS.
+
+Generated images are persisted with their ``gs://`` URIs only; delivery endpoints
+sign them on demand. Signing credentials are resolved once per process and URLs
+are reused while at least half of ``image_signed_url_ttl`` remains.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Any
+
+from app.config import config
+from app.utils.image_backends import create_blob_store
+
+logger = logging.getLogger(__name__)
+
+IMAGE_URL_FIELDS: tuple[tuple[str, str], ...] = (
+    ("image_estado_atual_gcs", "image_estado_atual_url"),
+    ("image_estado_intermediario_gcs", "image_estado_intermediario_url"),
+    ("image_estado_aspiracional_gcs", "image_estado_aspiracional_url"),
+)
+
+_MIME_BY_SUFFIX = {
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".webp": "image/webp",
+    ".json": "application/json",
+}
+
+_SIGNING_WORKERS = 8
+
+
+def _guess_content_type(gcs_uri: str) -> str | None:
+    suffix = os.path.splitext(gcs_uri)[1].lower()
+    return _MIME_BY_SUFFIX.get(suffix)
+
+
+def _split_gcs_uri(gcs_uri: str) -> tuple[str, str]:
+    bucket_name, _, blob_name = gcs_uri.removeprefix("gs://").partition("/")
+    if not gcs_uri.startswith("gs://") or not bucket_name or not blob_name:
+        raise ValueError(f"Invalid GCS URI: {gcs_uri}")
+    return bucket_name, blob_name
+
+
+class SignedUrlSigner:
+    """Sign GCS URIs with cached credentials and an in-memory URL cache."""
+
+    def __init__(self, *, storage_client: Any | None = None, credentials: Any | None = None) -> None:
+        self._storage_client = storage_client
+        self._credentials = credentials
+        self._credentials_loaded = credentials is not None
+        self._cache: dict[tuple[str, str | None], tuple[str, float]] = {}
+        self._lock = threading.Lock()
+        self._signed = 0
+        self._cache_hits = 0
+
+    def _client(self) -> Any:
+        if self._storage_client is None:
+            self._storage_client = create_blob_store()
+        return self._storage_client
+
+    def _signing_kwargs(self) -> dict[str, Any]:
+        """Return extra kwargs so token-only credentials sign via IAM signBlob.
+
+        Key-file credentials sign locally and need nothing; Cloud Run metadata
+        credentials have no private key, so we pass the service account email and
+        a (cached, refreshed on expiry) access token instead.
+        """
+
+        with self._lock:
+            if not self._credentials_loaded:
+                try:
+                    import google.auth
+
+                    self._credentials, _ = google.auth.default(
+                        scopes=["https://www.googleapis.com/auth/cloud-platform"]
+                    )
+                except Exception as exc:  # pragma: no cover - depends on environment
+                    logger.debug("No default credentials for URL signing: %s", exc)
+                    self._credentials = None
+                self._credentials_loaded = True
+            credentials = self._credentials
+
+        if credentials is None or hasattr(credentials, "sign_bytes"):
+            return {}
+        email = getattr(credentials, "service_account_email", None)
+        if not email:
+            return {}
+        if not getattr(credentials, "valid", False):
+            try:
+                from google.auth.transport.requests import Request
+
+                credentials.refresh(Request())
+            except Exception as exc:  # pragma: no cover - depends on environment
+                logger.warning("Failed to refresh signing credentials: %s", exc)
+                return {}
+        return {"service_account_email": email, "access_token": credentials.token}
+
+    def _cached(self, key: tuple[str, str | None]) -> str | None:
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            url, reuse_until = entry
+            if reuse_until <= time.monotonic():
+                self._cache.pop(key, None)
+                return None
+            self._cache_hits += 1
+            return url
+
+    def sign(self, gcs_uri: str, *, content_type: str | None = None) -> str:
+        """Return a signed GET URL for ``gcs_uri`` (empty string on failure)."""
+
+        content_type = content_type or _guess_content_type(gcs_uri)
+        key = (gcs_uri, content_type)
+        cached = self._cached(key)
+        if cached is not None:
+            return cached
+
+        ttl = max(int(config.image_signed_url_ttl), 1)
+        try:
+            bucket_name, blob_name = _split_gcs_uri(gcs_uri)
+            client = self._client()
+            blob = client.bucket(bucket_name).blob(blob_name)
+            kwargs: dict[str, Any] = {
+                "version": "v4",
+                "expiration": timedelta(seconds=ttl),
+                "method": "GET",
+            }
+            if getattr(client, "requires_signing_credentials", True):
+                kwargs.update(self._signing_kwargs())
+            if content_type:
+                kwargs["response_type"] = content_type
+            url = blob.generate_signed_url(**kwargs)
+        except Exception as exc:  # pragma: no cover - depends on GCP setup
+            logger.warning("Falha ao gerar Signed URL para %s: %s", gcs_uri, exc, exc_info=True)
+            return ""
+
+        with self._lock:
+            # Reuse while at least half of the TTL is left for the client.
+            self._cache[key] = (url, time.monotonic() + ttl / 2)
+            self._signed += 1
+        return url
+
+    def sign_many(self, gcs_uris: Iterable[str]) -> dict[str, str]:
+        """Sign several URIs, serving cache hits inline and the rest in parallel."""
+
+        unique = [uri for uri in dict.fromkeys(gcs_uris) if uri]
+        results: dict[str, str] = {}
+        pending: list[str] = []
+        for uri in unique:
+            cached = self._cached((uri, _guess_content_type(uri)))
+            if cached is not None:
+                results[uri] = cached
+            else:
+                pending.append(uri)
+        if len(pending) == 1:
+            results[pending[0]] = self.sign(pending[0])
+        elif pending:
+            with ThreadPoolExecutor(max_workers=min(_SIGNING_WORKERS, len(pending))) as pool:
+                for uri, url in zip(pending, pool.map(self.sign, pending), strict=True):
+                    results[uri] = url
+        return results
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "signed": self._signed,
+                "cache_hits": self._cache_hits,
+                "entries": len(self._cache),
+            }
+
+
+def _image_url_fields(visual: dict[str, Any]) -> list[tuple[str, str]]:
+    """Original image fields plus any derivative (``image_<stage>_<name>_gcs``)."""
+
+    fields = list(IMAGE_URL_FIELDS)
+    known = {gcs_field for gcs_field, _ in fields}
+    for key in visual:
+        if key.startswith("image_") and key.endswith("_gcs") and key not in known:
+            fields.append((key, key[: -len("_gcs")] + "_url"))
+    return fields
+
+
+def hydrate_image_urls(variations: Any, signer: SignedUrlSigner | None = None) -> Any:
+    """Fill ``image_*_url`` fields (originals and derivatives) from ``image_*_gcs`` in place."""
+
+    if not isinstance(variations, list):
+        return variations
+    signer = signer or get_signed_url_signer()
+
+    targets: list[tuple[dict[str, Any], str, str]] = []
+    for item in variations:
+        visual = item.get("visual") if isinstance(item, dict) else None
+        if not isinstance(visual, dict):
+            continue
+        for gcs_field, url_field in _image_url_fields(visual):
+            gcs_uri = visual.get(gcs_field)
+            if isinstance(gcs_uri, str) and gcs_uri.startswith("gs://"):
+                targets.append((visual, gcs_uri, url_field))
+
+    if not targets:
+        return variations
+
+    signed = signer.sign_many(uri for _, uri, _ in targets)
+    for visual, gcs_uri, url_field in targets:
+        url = signed.get(gcs_uri)
+        if url:
+            visual[url_field] = url
+    return variations
+
+
+_signer: SignedUrlSigner | None = None
+_signer_lock = threading.Lock()
+
+
+def get_signed_url_signer() -> SignedUrlSigner:
+    global _signer
+    with _signer_lock:
+        if _signer is None:
+            _signer = SignedUrlSigner()
+        return _signer
+
+
+__all__ = [
+    "IMAGE_URL_FIELDS",
+    "SignedUrlSigner",
+    "get_signed_url_signer",
+    "hydrate_image_urls",
+]
@@ -0,0 +1,138 @@
+"""Single-flight coalescing for identical in-flight model calls.
+
+While a call for ``key`` is running, later callers with the same key wait for
+its result instead of issuing their own Vertex request. Results are not kept
+after the call finishes; the response caches handle reuse after that.
+
+Sync (threads) and async callers share one group: the shared result lives in a
+``concurrent.futures.Future``, so a preflight running in a worker thread and an
+``aextract`` on the event loop coalesce with each other.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import logging
+import threading
+from collections.abc import Awaitable, Callable, Hashable
+from typing import Any, TypeVar
+
+logger = logging.getLogger(__name__)
+
+_T = TypeVar("_T")
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._lock = threading.Lock()
+        self._inflight: dict[Hashable, concurrent.futures.Future[Any]] = {}
+        self._leaders = 0
+        self._coalesced = 0
+
+    def _join(self, key: Hashable) -> tuple[concurrent.futures.Future[Any], bool]:
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self._coalesced += 1
+                return future, False
+            future = concurrent.futures.Future()
+            self._inflight[key] = future
+            self._leaders += 1
+            return future, True
+
+    def _settle(
+        self,
+        key: Hashable,
+        future: concurrent.futures.Future[Any],
+        *,
+        result: Any = None,
+        error: BaseException | None = None,
+        cancelled: bool = False,
+    ) -> None:
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+        if cancelled:
+            future.cancel()
+        elif error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key: Hashable | None, func: Callable[[], _T]) -> _T:
+        """Run ``func`` once per key among concurrent callers (blocking)."""
+
+        if key is None:
+            return func()
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                try:
+                    result = func()
+                except BaseException as exc:
+                    self._settle(key, future, error=exc)
+                    raise
+                self._settle(key, future, result=result)
+                return result
+            try:
+                logger.debug("single_flight_wait", extra={"group": self.name})
+                return future.result()
+            except concurrent.futures.CancelledError:
+                continue  # o líder foi cancelado; tenta de novo (possivelmente como líder)
+
+    async def ado(self, key: Hashable | None, func: Callable[[], Awaitable[_T]]) -> _T:
+        """Async :meth:`do`; ``func`` returns a fresh awaitable for the leader."""
+
+        if key is None:
+            return await func()
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                try:
+                    result = await func()
+                except asyncio.CancelledError:
+                    self._settle(key, future, cancelled=True)
+                    raise
+                except BaseException as exc:
+                    self._settle(key, future, error=exc)
+                    raise
+                self._settle(key, future, result=result)
+                return result
+            try:
+                logger.debug("single_flight_wait", extra={"group": self.name})
+                # shield: cancelar um seguidor não pode cancelar o resultado compartilhado.
+                return await asyncio.shield(asyncio.wrap_future(future))
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise  # o próprio seguidor foi cancelado
+                continue
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "leaders": self._leaders,
+                "coalesced": self._coalesced,
+                "inflight": len(self._inflight),
+            }
+
+
+_groups: dict[str, SingleFlight] = {}
+_groups_lock = threading.Lock()
+
+
+def get_single_flight(name: str) -> SingleFlight:
+    """Return the process-wide group for ``name`` (``storybrand``, ``preflight``, ``image_stage``)."""
+
+    with _groups_lock:
+        group = _groups.get(name)
+        if group is None:
+            group = SingleFlight(name)
+            _groups[name] = group
+        return group
+
+
+__all__ = ["SingleFlight", "get_single_flight"]
@@ -0,0 +1,306 @@
+"""Token-budget planner for the landing page → StoryBrand extraction.
+
+One place decides, for a given page, how much text goes to the model and how
+LangExtract splits it: input budget, ``max_char_buffer`` (chunk size),
+``max_workers`` and ``extraction_passes``. The decision is based on a local
+token estimate and a simple latency model,
+
+    predicted = passes * waves * (call_overhead + seconds_per_1k * tokens_per_call / 1000)
+
+where ``waves = ceil(chunks / max_workers)``. Each call also costs a fixed
+penalty, so short pages are not split just to shave a second. Among the configurations whose
+prediction fits ``STORYBRAND_TARGET_SECONDS`` it keeps the most input and the
+most passes. ``seconds_per_1k`` is recalibrated from the measured duration of
+each LangExtract call (:meth:`LatencyModel.observe`).
+
+The plan feeds the StoryBrand cache key, so its result-shaping outputs move
+in steps rather than with every recalibration: the input budget walks down in
+20% steps from the ceiling and ``max_char_buffer`` is rounded up to
+``_CHUNK_STEP_CHARS``. ``max_workers`` only changes latency and stays out of
+the key.
+
+The env knobs that used to be applied separately now act as ceilings:
+``STORYBRAND_MAX_INPUT_TOKENS`` and ``STORYBRAND_HARD_CHAR_LIMIT`` (input),
+``STORYBRAND_MAX_CHAR_BUFFER`` (chunk), ``STORYBRAND_MAX_WORKERS`` and
+``STORYBRAND_EXTRACTION_PASSES``.
+"""
+
+from __future__ import annotations
+
+import math
+import os
+import re
+import threading
+from dataclasses import asdict, dataclass
+from typing import Any
+
+from app.utils.storybrand_selection import select_relevant_text
+
+_WORD_RE = re.compile(r"\w+|[^\w\s]")
+
+# Menor pedaço que ainda dá contexto ao LangExtract.
+_MIN_CHUNK_CHARS = 600
+_MIN_INPUT_TOKENS = 800
+# Cada chamada repete prompt + few-shots: só paraleliza quando o ganho supera isso.
+_CALL_PENALTY_SECONDS = 0.5
+# Degrau do max_char_buffer: planos vizinhos caem no mesmo chunk e na mesma chave de cache.
+_CHUNK_STEP_CHARS = 500
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate SentencePiece token count (pt-BR/en) without a tokenizer.
+
+    Short words are one token; longer ones add a token every ~6 characters;
+    each punctuation mark is a token.
+    """
+
+    if not text:
+        return 0
+    return sum(1 + (len(piece) - 1) // 6 for piece in _WORD_RE.findall(text))
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+class LatencyModel:
+    """Per-call latency model; ``seconds_per_1k`` follows observed runs (EWMA)."""
+
+    def __init__(self, *, call_overhead: float, seconds_per_1k: float, smoothing: float = 0.3) -> None:
+        self.call_overhead = call_overhead
+        self.seconds_per_1k = seconds_per_1k
+        self.smoothing = smoothing
+        self.observations = 0
+        self._lock = threading.Lock()
+
+    def call_seconds(self, tokens: float) -> float:
+        return self.call_overhead + self.seconds_per_1k * tokens / 1000.0
+
+    def observe(self, plan: StoryBrandPlan, actual_seconds: float) -> None:
+        """Fold a measured extraction into ``seconds_per_1k``."""
+
+        work = plan.passes * plan.waves
+        if work <= 0 or plan.tokens_per_call <= 0 or actual_seconds <= 0:
+            return
+        per_call = actual_seconds / work - self.call_overhead
+        observed = max(0.05, per_call) * 1000.0 / plan.tokens_per_call
+        with self._lock:
+            self.seconds_per_1k += self.smoothing * (observed - self.seconds_per_1k)
+            self.observations += 1
+
+
+_latency_model: LatencyModel | None = None
+_latency_lock = threading.Lock()
+
+
+def get_latency_model() -> LatencyModel:
+    global _latency_model
+    with _latency_lock:
+        if _latency_model is None:
+            _latency_model = LatencyModel(
+                call_overhead=_env_float("STORYBRAND_CALL_OVERHEAD_SECONDS", 2.0),
+                seconds_per_1k=_env_float("STORYBRAND_SECONDS_PER_1K_TOKENS", 1.5),
+            )
+        return _latency_model
+
+
+@dataclass
+class StoryBrandPlan:
+    input_chars: int
+    input_tokens: int
+    budget_tokens: int
+    budget_chars: int
+    max_char_buffer: int
+    max_workers: int
+    passes: int
+    chunks: int
+    waves: int
+    tokens_per_call: int
+    predicted_seconds: float
+    target_seconds: float
+    reason: str
+
+    @property
+    def truncate(self) -> bool:
+        return self.input_chars > self.budget_chars
+
+    def as_dict(self) -> dict[str, Any]:
+        return {**asdict(self), "truncate": self.truncate}
+
+
+def _predict(
+    model: LatencyModel,
+    *,
+    budget_chars: int,
+    chunk_chars: int,
+    workers: int,
+    passes: int,
+    chars_per_token: float,
+    prompt_tokens: int,
+) -> tuple[float, int, int, int]:
+    chunks = max(1, math.ceil(budget_chars / chunk_chars))
+    workers = max(1, min(workers, chunks))
+    waves = math.ceil(chunks / workers)
+    tokens_per_call = prompt_tokens + int(min(chunk_chars, budget_chars) / chars_per_token)
+    predicted = passes * waves * model.call_seconds(tokens_per_call)
+    return predicted, chunks, waves, tokens_per_call
+
+
+def plan_storybrand_extraction(
+    text: str,
+    *,
+    prompt_tokens: int = 0,
+    target_seconds: float | None = None,
+    model: LatencyModel | None = None,
+) -> StoryBrandPlan:
+    """Choose input budget, chunk size, workers and passes for ``text``."""
+
+    model = model or get_latency_model()
+    target = target_seconds if target_seconds is not None else _env_float("STORYBRAND_TARGET_SECONDS", 30.0)
+    max_tokens = max(_MIN_INPUT_TOKENS, _env_int("STORYBRAND_MAX_INPUT_TOKENS", 3000))
+    hard_chars = max(0, _env_int("STORYBRAND_HARD_CHAR_LIMIT", 20000))
+    max_chunk = max(_MIN_CHUNK_CHARS, _env_int("STORYBRAND_MAX_CHAR_BUFFER", 3000))
+    max_workers = max(1, _env_int("STORYBRAND_MAX_WORKERS", 4))
+    max_passes = max(1, _env_int("STORYBRAND_EXTRACTION_PASSES", 1))
+
+    input_chars = len(text)
+    input_tokens = estimate_tokens(text)
+    chars_per_token = input_chars / input_tokens if input_tokens else 4.0
+
+    # Orçamentos candidatos: do teto configurado até o mínimo útil, em passos de 20%.
+    ceiling = min(input_tokens, max_tokens)
+    if hard_chars:
+        ceiling = min(ceiling, int(hard_chars / chars_per_token))
+    budgets: list[int] = []
+    budget = max(ceiling, 1)
+    while True:
+        budgets.append(budget)
+        if budget <= _MIN_INPUT_TOKENS:
+            break
+        budget = max(_MIN_INPUT_TOKENS, int(budget * 0.8))
+
+    fallback: tuple[Any, ...] | None = None
+    for budget_tokens in budgets:
+        budget_chars = min(input_chars, max(1, int(budget_tokens * chars_per_token)))
+        # Mais entrada vale mais que passes extras; para cada par, o melhor nº de workers.
+        for passes in range(max_passes, 0, -1):
+            best: tuple[Any, ...] | None = None
+            best_cost = math.inf
+            for workers in range(max_workers, 0, -1):
+                chunk_chars = max(_MIN_CHUNK_CHARS, math.ceil(budget_chars / workers))
+                chunk_chars = min(
+                    max_chunk, _CHUNK_STEP_CHARS * math.ceil(chunk_chars / _CHUNK_STEP_CHARS)
+                )
+                predicted, chunks, waves, tokens_per_call = _predict(
+                    model,
+                    budget_chars=budget_chars,
+                    chunk_chars=chunk_chars,
+                    workers=workers,
+                    passes=passes,
+                    chars_per_token=chars_per_token,
+                    prompt_tokens=prompt_tokens,
+                )
+                cost = predicted + _CALL_PENALTY_SECONDS * passes * chunks
+                if cost < best_cost:
+                    best_cost = cost
+                    best = (
+                        predicted, budget_tokens, budget_chars, chunk_chars,
+                        min(workers, chunks), passes, chunks, waves, tokens_per_call,
+                    )
+            if fallback is None or best[0] < fallback[0]:
+                fallback = best
+            if best[0] <= target:
+                if budget_tokens < ceiling:
+                    reason = "reduced_for_target"
+                elif ceiling < input_tokens:
+                    reason = "token_ceiling"
+                else:
+                    reason = "fits_target"
+                return _build(best, input_chars, input_tokens, target, reason)
+
+    return _build(fallback, input_chars, input_tokens, target, "over_target")
+
+
+def _build(
+    choice: tuple[Any, ...], input_chars: int, input_tokens: int, target: float, reason: str
+) -> StoryBrandPlan:
+    predicted, budget_tokens, budget_chars, chunk_chars, workers, passes, chunks, waves, tokens_per_call = choice
+    return StoryBrandPlan(
+        input_chars=input_chars,
+        input_tokens=input_tokens,
+        budget_tokens=budget_tokens,
+        budget_chars=budget_chars,
+        max_char_buffer=chunk_chars,
+        max_workers=workers,
+        passes=passes,
+        chunks=chunks,
+        waves=waves,
+        tokens_per_call=tokens_per_call,
+        predicted_seconds=round(predicted, 2),
+        target_seconds=target,
+        reason=reason,
+    )
+
+
+def apply_plan(text: str, plan: StoryBrandPlan) -> tuple[str, dict[str, Any]]:
+    """Reduce ``text`` to the plan's character budget; returns ``(text, truncation_info)``.
+
+    ``STORYBRAND_TRUNCATION_STRATEGY=head_tail`` keeps the start of the page
+    plus ``STORYBRAND_TAIL_RATIO`` of its end instead of ranked paragraphs.
+    """
+
+    if len(text) <= plan.budget_chars:
+        return text, {"strategy": "passthrough", "truncated": False, "input_length": len(text)}
+
+    budget = plan.budget_chars
+    if os.getenv("STORYBRAND_TRUNCATION_STRATEGY", "ranked").strip().lower() != "head_tail":
+        selection = select_relevant_text(text, budget)
+        if selection.truncated and selection.text:
+            return selection.text, {**selection.info, "truncated": True}
+
+    tail_ratio = min(max(_env_float("STORYBRAND_TAIL_RATIO", 0.2), 0.05), 0.4)
+    marker = "\n<!-- storybrand:tail -->\n"
+    tail_chars = int(budget * tail_ratio)
+    head_chars = max(0, budget - tail_chars - len(marker))
+    reduced = text[:head_chars]
+    if tail_chars:
+        reduced += marker + text[-tail_chars:]
+    return reduced, {
+        "strategy": "head_tail",
+        "truncated": True,
+        "input_length": len(text),
+        "budget_chars": budget,
+        "head_chars": head_chars,
+        "tail_chars": tail_chars,
+    }
+
+
+def plan_outcome(plan: StoryBrandPlan, actual_seconds: float) -> dict[str, Any]:
+    """Predicted vs. actual duration of a planned extraction, for ``storybrand_timing``."""
+
+    return {
+        "predicted_s": plan.predicted_seconds,
+        "actual_s": round(actual_seconds, 2),
+        "prediction_error_s": round(actual_seconds - plan.predicted_seconds, 2),
+    }
+
+
+__all__ = [
+    "LatencyModel",
+    "StoryBrandPlan",
+    "apply_plan",
+    "estimate_tokens",
+    "get_latency_model",
+    "plan_outcome",
+    "plan_storybrand_extraction",
+]
@@ -0,0 +1,235 @@
+"""Relevance-ranked reduction of landing page text for StoryBrand extraction.
+
+Long sales pages do not fit the StoryBrand character budget, and a head/tail
+slice drops the middle of the page, where testimonials, offers and CTAs
+usually sit. Here the Trafilatura text is split into paragraphs and each one
+is scored for StoryBrand signals (pt-BR lexicons for CTAs, pain, credentials,
+plan and success, plus numbers and prices), weighted by how distinctive its
+words are on the page (IDF, so repeated menus and footers score low).
+The best paragraphs are packed into the budget and kept in reading order.
+"""
+
+from __future__ import annotations
+
+import math
+import re
+import unicodedata
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any
+
+# Radicais sem acento; casam com o início das palavras normalizadas.
+SIGNAL_LEXICONS: dict[str, tuple[str, ...]] = {
+    "cta": (
+        "compr", "garant", "cliqu", "clique", "inscrev", "agend", "baix", "assin", "quer",
+        "comec", "fal", "whatsapp", "matricul", "reserv", "aproveit", "acess", "cadastr",
+        "solicit", "peca", "adquir", "vaga", "oferta", "desconto", "bonus", "gratis",
+        "buy", "sign", "join", "book", "start",
+    ),
+    "problem": (
+        "dor", "cansad", "cansaco", "frustr", "dificil", "dificuldade", "sofr", "medo",
+        "problem", "preocup", "ansied", "estress", "insegur", "vergonh", "travad", "perd",
+        "desperdic", "sozinh", "confus", "culpa", "desanim", "luta", "obstacul", "pain",
+        "struggl",
+    ),
+    "guide": (
+        "especialist", "certific", "premi", "experienc", "anos", "formad", "mestr", "doutor",
+        "fundad", "metodo", "garantia", "depoiment", "avaliac", "estrel", "aprovad",
+        "referenc", "reconhec", "autoridad", "confian", "seguranc", "expert", "years",
+    ),
+    "plan": (
+        "passo", "etapa", "primeir", "segund", "terceir", "como funciona", "program",
+        "modul", "aula", "cronogram", "jornad", "processo", "simples", "step",
+    ),
+    "success": (
+        "transform", "result", "conquist", "liberdad", "sonh", "realiz", "feliz", "saude",
+        "energi", "autoestim", "tranquil", "sucess", "vida nova", "finalmente", "success",
+    ),
+    "failure": (
+        "evit", "nunca mais", "nao deix", "pare de", "sem perder", "risco", "tarde demais",
+        "continuar", "prejuiz",
+    ),
+}
+
+SIGNAL_WEIGHTS: dict[str, float] = {
+    "cta": 2.0,
+    "problem": 1.5,
+    "guide": 1.5,
+    "plan": 1.0,
+    "success": 1.2,
+    "failure": 1.0,
+    "evidence": 1.0,
+}
+
+# Navegação, cookies e rodapés: não carregam StoryBrand.
+BOILERPLATE_STEMS: tuple[str, ...] = (
+    "cookie", "politica de privacidade", "termos de uso", "todos os direitos",
+    "direitos reservados", "cnpj", "menu", "newsletter", "copyright", "lgpd",
+)
+
+_EVIDENCE_RE = re.compile(r"\d+(?:[.,]\d+)*\s*(?:%|mil\b|x\b|anos\b|clientes\b|alunos\b)?|r\$|\+\s?\d")
+_TOKEN_RE = re.compile(r"[a-z0-9]{3,}")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+_MAX_SIGNAL_HITS = 3
+
+
+def _compile(stems: tuple[str, ...]) -> re.Pattern[str]:
+    alternatives = "|".join(re.escape(stem) for stem in sorted(stems, key=len, reverse=True))
+    return re.compile(rf"\b(?:{alternatives})")
+
+
+_SIGNAL_PATTERNS = {name: _compile(stems) for name, stems in SIGNAL_LEXICONS.items()}
+_BOILERPLATE_PATTERN = _compile(BOILERPLATE_STEMS)
+
+
+def normalize(text: str) -> str:
+    """Lowercase without accents, so lexicon stems match ``não``/``nao`` alike."""
+
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def segment_paragraphs(text: str, *, max_segment_chars: int = 1200) -> list[str]:
+    """Split Trafilatura text into paragraphs; overly long ones are split by sentence."""
+
+    segments: list[str] = []
+    for block in re.split(r"\n\s*\n|\n", text):
+        block = block.strip()
+        if not block:
+            continue
+        if len(block) <= max_segment_chars:
+            segments.append(block)
+            continue
+        current = ""
+        for sentence in _SENTENCE_RE.split(block):
+            if current and len(current) + len(sentence) + 1 > max_segment_chars:
+                segments.append(current)
+                current = ""
+            current = f"{current} {sentence}".strip()
+            while len(current) > max_segment_chars:
+                segments.append(current[:max_segment_chars])
+                current = current[max_segment_chars:]
+        if current:
+            segments.append(current)
+    return segments
+
+
+@dataclass
+class SegmentScore:
+    index: int
+    chars: int
+    score: float
+    signals: dict[str, int] = field(default_factory=dict)
+
+
+@dataclass
+class SelectionResult:
+    text: str
+    truncated: bool
+    info: dict[str, Any]
+
+
+def score_segments(segments: list[str]) -> list[SegmentScore]:
+    """Score each segment: weighted StoryBrand signals times how distinctive its words are."""
+
+    normalized = [normalize(segment) for segment in segments]
+    tokens = [_TOKEN_RE.findall(text) for text in normalized]
+    document_frequency: Counter[str] = Counter()
+    for segment_tokens in tokens:
+        document_frequency.update(set(segment_tokens))
+    total = len(segments)
+    idf = {
+        token: math.log((1 + total) / (1 + frequency)) + 1
+        for token, frequency in document_frequency.items()
+    }
+    seen: set[str] = set()
+
+    scores: list[SegmentScore] = []
+    for index, (text, segment_tokens) in enumerate(zip(normalized, tokens, strict=True)):
+        signals = {
+            name: min(_MAX_SIGNAL_HITS, len(pattern.findall(text)))
+            for name, pattern in _SIGNAL_PATTERNS.items()
+        }
+        signals["evidence"] = min(_MAX_SIGNAL_HITS, len(_EVIDENCE_RE.findall(text)))
+        signals = {name: hits for name, hits in signals.items() if hits}
+
+        if segment_tokens:
+            distinctiveness = sum(map(idf.__getitem__, segment_tokens)) / len(segment_tokens)
+        else:
+            distinctiveness = 0.0
+        signal_score = sum(SIGNAL_WEIGHTS[name] * hits for name, hits in signals.items())
+        score = (1.0 + signal_score) * distinctiveness
+        if _BOILERPLATE_PATTERN.search(text) and len(segment_tokens) < 40:
+            score = 0.0  # rodapé/menu curto: nunca entra no orçamento
+        if len(segment_tokens) < 3:
+            score *= 0.5  # títulos soltos e itens de menu
+        key = " ".join(segment_tokens)
+        if key in seen:
+            score = 0.0  # parágrafo repetido (menu, rodapé, CTA duplicado)
+        seen.add(key)
+        scores.append(SegmentScore(index=index, chars=len(segments[index]), score=score, signals=signals))
+    return scores
+
+
+def select_relevant_text(
+    text: str,
+    budget_chars: int,
+    *,
+    separator: str = "\n\n",
+    lead_segments: int = 1,
+) -> SelectionResult:
+    """Pack the highest-scoring paragraphs of ``text`` into ``budget_chars``.
+
+    The first ``lead_segments`` paragraphs (headline/hero) are always kept when
+    they fit, since they usually name the character and the problem. The result
+    keeps the page order; ``info`` describes what was kept and dropped.
+    """
+
+    length = len(text)
+    if budget_chars <= 0 or length <= budget_chars:
+        return SelectionResult(
+            text=text, truncated=False, info={"strategy": "passthrough", "input_length": length}
+        )
+
+    segments = segment_paragraphs(text)
+    scores = score_segments(segments)
+    ranked = sorted(scores[lead_segments:], key=lambda item: (-item.score, item.index))
+    chosen: list[SegmentScore] = []
+    used = 0
+    for candidate in [*scores[:lead_segments], *ranked]:
+        if candidate.score <= 0 and candidate.index >= lead_segments:
+            break
+        cost = candidate.chars + (len(separator) if chosen else 0)
+        if used + cost > budget_chars:
+            continue
+        chosen.append(candidate)
+        used += cost
+
+    chosen.sort(key=lambda item: item.index)
+    selected = separator.join(segments[item.index] for item in chosen)
+    coverage: Counter[str] = Counter()
+    for item in chosen:
+        coverage.update(dict.fromkeys(item.signals, 1))
+    info: dict[str, Any] = {
+        "strategy": "ranked_paragraphs",
+        "input_length": length,
+        "budget_chars": budget_chars,
+        "output_length": len(selected),
+        "segments_total": len(segments),
+        "segments_selected": len(chosen),
+        "selected_segments": [item.index for item in chosen],
+        "dropped_chars": max(0, sum(item.chars for item in scores) - sum(item.chars for item in chosen)),
+        "signal_coverage": dict(sorted(coverage.items())),
+    }
+    return SelectionResult(text=selected, truncated=True, info=info)
+
+
+__all__ = [
+    "SIGNAL_LEXICONS",
+    "SegmentScore",
+    "SelectionResult",
+    "normalize",
+    "score_segments",
+    "segment_paragraphs",
+    "select_relevant_text",
+]
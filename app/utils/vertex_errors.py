@@ -0,0 +1,109 @@
+"""Classification of Vertex AI errors shared by the retry, circuit and region layers."""
+
+from __future__ import annotations
+
+try:  # pragma: no cover - optional dependency during tests
+    from google.api_core import exceptions as gcloud_exceptions
+except Exception:  # pragma: no cover
+    gcloud_exceptions = None
+
+try:  # pragma: no cover - optional dependency during tests
+    from google.genai.errors import ClientError as GenAiClientError
+except Exception:  # pragma: no cover
+    GenAiClientError = None
+
+
+class VertexRetryExceededError(RuntimeError):
+    """Raised when retry attempts are exhausted while calling Vertex AI."""
+
+    def __init__(self, message: str, *, attempts: int, last_exception: BaseException | None, retry_after: float | None) -> None:
+        super().__init__(message)
+        self.attempts = attempts
+        self.last_exception = last_exception
+        self.retry_after = retry_after
+
+
+def extract_status_code(exc: BaseException) -> int | None:
+    for attr in ("code", "status_code", "http_status", "status"):  # pragma: no branch - tiny loop
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+        if hasattr(value, "value") and isinstance(value.value, int):
+            return value.value
+    return None
+
+
+def extract_retry_after(exc: BaseException) -> float | None:
+    header = None
+    for candidate in ("retry_after", "Retry-After", "retry-after"):
+        if hasattr(exc, candidate):
+            header = getattr(exc, candidate)
+            break
+    response = getattr(exc, "response", None)
+    if response is not None:
+        headers = getattr(response, "headers", None)
+        if headers and isinstance(headers, dict):
+            header = header or headers.get("Retry-After") or headers.get("retry-after")
+    if header is None:
+        return None
+    try:
+        if isinstance(header, (int, float)):
+            return float(header)
+        return float(str(header))
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable_error(exc: BaseException) -> bool:
+    status = extract_status_code(exc)
+    if status in {408, 429, 500, 503}:
+        return True
+    if gcloud_exceptions and isinstance(exc, gcloud_exceptions.ResourceExhausted):
+        return True
+    if gcloud_exceptions and isinstance(exc, gcloud_exceptions.TooManyRequests):
+        return True
+    if gcloud_exceptions and isinstance(exc, gcloud_exceptions.ServiceUnavailable):
+        return True
+    if GenAiClientError and isinstance(exc, GenAiClientError):
+        if status is None:
+            return True
+        return status in {408, 429, 500, 503}
+    return False
+
+
+def is_throttle_error(exc: BaseException) -> bool:
+    if extract_status_code(exc) == 429:
+        return True
+    if gcloud_exceptions and isinstance(
+        exc, (gcloud_exceptions.ResourceExhausted, gcloud_exceptions.TooManyRequests)
+    ):
+        return True
+    return "RESOURCE_EXHAUSTED" in str(exc)
+
+
+def is_vertex_failover_error(exc: BaseException) -> bool:
+    """429/503-style errors that another region may not share."""
+
+    status = extract_status_code(exc)
+    if status in {429, 503}:
+        return True
+    if gcloud_exceptions and isinstance(
+        exc,
+        (
+            gcloud_exceptions.ResourceExhausted,
+            gcloud_exceptions.TooManyRequests,
+            gcloud_exceptions.ServiceUnavailable,
+        ),
+    ):
+        return True
+    return "RESOURCE_EXHAUSTED" in str(exc) or "UNAVAILABLE" in str(exc)
+
+
+__all__ = [
+    "VertexRetryExceededError",
+    "extract_retry_after",
+    "extract_status_code",
+    "is_retryable_error",
+    "is_throttle_error",
+    "is_vertex_failover_error",
+]
@@ -0,0 +1,433 @@
+"""Per-model health of Vertex AI: error-rate circuit breaker and region pool.
+
+:func:`record_vertex_outcome` is the single sink for call outcomes: it feeds the
+model's AIMD limiter (:mod:`app.utils.vertex_scheduler`), its circuit breaker and,
+for 429/503 errors while another region is healthy, only that region's health.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from collections.abc import Callable, Iterable
+from contextvars import ContextVar
+
+from app.utils.vertex_errors import (
+    VertexRetryExceededError,
+    is_retryable_error,
+    is_throttle_error,
+    is_vertex_failover_error,
+)
+from app.utils.vertex_scheduler import DEFAULT_MODEL, get_vertex_limiter
+
+logger = logging.getLogger(__name__)
+
+# Circuit breaker: abre quando a taxa de erro na janela passa do limiar.
+_CIRCUIT_ENABLED = os.getenv("VERTEX_CIRCUIT_BREAKER_ENABLED", "true").lower() == "true"
+_CIRCUIT_ERROR_RATE = min(1.0, max(0.05, float(os.getenv("VERTEX_CIRCUIT_ERROR_RATE", "0.5"))))
+_CIRCUIT_MIN_CALLS = max(1, int(os.getenv("VERTEX_CIRCUIT_MIN_CALLS", "10")))
+_CIRCUIT_WINDOW_SECONDS = float(os.getenv("VERTEX_CIRCUIT_WINDOW_SECONDS", "60"))
+_CIRCUIT_OPEN_SECONDS = float(os.getenv("VERTEX_CIRCUIT_OPEN_SECONDS", "30"))
+_CIRCUIT_HALF_OPEN_PROBES = max(1, int(os.getenv("VERTEX_CIRCUIT_HALF_OPEN_PROBES", "2")))
+
+# Regiões: lista ordenada (a primeira é a preferida); falhas 429/503 trocam de região.
+_DEFAULT_REGION = os.getenv("GOOGLE_CLOUD_LOCATION", "us-central1")
+_REGION_COOLDOWN = float(os.getenv("VERTEX_REGION_COOLDOWN", "30"))
+_REGION_MIN_SCORE = 0.05
+
+
+class VertexCircuitOpenError(VertexRetryExceededError):
+    """Raised without calling Vertex AI while the model's circuit is open."""
+
+    def __init__(
+        self,
+        model: str,
+        *,
+        retry_after: float,
+        attempts: int = 0,
+        last_exception: BaseException | None = None,
+    ) -> None:
+        super().__init__(
+            f"Vertex AI circuit open for {model}; retry in {retry_after:.0f}s",
+            attempts=attempts,
+            last_exception=last_exception,
+            retry_after=retry_after,
+        )
+        self.model = model
+
+
+class VertexCircuitBreaker:
+    """Error-rate circuit breaker for one model.
+
+    ``closed`` tracks outcomes over ``window_seconds``; once at least ``min_calls``
+    were seen and the failure ratio reaches ``error_rate`` it opens. ``open``
+    rejects calls for ``open_seconds``, then ``half_open`` lets ``half_open_probes``
+    calls through: all of them succeeding closes the circuit, any failure reopens it.
+    Only saturation signals (429/5xx/timeouts) count as failures.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        model: str,
+        *,
+        error_rate: float = _CIRCUIT_ERROR_RATE,
+        min_calls: int = _CIRCUIT_MIN_CALLS,
+        window_seconds: float = _CIRCUIT_WINDOW_SECONDS,
+        open_seconds: float = _CIRCUIT_OPEN_SECONDS,
+        half_open_probes: int = _CIRCUIT_HALF_OPEN_PROBES,
+        enabled: bool = _CIRCUIT_ENABLED,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.model = model
+        self.error_rate = error_rate
+        self.min_calls = max(1, min_calls)
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.half_open_probes = max(1, half_open_probes)
+        self.enabled = enabled
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._outcomes: deque[tuple[float, bool]] = deque()
+        self._failures = 0
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self._last_probe_at = 0.0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def try_acquire(self) -> float | None:
+        """Admit a call, or return the seconds to wait while the circuit rejects calls."""
+
+        if not self.enabled:
+            return None
+        with self._lock:
+            now = self._clock()
+            if self._state == self.OPEN:
+                remaining = self._opened_at + self.open_seconds - now
+                if remaining > 0:
+                    return remaining
+                self._transition_locked(self.HALF_OPEN)
+                self._probes_in_flight = 0
+                self._probe_successes = 0
+            if self._state == self.HALF_OPEN:
+                # Sonda "perdida" (cancelada sem resultado) libera a vaga após open_seconds.
+                stale = now - self._last_probe_at >= self.open_seconds
+                if self._probes_in_flight >= self.half_open_probes and not stale:
+                    return self.open_seconds
+                if stale:
+                    self._probes_in_flight = 0
+                self._probes_in_flight += 1
+                self._last_probe_at = now
+            return None
+
+    def blocked_for(self) -> float | None:
+        """Seconds left while open (``None`` otherwise); does not admit a call."""
+
+        if not self.enabled:
+            return None
+        with self._lock:
+            if self._state != self.OPEN:
+                return None
+            remaining = self._opened_at + self.open_seconds - self._clock()
+            return remaining if remaining > 0 else None
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_probes:
+                    self._outcomes.clear()
+                    self._failures = 0
+                    self._transition_locked(self.CLOSED)
+            elif self._state == self.CLOSED:
+                self._append_locked(False)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._open_locked()
+            elif self._state == self.CLOSED:
+                self._append_locked(True)
+                total = len(self._outcomes)
+                if total >= self.min_calls and self._failures / total >= self.error_rate:
+                    self._open_locked()
+
+    def record_neutral(self) -> None:
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+
+    def _append_locked(self, failed: bool) -> None:
+        now = self._clock()
+        self._outcomes.append((now, failed))
+        self._failures += int(failed)
+        cutoff = now - self.window_seconds
+        while self._outcomes and self._outcomes[0][0] < cutoff:
+            _, expired_failed = self._outcomes.popleft()
+            self._failures -= int(expired_failed)
+
+    def _open_locked(self) -> None:
+        self._opened_at = self._clock()
+        self._outcomes.clear()
+        self._failures = 0
+        self._transition_locked(self.OPEN)
+
+    def _transition_locked(self, state: str) -> None:
+        if state == self._state:
+            return
+        previous, self._state = self._state, state
+        logger.warning(
+            "vertex_circuit_transition",
+            extra={"model": self.model, "from": previous, "to": state},
+        )
+
+
+_circuits: dict[str, VertexCircuitBreaker] = {}
+_circuits_lock = threading.Lock()
+
+
+def get_vertex_circuit(model: str | None = None) -> VertexCircuitBreaker:
+    """Return the per-model circuit breaker (created on first use)."""
+
+    key = model or DEFAULT_MODEL
+    with _circuits_lock:
+        circuit = _circuits.get(key)
+        if circuit is None:
+            circuit = VertexCircuitBreaker(key)
+            _circuits[key] = circuit
+        return circuit
+
+
+def check_vertex_circuit(
+    model: str | None = None,
+    *,
+    attempts: int = 0,
+    last_exception: BaseException | None = None,
+) -> None:
+    """Admit one call through the model's circuit or raise :class:`VertexCircuitOpenError`."""
+
+    blocked = get_vertex_circuit(model).try_acquire()
+    if blocked is not None:
+        raise VertexCircuitOpenError(
+            model or DEFAULT_MODEL,
+            retry_after=blocked,
+            attempts=attempts,
+            last_exception=last_exception,
+        )
+
+
+def raise_if_vertex_circuit_open(
+    model: str | None, *, attempts: int, last_exception: BaseException
+) -> None:
+    """Stop a retry ladder once the failure just recorded opened the circuit."""
+
+    blocked = get_vertex_circuit(model).blocked_for()
+    if blocked is not None:
+        raise VertexCircuitOpenError(
+            model or DEFAULT_MODEL,
+            retry_after=blocked,
+            attempts=attempts,
+            last_exception=last_exception,
+        ) from last_exception
+
+
+class RegionHealth:
+    __slots__ = ("cooldown_until", "failures", "latency", "name", "score", "successes")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.score = 1.0
+        self.cooldown_until = 0.0
+        self.latency: float | None = None
+        self.successes = 0
+        self.failures = 0
+
+
+class VertexRegionPool:
+    """Health-scored region selection for one model.
+
+    Each region keeps a score in ``(0, 1]``: successes pull it up (EWMA), 429/503
+    halve it and put the region in cooldown (``Retry-After`` or
+    ``VERTEX_REGION_COOLDOWN``). Calls are spread across regions out of cooldown
+    with probability proportional to ``score / latency``.
+    """
+
+    def __init__(
+        self,
+        regions: list[str],
+        *,
+        cooldown: float = _REGION_COOLDOWN,
+        smoothing: float = 0.2,
+        clock: Callable[[], float] = time.monotonic,
+        rng: random.Random | None = None,
+    ) -> None:
+        ordered = list(dict.fromkeys(region for region in regions if region)) or [_DEFAULT_REGION]
+        self._regions = {name: RegionHealth(name) for name in ordered}
+        self.cooldown = cooldown
+        self.smoothing = smoothing
+        self._clock = clock
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+
+    @property
+    def regions(self) -> list[str]:
+        return list(self._regions)
+
+    def choose(self, exclude: Iterable[str] = ()) -> str:
+        """Pick a region, avoiding ``exclude`` and regions in cooldown when possible."""
+
+        excluded = set(exclude)
+        with self._lock:
+            now = self._clock()
+            candidates = [h for h in self._regions.values() if h.name not in excluded]
+            if not candidates:
+                candidates = list(self._regions.values())
+            healthy = [h for h in candidates if h.cooldown_until <= now]
+            if not healthy:
+                # Todas em cooldown: a que sai primeiro.
+                return min(candidates, key=lambda h: h.cooldown_until).name
+            if len(healthy) == 1:
+                return healthy[0].name
+            weights = [h.score / max(h.latency or 1.0, 0.05) for h in healthy]
+            return self._rng.choices(healthy, weights=weights, k=1)[0].name
+
+    def has_alternative(self, tried: Iterable[str]) -> bool:
+        excluded = set(tried)
+        with self._lock:
+            now = self._clock()
+            return any(
+                h.name not in excluded and h.cooldown_until <= now for h in self._regions.values()
+            )
+
+    def record_success(self, region: str, latency: float | None = None) -> None:
+        with self._lock:
+            health = self._regions.get(region)
+            if health is None:
+                return
+            health.successes += 1
+            health.score += self.smoothing * (1.0 - health.score)
+            if latency is not None:
+                health.latency = (
+                    latency
+                    if health.latency is None
+                    else health.latency + self.smoothing * (latency - health.latency)
+                )
+
+    def record_failure(self, region: str, retry_after: float | None = None) -> None:
+        with self._lock:
+            health = self._regions.get(region)
+            if health is None:
+                return
+            health.failures += 1
+            health.score = max(_REGION_MIN_SCORE, health.score * 0.5)
+            health.cooldown_until = self._clock() + (retry_after or self.cooldown)
+
+    def snapshot(self) -> dict[str, dict[str, float | int | None]]:
+        with self._lock:
+            now = self._clock()
+            return {
+                h.name: {
+                    "score": round(h.score, 3),
+                    "cooldown_remaining": max(0.0, round(h.cooldown_until - now, 2)),
+                    "latency": h.latency,
+                    "successes": h.successes,
+                    "failures": h.failures,
+                }
+                for h in self._regions.values()
+            }
+
+
+def _configured_regions(model: str) -> list[str]:
+    raw = os.getenv("VERTEX_REGIONS_" + re.sub(r"[^A-Z0-9]", "_", model.upper())) or os.getenv(
+        "VERTEX_REGIONS", ""
+    )
+    regions = [item.strip() for item in raw.split(",") if item.strip()]
+    return regions or [_DEFAULT_REGION]
+
+
+_region_pools: dict[str, VertexRegionPool] = {}
+_region_pools_lock = threading.Lock()
+_current_region: ContextVar[str | None] = ContextVar("vertex_region", default=None)
+
+
+def get_region_pool(model: str | None = None) -> VertexRegionPool:
+    """Return the per-model region pool (``VERTEX_REGIONS[_<MODEL>]``, created on first use)."""
+
+    key = model or DEFAULT_MODEL
+    with _region_pools_lock:
+        pool = _region_pools.get(key)
+        if pool is None:
+            pool = VertexRegionPool(_configured_regions(key))
+            _region_pools[key] = pool
+        return pool
+
+
+def vertex_region(default: str | None = None) -> str:
+    """Region chosen by the retry layer for the current attempt (``default`` outside it)."""
+
+    return _current_region.get() or default or _DEFAULT_REGION
+
+
+def record_vertex_outcome(
+    model: str | None, exc: BaseException | None = None, *, region: str | None = None
+) -> None:
+    """Feed a call outcome to the model's AIMD limiter and circuit breaker.
+
+    Callers with their own retry loop pair this with :func:`check_vertex_circuit`.
+    ``region`` (default: the region of the current retry attempt) scopes 429/503
+    errors: while another region of the model is healthy the failure only cools
+    that region down (:func:`record_region_failure`) and does not shrink the
+    model's permits or count towards its circuit.
+    """
+
+    limiter = get_vertex_limiter(model)
+    circuit = get_vertex_circuit(model)
+    if exc is None:
+        limiter.on_success()
+        circuit.record_success()
+        return
+    region = region or _current_region.get()
+    if (
+        region is not None
+        and is_vertex_failover_error(exc)
+        and get_region_pool(model).has_alternative({region})
+    ):
+        circuit.record_neutral()
+        return
+    if is_throttle_error(exc):
+        limiter.on_throttle()
+    if is_retryable_error(exc) or isinstance(exc, (TimeoutError, asyncio.TimeoutError)):
+        circuit.record_failure()
+    else:
+        # Erros do próprio pedido (400, schema) não indicam saturação do modelo.
+        circuit.record_neutral()
+
+
+__all__ = [
+    "RegionHealth",
+    "VertexCircuitBreaker",
+    "VertexCircuitOpenError",
+    "VertexRegionPool",
+    "check_vertex_circuit",
+    "get_region_pool",
+    "get_vertex_circuit",
+    "raise_if_vertex_circuit_open",
+    "record_vertex_outcome",
+    "vertex_region",
+]
@@ -0,0 +1,294 @@
+"""Opt-in request hedging for latency-sensitive Vertex AI calls.
+
+:func:`run_vertex_call` / :func:`arun_vertex_call` run one call under the model's
+permits (:mod:`app.utils.vertex_scheduler`) and, when a :class:`HedgingPolicy` is
+enabled for the operation, fire a second identical request once the first one
+outlives the latency percentile; the first result wins.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from typing import TypeVar
+
+from app.utils.quotas import LLM_CALLS
+from app.utils.vertex_health import record_vertex_outcome
+from app.utils.vertex_scheduler import (
+    DEFAULT_MODEL,
+    alimit_vertex_concurrency,
+    charge_vertex_call_quota,
+    limit_vertex_concurrency,
+)
+
+try:  # pragma: no cover - optional dependency during tests
+    from app.utils.metrics import record_vertex_hedge
+except Exception:  # pragma: no cover
+    def record_vertex_hedge(_model: str, _operation: str, _outcome: str) -> None:  # type: ignore[override]
+        return
+
+_T = TypeVar("_T")
+
+# Hedging (opt-in): segunda chamada idêntica quando a primeira passa do percentil.
+_HEDGING_ENABLED = os.getenv("VERTEX_HEDGING_ENABLED", "false").lower() == "true"
+_HEDGE_MODELS = frozenset(
+    item.strip() for item in os.getenv("VERTEX_HEDGE_MODELS", "gemini-2.5-flash").split(",") if item.strip()
+)
+_HEDGE_PERCENTILE = min(99.9, max(50.0, float(os.getenv("VERTEX_HEDGE_PERCENTILE", "95"))))
+_HEDGE_BUDGET = min(1.0, max(0.0, float(os.getenv("VERTEX_HEDGE_BUDGET", "0.1"))))
+_HEDGE_WINDOW = max(10, int(os.getenv("VERTEX_HEDGE_WINDOW", "200")))
+_HEDGE_MIN_SAMPLES = max(1, int(os.getenv("VERTEX_HEDGE_MIN_SAMPLES", "20")))
+_HEDGE_MIN_DELAY = max(0.0, float(os.getenv("VERTEX_HEDGE_MIN_DELAY", "0.25")))
+
+
+class HedgingPolicy:
+    """Latency-percentile hedging with a budget, for one (model, operation) pair.
+
+    Once ``min_samples`` latencies were observed, a call still running after the
+    ``percentile`` of the last ``window`` latencies gets a second identical request;
+    the first result wins. Over the last ``window`` calls at most ``budget`` of them
+    may be hedged.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        percentile: float = _HEDGE_PERCENTILE,
+        window: int = _HEDGE_WINDOW,
+        min_samples: int = _HEDGE_MIN_SAMPLES,
+        budget: float = _HEDGE_BUDGET,
+        min_delay: float = _HEDGE_MIN_DELAY,
+    ) -> None:
+        self.name = name
+        self.percentile = percentile
+        self.window = max(1, window)
+        self.min_samples = max(1, min_samples)
+        self.budget = budget
+        self.min_delay = min_delay
+        self._lock = threading.Lock()
+        self._latencies: deque[float] = deque(maxlen=self.window)
+        self._calls = 0
+        self._hedged_calls: deque[int] = deque()
+
+    def observe(self, latency: float) -> None:
+        with self._lock:
+            self._latencies.append(latency)
+
+    def begin_call(self) -> int:
+        with self._lock:
+            self._calls += 1
+            return self._calls
+
+    def hedge_delay(self) -> float | None:
+        """Deadline after which a call is hedged, or ``None`` while there is too little data."""
+
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        rank = min(len(ordered) - 1, round(self.percentile / 100.0 * (len(ordered) - 1)))
+        return max(self.min_delay, ordered[rank])
+
+    def try_hedge(self, call_id: int) -> bool:
+        with self._lock:
+            horizon = self._calls - self.window
+            while self._hedged_calls and self._hedged_calls[0] <= horizon:
+                self._hedged_calls.popleft()
+            allowed = self.budget * min(self._calls, self.window)
+            if len(self._hedged_calls) + 1 > allowed:
+                return False
+            self._hedged_calls.append(call_id)
+            return True
+
+    def stats(self) -> dict[str, float | int | None]:
+        with self._lock:
+            calls, hedged = self._calls, len(self._hedged_calls)
+        return {"calls": calls, "hedged_in_window": hedged, "delay": self.hedge_delay()}
+
+
+_hedging_policies: dict[str, HedgingPolicy] = {}
+_hedging_lock = threading.Lock()
+
+
+def get_hedging_policy(model: str | None, operation: str | None) -> HedgingPolicy | None:
+    """Return the policy for ``operation`` on ``model``, or ``None`` when hedging does not apply."""
+
+    key_model = model or DEFAULT_MODEL
+    if not operation or not _HEDGING_ENABLED or key_model not in _HEDGE_MODELS:
+        return None
+    key = f"{key_model}:{operation}"
+    with _hedging_lock:
+        policy = _hedging_policies.get(key)
+        if policy is None:
+            policy = HedgingPolicy(key)
+            _hedging_policies[key] = policy
+        return policy
+
+
+def _observe_latency(policy: HedgingPolicy | None, started: float) -> None:
+    if policy is not None:
+        policy.observe(time.monotonic() - started)
+
+
+def _run_once(func: Callable[[], _T], model: str | None, policy: HedgingPolicy | None) -> _T:
+    with limit_vertex_concurrency(model, quota=None):
+        started = time.monotonic()
+        try:
+            result = func()
+        except Exception as exc:
+            record_vertex_outcome(model, exc)
+            raise
+    record_vertex_outcome(model)
+    _observe_latency(policy, started)
+    return result
+
+
+async def _arun_once(
+    func: Callable[[], Awaitable[_T]], model: str | None, policy: HedgingPolicy | None
+) -> _T:
+    async with alimit_vertex_concurrency(model, quota=None):
+        started = time.monotonic()
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            # Perdedor de um hedge: a latência real é ao menos o tempo decorrido.
+            _observe_latency(policy, started)
+            raise
+        except Exception as exc:
+            record_vertex_outcome(model, exc)
+            raise
+    record_vertex_outcome(model)
+    _observe_latency(policy, started)
+    return result
+
+
+_hedge_executor: concurrent.futures.ThreadPoolExecutor | None = None
+_hedge_executor_lock = threading.Lock()
+
+
+def _get_hedge_executor() -> concurrent.futures.ThreadPoolExecutor:
+    global _hedge_executor
+    with _hedge_executor_lock:
+        if _hedge_executor is None:
+            _hedge_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=int(os.getenv("VERTEX_HEDGE_THREADS", "8")),
+                thread_name_prefix="vertex-hedge",
+            )
+        return _hedge_executor
+
+
+def run_vertex_call(
+    func: Callable[[], _T],
+    *,
+    model: str | None = None,
+    hedge: str | None = None,
+    quota: str | None = LLM_CALLS,
+) -> _T:
+    """One Vertex call (no retries) under permits and, if ``hedge`` applies, hedging.
+
+    ``hedge`` names the latency class (e.g. ``"adk"``); only idempotent calls
+    should pass it. Hedging needs a helper thread for the sync path, since the
+    caller's thread cannot be interrupted. ``quota`` is charged once, whether or
+    not the call is hedged (``None`` when the caller already charged it).
+    """
+
+    if quota is not None:
+        charge_vertex_call_quota(quota)
+    policy = get_hedging_policy(model, hedge)
+    delay = policy.hedge_delay() if policy is not None else None
+    if policy is None or delay is None:
+        if policy is not None:
+            policy.begin_call()
+        return _run_once(func, model, policy)
+
+    call_id = policy.begin_call()
+    executor = _get_hedge_executor()
+    primary = executor.submit(contextvars.copy_context().run, _run_once, func, model, policy)
+    try:
+        return primary.result(timeout=delay)
+    except concurrent.futures.TimeoutError:
+        pass
+    if not policy.try_hedge(call_id):
+        return primary.result()
+    record_vertex_hedge(model or DEFAULT_MODEL, hedge or "", "issued")
+    secondary = executor.submit(contextvars.copy_context().run, _run_once, func, model, policy)
+    pending = {primary, secondary}
+    first_error: BaseException | None = None
+    while pending:
+        done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            error = future.exception()
+            if error is None:
+                if future is secondary:
+                    record_vertex_hedge(model or DEFAULT_MODEL, hedge or "", "won")
+                return future.result()
+            first_error = first_error or error
+    assert first_error is not None
+    raise first_error
+
+
+async def arun_vertex_call(
+    func: Callable[[], Awaitable[_T]],
+    *,
+    model: str | None = None,
+    hedge: str | None = None,
+    quota: str | None = LLM_CALLS,
+) -> _T:
+    """Async :func:`run_vertex_call`; the losing request is cancelled.
+
+    Only pass ``hedge`` for natively async calls, where cancelling the task stops
+    the request. A cancelled ``asyncio.to_thread`` keeps running in its thread
+    after the permit is released, so thread-backed calls must not be hedged.
+    """
+
+    if quota is not None:
+        charge_vertex_call_quota(quota)
+    policy = get_hedging_policy(model, hedge)
+    delay = policy.hedge_delay() if policy is not None else None
+    if policy is None or delay is None:
+        if policy is not None:
+            policy.begin_call()
+        return await _arun_once(func, model, policy)
+
+    call_id = policy.begin_call()
+    primary = asyncio.ensure_future(_arun_once(func, model, policy))
+    tasks = [primary]
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done or not policy.try_hedge(call_id):
+            return await primary
+        record_vertex_hedge(model or DEFAULT_MODEL, hedge or "", "issued")
+        secondary = asyncio.ensure_future(_arun_once(func, model, policy))
+        tasks.append(secondary)
+        pending = set(tasks)
+        first_error: BaseException | None = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                error = task.exception()
+                if error is None:
+                    if task is secondary:
+                        record_vertex_hedge(model or DEFAULT_MODEL, hedge or "", "won")
+                    return task.result()
+                first_error = first_error or error
+        assert first_error is not None
+        raise first_error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+__all__ = [
+    "HedgingPolicy",
+    "arun_vertex_call",
+    "get_hedging_policy",
+    "run_vertex_call",
+]
@@ -1,22 +1,63 @@
+"""Retry loop for Vertex AI calls, composed from the scheduling and health layers.
+
+- :mod:`app.utils.vertex_errors`: retryable/throttle classification of errors.
+- :mod:`app.utils.vertex_scheduler`: per-model permit pool, AIMD limiter, priorities.
+- :mod:`app.utils.vertex_health`: circuit breaker and region pool.
+- :mod:`app.utils.vertex_hedging`: opt-in hedged execution of one attempt.
+
+The public names of those modules are re-exported here, so callers keep importing
+from ``app.utils.vertex_retry``.
+"""
+
 from __future__ import annotations
 
+import asyncio
 import logging
 import os
 import random
-import threading
 import time
-from contextlib import contextmanager
-from typing import Callable, Iterable, Optional, TypeVar
-
-try:  # pragma: no cover - optional dependency during tests
-    from google.api_core import exceptions as gcloud_exceptions
-except Exception:  # pragma: no cover
-    gcloud_exceptions = None
+from collections.abc import Awaitable, Callable
+from typing import Optional, TypeVar
 
-try:  # pragma: no cover - optional dependency during tests
-    from google.genai.errors import ClientError as GenAiClientError
-except Exception:  # pragma: no cover
-    GenAiClientError = None
+from app.utils.vertex_errors import (
+    VertexRetryExceededError,
+    extract_retry_after,
+    extract_status_code,
+    is_retryable_error,
+    is_vertex_failover_error,
+)
+from app.utils.vertex_health import (
+    VertexCircuitBreaker,
+    VertexCircuitOpenError,
+    VertexRegionPool,
+    _current_region,
+    check_vertex_circuit,
+    get_region_pool,
+    get_vertex_circuit,
+    raise_if_vertex_circuit_open,
+    record_vertex_outcome,
+    vertex_region,
+)
+from app.utils.vertex_hedging import (
+    HedgingPolicy,
+    arun_vertex_call,
+    get_hedging_policy,
+    run_vertex_call,
+)
+from app.utils.vertex_scheduler import (
+    DEFAULT_MODEL,
+    KNOWN_MODELS,
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_NORMAL,
+    AdaptiveConcurrencyLimiter,
+    alimit_vertex_concurrency,
+    charge_vertex_call_quota,
+    get_vertex_limiter,
+    limit_vertex_concurrency,
+    set_vertex_call_context,
+    vertex_call_context,
+)
 
 try:  # pragma: no cover - optional dependency during tests
     from app.utils.metrics import record_vertex_429
@@ -35,80 +76,87 @@ _DEFAULT_MAX_BACKOFF = float(os.getenv("VERTEX_RETRY_MAX_BACKOFF", "30.0"))
 _DEFAULT_BACKOFF_MULTIPLIER = float(os.getenv("VERTEX_RETRY_BACKOFF_MULTIPLIER", "2.0"))
 _DEFAULT_JITTER = float(os.getenv("VERTEX_RETRY_JITTER", "1.5"))
 
-_CONCURRENCY_LIMIT = max(1, int(os.getenv("VERTEX_CONCURRENCY_LIMIT", "3")))
-_semaphore = threading.Semaphore(_CONCURRENCY_LIMIT)
-
-
-class VertexRetryExceededError(RuntimeError):
-    """Raised when retry attempts are exhausted while calling Vertex AI."""
-
-    def __init__(self, message: str, *, attempts: int, last_exception: BaseException, retry_after: float | None) -> None:
-        super().__init__(message)
-        self.attempts = attempts
-        self.last_exception = last_exception
-        self.retry_after = retry_after
-
-
-def _extract_status_code(exc: BaseException) -> int | None:
-    for attr in ("code", "status_code", "http_status", "status"):  # pragma: no branch - tiny loop
-        value = getattr(exc, attr, None)
-        if isinstance(value, int):
-            return value
-        if hasattr(value, "value") and isinstance(value.value, int):
-            return value.value
-    return None
-
-
-def _extract_retry_after(exc: BaseException) -> float | None:
-    header = None
-    for candidate in ("retry_after", "Retry-After", "retry-after"):
-        if hasattr(exc, candidate):
-            header = getattr(exc, candidate)
-            break
-    response = getattr(exc, "response", None)
-    if response is not None:
-        headers = getattr(response, "headers", None)
-        if headers and isinstance(headers, dict):
-            header = header or headers.get("Retry-After") or headers.get("retry-after")
-    if header is None:
-        return None
-    try:
-        if isinstance(header, (int, float)):
-            return float(header)
-        return float(str(header))
-    except (TypeError, ValueError):
-        return None
-
-
-def _is_retryable_exception(exc: BaseException) -> bool:
-    status = _extract_status_code(exc)
-    if status in {408, 429, 500, 503}:
-        return True
-    if gcloud_exceptions and isinstance(exc, gcloud_exceptions.ResourceExhausted):
-        return True
-    if gcloud_exceptions and isinstance(exc, gcloud_exceptions.TooManyRequests):
-        return True
-    if gcloud_exceptions and isinstance(exc, gcloud_exceptions.ServiceUnavailable):
-        return True
-    if GenAiClientError and isinstance(exc, GenAiClientError):
-        if status is None:
-            return True
-        return status in {408, 429, 500, 503}
-    return False
 
+def _retry_delay(
+    exc: BaseException,
+    attempts: int,
+    *,
+    initial_backoff: float,
+    max_backoff: float,
+    multiplier: float,
+    jitter: float,
+) -> tuple[float, float | None]:
+    retry_after_hint = extract_retry_after(exc)
+    delay = min(max_backoff, initial_backoff * (multiplier ** (attempts - 1)))
+    if retry_after_hint:
+        delay = max(delay, retry_after_hint)
+    delay += random.uniform(0, jitter)
+    return delay, retry_after_hint
 
-@contextmanager
-def limit_vertex_concurrency() -> Iterable[None]:
-    _semaphore.acquire()
-    try:
-        yield
-    finally:
-        _semaphore.release()
+
+def _log_retry(
+    log: logging.Logger,
+    exc: BaseException,
+    *,
+    attempts: int,
+    max_attempts: int,
+    retry_after_hint: float | None,
+    delay: float,
+) -> None:
+    status_code = extract_status_code(exc)
+    if status_code == 429:
+        try:
+            record_vertex_429({"stage": "storybrand_langextract"})
+        except Exception:  # pragma: no cover - metrics backend failure
+            logger.debug("Failed to record vertex429 metric", exc_info=True)
+
+    log.warning(
+        "vertex_call_retry",
+        extra={
+            "attempt": attempts,
+            "max_attempts": max_attempts,
+            "retry_after": retry_after_hint,
+            "delay": round(delay, 2),
+            "status_code": status_code,
+            "exception": exc.__class__.__name__,
+        },
+    )
+
+
+def record_region_failure(
+    regions: VertexRegionPool,
+    region: str,
+    exc: BaseException,
+    tried: set[str],
+    *,
+    attempts: int,
+    logger_obj: logging.Logger | None = None,
+) -> bool:
+    """Record a regional failure; ``True`` when the next attempt should go elsewhere now.
+
+    The attempt still counts toward the backoff, so it keeps growing from where it
+    was once every region has been tried in the current round. Callers do not count
+    it toward ``max_attempts``: a single-attempt call still tries a fresh region.
+    """
+
+    if not is_vertex_failover_error(exc):
+        return False
+    regions.record_failure(region, extract_retry_after(exc))
+    if regions.has_alternative(tried):
+        (logger_obj or logger).warning(
+            "vertex_region_failover",
+            extra={"from_region": region, "attempt": attempts, "exception": exc.__class__.__name__},
+        )
+        return True
+    tried.clear()  # nova rodada: todas as regiões voltam a ser candidatas após o backoff
+    return False
 
 
 def call_with_vertex_retry(
     func: Callable[[], _T],
     *,
+    model: str | None = None,
+    hedge: str | None = None,
     logger_obj: logging.Logger | None = None,
     max_attempts: int = _DEFAULT_MAX_ATTEMPTS,
     initial_backoff: float = _DEFAULT_INITIAL_BACKOFF,
@@ -116,49 +164,175 @@ def call_with_vertex_retry(
     multiplier: float = _DEFAULT_BACKOFF_MULTIPLIER,
     jitter: float = _DEFAULT_JITTER,
 ) -> _T:
-    """Execute ``func`` applying exponential backoff when Vertex AI throttles the request."""
+    """Execute ``func`` applying exponential backoff when Vertex AI throttles the request.
 
+    ``hedge`` opts the call into latency hedging (see :func:`run_vertex_call`).
+    The caller's ``LLM_CALLS`` quota is charged once for the whole retry ladder.
+    """
+
+    charge_vertex_call_quota()
     attempts = 0
     last_exception: Optional[BaseException] = None
     retry_after_hint: float | None = None
     log = logger_obj or logger
+    regions = get_region_pool(model)
+    tried: set[str] = set()
+    failovers = 0  # trocas imediatas de região não consomem max_attempts
 
-    while attempts < max_attempts:
+    while attempts - failovers < max_attempts:
+        check_vertex_circuit(model, attempts=attempts, last_exception=last_exception)
         attempts += 1
+        region = regions.choose(exclude=tried)
+        tried.add(region)
+        token = _current_region.set(region)
+        started = time.monotonic()
         try:
-            with limit_vertex_concurrency():
-                return func()
+            result = run_vertex_call(func, model=model, hedge=hedge, quota=None)
+            regions.record_success(region, time.monotonic() - started)
+            return result
         except Exception as exc:  # broad catch on purpose for retryable errors
             last_exception = exc
-            if not _is_retryable_exception(exc):
+            if not is_retryable_error(exc):
                 raise
+            # Circuito aberto: falha rápida em vez de percorrer o resto da escada de backoff.
+            raise_if_vertex_circuit_open(model, attempts=attempts, last_exception=exc)
+            if record_region_failure(
+                regions, region, exc, tried, attempts=attempts, logger_obj=log
+            ):
+                failovers += 1
+                continue
 
-            retry_after_hint = _extract_retry_after(exc)
-            delay = min(max_backoff, initial_backoff * (multiplier ** (attempts - 1)))
-            if retry_after_hint:
-                delay = max(delay, retry_after_hint)
-            delay += random.uniform(0, jitter)
-
-            status_code = _extract_status_code(exc)
-            if status_code == 429:
-                try:
-                    record_vertex_429({"stage": "storybrand_langextract"})
-                except Exception:  # pragma: no cover - metrics backend failure
-                    logger.debug("Failed to record vertex429 metric", exc_info=True)
-
-            log.warning(
-                "vertex_call_retry",
-                extra={
-                    "attempt": attempts,
-                    "max_attempts": max_attempts,
-                    "retry_after": retry_after_hint,
-                    "delay": round(delay, 2),
-                    "status_code": _extract_status_code(exc),
-                    "exception": exc.__class__.__name__,
-                },
+            delay, retry_after_hint = _retry_delay(
+                exc,
+                attempts,
+                initial_backoff=initial_backoff,
+                max_backoff=max_backoff,
+                multiplier=multiplier,
+                jitter=jitter,
+            )
+            _log_retry(
+                log,
+                exc,
+                attempts=attempts,
+                max_attempts=max_attempts,
+                retry_after_hint=retry_after_hint,
+                delay=delay,
             )
             time.sleep(delay)
+        finally:
+            _current_region.reset(token)
+
+    assert last_exception is not None  # for mypy/static type checking
+    message = "Vertex AI call failed after %s attempts" % attempts
+    raise VertexRetryExceededError(message, attempts=attempts, last_exception=last_exception, retry_after=retry_after_hint)
+
+
+async def acall_with_vertex_retry(
+    func: Callable[[], Awaitable[_T]],
+    *,
+    model: str | None = None,
+    hedge: str | None = None,
+    logger_obj: logging.Logger | None = None,
+    max_attempts: int = _DEFAULT_MAX_ATTEMPTS,
+    initial_backoff: float = _DEFAULT_INITIAL_BACKOFF,
+    max_backoff: float = _DEFAULT_MAX_BACKOFF,
+    multiplier: float = _DEFAULT_BACKOFF_MULTIPLIER,
+    jitter: float = _DEFAULT_JITTER,
+) -> _T:
+    """Async :func:`call_with_vertex_retry`: awaits permits and backoff without blocking the loop.
+
+    ``func`` returns a fresh awaitable per attempt (e.g. ``lambda: asyncio.to_thread(...)``).
+    Permits come from the same pool as the sync path, so the combined limit holds.
+    ``hedge`` is only safe for cancellable calls (see :func:`arun_vertex_call`).
+    The quota is charged once, as in the sync path.
+    """
+
+    charge_vertex_call_quota()
+    attempts = 0
+    last_exception: BaseException | None = None
+    retry_after_hint: float | None = None
+    log = logger_obj or logger
+    regions = get_region_pool(model)
+    tried: set[str] = set()
+    failovers = 0  # trocas imediatas de região não consomem max_attempts
+
+    while attempts - failovers < max_attempts:
+        check_vertex_circuit(model, attempts=attempts, last_exception=last_exception)
+        attempts += 1
+        region = regions.choose(exclude=tried)
+        tried.add(region)
+        token = _current_region.set(region)
+        started = time.monotonic()
+        try:
+            result = await arun_vertex_call(func, model=model, hedge=hedge, quota=None)
+            regions.record_success(region, time.monotonic() - started)
+            return result
+        except Exception as exc:  # broad catch on purpose for retryable errors
+            last_exception = exc
+            if not is_retryable_error(exc):
+                raise
+            # Circuito aberto: falha rápida em vez de percorrer o resto da escada de backoff.
+            raise_if_vertex_circuit_open(model, attempts=attempts, last_exception=exc)
+            if record_region_failure(
+                regions, region, exc, tried, attempts=attempts, logger_obj=log
+            ):
+                failovers += 1
+                continue
+
+            delay, retry_after_hint = _retry_delay(
+                exc,
+                attempts,
+                initial_backoff=initial_backoff,
+                max_backoff=max_backoff,
+                multiplier=multiplier,
+                jitter=jitter,
+            )
+            _log_retry(
+                log,
+                exc,
+                attempts=attempts,
+                max_attempts=max_attempts,
+                retry_after_hint=retry_after_hint,
+                delay=delay,
+            )
+            await asyncio.sleep(delay)
+        finally:
+            _current_region.reset(token)
 
     assert last_exception is not None  # for mypy/static type checking
     message = "Vertex AI call failed after %s attempts" % attempts
     raise VertexRetryExceededError(message, attempts=attempts, last_exception=last_exception, retry_after=retry_after_hint)
+
+
+__all__ = [
+    "DEFAULT_MODEL",
+    "KNOWN_MODELS",
+    "PRIORITY_BACKGROUND",
+    "PRIORITY_INTERACTIVE",
+    "PRIORITY_NORMAL",
+    "AdaptiveConcurrencyLimiter",
+    "HedgingPolicy",
+    "VertexCircuitBreaker",
+    "VertexCircuitOpenError",
+    "VertexRegionPool",
+    "VertexRetryExceededError",
+    "acall_with_vertex_retry",
+    "alimit_vertex_concurrency",
+    "arun_vertex_call",
+    "call_with_vertex_retry",
+    "charge_vertex_call_quota",
+    "check_vertex_circuit",
+    "get_hedging_policy",
+    "get_region_pool",
+    "get_vertex_circuit",
+    "get_vertex_limiter",
+    "is_vertex_failover_error",
+    "limit_vertex_concurrency",
+    "raise_if_vertex_circuit_open",
+    "record_region_failure",
+    "record_vertex_outcome",
+    "run_vertex_call",
+    "set_vertex_call_context",
+    "vertex_call_context",
+    "vertex_region",
+]
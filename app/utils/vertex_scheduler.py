@@ -0,0 +1,437 @@
+"""Per-model Vertex AI call scheduling: priority/fair permit queue and AIMD limits.
+
+Every model call (LangExtract, image generation and, with the LLM scheduler on,
+ADK agents) takes a permit from its model's :class:`_PermitPool`. Waiters are
+served by priority class and round-robin across users; the pool size follows
+an :class:`AdaptiveConcurrencyLimiter`. Calls are tagged with
+:func:`vertex_call_context`, which also decides whose quota is charged.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from collections.abc import AsyncIterator, Callable, Iterable
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+
+from app.utils.quotas import LLM_CALLS, charge_user_quota
+
+try:  # pragma: no cover - optional dependency during tests
+    from app.utils.metrics import (
+        record_llm_queue_depth,
+        record_llm_queue_wait,
+        record_vertex_permits,
+    )
+except Exception:  # pragma: no cover
+    def record_vertex_permits(_model: str, _permits: int) -> None:  # type: ignore[override]
+        return
+
+    def record_llm_queue_depth(_model: str, _priority: str, _depth: int) -> None:  # type: ignore[override]
+        return
+
+    def record_llm_queue_wait(_model: str, _priority: str, _seconds: float) -> None:  # type: ignore[override]
+        return
+
+
+logger = logging.getLogger(__name__)
+
+_CONCURRENCY_LIMIT = max(1, int(os.getenv("VERTEX_CONCURRENCY_LIMIT", "3")))
+
+# AIMD: +1 permissão por janela de sucessos, x fator em 429/RESOURCE_EXHAUSTED.
+_ADAPTIVE_ENABLED = os.getenv("VERTEX_ADAPTIVE_CONCURRENCY", "true").lower() == "true"
+_CONCURRENCY_MIN = max(1, int(os.getenv("VERTEX_CONCURRENCY_MIN", "1")))
+_CONCURRENCY_MAX = max(_CONCURRENCY_MIN, int(os.getenv("VERTEX_CONCURRENCY_MAX", "16")))
+_DECREASE_FACTOR = min(0.95, max(0.1, float(os.getenv("VERTEX_CONCURRENCY_DECREASE_FACTOR", "0.5"))))
+_DECREASE_COOLDOWN = float(os.getenv("VERTEX_CONCURRENCY_DECREASE_COOLDOWN", "5.0"))
+
+DEFAULT_MODEL = "gemini-2.5-flash"
+KNOWN_MODELS = ("gemini-2.5-pro", "gemini-2.5-flash", "gemini-2.5-flash-image")
+
+
+# Classes de prioridade: menor valor é atendido primeiro.
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_NORMAL = "normal"
+PRIORITY_BACKGROUND = "background"
+_PRIORITY_RANK = {PRIORITY_INTERACTIVE: 0, PRIORITY_NORMAL: 1, PRIORITY_BACKGROUND: 2}
+_ANONYMOUS_USER = "anonymous"
+
+_call_priority: ContextVar[str] = ContextVar("vertex_call_priority", default=PRIORITY_NORMAL)
+_call_user: ContextVar[str] = ContextVar("vertex_call_user", default=_ANONYMOUS_USER)
+
+
+def set_vertex_call_context(priority: str | None = None, user_id: str | None = None) -> None:
+    """Tag model calls made from the current context (and tasks/threads spawned from it)."""
+
+    if priority is not None:
+        if priority not in _PRIORITY_RANK:
+            raise ValueError(f"Unknown priority class: {priority!r}")
+        _call_priority.set(priority)
+    if user_id:
+        _call_user.set(str(user_id))
+
+
+@contextmanager
+def vertex_call_context(
+    priority: str | None = None, user_id: str | None = None
+) -> Iterable[None]:
+    """Scoped :func:`set_vertex_call_context`; restores the previous tags on exit."""
+
+    priority_token = _call_priority.set(_call_priority.get())
+    user_token = _call_user.set(_call_user.get())
+    try:
+        set_vertex_call_context(priority, user_id)
+        yield
+    finally:
+        _call_user.reset(user_token)
+        _call_priority.reset(priority_token)
+
+
+class _Waiter:
+    __slots__ = ("event", "future", "loop", "priority", "user")
+
+    def __init__(
+        self,
+        priority: str,
+        user: str,
+        *,
+        event: threading.Event | None = None,
+        loop: asyncio.AbstractEventLoop | None = None,
+        future: asyncio.Future[None] | None = None,
+    ) -> None:
+        self.priority = priority
+        self.user = user
+        self.event = event
+        self.loop = loop
+        self.future = future
+
+
+class _FairWaitQueue:
+    """Waiters grouped by priority class, round-robin across users within a class.
+
+    A user with many queued calls gets one turn per round, so a single long
+    pipeline cannot push other users' calls to the back of the line.
+    """
+
+    def __init__(self) -> None:
+        self._classes: dict[str, OrderedDict[str, deque[_Waiter]]] = {
+            name: OrderedDict() for name in sorted(_PRIORITY_RANK, key=_PRIORITY_RANK.get)
+        }
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def depth(self, priority: str) -> int:
+        return sum(len(items) for items in self._classes[priority].values())
+
+    def push(self, waiter: _Waiter) -> None:
+        users = self._classes[waiter.priority]
+        users.setdefault(waiter.user, deque()).append(waiter)
+        self._size += 1
+
+    def pop(self) -> _Waiter | None:
+        for users in self._classes.values():
+            if not users:
+                continue
+            user, items = next(iter(users.items()))
+            waiter = items.popleft()
+            if items:
+                users.move_to_end(user)
+            else:
+                del users[user]
+            self._size -= 1
+            return waiter
+        return None
+
+    def remove(self, waiter: _Waiter) -> bool:
+        users = self._classes[waiter.priority]
+        items = users.get(waiter.user)
+        if not items:
+            return False
+        try:
+            items.remove(waiter)
+        except ValueError:
+            return False
+        if not items:
+            del users[waiter.user]
+        self._size -= 1
+        return True
+
+
+class _PermitPool:
+    """Counting semaphore shared by threads and asyncio tasks.
+
+    Waiters are served by priority class (``interactive`` > ``normal`` >
+    ``background``) and round-robin across users inside a class, regardless of
+    kind; a released permit is handed to the next waiter directly, so neither side
+    can starve the other. Async waiters never block the event loop. The priority
+    class and user come from :func:`vertex_call_context`.
+    """
+
+    def __init__(self, limit: int, name: str = DEFAULT_MODEL) -> None:
+        self._limit = max(1, limit)
+        self._in_use = 0
+        self._lock = threading.Lock()
+        self.name = name
+        self._waiters = _FairWaitQueue()
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    @property
+    def in_use(self) -> int:
+        with self._lock:
+            return self._in_use
+
+    @property
+    def waiting(self) -> int:
+        with self._lock:
+            return len(self._waiters)
+
+    def acquire(self) -> None:
+        priority, user = _call_priority.get(), _call_user.get()
+        started = time.monotonic()
+        with self._lock:
+            if self._in_use < self._limit and not self._waiters:
+                self._in_use += 1
+                waiter = None
+            else:
+                waiter = _Waiter(priority, user, event=threading.Event())
+                self._enqueue_locked(waiter)
+        if waiter is not None:
+            waiter.event.wait()  # type: ignore[union-attr]
+        record_llm_queue_wait(self.name, priority, time.monotonic() - started)
+
+    async def acquire_async(self) -> None:
+        priority, user = _call_priority.get(), _call_user.get()
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._in_use < self._limit and not self._waiters:
+                self._in_use += 1
+                record_llm_queue_wait(self.name, priority, 0.0)
+                return
+            future: asyncio.Future[None] = loop.create_future()
+            waiter = _Waiter(priority, user, loop=loop, future=future)
+            self._enqueue_locked(waiter)
+        try:
+            await future
+        except BaseException:
+            with self._lock:
+                granted = not self._waiters.remove(waiter)
+                if not granted:
+                    self._report_depth_locked(priority)
+            # Cancelado depois de receber a permissão: devolve ao pool. Se a
+            # entrega ainda não tinha chegado, ``_deliver`` faz a devolução.
+            if granted and future.done() and not future.cancelled():
+                self.release()
+            raise
+        record_llm_queue_wait(self.name, priority, time.monotonic() - started)
+
+    def set_limit(self, limit: int) -> None:
+        """Resize the pool; extra permits go to waiters, excess ones drain on release."""
+
+        with self._lock:
+            self._limit = max(1, limit)
+            while self._in_use < self._limit and self._grant_next_locked():
+                self._in_use += 1
+
+    def release(self) -> None:
+        with self._lock:
+            if self._in_use <= self._limit and self._grant_next_locked():
+                return  # permissão repassada diretamente ao próximo da fila
+            self._in_use = max(0, self._in_use - 1)
+
+    def _enqueue_locked(self, waiter: _Waiter) -> None:
+        self._waiters.push(waiter)
+        self._report_depth_locked(waiter.priority)
+
+    def _report_depth_locked(self, priority: str) -> None:
+        record_llm_queue_depth(self.name, priority, self._waiters.depth(priority))
+
+    def _grant_next_locked(self) -> bool:
+        while True:
+            waiter = self._waiters.pop()
+            if waiter is None:
+                return False
+            self._report_depth_locked(waiter.priority)
+            if waiter.event is not None:
+                waiter.event.set()
+                return True
+            if waiter.future.done():  # type: ignore[union-attr]
+                continue
+            try:
+                waiter.loop.call_soon_threadsafe(self._deliver, waiter.future)  # type: ignore[union-attr]
+            except RuntimeError:  # loop fechado; tenta o próximo
+                continue
+            return True
+
+    def _deliver(self, future: asyncio.Future[None]) -> None:
+        if future.done():
+            self.release()
+        else:
+            future.set_result(None)
+
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD permit control for one model, backed by a shared :class:`_PermitPool`.
+
+    Each success grows the window by ``1/window`` (about one permit per window of
+    successful calls); a throttle multiplies it by ``decrease_factor``. Throttles
+    within ``cooldown`` seconds of the last decrease are treated as the same event.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        *,
+        initial: int,
+        minimum: int = _CONCURRENCY_MIN,
+        maximum: int = _CONCURRENCY_MAX,
+        decrease_factor: float = _DECREASE_FACTOR,
+        cooldown: float = _DECREASE_COOLDOWN,
+        adaptive: bool = _ADAPTIVE_ENABLED,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.model = model
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.adaptive = adaptive
+        self._clock = clock
+        self._window = float(min(self.maximum, max(self.minimum, initial)))
+        self._last_decrease: float | None = None
+        self._lock = threading.Lock()
+        self.pool = _PermitPool(int(self._window), name=model)
+        record_vertex_permits(model, self.pool.limit)
+
+    @property
+    def limit(self) -> int:
+        return self.pool.limit
+
+    def on_success(self) -> None:
+        if not self.adaptive:
+            return
+        with self._lock:
+            self._window = min(float(self.maximum), self._window + 1.0 / self._window)
+            self._apply_locked()
+
+    def on_throttle(self) -> None:
+        if not self.adaptive:
+            return
+        with self._lock:
+            now = self._clock()
+            if self._last_decrease is not None and now - self._last_decrease < self.cooldown:
+                return
+            self._last_decrease = now
+            self._window = max(float(self.minimum), self._window * self.decrease_factor)
+            self._apply_locked()
+
+    def _apply_locked(self) -> None:
+        limit = int(self._window)
+        if limit != self.pool.limit:
+            self.pool.set_limit(limit)
+            record_vertex_permits(self.model, limit)
+            logger.info(
+                "vertex_concurrency_adjusted",
+                extra={"model": self.model, "permits": limit},
+            )
+
+
+def _initial_limit(model: str, default: int | None = None) -> int:
+    override = os.getenv("VERTEX_CONCURRENCY_LIMIT_" + re.sub(r"[^A-Z0-9]", "_", model.upper()))
+    if override:
+        return max(1, int(override))
+    return max(1, default) if default else _CONCURRENCY_LIMIT
+
+
+_limiters: dict[str, AdaptiveConcurrencyLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_vertex_limiter(
+    model: str | None = None, *, initial: int | None = None
+) -> AdaptiveConcurrencyLimiter:
+    """Return the per-model limiter, created on first use.
+
+    ``initial`` only seeds a new limiter; ``VERTEX_CONCURRENCY_LIMIT_<MODEL>`` wins over it.
+    """
+
+    key = model or DEFAULT_MODEL
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            start = _initial_limit(key, default=initial)
+            limiter = AdaptiveConcurrencyLimiter(key, initial=start)
+            _limiters[key] = limiter
+        return limiter
+
+
+
+def charge_vertex_call_quota(quota: str = LLM_CALLS) -> None:
+    """Charge one logical call to the user tagged by :func:`vertex_call_context`.
+
+    Raises :class:`app.utils.quotas.QuotaExceededError` when no budget is left.
+    Retry loops charge once up front, so retries and hedges are not billed again.
+    """
+
+    charge_user_quota(_call_user.get(), quota)
+
+
+@contextmanager
+def limit_vertex_concurrency(
+    model: str | None = None, *, quota: str | None = LLM_CALLS
+) -> Iterable[None]:
+    """Hold a permit of ``model``'s pool, after charging the caller's ``quota``.
+
+    Raises :class:`app.utils.quotas.QuotaExceededError` (before queueing) when the
+    user tagged by :func:`vertex_call_context` has no budget left.
+    """
+
+    if quota is not None:
+        charge_vertex_call_quota(quota)
+    pool = get_vertex_limiter(model).pool
+    pool.acquire()
+    try:
+        yield
+    finally:
+        pool.release()
+
+
+@asynccontextmanager
+async def alimit_vertex_concurrency(
+    model: str | None = None, *, quota: str | None = LLM_CALLS
+) -> AsyncIterator[None]:
+    """Async counterpart of :func:`limit_vertex_concurrency` (same permit pool)."""
+
+    if quota is not None:
+        charge_vertex_call_quota(quota)
+    pool = get_vertex_limiter(model).pool
+    await pool.acquire_async()
+    try:
+        yield
+    finally:
+        pool.release()
+
+__all__ = [
+    "DEFAULT_MODEL",
+    "KNOWN_MODELS",
+    "PRIORITY_BACKGROUND",
+    "PRIORITY_INTERACTIVE",
+    "PRIORITY_NORMAL",
+    "AdaptiveConcurrencyLimiter",
+    "alimit_vertex_concurrency",
+    "charge_vertex_call_quota",
+    "get_vertex_limiter",
+    "limit_vertex_concurrency",
+    "set_vertex_call_context",
+    "vertex_call_context",
+]
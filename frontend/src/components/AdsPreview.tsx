@@ -42,6 +42,7 @@ interface ImageCarouselProps {
   ctaText?: string;
   ctaInstagram?: string;
   companyLabel?: string;
+  imagesSkipped?: boolean;
 }
 
 const VARIATION_TAB_CLASS = "rounded-lg data-[state=active]:bg-card/80 data-[state=active]:text-foreground";
@@ -90,10 +91,17 @@ function buildCopy(raw: unknown): CopyInfo {
 function buildVisual(raw: unknown): VisualInfo {
   const visual = isRecord(raw) ? raw : {};
 
-  // URLs individuais vindas do backend (quando não houver visual.images)
-  const urlAtual = coerceString((visual as any).image_estado_atual_url);
-  const urlInter = coerceString((visual as any).image_estado_intermediario_url);
-  const urlAsp = coerceString((visual as any).image_estado_aspiracional_url);
+  // URLs individuais vindas do backend (quando não houver visual.images).
+  // Prefere o preview WebP comprimido; cai para o PNG original se ausente.
+  const urlAtual =
+    coerceString((visual as any).image_estado_atual_preview_url) ||
+    coerceString((visual as any).image_estado_atual_url);
+  const urlInter =
+    coerceString((visual as any).image_estado_intermediario_preview_url) ||
+    coerceString((visual as any).image_estado_intermediario_url);
+  const urlAsp =
+    coerceString((visual as any).image_estado_aspiracional_preview_url) ||
+    coerceString((visual as any).image_estado_aspiracional_url);
   const imagesFromFields = [urlAtual, urlInter, urlAsp].filter(
     (u) => typeof u === "string" && u.length > 0,
   );
@@ -109,6 +117,7 @@ function buildVisual(raw: unknown): VisualInfo {
     prompt_estado_aspiracional: coerceString(visual.prompt_estado_aspiracional),
     aspect_ratio: coerceAspectRatio(visual.aspect_ratio),
     images: finalImages,
+    image_generation_skipped: coerceString(visual.image_generation_skipped) || undefined,
   };
 }
 
@@ -218,6 +227,7 @@ function ImageCarousel({
   ctaText,
   ctaInstagram,
   companyLabel,
+  imagesSkipped = false,
 }: ImageCarouselProps) {
   const hasImages = images.length > 0;
   const totalSlides = Math.max(prompts.length, hasImages ? images.length : 1);
@@ -325,6 +335,11 @@ function ImageCarousel({
             <p className="text-sm text-muted-foreground/90 whitespace-pre-line">
               {activePrompt?.text || "As imagens finais ainda não estão disponíveis. Utilize os prompts como referência visual."}
             </p>
+            {imagesSkipped && (
+              <p className="text-xs text-muted-foreground/80">
+                Imagens não geradas para esta variação: orçamento da sessão atingido.
+              </p>
+            )}
           </div>
         )}
         {!hasImages && (
@@ -442,16 +457,12 @@ function getVariationImages(variation?: AdVariation): string[] {
 
   // Fallback: procura campos individuais de URL (formato atual do backend)
   // Ordem mantida: estado_atual → estado_intermediario → estado_aspiracional
-  if (visual.image_estado_atual_url) {
-    images.push(visual.image_estado_atual_url);
-  }
-
-  if (visual.image_estado_intermediario_url) {
-    images.push(visual.image_estado_intermediario_url);
-  }
-
-  if (visual.image_estado_aspiracional_url) {
-    images.push(visual.image_estado_aspiracional_url);
+  // Preview comprimido quando disponível; senão, o PNG original.
+  for (const stage of ["estado_atual", "estado_intermediario", "estado_aspiracional"]) {
+    const url = visual[`image_${stage}_preview_url`] || visual[`image_${stage}_url`];
+    if (url) {
+      images.push(url);
+    }
   }
 
   return images;
@@ -602,6 +613,7 @@ export function AdsPreview({ userId, sessionId, isOpen, onClose }: AdsPreviewPro
         ctaText={activeVariation.copy.cta_texto}
         ctaInstagram={activeVariation.cta_instagram}
         companyLabel={companyLabel}
+        imagesSkipped={Boolean(activeVariation.visual.image_generation_skipped)}
       />
       <Card className="rounded-2xl border border-border/60 bg-card/80 shadow-sm">
         <CardContent className="space-y-4 py-6">
@@ -647,6 +659,7 @@ export function AdsPreview({ userId, sessionId, isOpen, onClose }: AdsPreviewPro
           ctaText={activeVariation.copy.cta_texto}
           ctaInstagram={activeVariation.cta_instagram}
           companyLabel={companyLabel}
+          imagesSkipped={Boolean(activeVariation.visual.image_generation_skipped)}
         />
         <div className="pointer-events-none absolute inset-0">
           <div className="flex justify-center">
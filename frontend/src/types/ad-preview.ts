@@ -9,6 +9,8 @@ export interface VisualInfo {
   prompt_estado_aspiracional: string;
   aspect_ratio: AspectRatio;
   images: string[];
+  // Motivo quando a geração foi pulada de propósito (ex.: "session_budget").
+  image_generation_skipped?: string;
 }
 
 export interface CopyInfo {
@@ -23,11 +23,16 @@ Saída padrão: {
 from __future__ import annotations
 
 from typing import Any, Dict, List, Optional
+import copy
+import hashlib
 import os
 import re
 import logging
+import threading
 
 from app.config import config
+from app.utils.single_flight import get_single_flight
+from app.utils.vertex_retry import call_with_vertex_retry, vertex_region
 
 try:
     import langextract as lx
@@ -87,6 +92,8 @@ class UserInputExtractor:
 
         # Prompt para extração dos campos mínimos
         self.prompt = base_prompt
+        # Few-shots montados uma vez; a instância é compartilhada via get_user_input_extractor().
+        self.examples = self._examples()
 
     def _examples(self) -> List[lx.data.ExampleData]:
         examples: List[lx.data.ExampleData] = []
@@ -386,25 +393,32 @@ class UserInputExtractor:
                 self.project,
                 self.location,
                 len(raw_text or ""),
-                len(self._examples()),
+                len(self.examples),
             )
         except Exception:
             pass
-        result = lx.extract(
-            text_or_documents=raw_text,
-            prompt_description=self.prompt,
-            examples=self._examples(),
-            model_id=self.model_id,
-            extraction_passes=1,
-            max_workers=4,
-            max_char_buffer=1800,
-            use_schema_constraints=True,
-            fence_output=False,
-            language_model_params={
-                "vertexai": True,
-                "project": self.project,
-                "location": self.location,
-            },
+        # Mesma fila por modelo do pipeline; o /run_preflight marca a chamada como interativa.
+        # Sem novas tentativas (o usuário está esperando). Sem hedging: lx.extract roda
+        # numa thread e a chamada perdedora não pode ser cancelada.
+        result = call_with_vertex_retry(
+            lambda: lx.extract(
+                text_or_documents=raw_text,
+                prompt_description=self.prompt,
+                examples=self.examples,
+                model_id=self.model_id,
+                extraction_passes=1,
+                max_workers=4,
+                max_char_buffer=1800,
+                use_schema_constraints=True,
+                fence_output=False,
+                language_model_params={
+                    "vertexai": True,
+                    "project": self.project,
+                    "location": vertex_region(self.location),
+                },
+            ),
+            model=self.model_id,
+            max_attempts=1,
         )
         converted = self._convert(result)
         try:
@@ -742,6 +756,50 @@ class UserInputExtractor:
         return None
 
 
+_extractors: dict[tuple, UserInputExtractor] = {}
+_extractors_lock = threading.Lock()
+
+
+def _extractor_key(model_id: str) -> tuple:
+    return (
+        model_id,
+        config.enable_new_input_fields,
+        config.preflight_shadow_mode,
+        os.getenv("GOOGLE_CLOUD_PROJECT"),
+        os.getenv("GOOGLE_CLOUD_LOCATION", "us-central1"),
+    )
+
+
+def make_preflight_flight_key(model_id: str, text: str) -> tuple:
+    """Single-flight key for a preflight extraction.
+
+    Includes the same flags as the extractor cache, so requests that would be served
+    by different extractor configurations never share a result.
+    """
+
+    return (*_extractor_key(model_id), hashlib.sha256(text.encode("utf-8")).hexdigest())
+
+
+def get_user_input_extractor(model_id: str = "gemini-2.5-flash") -> UserInputExtractor:
+    """Process-wide extractor for the current flags and Vertex project/location.
+
+    Prompt and few-shot examples are built once per configuration; the instance is
+    read-only after construction, so threads can share it.
+    """
+
+    key = _extractor_key(model_id)
+    with _extractors_lock:
+        extractor = _extractors.get(key)
+        if extractor is None:
+            extractor = UserInputExtractor(model_id)
+            _extractors[key] = extractor
+        return extractor
+
+
 def extract_user_input(raw_text: str) -> Dict[str, Any]:
-    extractor = UserInputExtractor()
-    return extractor.extract(raw_text or "")
+    extractor = get_user_input_extractor()
+    text = raw_text or ""
+    # Envios duplicados (duplo clique, retry do frontend) aguardam a mesma extração.
+    flight_key = make_preflight_flight_key(extractor.model_id, text)
+    result = get_single_flight("preflight").do(flight_key, lambda: extractor.extract(text))
+    return copy.deepcopy(result)
@@ -0,0 +1,57 @@
+"""Per-request setup cost of the LangExtract extractors: fresh instance vs. shared registry.
+
+``/run_preflight`` used to build a ``UserInputExtractor`` (prompt + few-shot
+examples, twice) and the landing page stage a ``StoryBrandExtractor`` for every
+request. Both now come from process-level registries. The model call is not
+part of this benchmark, only the setup that runs before it.
+
+Usage::
+
+    python -m tests.load_test.extractor_setup_benchmark --requests 2000
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+from collections.abc import Callable
+from typing import Any
+
+from app.tools.langextract_sb7 import StoryBrandExtractor, get_storybrand_extractor
+from helpers.user_extract_data import UserInputExtractor, get_user_input_extractor
+
+
+def _legacy_preflight_setup() -> Any:
+    extractor = UserInputExtractor()
+    # extract() montava os exemplos de novo para o log e para a chamada.
+    extractor._examples()
+    extractor._examples()
+    return extractor
+
+
+def _measure(setup: Callable[[], Any], requests: int) -> float:
+    started = time.perf_counter()
+    for _ in range(requests):
+        setup()
+    return (time.perf_counter() - started) / requests
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    cases = [
+        ("preflight", "per request", _legacy_preflight_setup),
+        ("preflight", "registry", get_user_input_extractor),
+        ("storybrand", "per request", StoryBrandExtractor),
+        ("storybrand", "registry", get_storybrand_extractor),
+    ]
+    print(f"{'path':<12}{'setup':<14}{'us/request':>12}")
+    for path, label, setup in cases:
+        per_request = _measure(setup, args.requests)
+        print(f"{path:<12}{label:<14}{per_request * 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Concurrency and caching benchmark for ``ImageAssetsAgent`` on the local backend.
+
+Runs the full agent against ``IMAGE_BACKEND=local`` (deterministic synthetic PNGs,
+objects written to a temporary directory), so it needs no Gemini or GCS access and
+can run in CI. For each concurrency level it reports a cold run and a warm run
+served by the content-addressed image cache.
+
+Usage::
+
+    python -m tests.load_test.image_assets_agent_benchmark --variations 3 --concurrency 1 3 --latency 0.2
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from importlib import import_module
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any
+
+from app.agent import ImageAssetsAgent
+from app.config import config
+
+gti = import_module("app.tools.generate_transformation_images")
+
+
+def _variations(count: int) -> list[dict[str, Any]]:
+    return [
+        {
+            "visual": {
+                "prompt_estado_atual": f"Pessoa cansada, variação {idx}",
+                "prompt_estado_intermediario": f"Pessoa pesquisando soluções, variação {idx}",
+                "prompt_estado_aspiracional": f"Pessoa confiante, variação {idx}",
+            }
+        }
+        for idx in range(count)
+    ]
+
+
+async def _run_agent(variations: int, session_id: str) -> tuple[float, dict[str, Any]]:
+    state: dict[str, Any] = {
+        "final_code_delivery": json.dumps(_variations(variations), ensure_ascii=False),
+        "user_id": "bench",
+    }
+    ctx = SimpleNamespace(session=SimpleNamespace(id=session_id, state=state))
+    started = time.perf_counter()
+    async for _ in ImageAssetsAgent()._run_async_impl(ctx):
+        pass
+    return time.perf_counter() - started, state
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--variations", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 3])
+    parser.add_argument("--latency", type=float, default=0.2, help="simulated model latency (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.environ.setdefault("DELIVERIES_BUCKET", "gs://bench-deliveries")
+        config.image_backend = "local"
+        config.image_local_backend_dir = str(Path(workdir) / "store")
+        config.image_local_latency_seconds = args.latency
+        config.image_local_error_rate = args.error_rate
+        config.enable_deterministic_final_validation = True  # não persiste a entrega final
+
+        print(f"{'concurrency':<12}{'run':>6}{'seconds':>10}{'model calls':>13}{'grade':>8}")
+        for concurrency in args.concurrency:
+            config.image_generation_max_concurrency = concurrency
+            config.image_cache_index_path = str(Path(workdir) / f"index-{concurrency}.jsonl")
+            gti._client = None
+            gti._storage_client = None
+            for run in ("cold", "warm"):
+                elapsed, state = asyncio.run(
+                    _run_agent(args.variations, f"bench-{concurrency}-{run}")
+                )
+                calls = gti._client.models.calls if gti._client is not None else 0
+                grade = state["image_assets_review"]["grade"]
+                print(f"{concurrency:<12}{run:>6}{elapsed:>10.2f}{calls:>13}{grade:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Throughput benchmark for the image generation path with N concurrent sessions.
+
+Compares the native async client path (``client.aio``) against the previous
+``asyncio.to_thread`` wrapper, which keeps one default-executor thread busy per
+in-flight request. The model and GCS upload are replaced by in-process fakes
+with a fixed latency, so the numbers isolate the scheduling overhead.
+
+Usage::
+
+    python -m tests.load_test.image_generation_benchmark --sessions 1 8 32 --latency 0.5
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import time
+from importlib import import_module
+from types import SimpleNamespace
+from typing import Any
+
+gti = import_module("app.tools.generate_transformation_images")
+
+_PNG_BYTES = b"\x89PNG\r\n\x1a\n-benchmark"
+_VARIATIONS_PER_SESSION = 3
+
+
+def _fake_response() -> Any:
+    part = SimpleNamespace(inline_data=SimpleNamespace(data=_PNG_BYTES, mime_type="image/png"))
+    return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]))])
+
+
+def _build_client(mode: str, latency: float) -> Any:
+    if mode == "async":
+
+        async def generate_content(**_: Any) -> Any:
+            await asyncio.sleep(latency)
+            return _fake_response()
+
+    else:
+
+        def blocking_generate_content(**_: Any) -> Any:
+            time.sleep(latency)
+            return _fake_response()
+
+        async def generate_content(**kwargs: Any) -> Any:
+            return await asyncio.to_thread(blocking_generate_content, **kwargs)
+
+    return SimpleNamespace(aio=SimpleNamespace(models=SimpleNamespace(generate_content=generate_content)))
+
+
+async def _fake_upload(image: Any, *, stage_label: str, variation_idx: int, **_: Any) -> Any:
+    return gti._UploadResult(gcs_uri=f"gs://bench/{stage_label}_{variation_idx}", signed_url="")
+
+
+async def _run_session(session_idx: int) -> None:
+    await asyncio.gather(
+        *(
+            gti.generate_transformation_images(
+                prompt_atual="Estado atual",
+                prompt_intermediario="Estado intermediário",
+                prompt_aspiracional="Estado aspiracional",
+                variation_idx=variation_idx,
+                metadata={"user_id": "bench", "session_id": f"bench-{session_idx}"},
+            )
+            for variation_idx in range(_VARIATIONS_PER_SESSION)
+        )
+    )
+
+
+async def _measure(mode: str, sessions: int, latency: float) -> float:
+    gti._client = _build_client(mode, latency)
+    started = time.perf_counter()
+    await asyncio.gather(*(_run_session(idx) for idx in range(sessions)))
+    return time.perf_counter() - started
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--latency", type=float, default=0.5, help="simulated model latency (s)")
+    args = parser.parse_args()
+
+    gti._upload_image = _fake_upload
+    gti.config.image_cache_enabled = False
+    images_per_session = _VARIATIONS_PER_SESSION * 3
+
+    print(f"{'mode':<8}{'sessions':>10}{'images':>10}{'seconds':>10}{'images/s':>12}")
+    for sessions in args.sessions:
+        for mode in ("thread", "async"):
+            elapsed = asyncio.run(_measure(mode, sessions, args.latency))
+            images = sessions * images_per_session
+            print(f"{mode:<8}{sessions:>10}{images:>10}{elapsed:>10.2f}{images / elapsed:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
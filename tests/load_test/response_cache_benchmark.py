@@ -0,0 +1,69 @@
+"""Cost of ``InMemoryResponseCache`` operations as the store grows.
+
+The cache used to scan every entry for expired ones on each ``get``/``set``
+while holding its lock; expiry now comes off a heap. This compares both on a
+store filled with ``--entries`` keys.
+
+Usage::
+
+    python -m tests.load_test.response_cache_benchmark --entries 10000 100000
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import time
+
+from app.utils.cache import InMemoryResponseCache
+
+
+class FullScanResponseCache(InMemoryResponseCache):
+    """Previous purge strategy: walk the whole store on every access."""
+
+    scan = False  # desligado durante o preenchimento, que seria O(n²)
+
+    def _purge_expired(self, now: float) -> None:
+        if not self.scan:
+            return
+        expired = [
+            key for key, entry in self._store.items() if entry.expires_at and entry.expires_at <= now
+        ]
+        for key in expired:
+            self._remove(key)
+
+
+def _measure(cache: InMemoryResponseCache, entries: int, operations: int) -> tuple[float, float]:
+    for index in range(entries):
+        cache.set(f"key-{index}", {"index": index})
+    keys = [f"key-{random.randrange(entries)}" for _ in range(operations)]
+    cache.scan = True
+
+    started = time.perf_counter()
+    for key in keys:
+        cache.get(key)
+    get_cost = (time.perf_counter() - started) / operations
+
+    started = time.perf_counter()
+    for offset, key in enumerate(keys):
+        cache.set(key, {"index": offset})
+    set_cost = (time.perf_counter() - started) / operations
+    return get_cost, set_cost
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--operations", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'entries':>9}  {'purge':<10}{'get us':>12}{'set us':>12}")
+    for entries in args.entries:
+        for label, cls in (("full scan", FullScanResponseCache), ("heap", InMemoryResponseCache)):
+            cache = cls(maxsize=entries, ttl_seconds=900)
+            get_cost, set_cost = _measure(cache, entries, args.operations)
+            print(f"{entries:>9}  {label:<10}{get_cost * 1e6:>12.1f}{set_cost * 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import json
+from types import SimpleNamespace
+from typing import Any
+
+import pytest
+from google.adk.events import Event
+
+from app.agent import ImageAssetsAgent, make_failure_handler
+from app.agents.budget import BudgetLoopGuard, SkipIfBudgetLow
+from app.config import config
+from app.utils.session_budget import start_session_budget
+
+
+class DummyAgent:
+    def __init__(self, name: str):
+        self.name = name
+        self.called = False
+
+    async def run_async(self, ctx):
+        self.called = True
+        yield Event(author=self.name)
+
+
+def make_ctx(state: dict[str, Any]) -> SimpleNamespace:
+    return SimpleNamespace(session=SimpleNamespace(state=state, id="sess"))
+
+
+def low_budget_state() -> dict[str, Any]:
+    state: dict[str, Any] = {}
+    start_session_budget(state, seconds=1000, llm_calls=10)
+    state["session_budget"]["llm_calls"] = 9
+    return state
+
+
+@pytest.fixture(autouse=True)
+def _budget_config(monkeypatch):
+    monkeypatch.setattr(config, "session_budget_enabled", True)
+    monkeypatch.setattr(config, "session_budget_low_fraction", 0.2)
+
+
+@pytest.mark.asyncio
+async def test_loop_guard_continues_when_budget_is_ok():
+    state: dict[str, Any] = {}
+    start_session_budget(state, seconds=1000, llm_calls=10)
+    guard = BudgetLoopGuard(name="guard", review_key="code_review_result", loop_name="loop")
+
+    events = [event async for event in guard._run_async_impl(make_ctx(state))]
+
+    assert not events[0].actions.escalate
+    assert "delivery_audit_trail" not in state
+
+
+@pytest.mark.asyncio
+async def test_loop_guard_cuts_review_but_keeps_failing_grade():
+    state = low_budget_state()
+    state["code_review_result"] = {"grade": "fail", "comment": "ajustar CTA"}
+    guard = BudgetLoopGuard(name="guard", review_key="code_review_result", loop_name="code_review_loop")
+
+    events = [event async for event in guard._run_async_impl(make_ctx(state))]
+
+    assert events[0].actions.escalate is True
+    assert state["code_review_result"]["grade"] == "fail"
+    assert state["code_review_result"]["budget_cut"] is True
+    assert state["delivery_audit_trail"][0]["action"] == "cut_review_iterations"
+
+    handler = make_failure_handler("code_review_result", "falhou")
+    handler(SimpleNamespace(state=state))
+    assert state["code_review_result_failed"] is True
+
+
+@pytest.mark.asyncio
+async def test_skip_if_budget_low_skips_stage_and_grades_skipped():
+    state = low_budget_state()
+    wrapped = DummyAgent("semantic_validation_stage")
+    gate = SkipIfBudgetLow(name="gate", review_key="semantic_visual_review", agent=wrapped)
+
+    events = [event async for event in gate._run_async_impl(make_ctx(state))]
+
+    assert wrapped.called is False
+    assert len(events) == 1
+    assert state["semantic_visual_review"]["grade"] == "skipped"
+    assert state["delivery_audit_trail"][0]["stage"] == "semantic_validation_stage"
+
+
+@pytest.mark.asyncio
+async def test_image_assets_agent_limits_variations_when_budget_low(monkeypatch):
+    monkeypatch.setattr(config, "session_budget_low_image_variations", 1)
+    monkeypatch.setattr(config, "enable_deterministic_final_validation", True)
+    visual = {
+        "prompt_estado_atual": "a",
+        "prompt_estado_intermediario": "b",
+        "prompt_estado_aspiracional": "c",
+    }
+    state = low_budget_state()
+    state["final_code_delivery"] = json.dumps(
+        [{"visual": dict(visual)}, {"visual": dict(visual)}, {"visual": dict(visual)}]
+    )
+    calls: list[int] = []
+
+    async def fake_generate(**kwargs: Any) -> dict[str, Any]:
+        calls.append(kwargs["variation_idx"])
+        stage = {"gcs_uri": "gs://b/x.png", "signed_url": ""}
+        return {
+            "estado_atual": stage,
+            "estado_intermediario": stage,
+            "estado_aspiracional": stage,
+        }
+
+    monkeypatch.setattr("app.agent.generate_transformation_images", fake_generate)
+
+    async for _ in ImageAssetsAgent()._run_async_impl(make_ctx(state)):
+        pass
+
+    assert calls == [0]
+    assert state["image_assets_review"]["grade"] == "pass"
+    assert [item["status"] for item in state["image_assets"]] == ["ok", "skipped", "skipped"]
+    delivered = json.loads(state["final_code_delivery"])
+    assert "image_generation_skipped" not in delivered[0]["visual"]
+    assert [item["visual"]["image_generation_skipped"] for item in delivered[1:]] == [
+        "session_budget",
+        "session_budget",
+    ]
+    degradations = [e for e in state["delivery_audit_trail"] if e["status"] == "degraded"]
+    assert degradations[0]["action"] == "limit_image_variations"
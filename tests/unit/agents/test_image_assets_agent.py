@@ -207,3 +207,162 @@ async def test_image_assets_agent_updates_normalized_payload(
 
     # Verifica que final_code_delivery_parsed também foi atualizado
     assert state["final_code_delivery_parsed"] == updated_normalized["variations"]
+
+
+@pytest.mark.asyncio
+async def test_image_assets_agent_generates_variations_concurrently(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    variations = [
+        {
+            "formato": "Feed",
+            "visual": {
+                "aspect_ratio": "4:5",
+                "prompt_estado_atual": f"Cena {idx} | Emotion: sad",
+                "prompt_estado_intermediario": f"Cena {idx} | Emotion: hopeful",
+                "prompt_estado_aspiracional": f"Cena {idx} | Emotion: happy",
+            },
+        }
+        for idx in range(3)
+    ]
+    state: dict[str, Any] = {
+        "final_code_delivery": json.dumps(variations, ensure_ascii=False),
+        "user_id": "user-concurrent",
+    }
+
+    in_flight = 0
+    max_in_flight = 0
+    all_started = asyncio.Event()
+
+    async def fake_generate(**kwargs: Any) -> dict[str, Any]:
+        nonlocal in_flight, max_in_flight
+        idx = kwargs["variation_idx"]
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        if in_flight == 3:
+            all_started.set()
+        await asyncio.wait_for(all_started.wait(), timeout=1)
+        # A última variação termina primeiro para exercitar a ordenação do resumo.
+        await asyncio.sleep(0.01 * (3 - idx))
+        for stage_idx, label in enumerate(
+            ("estado_atual", "estado_intermediario", "estado_aspiracional"), start=1
+        ):
+            await kwargs["progress_callback"](stage_idx, label)
+        in_flight -= 1
+        return {
+            "estado_atual": {"gcs_uri": f"gs://v{idx}/1", "signed_url": ""},
+            "estado_intermediario": {"gcs_uri": f"gs://v{idx}/2", "signed_url": ""},
+            "estado_aspiracional": {"gcs_uri": f"gs://v{idx}/3", "signed_url": ""},
+            "meta": {"variation_idx": idx},
+        }
+
+    monkeypatch.setattr("app.agent.generate_transformation_images", fake_generate)
+    monkeypatch.setattr("app.agent.persist_final_delivery", lambda ctx: None)
+    monkeypatch.setattr("app.agent.config.enable_deterministic_final_validation", True, raising=False)
+    monkeypatch.setattr("app.agent.config.image_generation_max_concurrency", 3, raising=False)
+
+    session = SimpleNamespace(id="sess-concurrent", state=state)
+    ctx = SimpleNamespace(session=session)
+
+    texts: list[str] = []
+    agent = ImageAssetsAgent()
+    async for event in agent._run_async_impl(ctx):
+        texts.append(event.content.parts[0].text)
+
+    assert max_in_flight == 3
+    assert state["image_assets_review"]["grade"] == "pass"
+    assert [item["variation_index"] for item in state["image_assets"]] == [0, 1, 2]
+    assert sum("etapa" in text for text in texts) == 9
+    assert sum(text.startswith("🎉") for text in texts) == 3
+    # A variação 3 conclui antes da 1, e o stream reflete essa ordem.
+    finished = [text for text in texts if text.startswith("🎉")]
+    assert finished[0].startswith("🎉 Variação 3")
+
+    parsed_delivery = json.loads(state["final_code_delivery"])
+    assert [item["visual"]["image_estado_atual_gcs"] for item in parsed_delivery] == [
+        "gs://v0/1",
+        "gs://v1/1",
+        "gs://v2/1",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_image_assets_agent_persists_and_reuses_stage_checkpoints(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    variations = [
+        {
+            "visual": {
+                "prompt_estado_atual": "atual",
+                "prompt_estado_intermediario": "intermediario",
+                "prompt_estado_aspiracional": "aspiracional",
+            }
+        }
+    ]
+    state: dict[str, Any] = {
+        "final_code_delivery": json.dumps(variations),
+        "user_id": "user-resume",
+        "image_generation_checkpoints": {
+            "0": {"estado_atual": {"gcs_uri": "gs://v0/1", "mime_type": "image/png", "prompt_hash": "h1"}}
+        },
+    }
+    received: list[Any] = []
+
+    async def fake_generate(**kwargs: Any) -> dict[str, Any]:
+        received.append(dict(kwargs["checkpoints"]))
+        kwargs["checkpoint_callback"](
+            "estado_aspiracional", {"gcs_uri": "gs://v0/3", "mime_type": "image/png", "prompt_hash": "h3"}
+        )
+        raise RuntimeError("estado_intermediario failed")
+
+    monkeypatch.setattr("app.agent.generate_transformation_images", fake_generate)
+    monkeypatch.setattr("app.agent.persist_final_delivery", lambda ctx: None)
+
+    ctx = SimpleNamespace(session=SimpleNamespace(id="sess-resume", state=state))
+    async for _ in ImageAssetsAgent()._run_async_impl(ctx):
+        pass
+
+    assert received == [{"estado_atual": {"gcs_uri": "gs://v0/1", "mime_type": "image/png", "prompt_hash": "h1"}}]
+    assert set(state["image_generation_checkpoints"]["0"]) == {"estado_atual", "estado_aspiracional"}
+
+
+@pytest.mark.asyncio
+async def test_image_assets_agent_checkpoints_survive_session_reload(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    from google.adk.sessions import InMemorySessionService
+
+    variations = [
+        {
+            "visual": {
+                "prompt_estado_atual": "atual",
+                "prompt_estado_intermediario": "intermediario",
+                "prompt_estado_aspiracional": "aspiracional",
+            }
+        }
+    ]
+    service = InMemorySessionService()
+    session = await service.create_session(
+        app_name="app",
+        user_id="user-resume",
+        state={"final_code_delivery": json.dumps(variations), "user_id": "user-resume"},
+    )
+
+    async def fake_generate(**kwargs: Any) -> dict[str, Any]:
+        kwargs["checkpoint_callback"](
+            "estado_atual", {"gcs_uri": "gs://v0/1", "mime_type": "image/png", "prompt_hash": "h1"}
+        )
+        raise RuntimeError("estado_intermediario failed")
+
+    monkeypatch.setattr("app.agent.generate_transformation_images", fake_generate)
+    monkeypatch.setattr("app.agent.persist_final_delivery", lambda ctx: None)
+
+    async for event in ImageAssetsAgent()._run_async_impl(SimpleNamespace(session=session)):
+        await service.append_event(session, event)
+
+    reloaded = await service.get_session(
+        app_name="app", user_id="user-resume", session_id=session.id
+    )
+    assert reloaded.state["image_generation_checkpoints"] == {
+        "0": {"estado_atual": {"gcs_uri": "gs://v0/1", "mime_type": "image/png", "prompt_hash": "h1"}}
+    }
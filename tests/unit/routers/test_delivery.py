@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any
+
+import pytest
+from fastapi import HTTPException
+
+from app.routers import delivery
+
+
+def _variation(idx: int) -> dict[str, Any]:
+    return {
+        "visual": {
+            "image_estado_atual_gcs": f"gs://bucket/{idx}/atual.png",
+            "image_estado_intermediario_gcs": f"gs://bucket/{idx}/intermediario.png",
+            "image_estado_aspiracional_gcs": f"gs://bucket/{idx}/aspiracional.png",
+        }
+    }
+
+
+def _fake_hydrate(variations: Any) -> Any:
+    for item in variations:
+        visual = item["visual"]
+        for stage in ("atual", "intermediario", "aspiracional"):
+            uri = visual[f"image_estado_{stage}_gcs"]
+            visual[f"image_estado_{stage}_url"] = f"https://signed/{uri.removeprefix('gs://')}"
+    return variations
+
+
+@pytest.fixture()
+def stored_payload(monkeypatch: pytest.MonkeyPatch) -> bytes:
+    payload = json.dumps([_variation(idx) for idx in range(3)]).encode("utf-8")
+    monkeypatch.setattr(delivery, "hydrate_image_urls", _fake_hydrate)
+    return payload
+
+
+def _use_meta(monkeypatch: pytest.MonkeyPatch, **meta: Any) -> None:
+    monkeypatch.setattr(
+        delivery,
+        "_load_local_meta",
+        lambda session_id: {"user_id": "user", "filename": "final.json", **meta},
+    )
+
+
+def _assert_signed(body: bytes) -> None:
+    data = json.loads(body)
+    assert data[0]["visual"]["image_estado_atual_url"] == "https://signed/bucket/0/atual.png"
+
+
+def test_download_from_gcs_returns_signed_url_to_hydrated_copy(
+    monkeypatch: pytest.MonkeyPatch, stored_payload: bytes
+) -> None:
+    uploads: dict[str, bytes] = {}
+
+    def make_blob(path: str) -> SimpleNamespace:
+        return SimpleNamespace(
+            download_as_bytes=lambda: stored_payload,
+            upload_from_string=lambda data, content_type=None: uploads.__setitem__(path, data),
+            generate_signed_url=lambda **kwargs: f"https://signed/{path}",
+        )
+
+    client = SimpleNamespace(bucket=lambda name: SimpleNamespace(blob=make_blob))
+    monkeypatch.setattr(delivery.storage, "Client", lambda project=None: client)
+    _use_meta(monkeypatch, final_delivery_gcs_uri="gs://deliveries/final/sess.json")
+
+    response = delivery.download_final(user_id="user", session_id="sess", inline=False)
+
+    assert response == {
+        "ok": True,
+        "signed_url": "https://signed/final/sess.signed.json",
+        "expires_in": 600,
+    }
+    _assert_signed(uploads["final/sess.signed.json"])
+
+
+def test_download_from_local_copy_serves_signed_attachment(
+    monkeypatch: pytest.MonkeyPatch, stored_payload: bytes, tmp_path: Path
+) -> None:
+    local_path = tmp_path / "sess.json"
+    local_path.write_bytes(stored_payload)
+    _use_meta(monkeypatch, final_delivery_local_path=str(local_path))
+
+    response = delivery.download_final(user_id="user", session_id="sess", inline=False)
+
+    assert response.headers["content-disposition"] == 'attachment; filename="final.json"'
+    _assert_signed(response.body)
+
+    inline = delivery.download_final(user_id="user", session_id="sess", inline=True)
+    _assert_signed(inline.body)
+
+
+def test_download_falls_back_to_local_copy_when_gcs_fails(
+    monkeypatch: pytest.MonkeyPatch, stored_payload: bytes, tmp_path: Path
+) -> None:
+    def broken_client(project: str | None = None) -> Any:
+        raise RuntimeError("no credentials")
+
+    local_path = tmp_path / "sess.json"
+    local_path.write_bytes(stored_payload)
+    monkeypatch.setattr(delivery.storage, "Client", broken_client)
+    _use_meta(
+        monkeypatch,
+        final_delivery_gcs_uri="gs://deliveries/final/sess.json",
+        final_delivery_local_path=str(local_path),
+    )
+
+    response = delivery.download_final(user_id="user", session_id="sess", inline=False)
+
+    _assert_signed(response.body)
+
+
+def test_download_fails_instead_of_serving_unsigned_payload(
+    monkeypatch: pytest.MonkeyPatch, stored_payload: bytes, tmp_path: Path
+) -> None:
+    def broken_hydrate(variations: Any) -> Any:
+        raise RuntimeError("signing unavailable")
+
+    local_path = tmp_path / "sess.json"
+    local_path.write_bytes(stored_payload)
+    monkeypatch.setattr(delivery, "hydrate_image_urls", broken_hydrate)
+    _use_meta(monkeypatch, final_delivery_local_path=str(local_path))
+
+    for inline in (True, False):
+        with pytest.raises(HTTPException) as excinfo:
+            delivery.download_final(user_id="user", session_id="sess", inline=inline)
+        assert excinfo.value.status_code == 502
+
+
+def test_download_rejects_other_users(monkeypatch: pytest.MonkeyPatch) -> None:
+    _use_meta(monkeypatch)
+
+    with pytest.raises(HTTPException) as excinfo:
+        delivery.download_final(user_id="someone-else", session_id="sess", inline=False)
+
+    assert excinfo.value.status_code == 404
+
+
+def test_budget_skipped_variations_do_not_require_image_urls() -> None:
+    data = _fake_hydrate([_variation(idx) for idx in range(3)])
+    data[2]["visual"] = {"image_generation_skipped": "session_budget"}
+
+    assert delivery._has_all_image_urls(data) is True
+    assert delivery._report_missing(data) == [
+        {"variation": 2, "status": "skipped", "reason": "session_budget"}
+    ]
+
+    del data[1]["visual"]["image_estado_intermediario_url"]
+    assert delivery._has_all_image_urls(data) is False
@@ -1,6 +1,6 @@
 import pytest
 
-from helpers.user_extract_data import extract_user_input
+from helpers.user_extract_data import extract_user_input, make_preflight_flight_key
 
 
 class DummyExtraction:
@@ -92,3 +92,50 @@ def test_extract_user_input_rejects_neutro_gender(patch_langextract, monkeypatch
 
     assert result["success"] is False
     assert any(error["field"] == "sexo_cliente_alvo" for error in result["errors"])
+
+
+def test_user_input_extractor_is_shared_and_builds_examples_once(monkeypatch):
+    from app.config import config
+    from helpers import user_extract_data as ued
+
+    monkeypatch.setattr(ued, "_extractors", {})
+    built = {"count": 0}
+    original = ued.UserInputExtractor._examples
+
+    def counting_examples(self):
+        built["count"] += 1
+        return original(self)
+
+    monkeypatch.setattr(ued.UserInputExtractor, "_examples", counting_examples)
+    seen_examples = []
+    monkeypatch.setattr(
+        ued.lx, "extract", lambda **kwargs: seen_examples.append(kwargs["examples"]) or DummyResult([])
+    )
+
+    first = ued.get_user_input_extractor()
+    first.extract("a")
+    first.extract("b")
+    assert ued.get_user_input_extractor() is first
+    assert built["count"] == 1
+    assert seen_examples[0] is seen_examples[1]
+
+    # Flags diferentes geram outro prompt, logo outra instância.
+    monkeypatch.setattr(config, "enable_new_input_fields", not config.enable_new_input_fields)
+    assert ued.get_user_input_extractor() is not first
+
+
+def test_preflight_flight_key_tracks_extractor_flags(monkeypatch):
+    from app.config import config
+
+    monkeypatch.setattr(config, "enable_new_input_fields", False)
+    monkeypatch.setattr(config, "preflight_shadow_mode", False)
+    base = make_preflight_flight_key("gemini-2.5-flash", "texto")
+    assert make_preflight_flight_key("gemini-2.5-flash", "texto") == base
+
+    monkeypatch.setattr(config, "enable_new_input_fields", True)
+    with_fields = make_preflight_flight_key("gemini-2.5-flash", "texto")
+    monkeypatch.setattr(config, "preflight_shadow_mode", True)
+    shadow = make_preflight_flight_key("gemini-2.5-flash", "texto")
+
+    assert len({base, with_fields, shadow}) == 3
+    assert make_preflight_flight_key("gemini-2.5-flash", "outro") != shadow
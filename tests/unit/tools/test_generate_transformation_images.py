@@ -2,10 +2,12 @@
 
 from __future__ import annotations
 
+import asyncio
 import json
 import logging
 from datetime import datetime, timezone
 from importlib import import_module
+from io import BytesIO
 from types import SimpleNamespace
 from typing import Any
 
@@ -16,6 +18,17 @@ from app.schemas.reference_assets import ReferenceImageMetadata
 
 gti = import_module("app.tools.generate_transformation_images")
 
+
+@pytest.fixture(autouse=True)
+def _disable_image_cache(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(gti.config, "image_cache_enabled", False)
+
+
+@pytest.fixture(autouse=True)
+def _disable_image_derivatives(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(gti.config, "image_derivatives_enabled", False)
+
+
 class _FakeReferenceImage:
     def __init__(self, name: str) -> None:
         self.name = name
@@ -321,3 +334,557 @@ async def test_generate_transformation_images_debug_logs(monkeypatch: pytest.Mon
     assert third_payload[0]["type"] == "image"
     assert third_payload[1]["type"] == "text"
     assert "The same persona fishes from a boat" in third_payload[1]["preview"]
+
+
+@pytest.mark.asyncio
+async def test_generate_transformation_images_runs_aspirational_in_parallel(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    aspirational_started = asyncio.Event()
+    calls: list[str] = []
+    progress: list[tuple[int, str]] = []
+
+    async def fake_call_model(inputs: list[Any]) -> _FakeGeneratedImage:
+        prompt_text = next((item for item in inputs if isinstance(item, str)), "")
+        if "ESTADO ATUAL" in prompt_text:
+            calls.append("atual")
+            # Só conclui se a etapa 3 tiver começado sem esperar pelas etapas 1 e 2.
+            await asyncio.wait_for(aspirational_started.wait(), timeout=1)
+            return _FakeGeneratedImage(1)
+        if "ESTADO INTERMEDIÁRIO" in prompt_text:
+            calls.append("intermediario")
+            return _FakeGeneratedImage(2)
+        calls.append("aspiracional")
+        aspirational_started.set()
+        return _FakeGeneratedImage(3)
+
+    async def fake_upload_image(*, stage_label: str, **_: Any) -> SimpleNamespace:
+        await asyncio.sleep(0)
+        return SimpleNamespace(gcs_uri=f"gs://generated/{stage_label}", signed_url="")
+
+    async def record_progress(stage_idx: int, stage_label: str) -> None:
+        progress.append((stage_idx, stage_label))
+
+    monkeypatch.setattr(gti, "_call_model", lambda inputs: fake_call_model(list(inputs)))
+    monkeypatch.setattr(
+        gti,
+        "_upload_image",
+        lambda image, **kwargs: fake_upload_image(**kwargs),
+    )
+
+    result = await gti.generate_transformation_images(
+        prompt_atual="Stage one",
+        prompt_intermediario="Stage two",
+        prompt_aspiracional="Stage three",
+        variation_idx=0,
+        metadata={"user_id": "user", "session_id": "session"},
+        progress_callback=record_progress,
+    )
+
+    assert calls.index("aspiracional") < calls.index("intermediario")
+    assert sorted(progress) == [
+        (1, "estado_atual"),
+        (2, "estado_intermediario"),
+        (3, "estado_aspiracional"),
+    ]
+    assert progress.index((1, "estado_atual")) < progress.index((2, "estado_intermediario"))
+    assert result["estado_intermediario"]["gcs_uri"] == "gs://generated/estado_intermediario"
+
+
+@pytest.mark.asyncio
+async def test_generate_transformation_images_cancels_sibling_stage_on_failure(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    aspirational_cancelled = False
+
+    async def fake_call_model(inputs: list[Any]) -> _FakeGeneratedImage:
+        nonlocal aspirational_cancelled
+        prompt_text = next((item for item in inputs if isinstance(item, str)), "")
+        if "ESTADO ATUAL" in prompt_text:
+            await asyncio.sleep(0)
+            raise RuntimeError("modelo indisponível")
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            aspirational_cancelled = True
+            raise
+        return _FakeGeneratedImage(3)
+
+    async def fake_upload_image(*, stage_label: str, **_: Any) -> SimpleNamespace:
+        return SimpleNamespace(gcs_uri=f"gs://generated/{stage_label}", signed_url="")
+
+    monkeypatch.setattr(gti, "_call_model", lambda inputs: fake_call_model(list(inputs)))
+    monkeypatch.setattr(
+        gti,
+        "_upload_image",
+        lambda image, **kwargs: fake_upload_image(**kwargs),
+    )
+
+    with pytest.raises(RuntimeError, match="modelo indisponível"):
+        await gti.generate_transformation_images(
+            prompt_atual="Stage one",
+            prompt_intermediario="Stage two",
+            prompt_aspiracional="Stage three",
+            variation_idx=0,
+            metadata={"user_id": "user", "session_id": "session"},
+        )
+
+    assert aspirational_cancelled is True
+
+
+def test_load_reference_image_reuses_cached_download(
+    monkeypatch: pytest.MonkeyPatch,
+    reference_character: ReferenceImageMetadata,
+) -> None:
+    from app.utils.reference_cache import ReferenceImageCache
+
+    cache = ReferenceImageCache(max_bytes=1_000_000, ttl_seconds=60)
+    monkeypatch.setattr(gti, "get_reference_image_cache", lambda: cache)
+
+    buffer = BytesIO()
+    Image.new("RGBA", (4, 4), color=(10, 20, 30, 255)).save(buffer, format="PNG")
+    downloads: list[str] = []
+
+    def fake_get(url: str, timeout: int) -> SimpleNamespace:
+        downloads.append(url)
+        return SimpleNamespace(content=buffer.getvalue(), raise_for_status=lambda: None)
+
+    monkeypatch.setattr(gti.requests, "get", fake_get)
+
+    first = gti._load_reference_image(reference_character)
+    second = gti._load_reference_image(reference_character)
+
+    assert downloads == ["https://signed/char-1"]
+    assert first is second
+    # PNG enviado como está: sem decodificar nem recodificar.
+    assert first == gti.GeneratedImage(data=buffer.getvalue(), mime_type="image/png")
+    assert cache.stats()["hits"] == 1
+
+
+def test_reference_part_converts_only_unsupported_formats() -> None:
+    jpeg = BytesIO()
+    Image.new("RGB", (4, 4), color=(1, 2, 3)).save(jpeg, format="JPEG")
+    gif = BytesIO()
+    Image.new("P", (4, 4)).save(gif, format="GIF")
+
+    passthrough = gti._reference_part(jpeg.getvalue())
+    converted = gti._reference_part(gif.getvalue())
+
+    assert passthrough.data == jpeg.getvalue()
+    assert passthrough.mime_type == "image/jpeg"
+    assert converted.mime_type == "image/png"
+    with Image.open(BytesIO(converted.data)) as image:
+        assert image.format == "PNG"
+        assert image.mode == "RGB"
+
+
+class _RecordingBlob:
+    def __init__(self, name: str, uploads: dict[str, Any]) -> None:
+        self.name = name
+        self._uploads = uploads
+
+    def upload_from_string(self, data: bytes, content_type: str) -> None:
+        self._uploads[self.name] = (data, content_type)
+
+    def generate_signed_url(self, **kwargs: Any) -> str:
+        return f"https://signed/{self.name}?type={kwargs['response_type']}"
+
+
+@pytest.mark.asyncio
+async def test_raw_passthrough_keeps_model_bytes_end_to_end(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    sent_parts: list[Any] = []
+    original = gti.GeneratedImage(data=b"\xff\xd8jpeg-bytes", mime_type="image/jpeg")
+    produced = b"\x89PNGnext-stage"
+
+    async def fake_generate_content(*, model: str, contents: list[Any], config: Any) -> Any:
+        sent_parts.extend(contents[0].parts)
+        inline = SimpleNamespace(data=produced, mime_type="image/png")
+        part = SimpleNamespace(inline_data=inline)
+        return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]))])
+
+    monkeypatch.setattr(
+        gti,
+        "_client",
+        SimpleNamespace(aio=SimpleNamespace(models=SimpleNamespace(generate_content=fake_generate_content))),
+    )
+    monkeypatch.setattr(gti.config, "image_raw_passthrough", True)
+
+    result = await gti._call_model([original, "prompt"])
+
+    assert isinstance(result, gti.GeneratedImage)
+    assert result.data == produced
+    assert sent_parts[0].inline_data.data == original.data
+    assert sent_parts[0].inline_data.mime_type == "image/jpeg"
+
+    uploads: dict[str, Any] = {}
+    bucket = SimpleNamespace(blob=lambda name: _RecordingBlob(name, uploads))
+    monkeypatch.setattr(gti, "_storage_client", SimpleNamespace(bucket=lambda _: bucket))
+    monkeypatch.setenv("DELIVERIES_BUCKET", "gs://deliveries")
+
+    monkeypatch.setattr(gti.config, "image_defer_signed_urls", False)
+
+    upload = await gti._upload_image(
+        original,
+        user_id="user",
+        session_id="sess",
+        variation_idx=0,
+        stage_label="estado_atual",
+    )
+
+    blob_path = "deliveries/user/sess/images/estado_atual_0.jpg"
+    assert uploads[blob_path] == (original.data, "image/jpeg")
+    assert upload.gcs_uri == f"gs://deliveries/{blob_path}"
+    assert upload.signed_url.endswith("type=image/jpeg")
+
+
+@pytest.mark.asyncio
+async def test_upload_image_defers_signing(monkeypatch: pytest.MonkeyPatch) -> None:
+    uploads: dict[str, Any] = {}
+    bucket = SimpleNamespace(blob=lambda name: _RecordingBlob(name, uploads))
+    monkeypatch.setattr(gti, "_storage_client", SimpleNamespace(bucket=lambda _: bucket))
+    monkeypatch.setenv("DELIVERIES_BUCKET", "gs://deliveries")
+    monkeypatch.setattr(gti.config, "image_defer_signed_urls", True)
+
+    upload = await gti._upload_image(
+        gti.GeneratedImage(data=b"png"),
+        user_id="user",
+        session_id="sess",
+        variation_idx=1,
+        stage_label="estado_atual",
+    )
+
+    assert upload.gcs_uri == "gs://deliveries/deliveries/user/sess/images/estado_atual_1.png"
+    assert upload.signed_url == ""
+
+
+@pytest.mark.asyncio
+async def test_upload_image_settles_reserved_gcs_bytes(monkeypatch: pytest.MonkeyPatch) -> None:
+    from app.utils import quotas
+
+    uploads: dict[str, Any] = {}
+    bucket = SimpleNamespace(blob=lambda name: _RecordingBlob(name, uploads))
+    monkeypatch.setattr(gti, "_storage_client", SimpleNamespace(bucket=lambda _: bucket))
+    monkeypatch.setenv("DELIVERIES_BUCKET", "gs://deliveries")
+    monkeypatch.setattr(gti.config, "image_defer_signed_urls", True)
+    monkeypatch.setattr(gti.config, "user_quota_enabled", True)
+    monkeypatch.setattr(quotas, "_quotas", quotas.UserQuotas(clock=lambda: 0.0))
+    burst = gti.config.user_quota_gcs_mb_burst * 1024 * 1024
+
+    quotas.charge_user_quota("user", quotas.GCS_BYTES, 4096)  # reservado antes do modelo
+    await gti._upload_image(
+        gti.GeneratedImage(data=b"png"),
+        user_id="user",
+        session_id="sess",
+        variation_idx=1,
+        stage_label="estado_atual",
+        reserved_bytes=4096,
+    )
+
+    remaining = quotas.get_user_quotas().report("user")["resources"][quotas.GCS_BYTES]
+    assert remaining["remaining"] == burst - len(b"png")
+
+
+@pytest.mark.asyncio
+async def test_generate_transformation_images_checks_gcs_quota_before_model(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    from app.utils import quotas
+
+    calls: list[Any] = []
+
+    async def fake_call_model(inputs: list[Any]) -> _FakeGeneratedImage:
+        calls.append(inputs)
+        return _FakeGeneratedImage(1)
+
+    monkeypatch.setattr(gti, "_call_model", fake_call_model)
+    monkeypatch.setattr(gti.config, "user_quota_enabled", True)
+    monkeypatch.setattr(quotas, "_quotas", quotas.UserQuotas())
+    burst = gti.config.user_quota_gcs_mb_burst * 1024 * 1024
+    quotas.charge_user_quota("user", quotas.GCS_BYTES, burst)
+
+    with pytest.raises(quotas.QuotaExceededError):
+        await gti.generate_transformation_images(
+            prompt_atual="Stage one",
+            prompt_intermediario="Stage two",
+            prompt_aspiracional="Stage three",
+            variation_idx=0,
+            metadata={"user_id": "user", "session_id": "session"},
+        )
+
+    assert calls == []
+
+
+class _FakeStore:
+    """Minimal GCS stand-in that remembers uploaded objects."""
+
+    def __init__(self) -> None:
+        self.objects: dict[str, bytes] = {}
+
+    def bucket(self, bucket_name: str) -> SimpleNamespace:
+        store = self
+
+        class _Blob:
+            def __init__(self, name: str) -> None:
+                self.name = name
+                self.path = f"{bucket_name}/{name}"
+
+            def exists(self) -> bool:
+                return self.path in store.objects
+
+            def download_as_bytes(self) -> bytes:
+                return store.objects[self.path]
+
+            def upload_from_string(self, data: bytes, content_type: str) -> None:
+                store.objects[self.path] = data
+
+            def generate_signed_url(self, **_: Any) -> str:
+                return f"https://signed/{self.path}"
+
+        return SimpleNamespace(blob=_Blob)
+
+
+@pytest.mark.asyncio
+async def test_generate_transformation_images_reuses_content_addressed_stages(
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Any,
+) -> None:
+    store = _FakeStore()
+    calls: list[str] = []
+
+    async def fake_call_model(inputs: list[Any]) -> Any:
+        prompt_text = next(item for item in inputs if isinstance(item, str))
+        calls.append(prompt_text)
+        return gti.GeneratedImage(data=f"img-{len(calls)}".encode(), mime_type="image/png")
+
+    monkeypatch.setattr(gti, "_call_model", lambda inputs: fake_call_model(list(inputs)))
+    monkeypatch.setattr(gti, "_storage_client", store)
+    monkeypatch.setenv("DELIVERIES_BUCKET", "gs://deliveries")
+    monkeypatch.setattr(gti.config, "image_cache_enabled", True)
+    monkeypatch.setattr(gti.config, "image_cache_index_path", str(tmp_path / "index.jsonl"))
+    monkeypatch.setattr(gti.config, "image_defer_signed_urls", False)
+
+    kwargs = {
+        "prompt_atual": "Stage one",
+        "prompt_intermediario": "Stage two",
+        "prompt_aspiracional": "Stage three",
+        "variation_idx": 0,
+    }
+    first = await gti.generate_transformation_images(
+        metadata={"user_id": "user", "session_id": "first"}, **kwargs
+    )
+    assert len(calls) == 3
+    assert "image_cache_hits" not in first["meta"]
+
+    second = await gti.generate_transformation_images(
+        metadata={"user_id": "user", "session_id": "second"}, **kwargs
+    )
+    assert len(calls) == 3  # nenhuma nova chamada ao modelo
+    assert second["meta"]["image_cache_hits"] == [
+        "estado_aspiracional",
+        "estado_atual",
+        "estado_intermediario",
+    ]
+    for stage in ("estado_atual", "estado_intermediario", "estado_aspiracional"):
+        assert second[stage]["gcs_uri"] == first[stage]["gcs_uri"]
+        assert second[stage]["signed_url"].startswith("https://signed/deliveries/")
+
+    # Alterar apenas o prompt intermediário reaproveita a etapa 1 como entrada da 2.
+    stage_two_inputs: list[Any] = []
+
+    async def record_call_model(inputs: list[Any]) -> Any:
+        stage_two_inputs.extend(inputs)
+        return await fake_call_model(inputs)
+
+    monkeypatch.setattr(gti, "_call_model", lambda inputs: record_call_model(list(inputs)))
+    third = await gti.generate_transformation_images(
+        metadata={"user_id": "user", "session_id": "third"},
+        **{**kwargs, "prompt_intermediario": "Stage two, revised"},
+    )
+    assert len(calls) == 4
+    assert stage_two_inputs[0] == gti.GeneratedImage(data=b"img-1", mime_type="image/png")
+    assert third["meta"]["image_cache_hits"] == ["estado_aspiracional", "estado_atual"]
+    assert third["estado_intermediario"]["gcs_uri"].startswith(
+        "gs://deliveries/deliveries/user/images/by-hash/"
+    )
+
+    # O cache é por usuário: outra conta com os mesmos prompts gera as próprias imagens.
+    other = await gti.generate_transformation_images(
+        metadata={"user_id": "other", "session_id": "first"}, **kwargs
+    )
+    assert len(calls) == 7
+    assert "image_cache_hits" not in other["meta"]
+    assert other["estado_atual"]["gcs_uri"].startswith("gs://deliveries/deliveries/other/")
+
+
+@pytest.mark.asyncio
+async def test_generate_transformation_images_cache_survives_prompt_round_trip(
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Any,
+) -> None:
+    store = _FakeStore()
+    calls: list[str] = []
+
+    async def fake_call_model(inputs: list[Any]) -> Any:
+        calls.append("call")
+        return gti.GeneratedImage(data=f"img-{len(calls)}".encode())
+
+    monkeypatch.setattr(gti, "_call_model", lambda inputs: fake_call_model(list(inputs)))
+    monkeypatch.setattr(gti, "_storage_client", store)
+    monkeypatch.setenv("DELIVERIES_BUCKET", "gs://deliveries")
+    monkeypatch.setattr(gti.config, "image_cache_enabled", True)
+    monkeypatch.setattr(gti.config, "image_cache_index_path", str(tmp_path / "index.jsonl"))
+    monkeypatch.setattr(gti.config, "image_defer_signed_urls", True)
+
+    def run(prompt: str) -> Any:
+        return gti.generate_transformation_images(
+            prompt_atual=prompt,
+            prompt_intermediario="Stage two",
+            prompt_aspiracional="Stage three",
+            variation_idx=0,
+            metadata={"user_id": "user", "session_id": "sess"},
+        )
+
+    # A → B → A na mesma sessão e variação.
+    first = await run("Prompt A")
+    await run("Prompt B")
+    third = await run("Prompt A")
+
+    assert len(calls) == 5  # A (3 etapas) + B (etapas 1 e 2); o segundo A vem do cache
+    assert third["meta"]["image_cache_hits"] == [
+        "estado_aspiracional",
+        "estado_atual",
+        "estado_intermediario",
+    ]
+    for stage in ("estado_atual", "estado_intermediario"):
+        uri = third[stage]["gcs_uri"]
+        assert uri == first[stage]["gcs_uri"]
+        assert store.objects[uri.removeprefix("gs://")] == store.objects[
+            first[stage]["gcs_uri"].removeprefix("gs://")
+        ]
+    assert store.objects[third["estado_atual"]["gcs_uri"].removeprefix("gs://")] == b"img-1"
+
+
+@pytest.mark.asyncio
+async def test_generate_transformation_images_regenerates_when_cached_object_is_gone(
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Any,
+) -> None:
+    store = _FakeStore()
+    calls: list[str] = []
+
+    async def fake_call_model(inputs: list[Any]) -> Any:
+        calls.append("call")
+        return gti.GeneratedImage(data=f"img-{len(calls)}".encode())
+
+    monkeypatch.setattr(gti, "_call_model", lambda inputs: fake_call_model(list(inputs)))
+    monkeypatch.setattr(gti, "_storage_client", store)
+    monkeypatch.setenv("DELIVERIES_BUCKET", "gs://deliveries")
+    monkeypatch.setattr(gti.config, "image_cache_enabled", True)
+    monkeypatch.setattr(gti.config, "image_cache_index_path", str(tmp_path / "index.jsonl"))
+
+    kwargs = {
+        "prompt_atual": "Stage one",
+        "prompt_intermediario": "Stage two",
+        "prompt_aspiracional": "Stage three",
+        "variation_idx": 0,
+        "metadata": {"user_id": "user", "session_id": "sess"},
+    }
+    await gti.generate_transformation_images(**kwargs)
+    store.objects.clear()
+
+    result = await gti.generate_transformation_images(**kwargs)
+
+    assert len(calls) == 6
+    assert "image_cache_hits" not in result["meta"]
+
+
+@pytest.mark.asyncio
+async def test_generate_transformation_images_resumes_from_checkpoints(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    store = _FakeStore()
+    calls: list[str] = []
+    fail_aspirational = True
+
+    async def fake_call_model(inputs: list[Any]) -> Any:
+        prompt_text = next(item for item in inputs if isinstance(item, str))
+        if fail_aspirational and "ASPIRACIONAL" in prompt_text:
+            raise RuntimeError("quota exhausted")
+        calls.append(prompt_text)
+        return gti.GeneratedImage(data=f"img-{len(calls)}".encode())
+
+    monkeypatch.setattr(gti, "_call_model", lambda inputs: fake_call_model(list(inputs)))
+    monkeypatch.setattr(gti, "_storage_client", store)
+    monkeypatch.setenv("DELIVERIES_BUCKET", "gs://deliveries")
+
+    checkpoints: dict[str, dict[str, str]] = {}
+
+    def record_checkpoint(stage_label: str, record: dict[str, str]) -> None:
+        checkpoints[stage_label] = record
+
+    kwargs = {
+        "prompt_atual": "Stage one",
+        "prompt_intermediario": "Stage two",
+        "prompt_aspiracional": "Stage three",
+        "variation_idx": 1,
+        "metadata": {"user_id": "user", "session_id": "sess"},
+        "checkpoint_callback": record_checkpoint,
+    }
+    with pytest.raises(RuntimeError):
+        await gti.generate_transformation_images(**kwargs)
+
+    assert set(checkpoints) == {"estado_atual", "estado_intermediario"}
+    assert len(calls) == 2
+
+    fail_aspirational = False
+    result = await gti.generate_transformation_images(checkpoints=dict(checkpoints), **kwargs)
+
+    assert len(calls) == 3  # apenas a etapa aspiracional foi gerada de novo
+    assert result["meta"]["resumed_stages"] == ["estado_atual", "estado_intermediario"]
+    assert result["estado_atual"]["gcs_uri"] == checkpoints["estado_atual"]["gcs_uri"]
+    assert set(checkpoints) == {"estado_atual", "estado_intermediario", "estado_aspiracional"}
+
+    # Um prompt diferente invalida o checkpoint da etapa e de suas dependentes.
+    await gti.generate_transformation_images(
+        checkpoints=dict(checkpoints), **{**kwargs, "prompt_atual": "Stage one, revised"}
+    )
+    assert len(calls) == 5
+
+
+@pytest.mark.asyncio
+async def test_upload_image_adds_compressed_derivatives(monkeypatch: pytest.MonkeyPatch) -> None:
+    source = Image.effect_noise((1536, 1024), 40).convert("RGB")
+    buffer = BytesIO()
+    source.save(buffer, format="PNG")
+    original = gti.GeneratedImage(data=buffer.getvalue())
+
+    store = _FakeStore()
+    monkeypatch.setattr(gti, "_storage_client", store)
+    monkeypatch.setenv("DELIVERIES_BUCKET", "gs://deliveries")
+    monkeypatch.setattr(gti.config, "image_derivatives_enabled", True)
+    monkeypatch.setattr(gti.config, "image_derivative_workers", 0)
+    monkeypatch.setattr(gti.config, "image_defer_signed_urls", True)
+
+    upload = await gti._upload_image(
+        original,
+        user_id="user",
+        session_id="sess",
+        variation_idx=0,
+        stage_label="estado_atual",
+    )
+
+    assert set(upload.derivatives) == {"preview", "preview_jpeg", "thumb"}
+    preview = upload.derivatives["preview"]
+    assert preview["gcs_uri"] == (
+        "gs://deliveries/deliveries/user/sess/images/derivatives/estado_atual_0_preview.webp"
+    )
+    assert preview["mime_type"] == "image/webp"
+    thumb_bytes = store.objects[upload.derivatives["thumb"]["gcs_uri"].removeprefix("gs://")]
+    assert max(Image.open(BytesIO(thumb_bytes)).size) == 320
+    assert len(thumb_bytes) * 10 < len(original.data)
+    assert gti._stored_derivatives(upload)["thumb"] == {
+        "gcs_uri": upload.derivatives["thumb"]["gcs_uri"],
+        "mime_type": "image/webp",
+    }
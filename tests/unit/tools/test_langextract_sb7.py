@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import threading
+from dataclasses import replace
+from typing import Any
+
+import pytest
+
+from app.tools import langextract_sb7
+from app.tools.langextract_sb7 import StoryBrandExtractor
+
+_PAGE = "Você se sente cansada de dietas? Garanta sua vaga agora com 30% de desconto.\n" * 20
+
+
+class _ThreadRecordingCache:
+    def __init__(self) -> None:
+        self.data: dict[str, Any] = {}
+        self.threads: list[tuple[str, int]] = []
+
+    def get(self, key: str) -> Any:
+        self.threads.append(("get", threading.get_ident()))
+        return self.data.get(key)
+
+    def set(self, key: str, value: Any) -> None:
+        self.threads.append(("set", threading.get_ident()))
+        self.data[key] = value
+
+
+@pytest.fixture()
+def extractor(monkeypatch: pytest.MonkeyPatch) -> StoryBrandExtractor:
+    monkeypatch.setenv("STORYBRAND_CACHE_ENABLED", "true")
+    instance = StoryBrandExtractor()
+    instance._cache = _ThreadRecordingCache()
+    monkeypatch.setattr(instance, "_timed_extract", lambda kwargs, plan: {"raw": True})
+    monkeypatch.setattr(instance, "_convert_to_storybrand_format", lambda result: {"ok": result})
+
+    async def no_retry(func, **_kwargs):
+        return await func()
+
+    monkeypatch.setattr(langextract_sb7, "acall_with_vertex_retry", no_retry)
+    return instance
+
+
+@pytest.mark.asyncio
+async def test_aextract_reads_and_writes_cache_off_the_event_loop(
+    extractor: StoryBrandExtractor,
+) -> None:
+    loop_thread = threading.get_ident()
+
+    first = await extractor.aextract(_PAGE, landing_page_url="https://lp")
+    second = await extractor.aextract(_PAGE, landing_page_url="https://lp")
+
+    assert first == second == {"ok": {"raw": True}}
+    assert [op for op, _ in extractor._cache.threads] == ["get", "set", "get"]
+    assert all(thread != loop_thread for _, thread in extractor._cache.threads)
+
+
+def test_cache_key_ignores_workers_and_prereduced_input_is_sent_as_is(
+    extractor: StoryBrandExtractor, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    text = _PAGE * 20
+    plan = extractor.plan_input(text)
+    prepared, info = extractor.prepare_input(text, plan)
+    reductions: list[str] = []
+    monkeypatch.setattr(
+        langextract_sb7, "apply_plan", lambda *args: reductions.append("again") or args
+    )
+
+    kwargs, key = extractor._prepare_request(prepared, "https://lp", plan, info)
+    _, other_key = extractor._prepare_request(
+        prepared, "https://lp", replace(plan, max_workers=plan.max_workers + 3), info
+    )
+
+    assert reductions == []
+    assert kwargs["text_or_documents"] == prepared
+    assert key == other_key
+    assert plan.max_char_buffer % 500 == 0
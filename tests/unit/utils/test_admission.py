@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import asyncio
+import json
+from typing import Any
+
+import pytest
+
+from app.config import config
+from app.utils.admission import (
+    AdmissionController,
+    AdmissionMiddleware,
+    AdmissionRejectedError,
+)
+
+
+@pytest.mark.asyncio
+async def test_queued_runs_are_admitted_in_fifo_order_with_positions():
+    controller = AdmissionController(max_active=1, max_queued=2, queue_timeout=5)
+    await controller.acquire("s1")
+
+    second = asyncio.create_task(controller.acquire("s2"))
+    third = asyncio.create_task(controller.acquire("s3"))
+    await asyncio.sleep(0)
+
+    assert controller.status("s3") | {"retry_after": None} == {
+        "active": 1,
+        "queued": 2,
+        "max_active": 1,
+        "max_queued": 2,
+        "state": "queued",
+        "position": 2,
+        "retry_after": None,
+    }
+    assert controller.position("s1") == 0
+
+    controller.release("s1")
+    await second
+    assert not third.done()
+    assert controller.position("s3") == 1
+
+    controller.release("s2")
+    await third
+    assert controller.position("s3") == 0
+
+
+@pytest.mark.asyncio
+async def test_full_queue_and_queue_timeout_are_rejected_with_retry_after():
+    controller = AdmissionController(
+        max_active=1, max_queued=1, queue_timeout=0.01, initial_run_seconds=40
+    )
+    await controller.acquire("s1")
+    waiting = asyncio.create_task(controller.acquire("s2"))
+    await asyncio.sleep(0)
+
+    with pytest.raises(AdmissionRejectedError) as full:
+        await controller.acquire("s3")
+    assert full.value.reason == "queue_full"
+    assert full.value.retry_after == pytest.approx(80.0)
+
+    with pytest.raises(AdmissionRejectedError) as timed_out:
+        await waiting
+    assert timed_out.value.reason == "queue_timeout"
+    assert timed_out.value.position == 1
+    assert controller.status()["queued"] == 0
+
+    with pytest.raises(AdmissionRejectedError) as busy:
+        await controller.acquire("s1")
+    assert busy.value.reason == "session_busy"
+
+
+async def _call(app: Any, path: str, body: dict[str, Any]) -> dict[str, Any]:
+    payload = json.dumps(body).encode()
+    sent: list[dict[str, Any]] = []
+    received = [{"type": "http.request", "body": payload, "more_body": False}]
+
+    async def receive() -> dict[str, Any]:
+        return received.pop(0) if received else {"type": "http.disconnect"}
+
+    async def send(message: dict[str, Any]) -> None:
+        sent.append(message)
+
+    scope = {"type": "http", "method": "POST", "path": path, "headers": []}
+    await app(scope, receive, send)
+    start = next(m for m in sent if m["type"] == "http.response.start")
+    body_bytes = b"".join(m.get("body", b"") for m in sent if m["type"] == "http.response.body")
+    return {"status": start["status"], "headers": dict(start["headers"]), "body": body_bytes}
+
+
+@pytest.mark.asyncio
+async def test_middleware_holds_slot_for_whole_stream_and_returns_429(monkeypatch):
+    monkeypatch.setattr(config, "run_admission_enabled", True)
+    release_stream = asyncio.Event()
+    seen_bodies: list[bytes] = []
+
+    async def streaming_app(scope, receive, send):
+        message = await receive()
+        seen_bodies.append(message["body"])
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await release_stream.wait()
+        await send({"type": "http.response.body", "body": b"data: done\n\n"})
+
+    controller = AdmissionController(max_active=1, max_queued=0, queue_timeout=0)
+    app = AdmissionMiddleware(streaming_app, controller=controller)
+
+    first = asyncio.create_task(_call(app, "/run_sse", {"session_id": "s1"}))
+    await asyncio.sleep(0.01)
+    rejected = await _call(app, "/run_sse", {"sessionId": "s2"})
+
+    assert rejected["status"] == 429
+    assert int(rejected["headers"][b"retry-after"]) >= 1
+    assert json.loads(rejected["body"])["reason"] == "queue_full"
+
+    release_stream.set()
+    assert (await first)["status"] == 200
+    assert json.loads(seen_bodies[0]) == {"session_id": "s1"}
+    assert controller.status()["active"] == 0
+
+
+def test_installed_middleware_rejections_carry_cors_headers(monkeypatch):
+    from fastapi import FastAPI
+    from fastapi.middleware.cors import CORSMiddleware
+    from fastapi.testclient import TestClient
+
+    from app.utils import admission
+
+    monkeypatch.setattr(config, "run_admission_enabled", True)
+    controller = AdmissionController(max_active=1, max_queued=0, queue_timeout=0)
+    asyncio.run(controller.acquire("busy"))
+    monkeypatch.setattr(admission, "_controller", controller)
+    app = FastAPI()
+    app.add_middleware(CORSMiddleware, allow_origins=["https://app.example"])
+    admission.install_admission_middleware(app)
+
+    @app.post("/run_sse")
+    def run_sse() -> dict[str, str]:  # pragma: no cover - sempre rejeitado
+        return {}
+
+    response = TestClient(app).post(
+        "/run_sse", json={"session_id": "s1"}, headers={"Origin": "https://app.example"}
+    )
+
+    assert [item.cls for item in app.user_middleware] == [CORSMiddleware, AdmissionMiddleware]
+    assert response.status_code == 429
+    assert response.headers["access-control-allow-origin"] == "https://app.example"
+    assert int(response.headers["retry-after"]) >= 1
+
+
+@pytest.mark.asyncio
+async def test_middleware_refuses_runs_without_quota_before_streaming(monkeypatch):
+    from app.utils import quotas
+
+    monkeypatch.setattr(config, "run_admission_enabled", True)
+    monkeypatch.setattr(config, "user_quota_enabled", True)
+    monkeypatch.setattr(config, "enable_image_generation", False)
+    monkeypatch.setattr(config, "user_quota_llm_calls_per_hour", 3600.0)
+    monkeypatch.setattr(config, "user_quota_llm_calls_burst", 1)
+    monkeypatch.setattr(quotas, "_quotas", quotas.UserQuotas())
+    started: list[str] = []
+
+    async def pipeline_app(scope, receive, send):
+        started.append(scope["path"])
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"data: ok\n\n"})
+
+    controller = AdmissionController(max_active=2, max_queued=0, queue_timeout=0)
+    app = AdmissionMiddleware(pipeline_app, controller=controller)
+
+    assert (await _call(app, "/run_sse", {"userId": "u1", "sessionId": "s1"}))["status"] == 200
+    quotas.charge_user_quota("u1", quotas.LLM_CALLS)
+    rejected = await _call(app, "/run_sse", {"user_id": "u1", "session_id": "s2"})
+    other_user = await _call(app, "/run_sse", {"user_id": "u2", "session_id": "s3"})
+
+    assert rejected["status"] == 429
+    assert int(rejected["headers"][b"retry-after"]) >= 1
+    assert json.loads(rejected["body"]) | {"retry_after": None} == {
+        "detail": "Cota do usuário esgotada; tente novamente mais tarde.",
+        "reason": "user_quota",
+        "resource": "llm_calls",
+        "retry_after": None,
+    }
+    assert other_user["status"] == 200
+    assert started == ["/run_sse", "/run_sse"]
+    assert controller.status()["active"] == 0
+
+
+@pytest.mark.asyncio
+async def test_middleware_records_session_owner_for_status_routes(monkeypatch):
+    monkeypatch.setattr(config, "run_admission_enabled", True)
+
+    async def pipeline_app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"data: ok\n\n"})
+
+    controller = AdmissionController(max_active=2, max_queued=0, queue_timeout=0, max_owners=2)
+    app = AdmissionMiddleware(pipeline_app, controller=controller)
+
+    await _call(app, "/run_sse", {"userId": "u1", "sessionId": "s1"})
+    await _call(app, "/run_sse", {"user_id": "u2", "session_id": "s2"})
+    assert controller.owner("s1") == "u1"
+    assert controller.owner("s2") == "u2"
+
+    await _call(app, "/run_sse", {"user_id": "u3", "session_id": "s3"})
+    assert controller.owner("s1") is None  # só as sessões mais recentes
+    assert controller.owner("s3") == "u3"
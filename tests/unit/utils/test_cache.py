@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+
+from app.utils import cache
+
+
+def _analysis(index: int) -> dict:
+    return {
+        "metadata": {"index": index},
+        "character": {"description": "Mães ocupadas " * 20},
+        "problem": {"types": {"external": f"problema {index}"}},
+    }
+
+
+def test_sqlite_cache_round_trips_compressed_payloads(tmp_path: Path) -> None:
+    store = cache.SqliteResponseCache(tmp_path / "sb" / "cache.sqlite3")
+
+    assert store.get("missing") is None
+    store.set("k1", _analysis(1))
+
+    assert store.get("k1") == _analysis(1)
+    stats = store.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 1 and stats["entries"] == 1
+    # O payload repetitivo deve ocupar bem menos que o JSON bruto.
+    assert stats["bytes"] < len(str(_analysis(1)))
+
+
+def test_sqlite_cache_is_shared_between_instances(tmp_path: Path) -> None:
+    path = tmp_path / "cache.sqlite3"
+    writer = cache.SqliteResponseCache(path)
+    reader = cache.SqliteResponseCache(path)
+
+    writer.set(cache.make_storybrand_cache_key("model", "https://lp"), _analysis(2))
+
+    assert reader.get(cache.make_storybrand_cache_key("model", "https://lp")) == _analysis(2)
+
+
+def test_sqlite_cache_expires_entries(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    now = [1_000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+    store = cache.SqliteResponseCache(tmp_path / "cache.sqlite3", ttl_seconds=60)
+
+    store.set("k1", _analysis(1))
+    now[0] += 59
+    assert store.get("k1") == _analysis(1)
+    now[0] += 2
+
+    assert store.get("k1") is None
+    assert store.stats()["expired"] == 1
+    assert store.stats()["entries"] == 0
+
+
+def test_sqlite_cache_evicts_least_recently_read(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    now = [1_000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+    probe = cache.SqliteResponseCache(tmp_path / "probe.sqlite3")
+    probe.set("k", _analysis(0))
+    entry_size = probe.stats()["bytes"]
+    store = cache.SqliteResponseCache(
+        tmp_path / "cache.sqlite3", max_bytes=int(entry_size * 2.5)
+    )
+
+    store.set("k1", _analysis(1))
+    now[0] += 100
+    store.set("k2", _analysis(2))
+    now[0] += 100
+    assert store.get("k1") is not None  # k1 passa a ser o mais recente
+    now[0] += 100
+    store.set("k3", _analysis(3))
+
+    assert store.get("k2") is None
+    assert store.get("k1") is not None
+    assert store.get("k3") is not None
+    assert store.stats()["evictions"] == 1
+
+
+def test_storybrand_cache_backend_is_selected_from_env(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(cache, "_storybrand_cache", None)
+    monkeypatch.setenv("STORYBRAND_CACHE_BACKEND", "sqlite")
+    monkeypatch.setenv("STORYBRAND_CACHE_PATH", str(tmp_path / "sb.sqlite3"))
+
+    selected = cache.get_storybrand_cache()
+
+    assert isinstance(selected, cache.SqliteResponseCache)
+    assert cache.get_storybrand_cache() is selected
+    assert selected.path == tmp_path / "sb.sqlite3"
+
+
+def test_memory_cache_expires_due_entries_without_full_scan(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    now = [1_000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+    store = cache.InMemoryResponseCache(maxsize=10, ttl_seconds=60)
+
+    store.set("k1", "a")
+    now[0] += 30
+    store.set("k2", "b")
+    store.set("k1", "c")  # sobrescrita deixa o registro antigo obsoleto no heap
+    now[0] += 31
+
+    assert store.get("k2") == "b"
+    assert store.get("k1") == "c"
+    now[0] += 30
+
+    assert store.get("k1") is None
+    stats = store.stats()
+    assert stats["entries"] == 0
+    assert stats["expired"] == 2
+    assert stats["bytes"] == 0
+
+
+def test_memory_cache_tracks_bytes_and_evicts_over_limit() -> None:
+    store = cache.InMemoryResponseCache(maxsize=10, ttl_seconds=None, max_bytes=10)
+
+    store.set("k1", "aaaa")
+    store.set("k2", "bbbb")
+    assert store.get("k1") == "aaaa"
+    store.set("k3", "cccc")
+
+    assert store.get("k2") is None
+    stats = store.stats()
+    assert stats["bytes"] == 8
+    assert stats["evictions"] == 1
+    assert store.delete("k1") is True
+    assert store.delete("k1") is False
+    assert store.stats()["bytes"] == 4
+
+
+def test_memory_cache_get_or_set_calls_loader_once() -> None:
+    store = cache.InMemoryResponseCache(maxsize=4)
+    calls: list[str] = []
+
+    def loader() -> dict:
+        calls.append("load")
+        return _analysis(1)
+
+    assert store.get_or_set("k1", loader) == _analysis(1)
+    assert store.get_or_set("k1", loader) == _analysis(1)
+    assert store.get_or_set("none", lambda: None) is None
+
+    assert calls == ["load"]
+    assert store.get("none") is None
+    assert store.stats()["hits"] == 1
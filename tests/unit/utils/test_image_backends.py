@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+from importlib import import_module
+from io import BytesIO
+from typing import Any
+
+import pytest
+from google.genai import types
+from PIL import Image
+
+from app.utils import image_backends, vertex_health, vertex_scheduler
+from app.utils.image_backends import (
+    InjectedBackendError,
+    InjectedThrottleError,
+    LocalBlobStore,
+    LocalImageClient,
+)
+
+gti = import_module("app.tools.generate_transformation_images")
+
+
+def _contents(text: str) -> list[types.Content]:
+    return [types.Content(role="user", parts=[types.Part.from_text(text=text)])]
+
+
+@pytest.mark.asyncio
+async def test_local_client_returns_deterministic_pngs() -> None:
+    client = LocalImageClient()
+
+    first = await client.aio.models.generate_content(model="m", contents=_contents("a"))
+    again = await client.aio.models.generate_content(model="m", contents=_contents("a"))
+    other = await client.aio.models.generate_content(model="m", contents=_contents("b"))
+
+    data = first.candidates[0].content.parts[0].inline_data.data
+    assert data == again.candidates[0].content.parts[0].inline_data.data
+    assert data != other.candidates[0].content.parts[0].inline_data.data
+    assert Image.open(BytesIO(data)).format == "PNG"
+
+
+@pytest.mark.asyncio
+async def test_local_client_injects_errors_reproducibly() -> None:
+    async def outcomes(seed: int) -> list[bool]:
+        client = LocalImageClient(error_rate=0.5, seed=seed)
+        results = []
+        for _ in range(20):
+            try:
+                await client.aio.models.generate_content(model="m", contents=_contents("x"))
+                results.append(True)
+            except InjectedBackendError:
+                results.append(False)
+        return results
+
+    first = await outcomes(7)
+    assert first == await outcomes(7)
+    assert True in first and False in first
+
+
+def test_local_blob_store_round_trip(tmp_path: Any) -> None:
+    store = LocalBlobStore(tmp_path)
+    blob = store.bucket("deliveries").blob("a/b.png")
+
+    assert not blob.exists()
+    blob.upload_from_string(b"png", content_type="image/png")
+
+    reread = store.bucket("deliveries").blob("a/b.png")
+    assert reread.exists()
+    assert reread.download_as_bytes() == b"png"
+    assert reread.generate_signed_url().startswith("file://")
+
+
+@pytest.mark.asyncio
+async def test_generate_transformation_images_runs_on_local_backend(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Any
+) -> None:
+    monkeypatch.setattr(image_backends.config, "image_backend", "local")
+    monkeypatch.setattr(image_backends.config, "image_local_backend_dir", str(tmp_path))
+    monkeypatch.setattr(image_backends.config, "image_cache_enabled", False)
+    monkeypatch.setattr(image_backends.config, "image_derivative_workers", 0)
+    monkeypatch.setattr(gti, "_client", None)
+    monkeypatch.setattr(gti, "_storage_client", None)
+    monkeypatch.setenv("DELIVERIES_BUCKET", "gs://deliveries")
+
+    result = await gti.generate_transformation_images(
+        prompt_atual="Atual",
+        prompt_intermediario="Intermediário",
+        prompt_aspiracional="Aspiracional",
+        variation_idx=0,
+        metadata={"user_id": "user", "session_id": "sess"},
+    )
+
+    assert isinstance(gti._client, LocalImageClient)
+    assert gti._client.models.calls == 3
+    for stage in ("estado_atual", "estado_intermediario", "estado_aspiracional"):
+        uri = result[stage]["gcs_uri"]
+        assert uri.startswith("gs://deliveries/")
+        assert (tmp_path / uri.removeprefix("gs://")).is_file()
+
+
+@pytest.mark.asyncio
+async def test_image_call_fails_over_from_throttled_region(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    import random
+
+    monkeypatch.setattr(image_backends.config, "image_backend", "local")
+    monkeypatch.setattr(image_backends.config, "image_local_throttled_regions", "us-central1")
+    monkeypatch.setattr(image_backends.config, "image_raw_passthrough", True)
+    monkeypatch.setenv("GOOGLE_CLOUD_LOCATION", "us-central1")
+    monkeypatch.setattr(gti, "_client", None)
+    monkeypatch.setattr(gti, "_regional_clients", {})
+    # Estado por modelo usado por gti (limitador, circuito); as regiões vêm do pool abaixo.
+    monkeypatch.setattr(vertex_scheduler, "_limiters", {})
+    monkeypatch.setattr(vertex_health, "_circuits", {})
+    pool = vertex_health.VertexRegionPool(
+        ["us-central1", "us-east4"], rng=random.Random(1)
+    )
+    monkeypatch.setattr(gti, "get_region_pool", lambda _model: pool)
+    sleeps: list[float] = []
+
+    async def fake_sleep(seconds: float) -> None:
+        sleeps.append(seconds)
+
+    monkeypatch.setattr(gti.asyncio, "sleep", fake_sleep)
+
+    first = await gti._call_model(["primeira"])
+    await gti._call_model(["segunda"])
+
+    assert isinstance(first, gti.GeneratedImage)
+    assert sleeps == []
+    assert gti._regional_clients["us-east4"].models.calls == 2
+    assert pool.snapshot()["us-east4"]["successes"] == 2
+    if gti._client is not None:  # us-central1 só é tentada antes do cooldown
+        assert gti._client.models.calls == 1
+        with pytest.raises(InjectedThrottleError):
+            await gti._client.aio.models.generate_content(model="m", contents=_contents("x"))
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+
+from app.utils import image_cache
+
+
+def test_make_image_cache_key_is_stable_and_sensitive_to_inputs() -> None:
+    base = {
+        "model": "gemini-2.5-flash-image",
+        "generation_config": {"temperature": 0.9},
+        "prompt": "Estado atual",
+        "reference_keys": ["char-1|gs://b/char-1", "prod-1|gs://b/prod-1"],
+    }
+
+    key = image_cache.make_image_cache_key(**base)
+
+    assert key == image_cache.make_image_cache_key(
+        **{**base, "reference_keys": list(reversed(base["reference_keys"]))}
+    )
+    assert key != image_cache.make_image_cache_key(**{**base, "prompt": "Outro"})
+    assert key != image_cache.make_image_cache_key(
+        **{**base, "generation_config": {"temperature": 0.1}}
+    )
+    assert key != image_cache.make_image_cache_key(**base, parent_key="abc")
+    assert image_cache.make_image_cache_key(**base, owner="a") != image_cache.make_image_cache_key(
+        **base, owner="b"
+    )
+
+
+def test_generated_image_index_persists_entries_and_deletions(tmp_path: Path) -> None:
+    path = tmp_path / "cache" / "index.jsonl"
+    index = image_cache.GeneratedImageIndex(path)
+
+    index.put("k1", gcs_uri="gs://bucket/one.png", mime_type="image/png")
+    index.put("k2", gcs_uri="gs://bucket/two.png", mime_type="image/png")
+    index.discard("k1")
+
+    reopened = image_cache.GeneratedImageIndex(path)
+    assert reopened.get("k1") is None
+    record = reopened.get("k2")
+    assert record is not None
+    assert record["gcs_uri"] == "gs://bucket/two.png"
+
+
+def test_generated_image_index_sees_entries_from_other_workers(tmp_path: Path) -> None:
+    path = tmp_path / "index.jsonl"
+    reader = image_cache.GeneratedImageIndex(path)
+    writer = image_cache.GeneratedImageIndex(path)
+    assert reader.get("k1") is None
+
+    writer.put("k1", gcs_uri="gs://bucket/one.png", mime_type="image/png", content_hash="abc")
+
+    record = reader.get("k1")
+    assert record is not None
+    assert record["content_hash"] == "abc"
+
+
+def test_generated_image_index_compacts_stale_lines(tmp_path: Path) -> None:
+    path = tmp_path / "index.jsonl"
+    index = image_cache.GeneratedImageIndex(path, compact_slack=4)
+    other = image_cache.GeneratedImageIndex(path)
+    assert other.get("k0") is None
+
+    for round_ in range(5):
+        for key in ("k0", "k1"):
+            index.put(key, gcs_uri=f"gs://bucket/{key}-{round_}.png", mime_type="image/png")
+
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert len(lines) <= 2 * 2 + 4
+    reopened = image_cache.GeneratedImageIndex(path)
+    assert reopened.get("k0")["gcs_uri"] == "gs://bucket/k0-4.png"
+    # Um worker que leu o arquivo antes da compactação relê do início.
+    assert other.get("k1")["gcs_uri"] == "gs://bucket/k1-4.png"
+    other.put("k2", gcs_uri="gs://bucket/k2.png", mime_type="image/png")
+    assert index.get("k2") is not None
+
+
+def test_get_generated_image_index_honours_opt_out(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    monkeypatch.setattr(image_cache.config, "image_cache_enabled", False)
+    assert image_cache.get_generated_image_index() is None
+
+    monkeypatch.setattr(image_cache.config, "image_cache_enabled", True)
+    monkeypatch.setattr(image_cache.config, "image_cache_index_path", str(tmp_path / "i.jsonl"))
+    index = image_cache.get_generated_image_index()
+    assert index is not None
+    assert index.path == tmp_path / "i.jsonl"
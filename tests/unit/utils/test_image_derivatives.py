@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import subprocess
+import sys
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from app.utils import image_derivatives
+from app.utils.image_derivatives import (
+    DerivativeSpec,
+    build_derivatives,
+    encode_derivatives,
+)
+
+
+def _png(size: tuple[int, int]) -> bytes:
+    buffer = BytesIO()
+    Image.effect_noise(size, 30).convert("RGB").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_encode_derivatives_resizes_and_keeps_spec_order() -> None:
+    specs = (
+        DerivativeSpec(name="thumb", format="WEBP", max_side=64, quality=60),
+        DerivativeSpec(name="preview", format="JPEG", max_side=256, quality=80),
+    )
+
+    results = encode_derivatives(_png((512, 384)), specs)
+
+    assert [item.name for item in results] == ["thumb", "preview"]
+    thumb, preview = results
+    assert (thumb.width, thumb.height) == (64, 48)
+    assert (preview.width, preview.height) == (256, 192)
+    assert preview.mime_type == "image/jpeg" and preview.extension == "jpg"
+    assert Image.open(BytesIO(thumb.data)).format == "WEBP"
+
+
+def test_encode_derivatives_never_upscales() -> None:
+    spec = DerivativeSpec(name="preview", format="WEBP", max_side=1024, quality=80)
+
+    (result,) = encode_derivatives(_png((200, 100)), (spec,))
+
+    assert (result.width, result.height) == (200, 100)
+
+
+@pytest.mark.asyncio
+async def test_build_derivatives_uses_thread_when_pool_disabled(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(image_derivatives.config, "image_derivative_workers", 0)
+
+    results = await build_derivatives(_png((400, 400)))
+
+    assert {item.name for item in results} == {"preview", "preview_jpeg", "thumb"}
+
+
+def test_pool_worker_module_does_not_import_config_or_agents() -> None:
+    # Os workers (spawn) importam apenas o módulo da função enviada ao pool.
+    code = (
+        "import sys, app.utils.derivative_encoding; "
+        "loaded = [m for m in ('app.config', 'app.agent', 'google.adk') if m in sys.modules]; "
+        "print(loaded)"
+    )
+
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+
+    assert result.stdout.strip().splitlines()[-1] == "[]"
+    assert image_derivatives.encode_derivatives.__module__ == "app.utils.derivative_encoding"
@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+import pytest
+
+from app.config import config
+from app.utils import quotas
+from app.utils.quotas import (
+    GCS_BYTES,
+    IMAGE_GENERATIONS,
+    LLM_CALLS,
+    QuotaExceededError,
+    TokenBucket,
+    UserQuotas,
+)
+
+
+@pytest.fixture(autouse=True)
+def _quota_config(monkeypatch):
+    monkeypatch.setattr(config, "user_quota_enabled", True)
+    monkeypatch.setattr(config, "user_quota_llm_calls_per_hour", 3600.0)  # 1 por segundo
+    monkeypatch.setattr(config, "user_quota_llm_calls_burst", 2)
+    monkeypatch.setattr(config, "user_quota_gcs_mb_per_hour", 3600.0)
+    monkeypatch.setattr(config, "user_quota_gcs_mb_burst", 1)
+
+
+def test_token_bucket_refills_and_caps_oversized_requests():
+    now = {"t": 0.0}
+    bucket = TokenBucket(rate_per_second=2.0, capacity=4, clock=lambda: now["t"])
+
+    assert bucket.consume(4) == 0.0
+    assert bucket.consume(1) == pytest.approx(0.5)
+    now["t"] = 1.0
+    assert bucket.remaining() == pytest.approx(2.0)
+    assert bucket.consume(100) == pytest.approx(1.0)  # limitado à capacidade (4)
+
+
+def test_quota_is_per_user_and_reports_retry_after():
+    now = {"t": 0.0}
+    user_quotas = UserQuotas(clock=lambda: now["t"])
+
+    user_quotas.charge("ana", LLM_CALLS)
+    user_quotas.charge("ana", LLM_CALLS)
+    with pytest.raises(QuotaExceededError) as excinfo:
+        user_quotas.charge("ana", LLM_CALLS)
+    assert excinfo.value.resource == LLM_CALLS
+    assert excinfo.value.retry_after == pytest.approx(1.0)
+
+    user_quotas.charge("bruno", LLM_CALLS)  # outro usuário, outro balde
+    user_quotas.charge("anonymous", LLM_CALLS, 1000)  # sem usuário: não medido
+    user_quotas.charge("ana", GCS_BYTES, 512 * 1024)
+
+    now["t"] = 1.0
+    user_quotas.charge("ana", LLM_CALLS)
+    report = user_quotas.report("ana")
+    assert report["enabled"] is True
+    assert report["resources"][LLM_CALLS]["remaining"] == 0
+    assert report["resources"][GCS_BYTES]["remaining"] == 1024 * 1024
+    assert report["resources"][IMAGE_GENERATIONS]["capacity"] == config.user_quota_images_burst
+
+
+def test_check_reports_exhaustion_without_consuming():
+    now = {"t": 0.0}
+    user_quotas = UserQuotas(clock=lambda: now["t"])
+
+    user_quotas.check("ana", LLM_CALLS)
+    user_quotas.check("ana", LLM_CALLS)
+    assert user_quotas.report("ana")["resources"][LLM_CALLS]["remaining"] == 2
+
+    user_quotas.charge("ana", LLM_CALLS, 2)
+    with pytest.raises(QuotaExceededError) as excinfo:
+        user_quotas.check("ana", LLM_CALLS)
+    assert excinfo.value.retry_after == pytest.approx(1.0)
+
+
+def test_settle_replaces_reservation_with_actual_amount():
+    now = {"t": 0.0}
+    user_quotas = UserQuotas(clock=lambda: now["t"])
+    mb = 1024 * 1024
+
+    user_quotas.charge("ana", GCS_BYTES, mb // 2)  # reserva
+    user_quotas.settle("ana", GCS_BYTES, reserved=mb // 2, actual=mb // 4)
+    assert user_quotas.report("ana")["resources"][GCS_BYTES]["remaining"] == 3 * mb // 4
+
+    # Acerto acima do saldo não recusa o upload já feito: fica como débito.
+    user_quotas.settle("ana", GCS_BYTES, reserved=0, actual=mb)
+    with pytest.raises(QuotaExceededError):
+        user_quotas.check("ana", GCS_BYTES)
+
+
+def test_full_and_least_recent_buckets_are_evicted():
+    now = {"t": 0.0}
+    user_quotas = UserQuotas(clock=lambda: now["t"], max_buckets=2, sweep_interval=10.0)
+
+    user_quotas.charge("ana", LLM_CALLS)
+    user_quotas.charge("bruno", LLM_CALLS)
+    user_quotas.charge("ana", LLM_CALLS)  # ana fica mais recente que bruno
+    user_quotas.charge("carla", LLM_CALLS)
+    assert set(user_quotas._buckets) == {("ana", LLM_CALLS), ("carla", LLM_CALLS)}
+    with pytest.raises(QuotaExceededError):
+        user_quotas.charge("ana", LLM_CALLS)  # saldo preservado
+
+    now["t"] = 10.0  # todos reabastecidos: a varredura remove os baldes cheios
+    user_quotas.charge("daniel", LLM_CALLS)
+    assert set(user_quotas._buckets) == {("daniel", LLM_CALLS)}
+
+
+def test_disabled_quotas_never_raise(monkeypatch):
+    monkeypatch.setattr(config, "user_quota_enabled", False)
+    user_quotas = UserQuotas()
+    for _ in range(10):
+        user_quotas.charge("ana", LLM_CALLS)
+
+
+def test_vertex_permit_path_charges_tagged_user(monkeypatch):
+    import app.utils.vertex_retry as vertex_retry
+
+    monkeypatch.setattr(quotas, "_quotas", UserQuotas())
+    calls = {"count": 0}
+
+    def call() -> str:
+        calls["count"] += 1
+        return "ok"
+
+    with vertex_retry.vertex_call_context(user_id="ana"):
+        assert vertex_retry.call_with_vertex_retry(call) == "ok"
+        assert vertex_retry.call_with_vertex_retry(call) == "ok"
+        with pytest.raises(QuotaExceededError):
+            vertex_retry.call_with_vertex_retry(call)
+    assert calls["count"] == 2
+    assert vertex_retry.call_with_vertex_retry(call) == "ok"  # fora do contexto: anônimo
+
+
+def test_retries_and_hedges_charge_one_call(monkeypatch):
+    import app.utils.vertex_retry as vertex_retry
+
+    monkeypatch.setattr(quotas, "_quotas", UserQuotas())
+    monkeypatch.setattr(vertex_retry.time, "sleep", lambda _: None)
+    attempts = {"count": 0}
+
+    class _Throttled(Exception):
+        status_code = 429
+
+    def flaky() -> str:
+        attempts["count"] += 1
+        if attempts["count"] % 2:
+            raise _Throttled("vertex throttle")
+        return "ok"
+
+    with vertex_retry.vertex_call_context(user_id="ana"):
+        assert vertex_retry.call_with_vertex_retry(flaky, jitter=0.0) == "ok"
+        assert vertex_retry.call_with_vertex_retry(flaky, jitter=0.0) == "ok"
+        with pytest.raises(QuotaExceededError):
+            vertex_retry.call_with_vertex_retry(flaky, jitter=0.0)
+    assert attempts["count"] == 4  # 2 chamadas lógicas, 4 tentativas, 2 créditos
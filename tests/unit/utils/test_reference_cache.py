@@ -1,6 +1,8 @@
 from __future__ import annotations
 
+import threading
 from datetime import datetime, timezone
+from types import SimpleNamespace
 from typing import Iterator
 
 import pytest
@@ -129,3 +131,78 @@ def test_purge_expired_entries(monkeypatch: pytest.MonkeyPatch) -> None:
     backend.purge_expired()
     # The entry expires because the purge occurs after TTL.
     assert backend.get(metadata.id) is None
+
+
+def test_reference_image_cache_evicts_by_size_and_counts_hits() -> None:
+    cache = reference_cache.ReferenceImageCache(max_bytes=10, ttl_seconds=60)
+
+    cache.set("a", b"12345", object())
+    cache.set("b", b"12345", object())
+    assert cache.get("a") is not None  # refresh "a" so "b" is the LRU entry
+    cache.set("c", b"123", object())
+
+    assert cache.get("b") is None
+    assert cache.get("c") is not None
+    stats = cache.stats()
+    assert stats == {
+        "hits": 2,
+        "misses": 1,
+        "evictions": 1,
+        "entries": 2,
+        "size_bytes": 8,
+    }
+
+    # Entries larger than the whole budget are returned but never stored.
+    oversized = cache.set("d", b"x" * 11, object())
+    assert oversized.data == b"x" * 11
+    assert cache.get("d") is None
+
+
+def test_reference_image_cache_counts_converted_payload_bytes() -> None:
+    cache = reference_cache.ReferenceImageCache(max_bytes=100, ttl_seconds=60)
+    original = b"G" * 20
+
+    passthrough = cache.set("same", original, SimpleNamespace(data=original))
+    converted = cache.set("png", original, SimpleNamespace(data=b"P" * 50))
+
+    assert passthrough.size_bytes == 20
+    assert converted.size_bytes == 70
+    assert cache.stats()["size_bytes"] == 90
+
+
+def test_reference_image_cache_respects_ttl(monkeypatch: pytest.MonkeyPatch) -> None:
+    clock = iter([10.0, 12.0, 20.0])
+    monkeypatch.setattr(reference_cache.time, "monotonic", lambda: next(clock))
+    cache = reference_cache.ReferenceImageCache(max_bytes=100, ttl_seconds=5)
+
+    cache.set("ref", b"data", object())
+    assert cache.get("ref") is not None
+    assert cache.get("ref") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_reference_image_cache_loads_each_key_once_across_threads() -> None:
+    cache = reference_cache.ReferenceImageCache(max_bytes=1_000, ttl_seconds=60)
+    calls: list[int] = []
+    started = threading.Event()
+
+    def loader() -> tuple[bytes, object]:
+        calls.append(1)
+        started.wait(timeout=1)
+        return b"payload", "decoded"
+
+    results: list[object] = []
+    threads = [
+        threading.Thread(target=lambda: results.append(cache.get_or_load("ref", loader).image))
+        for _ in range(3)
+    ]
+    for thread in threads:
+        thread.start()
+    started.set()
+    for thread in threads:
+        thread.join(timeout=2)
+
+    assert calls == [1]
+    assert results == ["decoded", "decoded", "decoded"]
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["hits"] == 2
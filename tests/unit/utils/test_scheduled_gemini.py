@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import os
+
+import pytest
+from google.adk.models.google_llm import Gemini
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from google.adk.models.registry import LLMRegistry
+
+from app.config import DevelopmentConfiguration
+from app.utils import vertex_health, vertex_retry, vertex_scheduler
+from app.utils.scheduled_gemini import ScheduledGemini
+
+
+@pytest.fixture(autouse=True)
+def _isolated_vertex_state(monkeypatch):
+    monkeypatch.setattr(vertex_scheduler, "_limiters", {})
+    monkeypatch.setattr(vertex_health, "_circuits", {})
+
+
+@pytest.mark.asyncio
+async def test_scheduled_gemini_releases_permit_before_yielding(monkeypatch):
+    async def fake_generate(self, llm_request, stream=False):
+        pool = vertex_retry.get_vertex_limiter("gemini-2.5-flash").pool
+        assert pool.in_use == 1
+        yield LlmResponse()
+
+    monkeypatch.setattr(Gemini, "generate_content_async", fake_generate)
+    llm = ScheduledGemini(model="gemini-2.5-flash")
+
+    received = []
+    async for response in llm.generate_content_async(LlmRequest(model="gemini-2.5-flash")):
+        # O fluxo do ADK roda ferramentas aqui; a permissão já foi devolvida.
+        assert vertex_retry.get_vertex_limiter("gemini-2.5-flash").pool.in_use == 0
+        received.append(response)
+
+    assert len(received) == 1
+
+
+@pytest.mark.asyncio
+async def test_scheduled_gemini_fails_fast_when_circuit_open(monkeypatch):
+    calls = {"count": 0}
+
+    async def fake_generate(self, llm_request, stream=False):
+        calls["count"] += 1
+        yield LlmResponse()
+
+    monkeypatch.setattr(Gemini, "generate_content_async", fake_generate)
+    circuit = vertex_retry.VertexCircuitBreaker("gemini-2.5-pro", min_calls=1)
+    monkeypatch.setitem(vertex_health._circuits, circuit.model, circuit)
+    circuit.record_failure()
+
+    llm = ScheduledGemini(model="gemini-2.5-pro")
+    with pytest.raises(vertex_retry.VertexCircuitOpenError):
+        async for _ in llm.generate_content_async(LlmRequest(model="gemini-2.5-pro")):
+            pass
+    assert calls["count"] == 0
+
+
+
+def test_default_config_keeps_adk_agents_off_the_vertex_permits(monkeypatch):
+    monkeypatch.delenv("ENABLE_LLM_SCHEDULER", raising=False)
+    assert DevelopmentConfiguration().enable_llm_scheduler is False
+
+
+@pytest.mark.skipif(
+    os.getenv("ENABLE_LLM_SCHEDULER", "").lower() == "true",
+    reason="scheduler habilitado no ambiente",
+)
+def test_adk_gemini_models_skip_the_scheduler_by_default():
+    import app.agent  # noqa: F401
+
+    # Sem o scheduler, os agentes não dividem as permissões de VERTEX_CONCURRENCY_LIMIT
+    assert LLMRegistry.resolve("gemini-2.5-flash") is not ScheduledGemini
@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+import pytest
+
+from app.config import config
+from app.utils.session_budget import (
+    budget_level,
+    budget_remaining,
+    record_degradation,
+    record_llm_calls,
+    start_session_budget,
+)
+
+
+@pytest.fixture(autouse=True)
+def _budget_config(monkeypatch):
+    monkeypatch.setattr(config, "session_budget_enabled", True)
+    monkeypatch.setattr(config, "session_budget_low_fraction", 0.2)
+
+
+def test_budget_level_uses_tightest_of_time_and_calls():
+    state: dict = {}
+    start_session_budget(state, seconds=100, llm_calls=10, now=1000.0)
+
+    assert budget_level(state, now=1010.0) == "ok"
+    record_llm_calls(state, 8)
+    assert budget_remaining(state, now=1010.0) == pytest.approx(0.2)
+    assert budget_level(state, now=1010.0) == "low"
+
+    state2: dict = {}
+    start_session_budget(state2, seconds=100, llm_calls=10, now=1000.0)
+    assert budget_level(state2, now=1100.0) == "exhausted"
+
+
+def test_budget_disabled_or_missing_is_always_ok(monkeypatch):
+    assert budget_level({}) == "ok"
+    state: dict = {}
+    start_session_budget(state, seconds=1, llm_calls=1, now=0.0)
+    monkeypatch.setattr(config, "session_budget_enabled", False)
+    assert budget_level(state, now=50.0) == "ok"
+
+
+def test_degradation_is_recorded_once_in_audit_trail():
+    state: dict = {}
+    start_session_budget(state, seconds=100, llm_calls=10)
+
+    assert record_degradation(state, stage="code_review_loop", action="cut", detail="x")
+    assert not record_degradation(state, stage="code_review_loop", action="cut", detail="x")
+
+    assert [item["action"] for item in state["session_budget"]["degradations"]] == ["cut"]
+    (event,) = state["delivery_audit_trail"]
+    assert event["stage"] == "code_review_loop"
+    assert event["status"] == "degraded"
+    assert event["action"] == "cut"
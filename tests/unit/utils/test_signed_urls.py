@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+from types import SimpleNamespace
+from typing import Any
+
+import pytest
+
+from app.utils import signed_urls
+from app.utils.signed_urls import SignedUrlSigner, hydrate_image_urls
+
+
+class _FakeStorage:
+    def __init__(self) -> None:
+        self.calls: list[tuple[str, dict[str, Any]]] = []
+
+    def bucket(self, bucket_name: str) -> SimpleNamespace:
+        storage = self
+
+        class _Blob:
+            def __init__(self, name: str) -> None:
+                self.path = f"{bucket_name}/{name}"
+
+            def generate_signed_url(self, **kwargs: Any) -> str:
+                storage.calls.append((self.path, kwargs))
+                return f"https://signed/{self.path}?n={len(storage.calls)}"
+
+        return SimpleNamespace(blob=_Blob)
+
+
+def _variation(prefix: str) -> dict[str, Any]:
+    return {
+        "visual": {
+            "image_estado_atual_gcs": f"gs://bucket/{prefix}/atual.png",
+            "image_estado_intermediario_gcs": f"gs://bucket/{prefix}/intermediario.png",
+            "image_estado_aspiracional_gcs": f"gs://bucket/{prefix}/aspiracional.jpg",
+        }
+    }
+
+
+def test_sign_reuses_cached_url_within_ttl(monkeypatch: pytest.MonkeyPatch) -> None:
+    storage = _FakeStorage()
+    signer = SignedUrlSigner(storage_client=storage, credentials=SimpleNamespace(sign_bytes=None))
+    monkeypatch.setattr(signed_urls.config, "image_signed_url_ttl", 3600)
+
+    first = signer.sign("gs://bucket/a.png")
+    second = signer.sign("gs://bucket/a.png")
+
+    assert first == second
+    assert len(storage.calls) == 1
+    _, kwargs = storage.calls[0]
+    assert kwargs["expiration"].total_seconds() == 3600
+    assert kwargs["response_type"] == "image/png"
+    assert signer.stats() == {"signed": 1, "cache_hits": 1, "entries": 1}
+
+
+def test_sign_refreshes_after_half_ttl(monkeypatch: pytest.MonkeyPatch) -> None:
+    storage = _FakeStorage()
+    signer = SignedUrlSigner(storage_client=storage, credentials=SimpleNamespace(sign_bytes=None))
+    monkeypatch.setattr(signed_urls.config, "image_signed_url_ttl", 100)
+    now = [1000.0]
+    monkeypatch.setattr(signed_urls.time, "monotonic", lambda: now[0])
+
+    signer.sign("gs://bucket/a.png")
+    now[0] += 49
+    signer.sign("gs://bucket/a.png")
+    assert len(storage.calls) == 1
+
+    now[0] += 2
+    signer.sign("gs://bucket/a.png")
+    assert len(storage.calls) == 2
+
+
+def test_token_credentials_sign_through_iam() -> None:
+    storage = _FakeStorage()
+    credentials = SimpleNamespace(
+        service_account_email="runner@project.iam.gserviceaccount.com",
+        token="token-123",
+        valid=True,
+    )
+    signer = SignedUrlSigner(storage_client=storage, credentials=credentials)
+
+    signer.sign("gs://bucket/a.png")
+
+    _, kwargs = storage.calls[0]
+    assert kwargs["service_account_email"] == "runner@project.iam.gserviceaccount.com"
+    assert kwargs["access_token"] == "token-123"
+
+
+def test_hydrate_image_urls_signs_in_batch() -> None:
+    storage = _FakeStorage()
+    signer = SignedUrlSigner(storage_client=storage, credentials=SimpleNamespace(sign_bytes=None))
+    variations = [_variation("v1"), _variation("v2"), {"visual": {}}]
+
+    hydrate_image_urls(variations, signer=signer)
+
+    assert len(storage.calls) == 6
+    visual = variations[0]["visual"]
+    assert visual["image_estado_atual_url"].startswith("https://signed/bucket/v1/atual.png")
+    assert visual["image_estado_aspiracional_url"].startswith("https://signed/bucket/v1/aspiracional.jpg")
+    assert "image_estado_atual_url" not in variations[2]["visual"]
+
+    hydrate_image_urls([_variation("v1")], signer=signer)
+    assert len(storage.calls) == 6
+
+
+def test_hydrate_image_urls_covers_derivatives() -> None:
+    storage = _FakeStorage()
+    signer = SignedUrlSigner(storage_client=storage, credentials=SimpleNamespace(sign_bytes=None))
+    variation = _variation("v1")
+    variation["visual"]["image_estado_atual_thumb_gcs"] = "gs://bucket/v1/derivatives/atual_thumb.webp"
+
+    hydrate_image_urls([variation], signer=signer)
+
+    visual = variation["visual"]
+    assert visual["image_estado_atual_thumb_url"].startswith("https://signed/bucket/v1/derivatives/")
+    thumb_calls = [kwargs for path, kwargs in storage.calls if path.endswith("atual_thumb.webp")]
+    assert thumb_calls[0]["response_type"] == "image/webp"
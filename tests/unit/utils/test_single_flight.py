@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.utils.single_flight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_calls_share_one_execution():
+    flight = SingleFlight("test")
+    calls = {"count": 0}
+
+    async def slow_call() -> dict:
+        calls["count"] += 1
+        await asyncio.sleep(0.05)
+        return {"ok": True}
+
+    results = await asyncio.gather(*(flight.ado("same", slow_call) for _ in range(5)))
+    other = await flight.ado("other", slow_call)
+
+    assert calls["count"] == 2
+    assert all(result is results[0] for result in results)
+    assert other == {"ok": True}
+    assert flight.stats() == {"leaders": 2, "coalesced": 4, "inflight": 0}
+
+
+@pytest.mark.asyncio
+async def test_threads_and_tasks_coalesce_and_share_errors():
+    flight = SingleFlight("test")
+    calls = {"count": 0}
+    started = threading.Event()
+
+    def failing_call() -> None:
+        calls["count"] += 1
+        started.set()
+        time.sleep(0.1)
+        raise RuntimeError("vertex down")
+
+    leader = asyncio.create_task(asyncio.to_thread(flight.do, "key", failing_call))
+    await asyncio.to_thread(started.wait)
+
+    async def follower() -> None:
+        await asyncio.sleep(10)  # não deve executar
+
+    with pytest.raises(RuntimeError, match="vertex down"):
+        await flight.ado("key", follower)
+    with pytest.raises(RuntimeError):
+        await leader
+    assert calls["count"] == 1
+
+
+@pytest.mark.asyncio
+async def test_cancelled_leader_hands_over_to_a_follower():
+    flight = SingleFlight("test")
+    calls = {"count": 0}
+
+    async def call() -> str:
+        calls["count"] += 1
+        await asyncio.sleep(0.05)
+        return "done"
+
+    leader = asyncio.create_task(flight.ado("key", call))
+    await asyncio.sleep(0)
+    follower = asyncio.create_task(flight.ado("key", call))
+    await asyncio.sleep(0)
+
+    leader.cancel()
+    assert await follower == "done"
+    assert calls["count"] == 2
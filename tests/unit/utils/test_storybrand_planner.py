@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import pytest
+
+from app.utils import storybrand_planner as planner
+
+_PARAGRAPH = (
+    "Você se sente cansada de dietas que não funcionam? Com o nosso método, mais de "
+    "2.000 alunas conquistaram resultados em 90 dias. Garanta sua vaga agora.\n"
+)
+
+
+@pytest.fixture(autouse=True)
+def _planner_env(monkeypatch: pytest.MonkeyPatch) -> None:
+    for name in (
+        "STORYBRAND_TARGET_SECONDS",
+        "STORYBRAND_MAX_INPUT_TOKENS",
+        "STORYBRAND_HARD_CHAR_LIMIT",
+        "STORYBRAND_MAX_CHAR_BUFFER",
+        "STORYBRAND_MAX_WORKERS",
+        "STORYBRAND_EXTRACTION_PASSES",
+        "STORYBRAND_TRUNCATION_STRATEGY",
+    ):
+        monkeypatch.delenv(name, raising=False)
+
+
+def _model(seconds_per_1k: float = 1.5) -> planner.LatencyModel:
+    return planner.LatencyModel(call_overhead=2.0, seconds_per_1k=seconds_per_1k)
+
+
+def test_estimate_tokens_tracks_text_length() -> None:
+    tokens = planner.estimate_tokens(_PARAGRAPH * 10)
+
+    assert planner.estimate_tokens("") == 0
+    assert len(_PARAGRAPH * 10) / 6 < tokens < len(_PARAGRAPH * 10) / 3
+
+
+def test_short_page_is_sent_whole_in_a_single_chunk() -> None:
+    plan = planner.plan_storybrand_extraction(_PARAGRAPH * 5, prompt_tokens=1000, model=_model())
+
+    assert plan.truncate is False
+    assert plan.chunks == 1
+    assert plan.max_workers == 1
+    assert plan.reason == "fits_target"
+
+
+def test_long_page_is_capped_and_split_across_workers() -> None:
+    text = _PARAGRAPH * 200
+
+    plan = planner.plan_storybrand_extraction(text, prompt_tokens=1000, model=_model())
+
+    assert plan.truncate is True
+    assert plan.reason == "token_ceiling"
+    assert plan.budget_tokens == 3000
+    assert plan.max_workers == 4
+    assert plan.max_char_buffer <= 3000  # teto STORYBRAND_MAX_CHAR_BUFFER
+    assert plan.max_char_buffer * plan.chunks >= plan.budget_chars
+    assert plan.waves == -(-plan.chunks // plan.max_workers)
+
+
+def test_tight_target_shrinks_budget_and_passes(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("STORYBRAND_EXTRACTION_PASSES", "2")
+    monkeypatch.setenv("STORYBRAND_MAX_WORKERS", "2")
+    text = _PARAGRAPH * 200
+
+    relaxed = planner.plan_storybrand_extraction(
+        text, prompt_tokens=1000, target_seconds=120, model=_model(6.0)
+    )
+    tight = planner.plan_storybrand_extraction(
+        text, prompt_tokens=1000, target_seconds=25, model=_model(6.0)
+    )
+
+    assert relaxed.passes == 2
+    assert relaxed.max_workers == 2
+    assert tight.passes == 1
+    assert tight.reason == "reduced_for_target"
+    assert tight.budget_tokens < relaxed.budget_tokens
+    assert tight.predicted_seconds <= 25
+
+
+def test_apply_plan_reduces_once_and_reports_outcome() -> None:
+    text = _PARAGRAPH * 200
+    plan = planner.plan_storybrand_extraction(text, prompt_tokens=1000, model=_model())
+
+    reduced, info = planner.apply_plan(text, plan)
+    again, again_info = planner.apply_plan(reduced, plan)
+
+    assert len(reduced) <= plan.budget_chars
+    assert info["strategy"] == "ranked_paragraphs"
+    assert again == reduced
+    assert again_info["truncated"] is False
+    assert planner.plan_outcome(plan, plan.predicted_seconds + 1.5)["prediction_error_s"] == 1.5
+
+
+def test_latency_model_calibrates_from_observed_calls() -> None:
+    model = _model(1.0)
+    plan = planner.plan_storybrand_extraction(_PARAGRAPH * 200, prompt_tokens=1000, model=model)
+    slow_call = plan.waves * model.call_seconds(plan.tokens_per_call) * 3
+
+    model.observe(plan, slow_call)
+
+    assert model.seconds_per_1k > 1.0
+    assert model.observations == 1
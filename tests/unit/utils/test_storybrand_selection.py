@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+from app.utils import storybrand_selection as selection
+
+_FILLER = (
+    "Nossa empresa nasceu em uma pequena cidade do interior e cresceu junto com a "
+    "comunidade local ao longo de muitas gerações de famílias."
+)
+
+
+def _sales_page() -> str:
+    paragraphs = [
+        "Emagreça com saúde sem abrir mão do que você gosta",
+        *[f"{_FILLER} Capítulo {index}." for index in range(12)],
+        "Você se sente cansada e frustrada com dietas que não funcionam e tem medo de perder a motivação?",
+        "Depoimento: em 3 meses perdi 12 kg com o método da Dra. Ana, especialista com 15 anos de experiência.",
+        "Garanta sua vaga agora com 30% de desconto e clique no botão para falar no WhatsApp.",
+        *[f"{_FILLER} Anexo {index}." for index in range(12)],
+        "Política de privacidade | Termos de uso | Todos os direitos reservados",
+    ]
+    return "\n".join(paragraphs)
+
+
+def test_segment_paragraphs_splits_long_blocks_by_sentence() -> None:
+    text = "Título\n\n" + " ".join(["Uma frase curta aqui."] * 20)
+
+    segments = selection.segment_paragraphs(text, max_segment_chars=100)
+
+    assert segments[0] == "Título"
+    assert all(len(segment) <= 100 for segment in segments)
+    assert "".join(segments[1:]).replace(" ", "") == text.split("\n\n")[1].replace(" ", "")
+
+
+def test_select_relevant_text_keeps_signals_from_the_middle_of_the_page() -> None:
+    page = _sales_page()
+
+    result = selection.select_relevant_text(page, 800)
+
+    assert result.truncated is True
+    assert len(result.text) <= 800
+    assert result.text.startswith("Emagreça com saúde")
+    assert "Garanta sua vaga" in result.text
+    assert "Depoimento" in result.text
+    assert "cansada e frustrada" in result.text
+    assert "Todos os direitos reservados" not in result.text
+    assert result.text.index("cansada") < result.text.index("Depoimento") < result.text.index("Garanta")
+    info = result.info
+    assert info["strategy"] == "ranked_paragraphs"
+    assert info["segments_selected"] == len(info["selected_segments"])
+    assert {"cta", "problem", "guide", "evidence"} <= set(info["signal_coverage"])
+
+
+def test_select_relevant_text_passes_short_text_through() -> None:
+    result = selection.select_relevant_text("Compre agora", 100)
+
+    assert result.truncated is False
+    assert result.text == "Compre agora"
+    assert result.info["strategy"] == "passthrough"
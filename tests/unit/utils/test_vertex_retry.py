@@ -90,6 +90,16 @@ def _load_vertex_retry_module():
 
 vertex_retry = _load_vertex_retry_module()
 
+from app.utils import vertex_health, vertex_hedging, vertex_scheduler  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def _isolated_vertex_state(monkeypatch):
+    # Limitadores e circuitos são globais por modelo; cada teste começa do zero.
+    monkeypatch.setattr(vertex_scheduler, "_limiters", {})
+    monkeypatch.setattr(vertex_health, "_circuits", {})
+    monkeypatch.setattr(vertex_health, "_region_pools", {})
+
 
 class _RetryableError(Exception):
     status_code = 429
@@ -145,3 +155,524 @@ def test_call_with_vertex_retry_exhausted(monkeypatch):
     err = excinfo.value
     assert err.attempts == 2
     assert isinstance(err.last_exception, _RetryableError)
+
+
+@pytest.mark.asyncio
+async def test_acall_with_vertex_retry_eventual_success(monkeypatch):
+    attempts = {"count": 0}
+    delays: list[float] = []
+
+    async def fake_sleep(seconds: float) -> None:
+        delays.append(seconds)
+
+    monkeypatch.setattr(vertex_retry.asyncio, "sleep", fake_sleep)
+    monkeypatch.setattr(vertex_retry.random, "uniform", lambda *_: 0.0)
+
+    async def flaky_call() -> str:
+        attempts["count"] += 1
+        if attempts["count"] < 3:
+            raise _RetryableError(retry_after=0.5)
+        return "ok"
+
+    result = await vertex_retry.acall_with_vertex_retry(
+        flaky_call,
+        max_attempts=3,
+        initial_backoff=0.01,
+        max_backoff=0.02,
+        jitter=0.0,
+    )
+
+    assert result == "ok"
+    assert delays == [0.5, 0.5]
+
+
+@pytest.mark.asyncio
+async def test_acall_with_vertex_retry_exhausted(monkeypatch):
+    async def no_sleep(_seconds: float) -> None:
+        return None
+
+    monkeypatch.setattr(vertex_retry.asyncio, "sleep", no_sleep)
+
+    async def always_fail() -> None:
+        raise _RetryableError(retry_after=2.0)
+
+    with pytest.raises(vertex_retry.VertexRetryExceededError) as excinfo:
+        await vertex_retry.acall_with_vertex_retry(always_fail, max_attempts=2, jitter=0.0)
+
+    assert excinfo.value.attempts == 2
+    assert excinfo.value.retry_after == 2.0
+
+
+def _install_limiter(monkeypatch, model=None, **kwargs):
+    limiter = vertex_retry.AdaptiveConcurrencyLimiter(
+        model or vertex_retry.DEFAULT_MODEL, **kwargs
+    )
+    monkeypatch.setitem(vertex_scheduler._limiters, limiter.model, limiter)
+    return limiter
+
+
+@pytest.mark.asyncio
+async def test_sync_and_async_callers_share_one_permit_pool(monkeypatch):
+    import asyncio
+    import threading
+    import time
+
+    pool = _install_limiter(monkeypatch, initial=2, adaptive=False).pool
+    active = {"now": 0, "peak": 0}
+    lock = threading.Lock()
+
+    def enter() -> None:
+        with lock:
+            active["now"] += 1
+            active["peak"] = max(active["peak"], active["now"])
+
+    def leave() -> None:
+        with lock:
+            active["now"] -= 1
+
+    def sync_worker() -> None:
+        with vertex_retry.limit_vertex_concurrency():
+            enter()
+            time.sleep(0.05)
+            leave()
+
+    async def async_worker() -> None:
+        async with vertex_retry.alimit_vertex_concurrency():
+            enter()
+            await asyncio.sleep(0.05)
+            leave()
+
+    threads = [threading.Thread(target=sync_worker) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    await asyncio.gather(*(async_worker() for _ in range(3)))
+    await asyncio.to_thread(lambda: [thread.join() for thread in threads])
+
+    assert active["peak"] == 2
+    assert pool.in_use == 0
+    assert pool.waiting == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_async_waiter_does_not_leak_permit(monkeypatch):
+    import asyncio
+
+    pool = _install_limiter(monkeypatch, initial=1, adaptive=False).pool
+
+    await pool.acquire_async()
+    waiter = asyncio.create_task(pool.acquire_async())
+    await asyncio.sleep(0)
+    assert pool.waiting == 1
+
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    pool.release()
+
+    assert pool.in_use == 0
+    async with vertex_retry.alimit_vertex_concurrency():
+        assert pool.in_use == 1
+
+
+def test_adaptive_limiter_grows_additively_and_shrinks_multiplicatively():
+    now = {"t": 0.0}
+    limiter = vertex_retry.AdaptiveConcurrencyLimiter(
+        "gemini-2.5-pro",
+        initial=4,
+        minimum=1,
+        maximum=6,
+        decrease_factor=0.5,
+        cooldown=5.0,
+        clock=lambda: now["t"],
+    )
+
+    for _ in range(5):
+        limiter.on_success()
+    assert limiter.limit == 5  # uma permissão a cada janela de sucessos
+
+    limiter.on_throttle()
+    assert limiter.limit == 2
+    limiter.on_throttle()  # mesmo evento de throttling (cooldown)
+    assert limiter.limit == 2
+
+    now["t"] = 10.0
+    limiter.on_throttle()
+    limiter.on_throttle()
+    now["t"] = 20.0
+    limiter.on_throttle()
+    assert limiter.limit == 1  # respeita o mínimo
+
+    for _ in range(200):
+        limiter.on_success()
+    assert limiter.limit == 6  # respeita o máximo
+
+
+def test_shrinking_limit_drains_and_growing_limit_wakes_waiters():
+    import threading
+
+    pool = vertex_scheduler._PermitPool(2)
+    pool.acquire()
+    pool.acquire()
+    pool.set_limit(1)
+    pool.release()
+    assert pool.in_use == 1  # excedente não é repassado
+
+    acquired = threading.Event()
+
+    def waiter() -> None:
+        pool.acquire()
+        acquired.set()
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    assert not acquired.wait(0.05)
+    pool.set_limit(2)
+    assert acquired.wait(1.0)
+    thread.join()
+    assert pool.in_use == 2
+
+
+def test_limiters_are_separate_per_model_and_fed_by_retry_outcomes(monkeypatch):
+    pro = _install_limiter(monkeypatch, "gemini-2.5-pro", initial=4, cooldown=0.0)
+    flash = _install_limiter(monkeypatch, "gemini-2.5-flash", initial=4, cooldown=0.0)
+    monkeypatch.setattr(vertex_retry.time, "sleep", lambda _: None)
+    calls = {"count": 0}
+
+    def flaky() -> str:
+        calls["count"] += 1
+        if calls["count"] == 1:
+            raise _RetryableError()
+        return "ok"
+
+    assert vertex_retry.call_with_vertex_retry(flaky, model="gemini-2.5-pro", jitter=0.0) == "ok"
+
+    assert pro.limit == 2
+    assert flash.limit == 4
+
+
+def test_circuit_opens_on_error_rate_and_half_opens_with_limited_probes():
+    now = {"t": 0.0}
+    circuit = vertex_retry.VertexCircuitBreaker(
+        "gemini-2.5-pro",
+        error_rate=0.5,
+        min_calls=4,
+        window_seconds=60.0,
+        open_seconds=30.0,
+        half_open_probes=2,
+        clock=lambda: now["t"],
+    )
+
+    for failed in (False, True, False):
+        assert circuit.try_acquire() is None
+        circuit.record_failure() if failed else circuit.record_success()
+    assert circuit.state == circuit.CLOSED  # abaixo de min_calls
+    circuit.record_failure()
+    assert circuit.state == circuit.OPEN
+    assert circuit.try_acquire() == pytest.approx(30.0)
+
+    now["t"] = 31.0
+    assert circuit.try_acquire() is None
+    assert circuit.try_acquire() is None
+    assert circuit.state == circuit.HALF_OPEN
+    assert circuit.try_acquire() is not None  # só duas sondas
+
+    circuit.record_success()
+    circuit.record_failure()
+    assert circuit.state == circuit.OPEN
+
+    now["t"] = 62.0
+    for _ in range(2):
+        assert circuit.try_acquire() is None
+        circuit.record_success()
+    assert circuit.state == circuit.CLOSED
+
+
+def test_open_circuit_fails_fast_with_retry_after(monkeypatch):
+    circuit = vertex_retry.VertexCircuitBreaker(
+        vertex_retry.DEFAULT_MODEL, min_calls=2, error_rate=0.5, open_seconds=45.0
+    )
+    monkeypatch.setitem(vertex_health._circuits, circuit.model, circuit)
+    sleeps: list[float] = []
+    monkeypatch.setattr(vertex_retry.time, "sleep", sleeps.append)
+    calls = {"count": 0}
+
+    def always_throttled() -> None:
+        calls["count"] += 1
+        raise _RetryableError()
+
+    with pytest.raises(vertex_retry.VertexCircuitOpenError) as excinfo:
+        vertex_retry.call_with_vertex_retry(always_throttled, max_attempts=5, jitter=0.0)
+
+    # Abre na segunda falha e interrompe a escada de backoff.
+    assert calls["count"] == 2
+    assert len(sleeps) == 1
+    assert excinfo.value.attempts == 2
+    assert excinfo.value.retry_after == pytest.approx(45.0, abs=1.0)
+
+    with pytest.raises(vertex_retry.VertexCircuitOpenError):
+        vertex_retry.call_with_vertex_retry(always_throttled)
+    assert calls["count"] == 2  # sem chamar o Vertex
+
+
+def test_non_retryable_errors_do_not_trip_the_circuit(monkeypatch):
+    circuit = vertex_retry.VertexCircuitBreaker(vertex_retry.DEFAULT_MODEL, min_calls=1)
+    monkeypatch.setitem(vertex_health._circuits, circuit.model, circuit)
+
+    def bad_request() -> None:
+        raise ValueError("400 INVALID_ARGUMENT")
+
+    for _ in range(3):
+        with pytest.raises(ValueError):
+            vertex_retry.call_with_vertex_retry(bad_request)
+
+    assert circuit.state == circuit.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_scheduler_serves_priority_classes_then_users_round_robin():
+    import asyncio
+
+    pool = vertex_scheduler._PermitPool(1)
+    await pool.acquire_async()
+    order: list[str] = []
+
+    async def waiter(label: str) -> None:
+        await pool.acquire_async()
+        order.append(label)
+
+    tasks = []
+    for label, priority, user in [
+        ("bg-alice-1", vertex_retry.PRIORITY_BACKGROUND, "alice"),
+        ("bg-alice-2", vertex_retry.PRIORITY_BACKGROUND, "alice"),
+        ("bg-bob-1", vertex_retry.PRIORITY_BACKGROUND, "bob"),
+        ("preflight-carol", vertex_retry.PRIORITY_INTERACTIVE, "carol"),
+    ]:
+        with vertex_retry.vertex_call_context(priority=priority, user_id=user):
+            tasks.append(asyncio.create_task(waiter(label)))
+        await asyncio.sleep(0)
+    assert pool.waiting == 4
+
+    for _ in tasks:
+        pool.release()
+        await asyncio.sleep(0.01)
+    await asyncio.gather(*tasks)
+
+    # Interativo primeiro; no background, alice e bob se alternam.
+    assert order == ["preflight-carol", "bg-alice-1", "bg-bob-1", "bg-alice-2"]
+
+
+def test_vertex_call_context_restores_previous_tags():
+    with vertex_retry.vertex_call_context(priority=vertex_retry.PRIORITY_BACKGROUND, user_id="u1"):
+        with vertex_retry.vertex_call_context(priority=vertex_retry.PRIORITY_INTERACTIVE):
+            assert vertex_scheduler._call_priority.get() == vertex_retry.PRIORITY_INTERACTIVE
+            assert vertex_scheduler._call_user.get() == "u1"
+        assert vertex_scheduler._call_priority.get() == vertex_retry.PRIORITY_BACKGROUND
+    assert vertex_scheduler._call_priority.get() == vertex_retry.PRIORITY_NORMAL
+
+    with pytest.raises(ValueError):
+        vertex_retry.set_vertex_call_context("urgent")
+
+
+def _install_hedging(monkeypatch, **kwargs):
+    policy = vertex_retry.HedgingPolicy("test", **kwargs)
+    monkeypatch.setattr(vertex_hedging, "get_hedging_policy", lambda model, operation: policy if operation else None)
+    return policy
+
+
+def test_hedging_policy_uses_latency_percentile_and_budget():
+    policy = vertex_retry.HedgingPolicy(
+        "gemini-2.5-flash:test", percentile=90, window=10, min_samples=5, budget=0.2, min_delay=0.0
+    )
+    assert policy.hedge_delay() is None  # amostras insuficientes
+    for latency in (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 5.0):
+        policy.observe(latency)
+    assert policy.hedge_delay() == pytest.approx(0.9)
+
+    call_ids = [policy.begin_call() for _ in range(10)]
+    assert policy.try_hedge(call_ids[0])
+    assert policy.try_hedge(call_ids[1])
+    assert not policy.try_hedge(call_ids[2])  # 20% de 10 chamadas
+
+
+@pytest.mark.asyncio
+async def test_arun_vertex_call_hedges_slow_call_and_takes_first_result(monkeypatch):
+    import asyncio
+
+    policy = _install_hedging(monkeypatch, min_samples=1, budget=1.0, min_delay=0.0)
+    policy.observe(0.02)
+    calls = {"count": 0}
+
+    async def call() -> str:
+        calls["count"] += 1
+        if calls["count"] == 1:
+            await asyncio.sleep(5)  # resposta lenta da cauda
+            return "slow"
+        return "fast"
+
+    result = await asyncio.wait_for(
+        vertex_retry.arun_vertex_call(call, hedge="test"), timeout=2
+    )
+
+    assert result == "fast"
+    assert calls["count"] == 2
+    assert vertex_retry.get_vertex_limiter().pool.in_use == 0  # perdedor cancelado
+
+
+@pytest.mark.asyncio
+async def test_arun_vertex_call_skips_hedge_when_budget_is_spent(monkeypatch):
+    import asyncio
+
+    policy = _install_hedging(monkeypatch, min_samples=1, budget=0.0, min_delay=0.0)
+    policy.observe(0.01)
+    calls = {"count": 0}
+
+    async def call() -> str:
+        calls["count"] += 1
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    assert await vertex_retry.arun_vertex_call(call, hedge="test") == "ok"
+    assert calls["count"] == 1
+
+
+def test_run_vertex_call_hedges_in_sync_path(monkeypatch):
+    import threading
+
+    policy = _install_hedging(monkeypatch, min_samples=1, budget=1.0, min_delay=0.0)
+    policy.observe(0.02)
+    release_slow = threading.Event()
+    calls = {"count": 0}
+    lock = threading.Lock()
+
+    def call() -> str:
+        with lock:
+            calls["count"] += 1
+            current = calls["count"]
+        if current == 1:
+            release_slow.wait(2)
+            return "slow"
+        return "fast"
+
+    try:
+        assert vertex_retry.run_vertex_call(call, hedge="test") == "fast"
+    finally:
+        release_slow.set()
+    assert calls["count"] == 2
+
+
+def _install_regions(monkeypatch, regions, **kwargs):
+    import random
+
+    now = {"t": 0.0}
+    pool = vertex_retry.VertexRegionPool(
+        regions, clock=lambda: now["t"], rng=random.Random(0), **kwargs
+    )
+    monkeypatch.setitem(vertex_health._region_pools, vertex_retry.DEFAULT_MODEL, pool)
+    return pool, now
+
+
+def test_region_pool_cools_down_throttled_region_and_prefers_healthy(monkeypatch):
+    pool, now = _install_regions(monkeypatch, ["us-central1", "us-east4"], cooldown=30.0)
+
+    pool.record_failure("us-central1", retry_after=10.0)
+    assert {pool.choose() for _ in range(20)} == {"us-east4"}
+    assert pool.choose(exclude={"us-east4"}) == "us-central1"  # todas "tentadas": a que volta antes
+    assert not pool.has_alternative({"us-east4"})
+
+    now["t"] = 11.0
+    for _ in range(5):
+        pool.record_success("us-east4", 0.5)
+    picks = [pool.choose() for _ in range(200)]
+    # De volta ao rodízio, mas com peso menor para a região que falhou.
+    assert 0 < picks.count("us-central1") < picks.count("us-east4")
+    snapshot = pool.snapshot()
+    assert snapshot["us-central1"]["failures"] == 1
+    assert snapshot["us-east4"]["successes"] == 5
+
+
+def test_retry_fails_over_to_other_region_without_sleeping(monkeypatch):
+    _install_regions(monkeypatch, ["us-central1", "us-east4", "europe-west4"])
+    sleeps: list[float] = []
+    monkeypatch.setattr(vertex_retry.time, "sleep", sleeps.append)
+    seen: list[str] = []
+
+    def call() -> str:
+        region = vertex_retry.vertex_region()
+        seen.append(region)
+        if len(seen) < 3:
+            raise _RetryableError()
+        return region
+
+    result = vertex_retry.call_with_vertex_retry(call, max_attempts=5, jitter=0.0)
+
+    assert result == seen[-1]
+    assert len(set(seen)) == 3  # cada tentativa em uma região diferente
+    assert sleeps == []
+    assert vertex_retry.vertex_region("fallback") == "fallback"
+
+
+def test_backoff_resumes_after_all_regions_fail(monkeypatch):
+    _install_regions(monkeypatch, ["us-central1", "us-east4"])
+    sleeps: list[float] = []
+    monkeypatch.setattr(vertex_retry.time, "sleep", sleeps.append)
+
+    def always_throttled() -> None:
+        raise _RetryableError()
+
+    with pytest.raises(vertex_retry.VertexRetryExceededError):
+        vertex_retry.call_with_vertex_retry(
+            always_throttled, max_attempts=4, initial_backoff=1.0, multiplier=2.0, jitter=0.0
+        )
+
+    # Falha 1 -> failover imediato (fora de max_attempts); depois o backoff segue a
+    # contagem de tentativas (2s, 4s, ...) em vez de recomeçar em 1s.
+    assert sleeps == [pytest.approx(value) for value in (2.0, 4.0, 8.0, 16.0)]
+
+
+def test_single_attempt_call_still_fails_over_to_a_fresh_region(monkeypatch):
+    _install_regions(monkeypatch, ["us-central1", "us-east4"])
+    sleeps: list[float] = []
+    monkeypatch.setattr(vertex_retry.time, "sleep", sleeps.append)
+    seen: list[str] = []
+
+    def call() -> str:
+        seen.append(vertex_retry.vertex_region())
+        if len(seen) == 1:
+            raise _RetryableError()
+        return "ok"
+
+    assert vertex_retry.call_with_vertex_retry(call, max_attempts=1, jitter=0.0) == "ok"
+    assert len(set(seen)) == 2
+    assert sleeps == []
+
+    _install_regions(monkeypatch, ["us-central1", "us-east4"])
+    seen.clear()
+
+    def always_throttled() -> None:
+        seen.append(vertex_retry.vertex_region())
+        raise _RetryableError()
+
+    with pytest.raises(vertex_retry.VertexRetryExceededError):
+        vertex_retry.call_with_vertex_retry(always_throttled, max_attempts=1, jitter=0.0)
+    assert len(seen) == 2  # a região alternativa é tentada uma vez, sem nova rodada
+
+
+def test_regional_throttle_does_not_penalize_model_while_another_region_is_healthy(monkeypatch):
+    pool, _ = _install_regions(monkeypatch, ["us-central1", "us-east4"])
+    limiter = _install_limiter(monkeypatch, initial=4, cooldown=0.0)
+    monkeypatch.setattr(vertex_retry.time, "sleep", lambda _: None)
+    seen: list[str] = []
+
+    def call() -> str:
+        seen.append(vertex_retry.vertex_region())
+        if len(seen) == 1:
+            raise _RetryableError()
+        return "ok"
+
+    assert vertex_retry.call_with_vertex_retry(call, jitter=0.0) == "ok"
+    assert limiter.limit == 4  # 429 regional: só a região entrou em cooldown
+    assert pool.snapshot()[seen[0]]["failures"] == 1
+
+    # Com a outra região ainda em cooldown, o 429 volta a reduzir as permissões do modelo.
+    vertex_retry.record_vertex_outcome(None, _RetryableError(), region=seen[1])
+    assert limiter.limit == 2